@@ -0,0 +1,461 @@
+from langchain.schema import Document
+
+import numpy as np
+import threading
+import sqlite3
+import json
+import uuid
+import os
+
+
+#########################------------ANN Vector Store-------------###############################
+# A local approximate-nearest-neighbour vector store: FAISS HNSW indexes over float32 vectors, next to an SQLite table of chunk text & metadata.
+# Vectors are appended to a flat vectors.f32 file & indexed by an in-memory "tail" HNSW index; once the tail holds segment_size vectors it's
+# sealed to a segment file that's loaded memory-mapped where the installed FAISS supports it (IO_FLAG_MMAP_IFC), so resident memory is mostly
+# the HNSW graph rather than the vectors themselves. The tail is rebuilt from vectors.f32 on open.
+# Deletes are tombstones excluded at search time (via an ID selector) until compact() rewrites the store without them.
+# With quantization 'int8' (8-bit scalar quantized HNSW) or 'binary' (1 sign bit per dimension, Hamming HNSW), the indexes hold compact codes
+# instead of float32 vectors: a search fetches k * rescore_multiplier candidates from them, then re-ranks those by exact L2 distance against
+# the float32 vectors in vectors.f32, which are only paged in for the candidates. An int8 store's tail stays float32 until it's sealed, as
+# its quantizer is trained on the vectors it encodes & the tail's first vectors needn't span the range of later ones.
+# It exposes the subset of langchain's Chroma wrapper & chromadb's Collection used by the app, so either may back a VectorDB folder.
+ANN_INDEX_FOLDER_NAME = 'faiss_hnsw'
+ANN_SQLITE_MAX_VARIABLES = 900
+ANN_QUANTIZATION_MODES = ['none', 'int8', 'binary']
+
+
+# Method to turn a Chroma where-filter on 'source' ({'source': s} or {'$or': [{'source': s}, ...]}) into a list of sources | None if unfiltered
+def parse_source_filter(where):
+
+    if not where:
+        return None
+    if 'source' in where:
+        return [where['source']]
+    if '$or' in where and all(list(clause.keys()) == ['source'] for clause in where['$or']):
+        return [clause['source'] for clause in where['$or']]
+
+    raise ValueError(f"Unsupported filter for the ANN vector store, only filters on 'source' are supported: {where}")
+
+
+def iter_sql_batches(values, batch_size=ANN_SQLITE_MAX_VARIABLES):
+    for start in range(0, len(values), batch_size):
+        yield values[start:start + batch_size]
+
+
+class FaissHnswVectorStore:
+
+    def __init__(self, persist_directory, embedding_function=None, m=32, ef_construction=200, ef_search=64, segment_size=100000, max_batch_size=5000, quantization='none', rescore_multiplier=4):
+        import faiss    # optional dependency, only needed when this backend is configured
+        self._faiss = faiss
+
+        if quantization not in ANN_QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported ANN quantization '{quantization}', expected one of {ANN_QUANTIZATION_MODES}")
+
+        self._persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self._collection = self     # the app calls Collection methods (add, get, delete, count) via vector_store._collection
+        self.max_batch_size = max_batch_size
+
+        self.m = int(m)
+        self.ef_construction = int(ef_construction)
+        self.ef_search = int(ef_search)
+        self.segment_size = int(segment_size)
+        self.rescore_multiplier = max(1, int(rescore_multiplier))
+
+        self._lock = threading.RLock()
+        self._index_folder = os.path.join(persist_directory, ANN_INDEX_FOLDER_NAME)
+        os.makedirs(self._index_folder, exist_ok=True)
+        self._vectors_path = os.path.join(self._index_folder, 'vectors.f32')
+
+        self._conn = sqlite3.connect(os.path.join(self._index_folder, 'chunks.db'), check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                    label INTEGER PRIMARY KEY,
+                    chunk_id TEXT UNIQUE,
+                    source TEXT,
+                    document TEXT,
+                    metadata TEXT,
+                    deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+            CREATE INDEX IF NOT EXISTS chunks_deleted ON chunks (deleted);
+            CREATE TABLE IF NOT EXISTS segments (
+                    segment_number INTEGER PRIMARY KEY,
+                    first_label INTEGER NOT NULL,
+                    end_label INTEGER NOT NULL,
+                    file_name TEXT
+            );
+            CREATE TABLE IF NOT EXISTS store_info (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+            );
+        ''')
+        # Stores created before segment files were named per build: NULL file_name means segment-<segment_number>.faiss
+        if 'file_name' not in [row['name'] for row in self._conn.execute("PRAGMA table_info(segments)").fetchall()]:
+            self._conn.execute("ALTER TABLE segments ADD COLUMN file_name TEXT")
+        self._conn.commit()
+
+        dimension = self._conn.execute("SELECT value FROM store_info WHERE key = 'dimension'").fetchone()
+        self.dimension = int(dimension['value']) if dimension else None
+
+        # The quantization the segments were built with; stores created before quantization existed hold float32 (HNSWFlat) indexes
+        stored_quantization = self._conn.execute("SELECT value FROM store_info WHERE key = 'quantization'").fetchone()
+        stored_quantization = stored_quantization['value'] if stored_quantization else 'none'
+        self.quantization = quantization
+
+        if self.dimension is not None and stored_quantization != quantization:
+            print(f"Rebuilding ANN index with quantization '{quantization}' (was '{stored_quantization}')")
+            self._truncate_uncommitted_vectors()
+            self._rebuild_segments()
+        else:
+            self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('quantization', ?)", (quantization,))
+            self._conn.commit()
+            self._load()
+
+    ### Persistence ###
+
+    def _segment_path(self, file_name):
+        return os.path.join(self._index_folder, file_name)
+
+    def _new_segment_file_name(self, segment_number):
+        return f'segment-{segment_number}-{uuid.uuid4().hex[:8]}.faiss'     # unique per build, so a rebuild never overwrites a file in use
+
+    def _read_segment_index(self, file_name):
+        if self.quantization == 'binary':
+            return self._faiss.read_index_binary(self._segment_path(file_name))    # 1 bit per dimension, small enough to load outright
+        mmap_flag = getattr(self._faiss, 'IO_FLAG_MMAP_IFC', None)
+        if mmap_flag is None:
+            return self._faiss.read_index(self._segment_path(file_name))   # this FAISS build can't memory-map flat vectors, loaded into memory
+        return self._faiss.read_index(self._segment_path(file_name), mmap_flag)
+
+    def _write_segment_index(self, index, file_name):
+        if self.quantization == 'binary':
+            self._faiss.write_index_binary(index, self._segment_path(file_name))
+        else:
+            self._faiss.write_index(index, self._segment_path(file_name))
+
+    def _new_hnsw_index(self, quantization=None):
+        quantization = quantization or self.quantization
+        if quantization == 'int8':
+            index = self._faiss.IndexHNSWSQ(self.dimension, self._faiss.ScalarQuantizer.QT_8bit, self.m)
+        elif quantization == 'binary':
+            index = self._faiss.IndexBinaryHNSW(-(-self.dimension // 8) * 8, self.m)     # dimension rounded up to whole bytes of sign bits
+        else:
+            index = self._faiss.IndexHNSWFlat(self.dimension, self.m)
+        index.hnsw.efConstruction = self.ef_construction
+        return index
+
+    # Method to create the index the tail is built in: float32 for an int8 store, which only quantizes a segment once it's sealed
+    def _new_tail_index(self):
+        return self._new_hnsw_index('none' if self.quantization == 'int8' else self.quantization)
+
+    # Method to turn float32 vectors into what the index holds: sign bits packed 8 per byte for 'binary', the vectors themselves otherwise
+    def _encode(self, vectors):
+        if self.quantization == 'binary':
+            return np.packbits(vectors > 0, axis=1)
+        return vectors
+
+    # Method to add float32 vectors to an index, training an int8 index's per-dimension ranges on them if it's new
+    def _add_to_index(self, index, vectors):
+        if not len(vectors):
+            return
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(self._encode(vectors))
+
+    # Method to build a segment index over the vectors first_label..end_label-1 in one go, so an int8 index is trained on all of them
+    def _build_segment_index(self, first_label, end_label):
+        index = self._new_hnsw_index()
+        self._add_to_index(index, self._read_vectors(first_label, end_label))
+        return index
+
+    def _read_vectors(self, first_label, end_label):
+        if end_label <= first_label:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._next_label, self.dimension))
+        return np.ascontiguousarray(vectors[first_label:end_label])
+
+    def _truncate_uncommitted_vectors(self):
+
+        self._next_label = self._conn.execute("SELECT COALESCE(MAX(label) + 1, 0) FROM chunks").fetchone()[0]
+
+        # Vectors appended by an add() that didn't get to commit its chunk rows are dropped:
+        if self.dimension is not None and os.path.exists(self._vectors_path):
+            expected_size = self._next_label * self.dimension * 4
+            if os.path.getsize(self._vectors_path) > expected_size:
+                with open(self._vectors_path, 'r+b') as vectors_file:
+                    vectors_file.truncate(expected_size)
+
+    def _load(self):
+
+        self._truncate_uncommitted_vectors()
+
+        self._segments = []     # [(first_label, end_label, index)]
+        for row in self._conn.execute("SELECT segment_number, first_label, end_label, file_name FROM segments ORDER BY first_label").fetchall():
+            self._segments.append((row['first_label'], row['end_label'], self._read_segment_index(row['file_name'] or f"segment-{row['segment_number']}.faiss")))
+
+        self._tail_first_label = self._segments[-1][1] if self._segments else 0
+        self._tail = None
+        if self.dimension is not None:
+            self._tail = self._new_tail_index()
+            self._add_to_index(self._tail, self._read_vectors(self._tail_first_label, self._next_label))
+
+    def _seal_tail(self):
+
+        segment_number = len(self._segments)
+        file_name = self._new_segment_file_name(segment_number)
+        # An int8 store's tail is float32, so the sealed segment is built quantized & trained on all of its vectors:
+        segment_index = self._build_segment_index(self._tail_first_label, self._next_label) if self.quantization == 'int8' else self._tail
+        self._write_segment_index(segment_index, file_name)
+        self._conn.execute("INSERT INTO segments (segment_number, first_label, end_label, file_name) VALUES (?, ?, ?, ?)", (segment_number, self._tail_first_label, self._next_label, file_name))
+        self._conn.commit()
+
+        self._segments.append((self._tail_first_label, self._next_label, self._read_segment_index(file_name)))
+        self._tail_first_label = self._next_label
+        self._tail = self._new_tail_index()
+
+    # Method to rebuild every sealed segment from vectors.f32 with the current quantization, the remainder forming the tail on reload.
+    # New segment files are written before the segments table switches to them; the old files are removed afterwards
+    def _rebuild_segments(self):
+
+        old_file_names = [row['file_name'] or f"segment-{row['segment_number']}.faiss" for row in self._conn.execute("SELECT segment_number, file_name FROM segments").fetchall()]
+        self._segments = []     # drops the old indexes, releasing their memory-mapped files
+
+        new_segments = []
+        sealed_end_label = self._next_label - self._next_label % self.segment_size
+        for segment_number, first_label in enumerate(range(0, sealed_end_label, self.segment_size)):
+            file_name = self._new_segment_file_name(segment_number)
+            self._write_segment_index(self._build_segment_index(first_label, first_label + self.segment_size), file_name)
+            new_segments.append((segment_number, first_label, first_label + self.segment_size, file_name))
+
+        self._conn.execute("DELETE FROM segments")
+        self._conn.executemany("INSERT INTO segments (segment_number, first_label, end_label, file_name) VALUES (?, ?, ?, ?)", new_segments)
+        self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('quantization', ?)", (self.quantization,))
+        self._conn.commit()
+
+        for file_name in old_file_names:
+            try:
+                os.remove(self._segment_path(file_name))
+            except OSError:
+                pass    # e.g. still memory-mapped on Windows; an unreferenced segment file is harmless
+
+        self._load()
+
+    ### Collection-compatible surface ###
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [{}] * len(ids)
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('dimension', ?)", (str(self.dimension),))
+                self._conn.commit()
+                self._tail = self._new_tail_index()
+
+            # As with Chroma, ids already stored are left as they are:
+            existing_ids = set()
+            for ids_batch in iter_sql_batches(list(ids)):
+                existing_ids.update(row['chunk_id'] for row in self._conn.execute(f"SELECT chunk_id FROM chunks WHERE chunk_id IN ({', '.join('?' for _ in ids_batch)})", ids_batch).fetchall())
+            new_positions = [position for position, chunk_id in enumerate(ids) if chunk_id not in existing_ids]
+            if not new_positions:
+                return
+
+            new_vectors = np.ascontiguousarray(vectors[new_positions])
+            first_label = self._next_label
+
+            # Vectors first, so chunk rows never reference a vector that isn't on disk:
+            with open(self._vectors_path, 'ab') as vectors_file:
+                vectors_file.write(new_vectors.tobytes())
+                vectors_file.flush()
+                os.fsync(vectors_file.fileno())
+
+            self._conn.executemany("INSERT INTO chunks (label, chunk_id, source, document, metadata) VALUES (?, ?, ?, ?, ?)", [(first_label + offset, ids[position], (metadatas[position] or {}).get('source'), documents[position], json.dumps(metadatas[position] or {})) for offset, position in enumerate(new_positions)])
+            self._conn.commit()
+
+            self._next_label += len(new_positions)
+            self._add_to_index(self._tail, new_vectors)
+
+            if self._tail.ntotal >= self.segment_size:
+                self._seal_tail()
+
+    def delete(self, ids):
+        with self._lock:
+            for ids_batch in iter_sql_batches(list(ids)):
+                self._conn.execute(f"UPDATE chunks SET deleted = 1, chunk_id = NULL WHERE chunk_id IN ({', '.join('?' for _ in ids_batch)})", ids_batch)
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE deleted = 0").fetchone()[0]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=('documents', 'metadatas')):
+
+        query = "SELECT label, chunk_id, document, metadata FROM chunks WHERE deleted = 0"
+        params = []
+
+        sources = parse_source_filter(where)
+        if sources is not None:
+            query += f" AND source IN ({', '.join('?' for _ in sources)})"
+            params += sources
+
+        with self._lock:
+            if ids is not None:
+                rows = []
+                for ids_batch in iter_sql_batches(list(ids)):
+                    rows += self._conn.execute(query + f" AND chunk_id IN ({', '.join('?' for _ in ids_batch)})", params + ids_batch).fetchall()
+                rows_by_id = {row['chunk_id']: row for row in rows}
+                rows = [rows_by_id[chunk_id] for chunk_id in ids if chunk_id in rows_by_id]
+            else:
+                query += " ORDER BY label"
+                if limit is not None:
+                    query += " LIMIT ? OFFSET ?"
+                    params += [int(limit), int(offset or 0)]
+                rows = self._conn.execute(query, params).fetchall()
+
+            embeddings = None
+            if 'embeddings' in include:
+                vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._next_label, self.dimension)) if self._next_label else None
+                embeddings = [vectors[row['label']].tolist() for row in rows]
+
+        return {
+            'ids': [row['chunk_id'] for row in rows],
+            'embeddings': embeddings,
+            'documents': [row['document'] for row in rows] if 'documents' in include else None,
+            'metadatas': [json.loads(row['metadata']) for row in rows] if 'metadatas' in include else None,
+        }
+
+    ### Search ###
+
+    # Method to build the FAISS ID selector for the labels first_label..end_label-1 of a segment | returns (selector, arrays to keep alive), or
+    # (False, None) when nothing in the segment may be returned
+    def _segment_selector(self, first_label, end_label, allowed_labels, deleted_labels):
+
+        if allowed_labels is not None:
+            local_labels = allowed_labels[(allowed_labels >= first_label) & (allowed_labels < end_label)] - first_label
+            if not len(local_labels):
+                return False, None
+            return self._faiss.IDSelectorBatch(len(local_labels), self._faiss.swig_ptr(local_labels)), local_labels
+
+        local_labels = deleted_labels[(deleted_labels >= first_label) & (deleted_labels < end_label)] - first_label
+        if not len(local_labels):
+            return None, None
+        batch_selector = self._faiss.IDSelectorBatch(len(local_labels), self._faiss.swig_ptr(local_labels))
+        return self._faiss.IDSelectorNot(batch_selector), (local_labels, batch_selector)
+
+    # Method to find the k nearest live chunks to vector, optionally among chunks of sources only | returns [(label, squared L2 distance)] nearest-first
+    def search_by_vector(self, vector, k, sources=None):
+
+        query_vector = np.ascontiguousarray(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+        candidate_k = k if self.quantization == 'none' else k * self.rescore_multiplier
+
+        with self._lock:
+            if self.dimension is None:
+                return []
+
+            if sources is not None:
+                allowed_labels = np.array([row[0] for sources_batch in iter_sql_batches(list(sources)) for row in self._conn.execute(f"SELECT label FROM chunks WHERE deleted = 0 AND source IN ({', '.join('?' for _ in sources_batch)})", sources_batch).fetchall()], dtype=np.int64)
+                deleted_labels = None
+            else:
+                allowed_labels = None
+                deleted_labels = np.array([row[0] for row in self._conn.execute("SELECT label FROM chunks WHERE deleted = 1").fetchall()], dtype=np.int64)
+
+            searchable = list(self._segments) + [(self._tail_first_label, self._next_label, self._tail)]
+
+            results = []
+            for first_label, end_label, index in searchable:
+                if index is None or index.ntotal == 0:
+                    continue
+                selector, keep_alive = self._segment_selector(first_label, end_label, allowed_labels, deleted_labels)
+                if selector is False:
+                    continue
+
+                search_parameters = self._faiss.SearchParametersHNSW()
+                search_parameters.efSearch = max(self.ef_search, candidate_k)
+                if selector is not None:
+                    search_parameters.sel = selector
+
+                distances, local_labels = index.search(self._encode(query_vector), candidate_k, params=search_parameters)
+                results += [(first_label + int(local_label), float(distance)) for local_label, distance in zip(local_labels[0], distances[0]) if local_label >= 0]
+
+            if self.quantization != 'none' and results:
+                results = self._rescore(query_vector[0], [label for label, _ in results])
+
+        return sorted(results, key=lambda result: result[1])[:k]
+
+    # Method to re-rank candidate labels by exact squared L2 distance to query_vector, reading only their float32 vectors from disk
+    def _rescore(self, query_vector, labels):
+        labels = np.unique(np.asarray(labels, dtype=np.int64))
+        vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._next_label, self.dimension))
+        distances = ((vectors[labels] - query_vector) ** 2).sum(axis=1)
+        return [(int(label), float(distance)) for label, distance in zip(labels, distances)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+
+        nearest = self.search_by_vector(embedding, k, parse_source_filter(filter))
+        if not nearest:
+            return []
+
+        with self._lock:
+            labels = [label for label, _ in nearest]
+            rows = {row['label']: row for row in self._conn.execute(f"SELECT label, document, metadata FROM chunks WHERE label IN ({', '.join('?' for _ in labels)})", labels).fetchall()}
+
+        return [(Document(page_content=rows[label]['document'], metadata=json.loads(rows[label]['metadata'])), distance) for label, distance in nearest if label in rows]
+
+    def add_documents(self, documents, ids):
+        embeddings = self._embedding_function.embed_documents([document.page_content for document in documents])
+        self.add(ids=ids, embeddings=embeddings, documents=[document.page_content for document in documents], metadatas=[document.metadata for document in documents])
+        return ids
+
+    ### Maintenance ###
+
+    # Method to rewrite the store without its deleted chunks: vectors are relabelled contiguously & the segments rebuilt
+    def compact(self):
+
+        with self._lock:
+            if self.dimension is None:
+                return
+
+            live_rows = self._conn.execute("SELECT label FROM chunks WHERE deleted = 0 ORDER BY label").fetchall()
+            if len(live_rows) == self._next_label:
+                return
+
+            print(f"Compacting ANN index: {self._next_label - len(live_rows)} deleted chunks")
+            old_vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._next_label, self.dimension))
+            compacted_vectors_path = self._vectors_path + '.compacting'
+            with open(compacted_vectors_path, 'wb') as vectors_file:
+                for labels_batch in iter_sql_batches([row['label'] for row in live_rows], self.segment_size):
+                    vectors_file.write(np.ascontiguousarray(old_vectors[labels_batch]).tobytes())
+            del old_vectors
+
+            # With deleted chunks gone, relabelling in label order keeps labels unique while they're rewritten:
+            self._conn.execute("DELETE FROM chunks WHERE deleted = 1")
+            for new_label, row in enumerate(live_rows):
+                self._conn.execute("UPDATE chunks SET label = ? WHERE label = ?", (new_label, row['label']))
+            self._conn.commit()
+
+            os.replace(compacted_vectors_path, self._vectors_path)
+            self._next_label = len(live_rows)
+
+            self._rebuild_segments()
+            self._conn.execute("VACUUM")
+
+    # Method to measure the bytes of the HNSW indexes themselves (graph & vectors or codes), excluding vectors.f32 which quantized searches only read for rescoring
+    def index_size_bytes(self):
+        with self._lock:
+            indexes = [index for _, _, index in self._segments] + ([self._tail] if self._tail is not None else [])
+            serialize = self._faiss.serialize_index_binary if self.quantization == 'binary' else self._faiss.serialize_index
+            return sum(serialize(index).nbytes for index in indexes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+#########################-------------------------------------###############################
@@ -2,7 +2,7 @@ from flask import Flask, render_template, request, redirect, url_for, Response,
 from flask import send_from_directory
 from flask import jsonify
 
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer, CrossEncoder
 
 from pdfminer.high_level import extract_text
 from werkzeug.utils import secure_filename
@@ -33,21 +33,33 @@ from PIL import Image
 
 import fitz # PyMuPDF
 from rapidfuzz import process, fuzz
+from ann_vector_store import FaissHnswVectorStore
+from onnx_embeddings import OnnxEmbeddings
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from urllib.parse import unquote
 from threading import Thread
+import multiprocessing
+import numpy as np
+import pytesseract
+import collections
 import subprocess
 import threading
 import traceback
 import platform
 import tempfile
 import datetime
+import hashlib
 import requests
 import logging
 import sqlite3
 import signal
+import shutil
+import socket
+import atexit
 import PyPDF2
 import base64
+import random
 import queue
 import uuid
 import json
@@ -56,6 +68,7 @@ import nltk
 import zlib
 import ast
 import sys
+import gc
 import os
 import io
 import re
@@ -108,8 +121,6 @@ VECTORDB_LOADED_UP = False
 LLM_CHANGE_RELOAD_TRIGGER_SET = False
 VECTORDB_CHANGE_RELOAD_TRIGGER_SET = False
 VECTOR_STORE = None
-HF_BGE_EMBEDDINGS = None
-AZURE_OPENAI_EMBEDDINGS = None
 HISTORY_MEMORY_WITH_BUFFER = None   #Init in load_model_and_vectordb(); reset in load_chat_history() when old chats loaded, and in load_model_and_vectordb() when 'New Chat' selected; used for non-RAG convChain init in stream, and for saving context in stream for RAG chains and lastly, for setting HISTORY_SUMMARY in stream() via load_memory_variables({})
 HISTORY_SUMMARY = {}    #Set in stream() via HISTORY_MEMORY_WITH_BUFFER.load_memory_variables({}), and in load_chat_history() from chat_history DB; cleared in load_model_and_vectordb() when 'New Chat' selected; used to init prompt templates in stream() and lastly, for storage to chat_history DB in stream() and get_references()
 
@@ -195,46 +206,151 @@ if not os.path.exists('config.json'):
 
 
 
-# Method to write to config.json | input- dict of key:values to be written to config.json
-def write_config(config_updates, filename='config.json'):
+#########################------------Config Store-------------###############################
+# config.json is read on practically every request, so rather than opening & JSON-parsing the file for every read_config() call, we hold an
+# in-memory snapshot per config file and only re-parse it when the file's mtime (or size) changes, which still allows users to hand-edit config.json.
+# Writes are serialized under CONFIG_LOCK and land atomically via a temp-file + os.replace(), so concurrent requests can never observe a torn config.json.
+# Modules interested in specific keys (ex: the LLM & VectorDB reload triggers) register via subscribe_to_config_changes() instead of write_config() special-casing them.
+CONFIG_LOCK = threading.RLock()
+CONFIG_SNAPSHOTS = {}       # CONFIG_SNAPSHOTS[filename] = {'signature': (st_mtime_ns, st_size), 'config': {...}}
+CONFIG_SUBSCRIBERS = []     # callables of the form callback(changed_keys_dict, previous_config) where changed_keys_dict = {key: new_value}; return True if an app restart is required
+
+
+def get_config_file_signature(filename):
+    file_stat = os.stat(filename)
+    return (file_stat.st_mtime_ns, file_stat.st_size)
+
+
+def notify_config_subscribers(changed_keys, previous_config):
 
-    # Open config file to read-in all current params:
-    try:
-        with open(filename, 'r') as file:
-            config = json.load(file)
-    except Exception as e:
-        config = {}     #init emply config dict
-        handle_error_no_return("Could not read config.json when attempting to write, encountered error: ", e)
-        
     restart_required = False
-    if LLM_LOADED_UP:
-        llm_trigger_keys_for_app_restart = ['use_local_llm', 'local_llm_server', 'use_azure_open_ai', 'use_gpu', 'model_choice', 'local_llm_chat_template_format', 'local_llm_context_length', 'local_llm_max_new_tokens', 'local_llm_gpu_layers', 'base_template']
-                
-        for key in llm_trigger_keys_for_app_restart:
-            if key in config_updates and config_updates[key] != config.get(key):
-                global LLM_CHANGE_RELOAD_TRIGGER_SET
-                LLM_CHANGE_RELOAD_TRIGGER_SET = True
-                restart_required = True
-                break
-    
-    if VECTORDB_LOADED_UP:
-        vectordb_trigger_keys_for_app_restart = ['embedding_model_choice']
 
-        for key in vectordb_trigger_keys_for_app_restart:
-            if key in config_updates and config_updates[key] != config.get(key):
-                global VECTORDB_CHANGE_RELOAD_TRIGGER_SET
-                VECTORDB_CHANGE_RELOAD_TRIGGER_SET = True
+    for callback in list(CONFIG_SUBSCRIBERS):
+        try:
+            if callback(changed_keys, previous_config):
                 restart_required = True
-                break
+        except Exception as e:
+            handle_error_no_return(f"Config change subscriber {getattr(callback, '__name__', callback)} failed, printing error and proceeding: ", e)
+
+    return restart_required
+
+
+# Method to obtain the current config dict for a config file, re-parsing it from disk only if it has changed since it was last loaded
+def load_config_snapshot(filename='config.json'):
+
+    with CONFIG_LOCK:
+        signature = get_config_file_signature(filename)
+        snapshot = CONFIG_SNAPSHOTS.get(filename)
+
+        if snapshot is not None and snapshot['signature'] == signature:
+            return snapshot['config']
+
+        with open(filename, 'r') as file:
+            config = json.load(file)
+
+        CONFIG_SNAPSHOTS[filename] = {'signature': signature, 'config': config}
+
+        # config.json was edited outside of write_config(), let subscribers know what changed:
+        if snapshot is not None:
+            previous_config = snapshot['config']
+            changed_keys = {key: value for key, value in config.items() if previous_config.get(key) != value}
+            if changed_keys:
+                notify_config_subscribers(changed_keys, previous_config)
+
+        return config
+
+
+def subscribe_to_config_changes(callback):
+    with CONFIG_LOCK:
+        if callback not in CONFIG_SUBSCRIBERS:
+            CONFIG_SUBSCRIBERS.append(callback)
+
+
+def unsubscribe_from_config_changes(callback):
+    with CONFIG_LOCK:
+        if callback in CONFIG_SUBSCRIBERS:
+            CONFIG_SUBSCRIBERS.remove(callback)
+
 
-    config.update(config_updates)
+# Write config atomically: dump to a temp file in the same directory (so os.replace() stays on one filesystem) and swap it in
+def write_config_file_atomically(config, filename='config.json'):
+
+    config_dir = os.path.dirname(os.path.abspath(filename))
+    temp_fd, temp_path = tempfile.mkstemp(prefix='.config_', suffix='.json.tmp', dir=config_dir)
 
-    # Write updated config.json:
     try:
-        with open(filename, 'w') as file:
+        if os.path.exists(filename):
+            os.chmod(temp_path, os.stat(filename).st_mode & 0o777)  # mkstemp() creates files as 0600, retain the permissions of the existing config.json
+        with os.fdopen(temp_fd, 'w') as file:
             json.dump(config, file, indent=4)
-    except Exception as e:
-        handle_local_error("Could not update config.json, encountered error: ", e)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, filename)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# Reload-trigger subscribers: flag the LLM / VectorDB for a reload when a relevant key changes after they've been loaded up
+LLM_TRIGGER_KEYS_FOR_APP_RESTART = ['use_local_llm', 'local_llm_server', 'use_azure_open_ai', 'use_gpu', 'model_choice', 'local_llm_chat_template_format', 'local_llm_context_length', 'local_llm_max_new_tokens', 'local_llm_gpu_layers', 'base_template']
+VECTORDB_TRIGGER_KEYS_FOR_APP_RESTART = ['embedding_model_choice']
+
+
+def set_llm_reload_trigger_on_config_change(changed_keys, previous_config):
+    global LLM_CHANGE_RELOAD_TRIGGER_SET
+
+    if LLM_LOADED_UP and any(key in changed_keys for key in LLM_TRIGGER_KEYS_FOR_APP_RESTART):
+        LLM_CHANGE_RELOAD_TRIGGER_SET = True
+        return True
+
+    return False
+
+
+def set_vectordb_reload_trigger_on_config_change(changed_keys, previous_config):
+    global VECTORDB_CHANGE_RELOAD_TRIGGER_SET
+
+    if VECTORDB_LOADED_UP and any(key in changed_keys for key in VECTORDB_TRIGGER_KEYS_FOR_APP_RESTART):
+        VECTORDB_CHANGE_RELOAD_TRIGGER_SET = True
+        return True
+
+    return False
+
+
+subscribe_to_config_changes(set_llm_reload_trigger_on_config_change)
+subscribe_to_config_changes(set_vectordb_reload_trigger_on_config_change)
+
+
+# Method to write to config.json | input- dict of key:values to be written to config.json
+def write_config(config_updates, filename='config.json'):
+
+    with CONFIG_LOCK:
+
+        # Obtain all current params from the config snapshot:
+        try:
+            config = load_config_snapshot(filename)
+        except Exception as e:
+            config = {}     #init emply config dict
+            handle_error_no_return("Could not read config.json when attempting to write, encountered error: ", e)
+
+        changed_keys = {key: value for key, value in config_updates.items() if key not in config or config[key] != value}
+
+        # Nothing to do, skip the disk write altogether (ex: do_rag being re-written with the same value on every query):
+        if not changed_keys:
+            return {'success': True, 'restart_required': False}
+
+        # Never mutate the current snapshot in-place as other threads may be holding a reference to it, build a new dict instead:
+        updated_config = dict(config)
+        updated_config.update(config_updates)
+
+        # Write updated config.json:
+        try:
+            write_config_file_atomically(updated_config, filename)
+            CONFIG_SNAPSHOTS[filename] = {'signature': get_config_file_signature(filename), 'config': updated_config}
+        except Exception as e:
+            handle_local_error("Could not update config.json, encountered error: ", e)
+
+        restart_required = notify_config_subscribers(changed_keys, config)
      
     return {'success': True, 'restart_required':restart_required}
             
@@ -242,10 +358,9 @@ def write_config(config_updates, filename='config.json'):
 # Method to read from config.json | input- list of keys to be read from config.json; output- dict of key:value pairs; MANAGE DEFAULTS HERE!
 def read_config(keys, default_value=None, filename='config.json'):
     
-    # Open config file to read-in all current params:
+    # Obtain all current params from the config snapshot:
     try:
-        with open(filename, 'r') as file:
-            config = json.load(file)
+        config = load_config_snapshot(filename)
     except Exception as e:
         handle_error_no_return("Could not read config.json, encountered error: ", e)
         return {key: default_value for key in keys}     #because a read scenario wherein config.json does not exist shouldn't occur!
@@ -270,7 +385,14 @@ def read_config(keys, default_value=None, filename='config.json'):
                 'sqlite_images_db':base_directory + '/images_database_main.db',
                 'sqlite_history_db':base_directory + '/chat_history.db',
                 'sqlite_docs_loaded_db':base_directory + '/docs_loaded.db',
+                'sqlite_ingestion_jobs_db':base_directory + '/ingestion_jobs.db',
+                'sqlite_content_cache_db':base_directory + '/content_cache.db',
+                'content_cache_texts_folder':base_directory + '/content_cache_texts',
+                'sqlite_rerank_vectors_db':base_directory + '/rerank_vectors.db',
+                'sqlite_lexical_index_db':base_directory + '/lexical_index.db',
+                'sqlite_embedding_journal_db':base_directory + '/embedding_journal.db',
                 'model_dir':base_directory + '/models',
+                'onnx_embedding_models_folder':base_directory + '/onnx_embedding_models',
                 'highlighted_docs':base_directory + '/highlighted_pdfs',
                 'ocr_pdfs':base_directory + '/ocr_pdfs',
                 'pdfs_to_txts':base_directory + '/pdfs_to_txts',
@@ -283,12 +405,29 @@ def read_config(keys, default_value=None, filename='config.json'):
                 'use_gpu':True,
                 'use_gpu_for_embeddings':False,
                 'azure_cv_free_tier':True,
+                'azure_ocr_requests_per_minute':600,
+                'ocr_dpi':300,
+                'ocr_render_window_pages':4,
+                'ocr_max_in_flight':4,
+                'ocr_max_retries':6,
+                'local_ocr_workers':0,
+                'tesseract_lang':'eng',
+                'tesseract_config':'--psm 3',
+                'ocr_mode':'hybrid',
+                'ocr_min_text_chars_per_page':20,
+                'azure_doc_ai_pages_per_shard':20,
+                'azure_doc_ai_max_concurrent_shards':4,
                 'use_azure_open_ai':False,
                 'use_openai_embeddings':False,
                 'azure_openai_api_type':'azure',
                 'azure_openai_api_version':'2023-05-15',
                 'azure_openai_max_tokens':4096,
                 'azure_openai_temperature':0.7,
+                'azure_openai_embeddings_tokens_per_minute':120000,
+                'azure_openai_embeddings_requests_per_minute':720,
+                'azure_openai_embeddings_max_concurrency':4,
+                'azure_openai_embeddings_batch_size':16,
+                'azure_openai_embeddings_max_retries':8,
                 'use_bge_large_embeddings':False,
                 'use_bge_base_embeddings':False,
                 'use_sbert_embeddings':True,
@@ -307,6 +446,52 @@ def read_config(keys, default_value=None, filename='config.json'):
                 'local_llm_n_keep':0,
                 'server_timeout_seconds':10,
                 'server_retry_attempts':3,
+                'ingestion_worker_count':2,
+                'use_office_conversion_pool':True,
+                'office_pool_size':2,
+                'office_pool_base_port':2002,
+                'office_pool_max_conversions_per_listener':50,
+                'office_conversion_timeout_seconds':180,
+                'office_listener_startup_timeout_seconds':60,
+                'pdf_text_extractor':'auto',
+                'pdf_extraction_workers':0,
+                'pdf_extraction_pages_per_shard':50,
+                'pdf_extraction_parallel_page_threshold':100,
+                'chunk_size':256,
+                'chunk_overlap':32,
+                'reranker_mode':'bi_encoder',
+                'reranker_bi_encoder_model':'all-MiniLM-L6-v2',
+                'reranker_cross_encoder_model':'cross-encoder/ms-marco-MiniLM-L-6-v2',
+                'reranker_candidate_budget':11,
+                'use_hybrid_search':True,
+                'hybrid_search_lexical_k':11,
+                'hybrid_search_rrf_k':60,
+                'retrieval_fetch_k':11,
+                'retrieval_max_distance':1.0,
+                'retrieval_collapse_same_page':True,
+                'retrieval_use_mmr':True,
+                'retrieval_mmr_lambda':0.7,
+                'retrieval_mmr_k':8,
+                'vectordb_compaction_interval_hours':24,
+                'vectordb_compaction_min_deleted_chunks':1000,
+                'vector_backend':'chroma',
+                'ann_hnsw_m':32,
+                'ann_hnsw_ef_construction':200,
+                'ann_hnsw_ef_search':64,
+                'ann_segment_size':100000,
+                'ann_quantization':'none',
+                'ann_quantization_by_vectordb':{},
+                'ann_rescore_multiplier':4,
+                'query_embedding_cache_max_entries':1024,
+                'retrieval_cache_max_entries':256,
+                'use_semantic_answer_cache':False,
+                'semantic_answer_cache_similarity_threshold':0.95,
+                'semantic_answer_cache_ttl_seconds':86400,
+                'semantic_answer_cache_max_entries':500,
+                'embedding_backend':'pytorch',
+                'onnx_embedding_quantize':False,
+                'onnx_embedding_intra_op_threads':0,
+                'onnx_embedding_parity_tolerance':0.02,
                 'base_template':"Answer the user's question in as much detail as possible. Be as accurate as possible. Do not make up answers or fabricate false information! Whenever additional context is provided, mention the document names and page numbers the user should reference as per your best judgement.",
             }.get(key, 'undefined')
 
@@ -365,6 +550,347 @@ def config_writer_api():
     
     return jsonify({"success": write_return['success'], "restart_required": write_return['restart_required']})
 
+#########################-------------------------------------###############################
+
+
+#########################------------Embedding Model Registry-------------###############################
+# Embedding models are loaded once per (model name, device), kept warm, and shared by ingestion & query code via get_embedding_function().
+# Models no longer selected are unloaded when the embedding model choice changes in config.json.
+# With embedding_backend 'onnx' & use_gpu_for_embeddings off, the sentence-transformers & BGE models run on CPU via ONNX Runtime (see onnx_embeddings.py), as device 'onnx-cpu'
+# or 'onnx-cpu-int8' (onnx_embedding_quantize): their vectors are checked to be within onnx_embedding_parity_tolerance of PyTorch's, so they keep
+# using the same VectorDB folders. A model that can't be exported, or fails the parity check, is loaded with PyTorch instead.
+# onnx_embedding_intra_op_threads & onnx_embedding_parity_tolerance apply when a model is next loaded.
+EMBEDDING_MODEL_REGISTRY = {}   # (model_name, device) -> langchain embeddings instance
+EMBEDDING_MODEL_REGISTRY_LOCK = threading.RLock()
+BGE_QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "   # HuggingFaceBgeEmbeddings' default for the English bge models
+EMBEDDING_MODEL_CONFIG_KEYS = ['use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings', 'use_gpu_for_embeddings', 'azure_openai_text_ada_deployment_name', 'embedding_model_choice', 'embedding_backend', 'onnx_embedding_quantize']
+
+
+# Method to determine the (model name, device) key for the embedding model currently selected in config.json, or for embedding_model_choice if given
+def get_embedding_model_key(embedding_model_choice=None):
+
+    try:
+        read_return = read_config(['use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings', 'use_gpu_for_embeddings', 'embedding_backend', 'onnx_embedding_quantize'])
+        use_sbert_embeddings = read_return['use_sbert_embeddings']
+        use_openai_embeddings = read_return['use_openai_embeddings']
+        use_bge_base_embeddings = read_return['use_bge_base_embeddings']
+        use_bge_large_embeddings = read_return['use_bge_large_embeddings']
+        use_gpu_for_embeddings = read_return['use_gpu_for_embeddings']
+        embedding_backend = read_return['embedding_backend']
+        onnx_embedding_quantize = read_return['onnx_embedding_quantize']
+        if embedding_model_choice is not None:
+            use_sbert_embeddings = embedding_model_choice == 'sbert_mpnet_base_v2'
+            use_openai_embeddings = embedding_model_choice == 'openai_text_ada'
+            use_bge_base_embeddings = embedding_model_choice == 'bge_base'
+            use_bge_large_embeddings = embedding_model_choice == 'bge_large'
+        if use_openai_embeddings:
+            azure_openai_text_ada_deployment_name = read_config(['azure_openai_text_ada_deployment_name'])['azure_openai_text_ada_deployment_name']
+    except Exception as e:
+        handle_local_error("Missing embedding model values in config.json, could not determine the embedding model to use. Error: ", e)
+
+    device = "cuda" if use_gpu_for_embeddings else "cpu"
+    use_onnx_backend = embedding_backend == 'onnx' and not use_gpu_for_embeddings
+    if use_onnx_backend:
+        device = "onnx-cpu-int8" if onnx_embedding_quantize else "onnx-cpu"
+
+    if use_sbert_embeddings:
+        if use_onnx_backend:
+            return ("sentence-transformers/all-mpnet-base-v2", device)
+        return ("sentence-transformers/all-mpnet-base-v2", "auto")  # sentence-transformers picks the device itself, as it always has here
+    elif use_openai_embeddings:
+        return (f"azure-openai/{azure_openai_text_ada_deployment_name}", "remote")
+    elif use_bge_base_embeddings:
+        return ("BAAI/bge-base-en", device)
+    elif use_bge_large_embeddings:
+        return ("BAAI/bge-large-en", device)
+
+    return None
+
+
+# Method to read the config.json values load_embedding_model() needs for model_name on device. get_embedding_function() reads them before taking
+# EMBEDDING_MODEL_REGISTRY_LOCK: write_config() notifies unload_embedding_models_on_config_change() while holding CONFIG_LOCK, and that waits on the registry lock
+def read_embedding_model_load_config(model_name, device):
+
+    if device.startswith("onnx-cpu"):
+        try:
+            return read_config(['onnx_embedding_models_folder', 'onnx_embedding_intra_op_threads', 'onnx_embedding_parity_tolerance'])
+        except Exception as e:
+            handle_error_no_return("Could not read ONNX embedding values from config.json, the model will be loaded with PyTorch instead. Error: ", e)
+            return {}
+
+    if model_name.startswith("azure-openai/"):
+        try:
+            return read_config(['azure_openai_text_ada_api_url', 'azure_openai_text_ada_api_key', 'azure_openai_api_type', 'azure_openai_api_version'])
+        except Exception as e:
+            handle_local_error("Missing values for Azure OpenAI Embeddings in config.json. Error: ", e)
+
+    return {}
+
+
+def load_embedding_model(model_name, device, load_config):
+
+    print(f"\n\nLoading embedding model {model_name} on device {device}\n\n")
+
+    if device.startswith("onnx-cpu"):
+        try:
+            return load_onnx_embedding_model(model_name, quantize=(device == "onnx-cpu-int8"), load_config=load_config)
+        except Exception as e:
+            handle_error_no_return(f"Could not load embedding model {model_name} via ONNX Runtime, loading it with PyTorch on CPU instead. Encountered error: ", e)
+            device = "auto" if model_name == "sentence-transformers/all-mpnet-base-v2" else "cpu"
+
+    if model_name == "sentence-transformers/all-mpnet-base-v2":
+        return HuggingFaceEmbeddings(model_name=model_name)
+
+    elif model_name.startswith("azure-openai/"):
+        try:
+            os.environ["OPENAI_API_BASE"] = load_config['azure_openai_text_ada_api_url']
+            os.environ["OPENAI_API_KEY"] = load_config['azure_openai_text_ada_api_key']
+            os.environ["OPENAI_API_TYPE"] = load_config['azure_openai_api_type']
+            os.environ["OPENAI_API_VERSION"] = load_config['azure_openai_api_version']
+        except Exception as e:
+            handle_local_error("Missing values for Azure OpenAI Embeddings in config.json, or could not set them as OS environment variables. Error: ", e)
+        return OpenAIEmbeddings(deployment=model_name[len("azure-openai/"):])
+
+    elif model_name.startswith("BAAI/bge-"):
+        encode_kwargs = {"normalize_embeddings": True}
+        return HuggingFaceBgeEmbeddings(model_name=model_name, model_kwargs={"device": device}, encode_kwargs=encode_kwargs)
+
+    raise ValueError(f"Unknown embedding model: {model_name}")
+
+
+def load_onnx_embedding_model(model_name, quantize, load_config):
+
+    try:
+        onnx_embedding_models_folder = load_config['onnx_embedding_models_folder']
+        onnx_embedding_intra_op_threads = int(load_config['onnx_embedding_intra_op_threads'])
+        onnx_embedding_parity_tolerance = float(load_config['onnx_embedding_parity_tolerance'])
+    except Exception as e:
+        handle_local_error("Missing ONNX embedding values in config.json for method load_onnx_embedding_model. Error: ", e)
+
+    if model_name.startswith("BAAI/bge-"):    # as HuggingFaceBgeEmbeddings: normalized, with its default instruction prepended to queries
+        return OnnxEmbeddings(model_name, onnx_embedding_models_folder, quantize, onnx_embedding_intra_op_threads, onnx_embedding_parity_tolerance, normalize_embeddings=True, query_instruction=BGE_QUERY_INSTRUCTION)
+
+    return OnnxEmbeddings(model_name, onnx_embedding_models_folder, quantize, onnx_embedding_intra_op_threads, onnx_embedding_parity_tolerance)
+
+
+# Method to obtain the shared embedding function for the currently selected model (or embedding_model_choice), loading it on first use
+def get_embedding_function(embedding_model_choice=None):
+
+    model_key = get_embedding_model_key(embedding_model_choice)
+    if model_key is None:
+        return None
+
+    load_config = read_embedding_model_load_config(*model_key)   # never read config.json under the registry lock, see read_embedding_model_load_config()
+
+    with EMBEDDING_MODEL_REGISTRY_LOCK:
+        embedding_function = EMBEDDING_MODEL_REGISTRY.get(model_key)
+        if embedding_function is None:
+            try:
+                embedding_function = load_embedding_model(*model_key, load_config)
+            except Exception as e:
+                handle_local_error(f"Could not load embedding model {model_key[0]} on device {model_key[1]}, encountered error: ", e)
+            EMBEDDING_MODEL_REGISTRY[model_key] = embedding_function
+
+    return embedding_function
+
+
+def unload_embedding_models(keep_model_key=None):
+
+    with EMBEDDING_MODEL_REGISTRY_LOCK:
+        for model_key in [model_key for model_key in EMBEDDING_MODEL_REGISTRY if model_key != keep_model_key]:
+            print(f"\n\nUnloading embedding model {model_key[0]} from device {model_key[1]}\n\n")
+            del EMBEDDING_MODEL_REGISTRY[model_key]
+
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception as e:
+        handle_error_no_return("Could not release cached GPU memory after unloading embedding models, encountered error: ", e)
+
+
+def unload_embedding_models_on_config_change(changed_keys, previous_config):
+
+    if any(key in changed_keys for key in EMBEDDING_MODEL_CONFIG_KEYS):
+        unload_embedding_models(keep_model_key=get_embedding_model_key())
+
+    return False
+
+
+subscribe_to_config_changes(unload_embedding_models_on_config_change)
+
+#########################-------------------------------------###############################
+
+
+#########################------------Retriever-------------###############################
+# Owns one open Chroma collection per (VectorDB folder, embedding model), each opened once and shared by ingestion & queries.
+# VECTOR_STORE always references the collection for the configured embedding model & folder: when either changes (embedding model
+# switch, reset_vector_db_on_disk), the new collection is fully opened first and VECTOR_STORE is then swapped over in a single assignment.
+# Requests take a reference to VECTOR_STORE once, so they never see a half-reloaded store, and the query path never opens one itself.
+VECTORDB_FOLDER_KEYS_BY_MODEL_CHOICE = {'sbert_mpnet_base_v2': 'vectordb_sbert_folder', 'openai_text_ada': 'vectordb_openai_folder', 'bge_base': 'vectordb_bge_base_folder', 'bge_large': 'vectordb_bge_large_folder'}
+VECTORDB_FOLDER_PREFIXES_BY_MODEL_CHOICE = {'sbert_mpnet_base_v2': 'chroma_db_sbert_embeddings', 'openai_text_ada': 'chroma_db_openai_embeddings', 'bge_base': 'chroma_db_bge_base_embeddings', 'bge_large': 'chroma_db_bge_large_embeddings'}
+VECTOR_STORE_CONFIG_KEYS = EMBEDDING_MODEL_CONFIG_KEYS + list(VECTORDB_FOLDER_KEYS_BY_MODEL_CHOICE.values()) + ['vector_backend', 'ann_hnsw_m', 'ann_hnsw_ef_construction', 'ann_hnsw_ef_search', 'ann_segment_size', 'ann_quantization', 'ann_quantization_by_vectordb', 'ann_rescore_multiplier']
+OPEN_VECTOR_STORES = {}     # (persist_directory, embedding model key, vector_backend, (ANN quantization, rescore multiplier) | None) -> Chroma | FaissHnswVectorStore
+OPEN_VECTOR_STORES_LOCK = threading.RLock()
+VECTOR_STORE_SWAP_LOCK = threading.Lock()
+
+
+def get_vectordb_folder_for_model_choice(embedding_model_choice):
+    folder_key = VECTORDB_FOLDER_KEYS_BY_MODEL_CHOICE[embedding_model_choice]
+    return read_config([folder_key])[folder_key]
+
+
+# Method to map the use_*_embeddings flags onto the embedding model choice they select
+def get_embedding_model_choice_in_use():
+
+    try:
+        read_return = read_config(['use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings'])
+    except Exception as e:
+        handle_local_error("Missing embedding model values in config.json for method get_embedding_model_choice_in_use. Error: ", e)
+
+    if read_return['use_sbert_embeddings']:
+        return 'sbert_mpnet_base_v2'
+    elif read_return['use_openai_embeddings']:
+        return 'openai_text_ada'
+    elif read_return['use_bge_base_embeddings']:
+        return 'bge_base'
+    elif read_return['use_bge_large_embeddings']:
+        return 'bge_large'
+
+    return None
+
+
+def get_vectordb_folder_in_use():
+    embedding_model_choice = get_embedding_model_choice_in_use()
+    if embedding_model_choice is None:
+        return ""
+    return get_vectordb_folder_for_model_choice(embedding_model_choice)
+
+
+# Method to obtain the open collection for persist_directory (default: the folder in use) with the configured embedding model (or embedding_model_choice),
+# opening it on first use
+def get_vector_store(persist_directory=None, embedding_model_choice=None):
+
+    if persist_directory is None:
+        persist_directory = get_vectordb_folder_in_use()
+    vector_backend = read_config(['vector_backend'])['vector_backend']
+    ann_quantization_settings = get_ann_quantization_settings(persist_directory) if vector_backend == 'faiss_hnsw' else None
+    store_key = (persist_directory, get_embedding_model_key(embedding_model_choice), vector_backend, ann_quantization_settings)
+
+    with OPEN_VECTOR_STORES_LOCK:
+        vector_store = OPEN_VECTOR_STORES.get(store_key)
+        if vector_store is None:
+            print(f"\n\nOpening VectorDB {persist_directory} ({vector_backend})\n\n")
+            vector_store = open_vector_store(persist_directory, vector_backend, embedding_model_choice)
+            OPEN_VECTOR_STORES[store_key] = vector_store
+
+    return vector_store
+
+
+# Method to obtain the ANN quantization for a VectorDB folder: its entry in ann_quantization_by_vectordb (keyed by folder name) if any, else ann_quantization
+# Returns (quantization: 'none' | 'int8' | 'binary', rescore_multiplier)
+def get_ann_quantization_settings(persist_directory):
+
+    try:
+        read_return = read_config(['ann_quantization', 'ann_quantization_by_vectordb', 'ann_rescore_multiplier'])
+        ann_quantization_by_vectordb = read_return['ann_quantization_by_vectordb'] or {}
+        ann_quantization = ann_quantization_by_vectordb.get(os.path.basename(os.path.normpath(persist_directory)), read_return['ann_quantization'])
+        ann_rescore_multiplier = int(read_return['ann_rescore_multiplier'])
+    except Exception as e:
+        handle_local_error("Missing ANN quantization values in config.json for method get_ann_quantization_settings. Error: ", e)
+
+    return ann_quantization, ann_rescore_multiplier
+
+
+# vector_backend: 'chroma' (langchain's Chroma wrapper) | 'faiss_hnsw' (FaissHnswVectorStore, index files kept within the same VectorDB folder)
+def open_vector_store(persist_directory, vector_backend, embedding_model_choice=None):
+
+    if vector_backend != 'faiss_hnsw':
+        return Chroma(persist_directory=persist_directory, embedding_function=get_embedding_function(embedding_model_choice))
+
+    try:
+        read_return = read_config(['ann_hnsw_m', 'ann_hnsw_ef_construction', 'ann_hnsw_ef_search', 'ann_segment_size'])
+        ann_hnsw_m = int(read_return['ann_hnsw_m'])
+        ann_hnsw_ef_construction = int(read_return['ann_hnsw_ef_construction'])
+        ann_hnsw_ef_search = int(read_return['ann_hnsw_ef_search'])
+        ann_segment_size = int(read_return['ann_segment_size'])
+    except Exception as e:
+        handle_local_error("Missing ANN index values in config.json for method open_vector_store. Error: ", e)
+
+    # Switching a folder's quantization rebuilds its index segments from the full-precision vectors kept alongside them
+    ann_quantization, ann_rescore_multiplier = get_ann_quantization_settings(persist_directory)
+
+    vector_store = FaissHnswVectorStore(persist_directory, get_embedding_function(embedding_model_choice), m=ann_hnsw_m, ef_construction=ann_hnsw_ef_construction, ef_search=ann_hnsw_ef_search, segment_size=ann_segment_size, quantization=ann_quantization, rescore_multiplier=ann_rescore_multiplier)
+
+    # A folder switched over from Chroma keeps its chunks: the stored vectors are copied across rather than re-embedded
+    if vector_store.count() == 0 and os.path.exists(os.path.join(persist_directory, 'chroma.sqlite3')):
+        try:
+            import_chroma_into_ann_store(persist_directory, vector_store)
+        except Exception as e:
+            handle_error_no_return("Could not import the VectorDB's Chroma collection into the ANN index, encountered error: ", e)
+
+    return vector_store
+
+
+def import_chroma_into_ann_store(persist_directory, ann_store, page_size=5000):
+
+    chroma_collection = Chroma(persist_directory=persist_directory, embedding_function=get_embedding_function())._collection
+    if chroma_collection.count() == 0:
+        return
+
+    print(f"\n\nImporting {chroma_collection.count()} chunks from Chroma into the ANN index\n\n")
+    offset = 0
+    while True:
+        stored_chunks = chroma_collection.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not stored_chunks['ids']:
+            break
+        ann_store.add(ids=stored_chunks['ids'], embeddings=stored_chunks['embeddings'], documents=stored_chunks['documents'], metadatas=stored_chunks['metadatas'])
+        offset += page_size
+
+
+# Method to point VECTOR_STORE at the collection for the current config, dropping handles to collections no longer in use
+def activate_vector_store():
+    global VECTOR_STORE
+
+    with VECTOR_STORE_SWAP_LOCK:
+        persist_directory = get_vectordb_folder_in_use()
+        vector_store = get_vector_store(persist_directory)
+        VECTOR_STORE = vector_store     # the swap itself: a single reference assignment
+
+        with OPEN_VECTOR_STORES_LOCK:
+            for store_key in [store_key for store_key, open_store in OPEN_VECTOR_STORES.items() if open_store is not vector_store]:
+                del OPEN_VECTOR_STORES[store_key]
+
+    return vector_store, persist_directory
+
+
+def activate_vector_store_in_background():
+
+    try:
+        vector_store, persist_directory = activate_vector_store()
+    except Exception as e:
+        handle_error_no_return("Could not swap to the newly configured VectorDB, encountered error: ", e)
+        return
+
+    try:
+        backfill_lexical_index(vector_store, persist_directory)
+    except Exception as e:
+        handle_error_no_return("Could not backfill the lexical index, hybrid search will miss documents not yet indexed. Encountered error: ", e)
+
+
+# Subscribers are notified while config.json is locked, so the (potentially slow) model load & open happen on a separate thread
+def swap_vector_store_on_config_change(changed_keys, previous_config):
+
+    if VECTORDB_LOADED_UP and any(key in changed_keys for key in VECTOR_STORE_CONFIG_KEYS):
+        Thread(target=activate_vector_store_in_background, daemon=True).start()
+
+    return False
+
+
+subscribe_to_config_changes(swap_vector_store_on_config_change)
+
+#########################-------------------------------------###############################
 
 
 #########################------------Setup Directories-------------###############################
@@ -375,7 +901,6 @@ if platform.system() == 'Windows':
     from msrest.authentication import CognitiveServicesCredentials
     from azure.ai.formrecognizer import DocumentAnalysisClient
     from azure.core.credentials import AzureKeyCredential
-    from azure.core.exceptions import HttpResponseError
     import azure.ai.vision as sdk
     
     #BASE_DIRECTORY = 'C:/lars_storage'
@@ -390,7 +915,6 @@ elif platform.system() == 'Linux':
     from msrest.authentication import CognitiveServicesCredentials
     from azure.ai.formrecognizer import DocumentAnalysisClient
     from azure.core.credentials import AzureKeyCredential
-    from azure.core.exceptions import HttpResponseError
     import azure.ai.vision as sdk
     
     #BASE_DIRECTORY = '/app/lars_storage'
@@ -502,2644 +1026,5485 @@ app.config['UPLOAD_FOLDER'] = upload_folder
 app.config['DOWNLOAD_FOLDER'] = highlighted_docs
 
 
+# Matches any run of characters that are not word characters, which covers both punctuation/symbols and whitespace
+CLEAN_TEXT_REGEX = re.compile(r'[^\w]+')
+
 def clean_text_string(text_to_be_cleaned):
     
     # Clean text
     # text_to_be_cleaned = text_to_be_cleaned.replace("►", "").replace("■", "").replace("▼", "")
     # text_to_be_cleaned = text_to_be_cleaned.replace("Confidential Copy \n            for \n         DKPPU", "")
     #clean_text = re.sub(r'\n(?=[a-z.])', ' ', text)     # replaces newline chars immediately followed by a small-letter or dot with a space as they're likely to be the same sentence split-up across lines.
-    clean_text = re.sub(r'\n+', '\n', text_to_be_cleaned)
-
-    # This regex substitutes anything that is not a word character or whitespace with an empty string.
-    clean_text = re.sub(r'[^\w\s]', ' ', clean_text)
 
-    # This regex substitutes any sequence of whitespace characters with a single space.
-    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+    # Previously three passes: collapse newlines, swap anything that is not a word character or whitespace for a space, then collapse whitespace.
+    # As [^\w\s] and \s together are exactly [^\w], a single pass replacing each run of non-word characters with one space is equivalent:
+    clean_text = CLEAN_TEXT_REGEX.sub(' ', text_to_be_cleaned).strip()
 
     return clean_text
 
 
-def PDFtoAzureDocAiTXT(input_filepath):
+#########################------------Content Cache-------------###############################
+# Extraction & embedding results are cached against the SHA-256 of the source PDF rather than its filename, so that:
+# 1. a replaced file (same name, new content) is re-extracted instead of returning stale text
+# 2. a renamed or duplicate upload re-uses the text already extracted for that content, and the chunk vectors already stored in the VectorDB
+# extraction_cache maps (content_hash, extractor) to a copy of the extracted .txt kept under content_cache_texts_folder as <content_hash>-<extractor>.txt,
+# as the .txt next to the upload is named after the file & overwritten by the next upload of that name; embedding_cache maps (content_hash, extractor,
+# chunk params, embedding model, vectordb) to the ids of the chunks stored for a given source .txt
+def compute_file_hash(filepath, block_size=1024*1024):
+    file_hash = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def connect_to_content_cache_db():
 
-    print("\n\nProcessing Document - PDF to Azure DocAI TXT\n\n")
-    
     try:
-        read_return = read_config(['azure_doc_ai_endpoint', 'azure_doc_ai_subscription_key', 'ocr_pdfs'])
-        azure_doc_ai_endpoint = read_return['azure_doc_ai_endpoint']
-        azure_doc_ai_subscription_key = read_return['azure_doc_ai_subscription_key']
-        ocr_pdfs = read_return['ocr_pdfs']
+        read_return = read_config(['sqlite_content_cache_db'])
+        sqlite_content_cache_db = read_return['sqlite_content_cache_db']
     except Exception as e:
-        handle_local_error("Missing Azure OCR Endpoint URL & Subscription Key for PDFtoAzureDocAiTXT, please provide required API config. Error: ", e)
+        handle_local_error("Missing sqlite_content_cache_db in config.json for method connect_to_content_cache_db. Error: ", e)
 
     try:
-        source_filename = os.path.basename(input_filepath)
+        conn = sqlite3.connect(sqlite_content_cache_db, timeout=30)
+        conn.row_factory = sqlite3.Row
     except Exception as e:
-        handle_local_error("Could not extract filename, encountered error: ", e)
-
-    # Set output path
-    output_text_file_name = source_filename.replace(".pdf",".txt")
-    output_text_file_path = os.path.join(ocr_pdfs, output_text_file_name).replace("\\","/")
-
-    if os.path.exists(output_text_file_path):
-        print("Azure-OCR'ed doc already exists! Returning existing file.")
-        return output_text_file_path
+        handle_local_error("Could not establish connection to content cache DB, encountered error: ", e)
 
-    # Initialize text output
+    # If the database does not currently exist...
     try:
-        output_text_file = open(output_text_file_path, 'w', encoding='utf-8')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                    content_hash TEXT NOT NULL,
+                    extractor TEXT NOT NULL,
+                    text_file_path TEXT NOT NULL,
+                    created_at TEXT,
+                    PRIMARY KEY (content_hash, extractor)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                    id INTEGER PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    extractor TEXT NOT NULL,
+                    chunk_size INTEGER,
+                    chunk_overlap INTEGER,
+                    embedding_model TEXT NOT NULL,
+                    vectordb_used TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    chunk_ids TEXT NOT NULL,
+                    created_at TEXT,
+                    UNIQUE (content_hash, extractor, chunk_size, chunk_overlap, embedding_model, vectordb_used, source)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS docai_shard_cache (
+                    content_hash TEXT NOT NULL,
+                    first_page INTEGER NOT NULL,
+                    last_page INTEGER NOT NULL,
+                    records TEXT NOT NULL,
+                    created_at TEXT,
+                    PRIMARY KEY (content_hash, first_page, last_page)
+            )
+        ''')
+        conn.commit()
     except Exception as e:
-        handle_local_error("Could not initialize/access output text file, encountered error: ", e)
+        handle_local_error("Could not create content cache DB, encountered error: ", e)
+
+    return conn
+
+
+def get_cached_extraction_path(content_hash, extractor):
 
     try:
-        docai_client = DocumentAnalysisClient(azure_doc_ai_endpoint, AzureKeyCredential(azure_doc_ai_subscription_key))
+        content_cache_texts_folder = read_config(['content_cache_texts_folder'])['content_cache_texts_folder']
     except Exception as e:
-        handle_local_error("Could not create ComputerVisionClient for Azure DocAI, encountered error: ", e)
+        handle_local_error("Missing content_cache_texts_folder in config.json for method get_cached_extraction_path. Error: ", e)
+
+    os.makedirs(content_cache_texts_folder, exist_ok=True)
+    return os.path.join(content_cache_texts_folder, f"{content_hash}-{extractor}.txt")
 
+
+# If text has already been extracted for this content via this extractor, place it at output_text_file_path and return True
+def restore_cached_extraction(content_hash, extractor, output_text_file_path):
+
+    conn = connect_to_content_cache_db()
     try:
-        with open(input_filepath, "rb") as pdf_file:
-            # 1 - Get page count:
-            try:
-                pypdf_reader = PyPDF2.PdfReader(pdf_file)
-                page_count = len(pypdf_reader.pages)
-                page_range = f"1-{page_count}" if page_count > 1 else "1"
-                print(f"page_range: {page_range}")
-            except Exception as e:
-                handle_local_error("Could not get page count for call to Azure DocAI, encountered error: ", e)
+        row = conn.execute("SELECT text_file_path FROM extraction_cache WHERE content_hash = ? AND extractor = ?", (content_hash, extractor)).fetchone()
+    finally:
+        conn.close()
 
-            # 2 - Reset file-read stream's internal pointer, which has now been set to the end of the file due to the above read operation!
-            pdf_file.seek(0)
+    # Rows recorded before texts were kept by content hash point at a filename-derived .txt that may since hold another document's text:
+    cached_text_file_path = get_cached_extraction_path(content_hash, extractor)
+    if row is None or os.path.abspath(row['text_file_path']) != os.path.abspath(cached_text_file_path) or not os.path.exists(cached_text_file_path):
+        return False
 
-            # 3 - Call Azure DocAI:
-            try:
-                poller = docai_client.begin_analyze_document("prebuilt-layout", pdf_file, pages=page_range)
-                result = poller.result()
-            except Exception as e:
-                handle_local_error("Could not get results for begin_analyze_document for Azure DocAI, encountered error: ", e)
+    # Extracted text only carries [PAGE:n] markers and no filenames, so a copy is valid for a renamed duplicate:
+    shutil.copyfile(cached_text_file_path, output_text_file_path)
 
-        # print(f"result: \n{result}")
+    return True
 
-        used_regions = set()   # set will avoid duplicates
 
-        if hasattr(result, 'tables'):
-            for table in result.tables:
-                #print("Found table")
-                if table.cells:     # Check if there are cells in the table 
-                    for cell in table.cells:
-                        #print(f"Row {cell.row_index}, Column {cell.column_index}, Text: {cell.content}")
-                        cell_text = f'Row {cell.row_index}, Column {cell.column_index}: {cell.content}'
+def record_cached_extraction(content_hash, extractor, output_text_file_path):
 
-                        # Get page number
-                        page_number = ""
-                        if cell.bounding_regions:   # Check if there are bounding regions
-                            for region in cell.bounding_regions:
-                                page_number = region.page_number
-                                cell_polygon = region.polygon
-                                cell_polygon_tuple = tuple((point.x, point.y) for point in cell_polygon)    # lists aren't hashable to cast to a tuple
-                                used_regions.add(cell_polygon_tuple)
+    cached_text_file_path = get_cached_extraction_path(content_hash, extractor)
+    shutil.copyfile(output_text_file_path, cached_text_file_path + '.tmp')
+    os.replace(cached_text_file_path + '.tmp', cached_text_file_path)
 
-                        try:
-                            output_text_file.write(f"[PAGE:{page_number}]\n{cell_text}\n")
-                        except Exception as e:
-                            handle_local_error("could not write to output text file, encountered error: ", e)
-
-        # Get paragraphs
-        if hasattr(result, 'paragraphs'):
-            for paragraph in result.paragraphs:
-                para_page_number = paragraph.bounding_regions[0].page_number
-                para_polygon = paragraph.bounding_regions[0].polygon
-                para_polygon_tuple = tuple((point.x, point.y) for point in para_polygon)
-                
-                if para_polygon_tuple in used_regions:
-                    continue
-                
-                para_content = paragraph.content
-                #print(f"\n---Processing Page: {para_page_number}---\n")
-                #print(f"paragraph: {para_content}")
+    conn = connect_to_content_cache_db()
+    try:
+        conn.execute("INSERT OR REPLACE INTO extraction_cache (content_hash, extractor, text_file_path, created_at) VALUES (?, ?, ?, ?)", (content_hash, extractor, cached_text_file_path, datetime.datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
 
-                # write the extracted text to the file:
-                try:
-                    output_text_file.write(f"[PAGE:{para_page_number}]\n{para_content}\n")
-                    used_regions.add(para_polygon_tuple)
-                except Exception as e:
-                    handle_local_error("could not write to output text file, encountered error: ", e)
 
-    except Exception as e:
-        handle_local_error("Error processing document with azure DocAI: ", e)
+def find_cached_embeddings(content_hash, extractor, chunk_size, chunk_overlap, embedding_model, vectordb_used):
 
-    # Close all files
-    output_text_file.close()
+    conn = connect_to_content_cache_db()
+    try:
+        rows = conn.execute("SELECT source, chunk_ids FROM embedding_cache WHERE content_hash = ? AND extractor = ? AND chunk_size = ? AND chunk_overlap = ? AND embedding_model = ? AND vectordb_used = ?", (content_hash, extractor, chunk_size, chunk_overlap, embedding_model, vectordb_used)).fetchall()
+    finally:
+        conn.close()
 
-    return output_text_file_path
+    return [(row['source'], json.loads(row['chunk_ids'])) for row in rows]
 
 
-def PDFtoAzureOCRTXT(input_filepath):
-    
-    print("\n\nProcessing Document - PDF to Azure OCR TXT\n\n")
-    
+def find_stale_embeddings_for_source(content_hash, source, vectordb_used):
+
+    conn = connect_to_content_cache_db()
     try:
-        read_return = read_config(['azure_ocr_endpoint', 'azure_ocr_subscription_key', 'ocr_pdfs', 'azure_cv_free_tier'])
-        azure_ocr_endpoint = read_return['azure_ocr_endpoint']
-        azure_ocr_subscription_key = read_return['azure_ocr_subscription_key']
-        ocr_pdfs = read_return['ocr_pdfs']
-        azure_cv_free_tier = read_return['azure_cv_free_tier']
-    except Exception as e:
-        handle_local_error("Missing Azure OCR Endpoint URL & Subscription Key for PDFtoAzureOCRTXT, please provide required API config. Error: ", e)
+        rows = conn.execute("SELECT id, chunk_ids FROM embedding_cache WHERE source = ? AND vectordb_used = ? AND content_hash != ?", (source, vectordb_used, content_hash)).fetchall()
+    finally:
+        conn.close()
+
+    return [(row['id'], json.loads(row['chunk_ids'])) for row in rows]
 
+
+def forget_cached_embeddings(row_ids):
+
+    conn = connect_to_content_cache_db()
     try:
-        source_filename = os.path.basename(input_filepath)
-    except Exception as e:
-        handle_local_error("Could not extract filename, encountered error: ", e)
+        conn.executemany("DELETE FROM embedding_cache WHERE id = ?", [(row_id,) for row_id in row_ids])
+        conn.commit()
+    finally:
+        conn.close()
 
-    # Set output path
-    output_text_file_name = source_filename.replace(".pdf",".txt")
-    output_text_file_path = os.path.join(ocr_pdfs, output_text_file_name).replace("\\","/")
 
-    if os.path.exists(output_text_file_path):
-        print("OCR'ed doc already exists! Returning existing file.")
-        return output_text_file_path
+def forget_cached_embeddings_for_source(source, vectordb_used):
 
-    # Convert PDF to  a list of images
+    conn = connect_to_content_cache_db()
     try:
-        print("\n\nConverting PDF to a list of Images\n\n")
-        pages = convert_from_path(input_filepath, 300) # 300dpi - good balance between quality and performance
-    except Exception as e:
-        handle_local_error("Could not image PDF file, encountered error: ", e)
+        conn.execute("DELETE FROM embedding_cache WHERE source = ? AND vectordb_used = ?", (source, vectordb_used))
+        conn.commit()
+    finally:
+        conn.close()
 
-    # Initialize text output
+
+def record_cached_embeddings(content_hash, extractor, chunk_size, chunk_overlap, embedding_model, vectordb_used, source, chunk_ids):
+
+    conn = connect_to_content_cache_db()
     try:
-        output_text_file = open(output_text_file_path, 'w', encoding='utf-8')
-    except Exception as e:
-        handle_local_error("Could not initialize/access output text file, encountered error: ", e)
+        conn.execute("INSERT OR REPLACE INTO embedding_cache (content_hash, extractor, chunk_size, chunk_overlap, embedding_model, vectordb_used, source, chunk_ids, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (content_hash, extractor, chunk_size, chunk_overlap, embedding_model, vectordb_used, source, json.dumps(chunk_ids), datetime.datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
 
+
+# Azure DocAI results per page-range shard, so a failure late in a long document doesn't redo the shards already analyzed | records: [(page_number, text)]
+def find_cached_docai_shard(content_hash, first_page, last_page):
+
+    conn = connect_to_content_cache_db()
     try:
-        computervision_client = ComputerVisionClient(azure_ocr_endpoint, CognitiveServicesCredentials(azure_ocr_subscription_key))
-    except Exception as e:
-        handle_local_error("Could not create ComputerVisionClient for Azure OCR, encountered error: ", e)
-    
-    calls_made = 0
+        row = conn.execute("SELECT records FROM docai_shard_cache WHERE content_hash = ? AND first_page = ? AND last_page = ?", (content_hash, first_page, last_page)).fetchone()
+    finally:
+        conn.close()
 
-    # Iterate over each page and apply OCR:
-    print("\n\nBeginning image to Text OCR\n\n")
-    for page_number, image in enumerate(pages, start = 1):
-        
-        # Convert to bytes and create a stream
-        try:
-            img_stream = io.BytesIO()
-            image.save(img_stream, format='PNG')
-            img_stream.seek(0)  # Reset the stream position to the beginning
-        except Exception as e:
-            handle_local_error("Could not convert image to Byte Stream for Azure OCR, encountered error: ", e)
-            continue
+    return [tuple(record) for record in json.loads(row['records'])] if row else None
 
-        # Send to Azure OCR
-        try:
-            if azure_cv_free_tier:
-                if calls_made < 20:
-                    print(f"Submitting page {page_number} to AzureComputerVision for OCR")
-                    result = computervision_client.recognize_printed_text_in_stream(image=img_stream)
-                    #analyze_result = computervision_client.begin_analyze_document("prebuilt-layout", img_stream).result()
-                    calls_made += 1
-                else:
-                    print("Sleeping for 60secs due to AzureOCR free-tier restrictions!")
-                    time.sleep(63)  #free tier restrictions!
-                    print(f"Submitting page {page_number} to AzureComputerVision for OCR")
-                    result = computervision_client.recognize_printed_text_in_stream(image=img_stream)
-                    #analyze_result = computervision_client.begin_analyze_document("prebuilt-layout", img_stream).result()
-                    calls_made = 1  #reset counter
-            else:
-                print(f"Submitting page {page_number} to AzureComputerVision for OCR")
-                result = computervision_client.recognize_printed_text_in_stream(image=img_stream)
-        except HttpResponseError as e:
-            print(f"\n\nHttpResponseError e: {e}\n\n")
-            if e.status_code == 429:
-                print("Exceeded free-tier usage limits, waiting for one-minute and retrying")
-                time.sleep(63)  #free tier restrictions!
-                img_stream.seek(0)
-                print(f"Submitting page {page_number} to AzureComputerVision for OCR")
-                result = computervision_client.recognize_printed_text_in_stream(image=img_stream)
-                calls_made = 1  #reset counter
-        except Exception as e:
-            if "(429)" in str(e):
-                print("Exceeded free-tier usage limits, waiting for one-minute and retrying")
-                time.sleep(63)  #free tier restrictions!
-                img_stream.seek(0)
-                print(f"Submitting page {page_number} to AzureComputerVision for OCR")
-                result = computervision_client.recognize_printed_text_in_stream(image=img_stream)
-                calls_made = 1  #reset counter\
-            else:
-                handle_local_error("Could not convert image to Byte Stream for Azure OCR, encountered error: ", e)
 
-        for region in result.regions:
-            for line in region.lines:
-                #print(" ".join([word.text for word in line.words]))
+def record_cached_docai_shard(content_hash, first_page, last_page, records):
 
-                try:
-                    clean_text = str(" ".join([word.text for word in line.words]))
-                except Exception as e:
-                    handle_error_no_return("Could not obtain line from Azure OCR result, encountered error: ", e)
-                    continue
+    conn = connect_to_content_cache_db()
+    try:
+        conn.execute("INSERT OR REPLACE INTO docai_shard_cache (content_hash, first_page, last_page, records, created_at) VALUES (?, ?, ?, ?, ?)", (content_hash, first_page, last_page, json.dumps(records), datetime.datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
 
-                # Write the extracted text to the file:
-                try:
-                    output_text_file.write(f"[PAGE:{page_number}]\n{clean_text}\n")
-                except Exception as e:
-                    handle_local_error("Could not write to output text file, encountered error: ", e)
 
-    # Close all files
-    output_text_file.close()
+# Once the document's merged text is in the extraction cache, its shards are no longer needed
+def forget_cached_docai_shards(content_hash):
 
-    return output_text_file_path
+    conn = connect_to_content_cache_db()
+    try:
+        conn.execute("DELETE FROM docai_shard_cache WHERE content_hash = ?", (content_hash,))
+        conn.commit()
+    finally:
+        conn.close()
 
+#########################-------------------------------------###############################
 
-def PDFtoTXT(input_file):
 
-    print("\n\nProcessing Document - PDF to TXT\n\n")
+#########################------------Lexical Index-------------###############################
+# An SQLite FTS5 (BM25) index over the same chunks stored to Chroma, maintained at ingestion time & scoped by VectorDB folder. Queries run
+# against both indexes and the results are fused via reciprocal-rank fusion, which recovers exact-term matches (part numbers, acronyms)
+# that dense retrieval tends to miss, without having to raise k.
+def connect_to_lexical_index_db():
 
     try:
-        read_return = read_config(['pdfs_to_txts'])
-        pdfs_to_txts = read_return['pdfs_to_txts']
+        read_return = read_config(['sqlite_lexical_index_db'])
+        sqlite_lexical_index_db = read_return['sqlite_lexical_index_db']
     except Exception as e:
-        handle_local_error("Missing pdfs_to_txts directory for PDFtoTXT in config.json, encountered error: ", e)
-    
-    # Initialize PDF file reader
+        handle_local_error("Missing sqlite_lexical_index_db in config.json for method connect_to_lexical_index_db. Error: ", e)
+
     try:
-        pdf_file = open(input_file, 'rb')
+        conn = sqlite3.connect(sqlite_lexical_index_db, timeout=30)
+        conn.row_factory = sqlite3.Row
     except Exception as e:
-        handle_local_error("Could not open PDF file, encountered error: ", e)
+        handle_local_error("Could not establish connection to lexical index DB, encountered error: ", e)
 
+    # If the database does not currently exist... (the FTS5 table is external-content, kept in sync with lexical_chunks via triggers)
     try:
-        source_filename = os.path.basename(input_file)
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS lexical_chunks (
+                    id INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    vectordb_used TEXT NOT NULL,
+                    source TEXT,
+                    page_number INTEGER,
+                    content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS lexical_chunks_vectordb_used ON lexical_chunks (vectordb_used);
+            CREATE VIRTUAL TABLE IF NOT EXISTS lexical_chunks_fts USING fts5(content, content='lexical_chunks', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS lexical_chunks_after_insert AFTER INSERT ON lexical_chunks BEGIN
+                INSERT INTO lexical_chunks_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS lexical_chunks_after_delete AFTER DELETE ON lexical_chunks BEGIN
+                INSERT INTO lexical_chunks_fts (lexical_chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+        ''')
     except Exception as e:
-        handle_local_error("Could not open PDF file, encountered error: ", e)
+        handle_local_error("Could not create lexical index tables, encountered error: ", e)
 
-    # Initialize PDF reader
+    return conn
+
+
+# Method to add chunks to the lexical index | chunks already indexed (by chunk_id) are skipped
+def index_chunks_lexically(vectordb_used, chunk_ids, documents):
+
+    conn = connect_to_lexical_index_db()
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-    except Exception as e:
-        handle_local_error("Could not initialize PDF reader, encountered error: ", e)
+        conn.executemany("INSERT OR IGNORE INTO lexical_chunks (chunk_id, vectordb_used, source, page_number, content) VALUES (?, ?, ?, ?, ?)", [(chunk_id, vectordb_used, doc.metadata.get('source'), doc.metadata.get('page_number'), doc.page_content) for chunk_id, doc in zip(chunk_ids, documents)])
+        conn.commit()
+    finally:
+        conn.close()
 
-    # Set output path
-    output_text_file_name = source_filename.replace(".pdf",".txt")
-    output_text_file_path = os.path.join(pdfs_to_txts, output_text_file_name).replace("\\","/")
 
-    if os.path.exists(output_text_file_path):
-        print("PyPDF2-extracted .txt already exists! Returning existing file.")
-        return output_text_file_path
+def remove_chunks_from_lexical_index(chunk_ids):
 
-    # Initialize text output
+    conn = connect_to_lexical_index_db()
     try:
-        output_text_file = open(output_text_file_path, 'w', encoding='utf-8')
-    except Exception as e:
-        handle_local_error("Could not initialize/access output text file, encountered error: ", e)
+        conn.executemany("DELETE FROM lexical_chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+        conn.commit()
+    finally:
+        conn.close()
 
-    # Loop through all the pages and extract text
-    for page_num in range(len(pdf_reader.pages)):
-        
-        try:
-            page = pdf_reader.pages[page_num]
-            text = page.extract_text()
-        except Exception as e:
-            handle_error_no_return("Could not extract text from page, encountered error: ", e)
 
-        #clean_text = text
-        # Clean text
-        clean_text = clean_text_string(text)
-        page_number = int(page_num) + 1
-        
-        # Optionally, you can include page numbers in the text file
-        # output_text_file.write(f'\n\n--- Page {page_num + 1} ---\n\n')
-        
-        # Write the extracted text to the file
-        try:
-            output_text_file.write(f"[PAGE:{page_number}]\n{clean_text}\n")
-        except Exception as e:
-            handle_local_error("Could not write to output text file, encountered error: ", e)
+# Method to index every chunk of an existing Chroma collection not yet in the lexical index (ex: documents loaded before the index existed)
+def backfill_lexical_index(vector_store, vectordb_used, page_size=5000):
 
-    # Close all files
-    pdf_file.close()
-    output_text_file.close()
+    conn = connect_to_lexical_index_db()
+    try:
+        indexed_count = conn.execute("SELECT COUNT(*) FROM lexical_chunks WHERE vectordb_used = ?", (vectordb_used,)).fetchone()[0]
+    finally:
+        conn.close()
 
-    return output_text_file_path
+    if indexed_count >= vector_store._collection.count():
+        return
 
+    print("\n\nBackfilling the lexical index from the VectorDB\n\n")
+    offset = 0
+    while True:
+        stored_chunks = vector_store._collection.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+        if not stored_chunks['ids']:
+            break
+        documents = [Document(page_content=content, metadata=metadata or {}) for content, metadata in zip(stored_chunks['documents'], stored_chunks['metadatas'])]
+        index_chunks_lexically(vectordb_used, stored_chunks['ids'], documents)
+        offset += page_size
+
+    bump_corpus_version(vectordb_used)     # hybrid search now sees the backfilled chunks
 
-def extract_images_from_pdf(pdf_path):
-    
-    print("Extracting Images from PDF")
 
+# Method to turn a user query into an FTS5 match expression: any of the query's terms, each quoted so FTS5 syntax characters are taken literally
+def build_lexical_match_query(query):
+    terms = dict.fromkeys(term.lower() for term in re.findall(r'\w+', query))
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def lexical_search(query, vectordb_used, k, sources=None):
+
+    match_query = build_lexical_match_query(query)
+    if match_query is None or sources == []:
+        return []
+
+    # Optionally scoped to chunks of sources:
+    source_clause = f"AND lexical_chunks.source IN ({', '.join('?' for _ in sources)})" if sources else ""
+
+    conn = connect_to_lexical_index_db()
     try:
-        source_filename = os.path.basename(pdf_path)
-    except Exception as e:
-        handle_local_error("Could not extract filename, encountered error: ", e)
-    
-    with open(pdf_path, 'rb') as file:
-        
-        try:
-            pdf_reader = PyPDF2.PdfReader(file)
-        except Exception as e:
-            handle_local_error("Could not read PDF, encountered error: ", e)
+        rows = conn.execute(f'''
+            SELECT lexical_chunks.source, lexical_chunks.page_number, lexical_chunks.content
+            FROM lexical_chunks_fts JOIN lexical_chunks ON lexical_chunks.id = lexical_chunks_fts.rowid
+            WHERE lexical_chunks_fts MATCH ? AND lexical_chunks.vectordb_used = ? {source_clause}
+            ORDER BY bm25(lexical_chunks_fts) LIMIT ?
+        ''', [match_query, vectordb_used] + list(sources or []) + [k]).fetchall()
+    finally:
+        conn.close()
 
-        images = []
+    return [Document(page_content=row['content'], metadata={'source': row['source'], 'page_number': row['page_number']}) for row in rows]
 
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
 
-            text = page.extract_text().strip()
-            if not text:
-                print("Scanned page, skipping")
-                continue
+# Reciprocal-rank fusion | input- lists of documents each ordered best-first; a chunk is identified by its source & content | returns (document, fused score) best-first
+def reciprocal_rank_fusion(ranked_lists, rrf_k=60):
 
-            if '/XObject' in page['/Resources']:
-                xObject = page['/Resources']['/XObject'].get_object()
-                for obj in xObject:
-                    if xObject[obj]['/Subtype'] == '/Image':
+    fused_scores = {}
+    fused_docs = {}
 
-                        # Log details about the image object:
-                        try:
-                            image_obj = xObject[obj]
-                            obj_details = {
-                                'Object Reference': obj,
-                                'Width': image_obj.get('/Width', 'Unknown'),
-                                'Height': image_obj.get('/Height', 'Unknown'),
-                                'Color Space': image_obj.get('/ColorSpace', 'Unkown'),
-                                'Filter': image_obj.get('/Filter', 'Unknown'),
-                                'Bits Per Component': image_obj.get('/BitsPerComponent', 'Unknown')
-                            }
-                            #print(f"\n\nImage Object Details: {obj_details}\n\n")   # Filter is indicative of format: '/DCTDecode': 'JPEG', '/FlateDecode': 'PNG or others','/JPXDecode': 'JPEG 2000', etc.
+    for ranked_docs in ranked_lists:
+        for rank, doc in enumerate(ranked_docs):
+            doc_key = (doc.metadata.get('source'), doc.page_content)
+            fused_scores[doc_key] = fused_scores.get(doc_key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            fused_docs.setdefault(doc_key, doc)
 
-                            # data  = image_obj._data
+    return [(fused_docs[doc_key], fused_scores[doc_key]) for doc_key in sorted(fused_scores, key=fused_scores.get, reverse=True)]
 
-                            if obj_details['Filter'] == '/FlateDecode':
-                                #print("\n\nDecoding PNG!\n\n")
-                                try:
-                                    data  = image_obj._data
-                                    decompressed_data = zlib.decompress(data)
-                                except Exception as e:
-                                    error_message = f"\n\nPNG decompression exception: {e}\n\n"
-                                    if logger:
-                                        logger.error(error_message)
-                                        print(error_message)
-                                    else:
-                                        print(error_message)
-                            else:
-                                decompressed_data  = image_obj._data
 
-                            text = page.extract_text()  
-                            # clean_text = text
+# Method to fuse dense similarity search results with lexical search results for the same query | returns (document, fused score) best-first
+def fuse_with_lexical_results(query, dense_docs, vectordb_used, k, sources=None):
 
-                            # Clean text
-                            clean_text = clean_text_string(text)
+    try:
+        read_return = read_config(['hybrid_search_lexical_k', 'hybrid_search_rrf_k'])
+        hybrid_search_lexical_k = int(read_return['hybrid_search_lexical_k'])
+        hybrid_search_rrf_k = int(read_return['hybrid_search_rrf_k'])
+    except Exception as e:
+        handle_local_error("Missing hybrid search values in config.json for method fuse_with_lexical_results. Error: ", e)
 
-                            try:
-                                if obj_details['Filter'] == '/FlateDecode':
-                                    # Determine Color Space:
-                                    color_space = image_obj.get('/ColorSpace')
+    lexical_docs = lexical_search(query, vectordb_used, hybrid_search_lexical_k, sources)
+    return reciprocal_rank_fusion([dense_docs, lexical_docs], hybrid_search_rrf_k)[:k]
 
-                                    if color_space == '/DeviceRGB':
-                                        mode = 'RGB'
-                                    elif color_space == '/DeviceCMYK':
-                                        mode = 'CMYK'
-                                    elif color_space == '/DeviceGray':
-                                        mode = 'L'
-                                    else:
-                                        mode = 'L'  # Default to grayscale if unsure
+#########################-------------------------------------###############################
 
-                                    # Create image from bytes
-                                    image = Image.frombytes(mode, ((obj_details['Width']), (obj_details['Height'])), decompressed_data) # 'L' for 8-bit pixels, black and white
-                                    with io.BytesIO() as output:
-                                        image.save(output, format='JPEG')
-                                        binary_data = output.getvalue()
-                                        format = "JPEG"
-                                        images.append((binary_data,clean_text,format))
 
-                                else:
-                                    # Load image from bytes
-                                    image = Image.open(io.BytesIO(decompressed_data))
+# Method to analyze pages first_page..last_page of a PDF via Azure DocAI's prebuilt-layout model | returns [(page_number, text)], table
+# cells first then paragraphs not already covered by a table cell, with page numbers relative to the whole document
+def analyze_docai_shard(docai_client, input_filepath, first_page, last_page):
 
-                                    # Determine format (JPEG)
-                                    format = image.format
-                                    
-                                    #print(f"\n\nImage format: {format}\n\n")  # This will print the format
+    # Only upload the shard's pages:
+    with fitz.open(input_filepath) as source_pdf, fitz.open() as shard_pdf:
+        shard_pdf.insert_pdf(source_pdf, from_page=first_page - 1, to_page=last_page - 1)
+        shard_pdf_bytes = shard_pdf.tobytes()
 
-                                    # If image loads, append image to images DB
-                                    images.append((decompressed_data,clean_text,format))
+    print(f"Submitting pages {first_page} to {last_page} to Azure DocAI")
+    poller = docai_client.begin_analyze_document("prebuilt-layout", shard_pdf_bytes)
+    result = poller.result()
 
-                            except Exception as e:
-                                error_message = f"\n\nEncountered unrecognized or invalid image data for object detailed below. Exception: {e}\n\n"
-                                if logger:
-                                    logger.error(error_message)
-                                    logger.error(obj_details)
-                                    print(error_message)
-                                    print(f"\n\nImage Object Details: {obj_details}\n\n")   # Filter is indicative of format: '/DCTDecode': 'JPEG', '/FlateDecode': 'PNG or others','/JPXDecode': 'JPEG 2000', etc.
+    page_offset = first_page - 1
+    records = []
+    used_regions = set()   # (page_number, polygon) - set will avoid duplicates
 
-                                else:
-                                    print(error_message)
-                                    print(f"\n\nImage Object Details: {obj_details}\n\n")   # Filter is indicative of format: '/DCTDecode': 'JPEG', '/FlateDecode': 'PNG or others','/JPXDecode': 'JPEG 2000', etc.
+    if hasattr(result, 'tables'):
+        for table in result.tables:
+            if table.cells:     # Check if there are cells in the table 
+                for cell in table.cells:
+                    cell_text = f'Row {cell.row_index}, Column {cell.column_index}: {cell.content}'
 
+                    # Get page number
+                    page_number = first_page
+                    if cell.bounding_regions:   # Check if there are bounding regions
+                        for region in cell.bounding_regions:
+                            page_number = region.page_number + page_offset
+                            cell_polygon_tuple = tuple((point.x, point.y) for point in region.polygon)    # lists aren't hashable to cast to a tuple
+                            used_regions.add((page_number, cell_polygon_tuple))
 
-                        except Exception as e:
-                            handle_error_no_return("Could not process image object. Exception: ", e)
+                    records.append((page_number, cell_text))
 
-        # print("Images array:")
-        # print(images)
-        return images
+    # Get paragraphs
+    if hasattr(result, 'paragraphs'):
+        for paragraph in result.paragraphs:
+            para_page_number = paragraph.bounding_regions[0].page_number + page_offset
+            para_polygon_tuple = tuple((point.x, point.y) for point in paragraph.bounding_regions[0].polygon)
 
+            if (para_page_number, para_polygon_tuple) in used_regions:
+                continue
 
-def store_images_to_db(images):
+            records.append((para_page_number, paragraph.content))
+            used_regions.add((para_page_number, para_polygon_tuple))
 
-    print("\n\nStoring Images to Database\n\n")
+    return records
 
+
+# use_cache=False skips the content cache, for throwaway PDFs (ex: PDFtoHybridTXT's scanned pages)
+def PDFtoAzureDocAiTXT(input_filepath, content_hash=None, use_cache=True):
+
+    print("\n\nProcessing Document - PDF to Azure DocAI TXT\n\n")
+    
     try:
-        read_return = read_config(['sqlite_images_db'])
-        sqlite_images_db = read_return['sqlite_images_db']
+        read_return = read_config(['azure_doc_ai_endpoint', 'azure_doc_ai_subscription_key', 'ocr_pdfs', 'azure_doc_ai_pages_per_shard', 'azure_doc_ai_max_concurrent_shards'])
+        azure_doc_ai_endpoint = read_return['azure_doc_ai_endpoint']
+        azure_doc_ai_subscription_key = read_return['azure_doc_ai_subscription_key']
+        ocr_pdfs = read_return['ocr_pdfs']
+        azure_doc_ai_pages_per_shard = max(1, int(read_return['azure_doc_ai_pages_per_shard']))
+        azure_doc_ai_max_concurrent_shards = max(1, int(read_return['azure_doc_ai_max_concurrent_shards']))
     except Exception as e:
-        handle_local_error("Missing sqlite_images_db in config.json for method store_images_to_db. Error: ", e)
+        handle_local_error("Missing Azure OCR Endpoint URL & Subscription Key for PDFtoAzureDocAiTXT, please provide required API config. Error: ", e)
 
     try:
-        conn = sqlite3.connect(sqlite_images_db)
-        cursor = conn.cursor()
+        source_filename = os.path.basename(input_filepath)
     except Exception as e:
-        handle_local_error("Could not establish connection to Images DB, encountered error: ", e)
-    
-    # If the database does not currently exist...
+        handle_local_error("Could not extract filename, encountered error: ", e)
+
+    # Set output path
+    output_text_file_name = source_filename.replace(".pdf",".txt")
+    output_text_file_path = os.path.join(ocr_pdfs, output_text_file_name).replace("\\","/")
+
     try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS images (
-                    id INTEGER PRIMARY KEY,
-                    image_data BLOB NOT NULL,
-                    surrounding_text TEXT,
-                    metadata TEXT,
-                    format TEXT
-            )
-        ''')
+        if content_hash is None:
+            content_hash = compute_file_hash(input_filepath)
+        if use_cache and restore_cached_extraction(content_hash, 'azure_doc_ai', output_text_file_path):
+            print("Text for this document's content has already been extracted via azure_doc_ai! Returning cached file.")
+            return output_text_file_path
+    except Exception as e:
+        handle_error_no_return("Could not check the content cache, proceeding to extract text. Encountered error: ", e)
 
-        conn.commit()
+    try:
+        docai_client = DocumentAnalysisClient(azure_doc_ai_endpoint, AzureKeyCredential(azure_doc_ai_subscription_key))
     except Exception as e:
-        handle_local_error("Could not create Images DB, encountered error: ", e)
-    
+        handle_local_error("Could not create ComputerVisionClient for Azure DocAI, encountered error: ", e)
+
+    # 1 - Get page count & split it into page-range shards:
     try:
-        for image_data, surrounding_text, format in images:
-            #print("surrounding_text: ", surrounding_text)
-            # Check if the image_data already exists in the database:
-            cursor.execute("SELECT COUNT(*) FROM images WHERE image_data = ?", (image_data,))
-            if cursor.fetchone()[0] == 0:
-                print("\nInserting new image into images DB\n")
-                cursor.execute("INSERT INTO images (image_data, surrounding_text, format) VALUES (?, ?, ?)", (image_data, surrounding_text, format))
-        conn.commit()
+        page_count = get_pdf_page_count(input_filepath)
     except Exception as e:
-        handle_local_error("Could not store images to Images DB, encountered error: ", e)
-    finally:
-        conn.close()
+        handle_local_error("Could not get page count for call to Azure DocAI, encountered error: ", e)
 
+    shards = [(first_page, min(first_page + azure_doc_ai_pages_per_shard - 1, page_count)) for first_page in range(1, page_count + 1, azure_doc_ai_pages_per_shard)]
+    print(f"Analyzing {page_count} pages in {len(shards)} shards")
 
-def record_doc_loaded_to_db(document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap):
+    # 2 - Re-use shards analyzed by a previous, failed attempt:
+    shard_records = {}
+    for shard in shards if use_cache else []:
+        try:
+            cached_records = find_cached_docai_shard(content_hash, *shard)
+            if cached_records is not None:
+                shard_records[shard] = cached_records
+        except Exception as e:
+            handle_error_no_return("Could not check the DocAI shard cache, encountered error: ", e)
+
+    # 3 - Analyze the remaining shards concurrently, caching each as it completes:
+    remaining_shards = [shard for shard in shards if shard not in shard_records]
+    if len(remaining_shards) < len(shards):
+        print(f"Re-using {len(shards) - len(remaining_shards)} shards analyzed previously")
+
+    # After a failure, shards not yet started are cancelled but those already in flight are still cached for the next attempt
+    shard_error = None
+    with ThreadPoolExecutor(max_workers=azure_doc_ai_max_concurrent_shards) as executor:
+        futures = {executor.submit(analyze_docai_shard, docai_client, input_filepath, *shard): shard for shard in remaining_shards}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            shard = futures[future]
+            try:
+                shard_records[shard] = future.result()
+            except Exception as e:
+                if shard_error is None:
+                    shard_error = e
+                    for pending_future in futures:
+                        pending_future.cancel()
+                continue
+            try:
+                if use_cache:
+                    record_cached_docai_shard(content_hash, *shard, shard_records[shard])
+            except Exception as e:
+                handle_error_no_return("Could not record DocAI shard to the cache, encountered error: ", e)
 
-    print("\n\nRecording document loading to records DB\n\n")
+    if shard_error is not None:
+        handle_local_error("Error processing document with azure DocAI, shards completed so far have been cached. Encountered error: ", shard_error)
 
+    # 4 - Write out page by page, each page's table cells ahead of its paragraphs:
     try:
-        read_return = read_config(['sqlite_docs_loaded_db'])
-        sqlite_docs_loaded_db = read_return['sqlite_docs_loaded_db']
+        with open(output_text_file_path, 'w', encoding='utf-8') as output_text_file:
+            all_records = [record for shard in shards for record in shard_records[shard]]
+            for page_number, text in sorted(all_records, key=lambda record: record[0]):     # sorted() is stable
+                output_text_file.write(f"[PAGE:{page_number}]\n{text}\n")
     except Exception as e:
-        handle_local_error("Missing sqlite_docs_loaded_db in config.json for method store_images_to_db. Error: ", e)
+        handle_local_error("could not write to output text file, encountered error: ", e)
 
     try:
-        conn = sqlite3.connect(sqlite_docs_loaded_db)
-        cursor = conn.cursor()
+        if use_cache:
+            record_cached_extraction(content_hash, 'azure_doc_ai', output_text_file_path)
+            forget_cached_docai_shards(content_hash)
     except Exception as e:
-        handle_local_error("Could not establish connection to document_records DB, encountered error: ", e)
-    
-    # If the database does not currently exist...
-    try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS document_records (
-                    id INTEGER PRIMARY KEY,
-                    document_name TEXT NOT NULL,
-                    embedding_model TEXT NOT NULL,
-                    vectordb_used TEXT,
-                    chunk_size INTEGER,
-                    chunk_overlap INTEGER
-            )
-        ''')
+        handle_error_no_return("Could not record extracted text to the content cache, encountered error: ", e)
 
-        conn.commit()
-    except Exception as e:
-        handle_local_error("Could not create document_records DB, encountered error: ", e)
-    
-    try:
-        cursor.execute("INSERT INTO document_records (document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap) VALUES (?, ?, ?, ?, ?)", (document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        handle_local_error("Could not update document_records DB, encountered error: ", e)
+    return output_text_file_path
 
 
+#########################------------OCR Page Pipeline-------------###############################
+# Rather than rendering every page of a PDF into memory before OCR starts, pages are rendered in windows of ocr_render_window_pages
+# (via pdf2image's first_page/last_page), handed off as PNG bytes to at most ocr_max_in_flight concurrent recognition calls, and the
+# results appended to the output in page order. Progress is checkpointed to a sidecar file after each page, so an interrupted
+# document resumes from the last completed page rather than starting over.
+AZURE_OCR_RATE_LIMITERS = {}    # endpoint -> TokenBucket
+AZURE_OCR_RATE_LIMITERS_LOCK = threading.Lock()
 
-# List-splitter function for a large number of embeddings!
-def split_embeddings_list(all_splits, max_emmbeddings_list_size):
-    for i in range(0, len(all_splits), max_emmbeddings_list_size):  # Step through the large list in steps of max size
-        yield all_splits[i:i + max_emmbeddings_list_size]   # Yield a slice of all_splits from index i upto but NOT including i+max_size 
 
+def get_azure_ocr_rate_limiter(endpoint, requests_per_minute):
 
-class Document:
-    def __init__(self, page_content, metadata):
-        self.page_content = page_content
-        self.metadata = metadata
+    with AZURE_OCR_RATE_LIMITERS_LOCK:
+        limiter = AZURE_OCR_RATE_LIMITERS.get(endpoint)
+        if limiter is None or limiter.capacity != requests_per_minute:
+            limiter = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+            AZURE_OCR_RATE_LIMITERS[endpoint] = limiter
 
-    def __repr__(self): #to provide string-representation of an object
-        return f"Document(page_content='{self.page_content[:50]}...', metadata={self.metadata})"
+    return limiter
 
 
+def get_ocr_progress_path(output_text_file_path):
+    return output_text_file_path + ".progress"
 
-def chunk_docs_with_page_numbers(input_file, chunk_size=250):
-    documents = []
-    current_chunk = ""
-    current_page = 1
 
-    def add_chunk(chunk, page):
-        if chunk:
-            documents.append(Document(
-                page_content=chunk.strip(),
-                metadata={'source': input_file, 'page_number': page}
-            ))
-
-    try:
-        with open(input_file, 'r', encoding='utf-8') as file:
-            for line in file:
-                if line.startswith('[PAGE:'):
-                    new_page = int(line.strip()[6:-1])
-                    if new_page != current_page:
-                        add_chunk(current_chunk, current_page)
-                        current_chunk = ""
-                        current_page = new_page
-                    continue
+# Method to obtain the page to resume OCR from | truncates any output written after the last checkpoint, returns 1 if there is nothing to resume
+def resume_ocr_progress(output_text_file_path, content_hash, extractor):
 
-                if len(current_chunk) + len(line) > chunk_size:
-                    add_chunk(current_chunk, current_page)
-                    current_chunk = line
-                else:
-                    current_chunk += line
+    progress_path = get_ocr_progress_path(output_text_file_path)
+    try:
+        with open(progress_path, 'r') as progress_file:
+            progress = json.load(progress_file)
+    except FileNotFoundError:
+        return 1
+    except Exception as e:
+        handle_error_no_return("Could not read OCR progress, starting over. Encountered error: ", e)
+        return 1
 
-                if len(current_chunk) >= chunk_size:
-                    add_chunk(current_chunk, current_page)
-                    current_chunk = ""
-        
-        # Add any remaining content
-        add_chunk(current_chunk, current_page)
+    if progress.get('content_hash') != content_hash or progress.get('extractor') != extractor or not os.path.exists(output_text_file_path):
+        return 1
 
-    except Exception as e:
-        handle_local_error("Could not chunk document, encountered error: ", e)
+    os.truncate(output_text_file_path, progress['output_offset'])
+    print(f"Resuming OCR after page {progress['last_completed_page']}")
+    return progress['last_completed_page'] + 1
 
-    return documents
 
+def checkpoint_ocr_progress(output_text_file_path, content_hash, extractor, last_completed_page, output_offset):
 
-# Document vectorization and chunking
-def LoadNewDocument(input_file):
+    progress_path = get_ocr_progress_path(output_text_file_path)
+    temp_progress_path = progress_path + ".tmp"
+    with open(temp_progress_path, 'w') as progress_file:
+        json.dump({'content_hash': content_hash, 'extractor': extractor, 'last_completed_page': last_completed_page, 'output_offset': output_offset}, progress_file)
+    os.replace(temp_progress_path, progress_path)
 
-    global VECTOR_STORE
-    
-    ### L1 - Load Data from Source ###
-    print("\nLoading Document")
+
+def render_page_to_png_bytes(image):
+    img_stream = io.BytesIO()
+    image.save(img_stream, format='PNG')
+    image.close()
+    return img_stream.getvalue()
+
+
+# Method to OCR a PDF into output_text_file_path | submit_page(png_bytes) must return a future resolving to the page's lines of text,
+# max_in_flight overrides ocr_max_in_flight (ex: to keep every local OCR worker busy)
+def run_ocr_page_pipeline(input_filepath, output_text_file_path, content_hash, extractor, submit_page, max_in_flight=None):
 
     try:
-        read_return = read_config(['use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings', 'vectordb_sbert_folder', 'vectordb_openai_folder', 'vectordb_bge_base_folder', 'vectordb_bge_large_folder'])
-        use_sbert_embeddings = read_return['use_sbert_embeddings']
-        use_openai_embeddings = read_return['use_openai_embeddings']
-        use_bge_base_embeddings = read_return['use_bge_base_embeddings']
-        use_bge_large_embeddings = read_return['use_bge_large_embeddings']
-        vectordb_sbert_folder = read_return['vectordb_sbert_folder']
-        vectordb_openai_folder = read_return['vectordb_openai_folder']
-        vectordb_bge_base_folder = read_return['vectordb_bge_base_folder']
-        vectordb_bge_large_folder = read_return['vectordb_bge_large_folder']
+        read_return = read_config(['ocr_dpi', 'ocr_render_window_pages', 'ocr_max_in_flight'])
+        ocr_dpi = int(read_return['ocr_dpi'])
+        ocr_render_window_pages = max(1, int(read_return['ocr_render_window_pages']))
+        ocr_max_in_flight = max(1, int(max_in_flight or read_return['ocr_max_in_flight']))
     except Exception as e:
-        handle_local_error("Missing values in config.json, could not LoadNewDocument. Error: ", e)
-
-    chunk_sz = 250
-    chunk_olp = 0
+        handle_local_error("Missing OCR pipeline values in config.json for method run_ocr_page_pipeline. Error: ", e)
 
-    ### L2 - Chunk Source Data ###
-    print("Chunking Doc")
     try:
-        numbered_splits = chunk_docs_with_page_numbers(input_file, chunk_sz)
+        page_count = get_pdf_page_count(input_filepath)
+    except Exception as e:
+        handle_local_error("Could not open PDF file to determine page count, encountered error: ", e)
 
-        # print(f"\n\nnumbered_splits sample: {numbered_splits[:3]}\n\n")
-        # print(f"\n\nnumbered_splits type: {type(numbered_splits[3])}\n\n")
-        
+    start_page = resume_ocr_progress(output_text_file_path, content_hash, extractor)
+
+    # Initialize text output
+    try:
+        output_text_file = open(output_text_file_path, 'a' if start_page > 1 else 'w', encoding='utf-8')
     except Exception as e:
-        handle_local_error("Failed to chunk document for storage to VectorDB, encountered error: ", e)
+        handle_local_error("Could not initialize/access output text file, encountered error: ", e)
 
-    ### L3 - Store Chunks in VectorDB ###
-    print("Storing to VectorDB: ChromaDB")
+    pending_pages = []  # (page_number, future), in page order
+
+    def write_completed_pages(wait_for_first=False):
+        while pending_pages and (wait_for_first or pending_pages[0][1].done()):
+            wait_for_first = False
+            page_number, future = pending_pages.pop(0)
+            for clean_text in future.result():
+                output_text_file.write(f"[PAGE:{page_number}]\n{clean_text}\n")
+            output_text_file.flush()
+            checkpoint_ocr_progress(output_text_file_path, content_hash, extractor, page_number, output_text_file.tell())
+
+    print(f"\n\nBeginning image to Text OCR of pages {start_page} to {page_count}\n\n")
     try:
-        # Return VectorStore initialized from documents and embeddings.
-        if use_sbert_embeddings:
-            # Ideally should use MAX_BATCH_SIZE obtained elsewhere 
-            if len(numbered_splits) > 5000:
-                split_docs = split_embeddings_list(numbered_splits, 5000)
-                for split_docs_list in split_docs:
-                    VECTOR_STORE = Chroma.from_documents(documents=split_docs_list, embedding=HuggingFaceEmbeddings(), persist_directory=vectordb_sbert_folder)
-            else:
-                VECTOR_STORE = Chroma.from_documents(documents=numbered_splits, embedding=HuggingFaceEmbeddings(), persist_directory=vectordb_sbert_folder)
-        
-        elif use_openai_embeddings:
-            print("Using OpenAI Text Ada Model via Azure OpenAI")
+        for window_start in range(start_page, page_count + 1, ocr_render_window_pages):
+            window_end = min(window_start + ocr_render_window_pages - 1, page_count)
 
-            list_position = 0
-            token_count = 0
+            try:
+                images = convert_from_path(input_filepath, ocr_dpi, first_page=window_start, last_page=window_end)
+            except Exception as e:
+                handle_local_error(f"Could not image pages {window_start} to {window_end} of the PDF file, encountered error: ", e)
+
+            for page_number, image in enumerate(images, start=window_start):
+                try:
+                    png_bytes = render_page_to_png_bytes(image)
+                except Exception as e:
+                    handle_local_error("Could not convert image to Byte Stream for OCR, encountered error: ", e)
 
-            for i in range(list_position, len(numbered_splits)):
+                while len(pending_pages) >= ocr_max_in_flight:
+                    write_completed_pages(wait_for_first=True)
 
-                token_count += len(str(numbered_splits[i]))
-                if token_count >= 108000:
-                    VECTOR_STORE = Chroma.from_documents(documents=numbered_splits[list_position:i+1], embedding=AZURE_OPENAI_EMBEDDINGS, persist_directory=vectordb_openai_folder)  #AZURE_OPENAI_EMBEDDINGS defined on line 407
-                    list_position = i+1
-                    token_count = 0
-                    print("Loaded batch, sleeping for one minute to stay within rate-limit")
-                    time.sleep(63)
-                    continue
+                print(f"Submitting page {page_number} for OCR")
+                pending_pages.append((page_number, submit_page(png_bytes)))
 
-            # post-loop, if any splits are left to be processed but were missed due to token_count not reaching the limit:
-            if list_position < len(numbered_splits):
-                VECTOR_STORE = Chroma.from_documents(documents=numbered_splits[list_position:], embedding=AZURE_OPENAI_EMBEDDINGS, persist_directory=vectordb_openai_folder) #AZURE_OPENAI_EMBEDDINGS defined on line 407
+            del images
+            write_completed_pages()
 
-        elif use_bge_base_embeddings or use_bge_large_embeddings:
-            persist_directory = ""
-            if use_bge_base_embeddings:
-                persist_directory = vectordb_bge_base_folder
-            elif use_bge_large_embeddings:
-                persist_directory = vectordb_bge_large_folder
-            VECTOR_STORE = Chroma.from_documents(documents=numbered_splits, embedding=HF_BGE_EMBEDDINGS, persist_directory=persist_directory)    #HF_BGE_EMBEDDINGS defined in process_model() line 2133
+        while pending_pages:
+            write_completed_pages(wait_for_first=True)
 
     except Exception as e:
-        handle_local_error("Could not store to VectorDB, encountered error: ", e)
+        for _, future in pending_pages:
+            future.cancel()
+        output_text_file.close()
+        handle_local_error("OCR failed, progress up to the last completed page has been saved and will be resumed. Encountered error: ", e)
 
-    return chunk_sz, chunk_olp
+    # Close all files
+    output_text_file.close()
 
+    try:
+        os.remove(get_ocr_progress_path(output_text_file_path))
+    except FileNotFoundError:
+        pass
 
-def find_images_in_db(reference_pages):
+#########################-------------------------------------###############################
+
+
+def recognize_page_via_azure_ocr(computervision_client, png_bytes, limiter, max_retries):
+
+    for attempt in range(max_retries + 1):
+        limiter.acquire(1)
+        try:
+            result = computervision_client.recognize_printed_text_in_stream(image=io.BytesIO(png_bytes))
+            #analyze_result = computervision_client.begin_analyze_document("prebuilt-layout", img_stream).result()
+            break
+        except Exception as e:
+            if (getattr(e, 'status_code', None) == 429 or "(429)" in str(e)) and attempt < max_retries:
+                backoff_seconds = min(60, 2 ** attempt) + random.uniform(0, 1)
+                print(f"Exceeded Azure OCR rate limits, waiting for {backoff_seconds:.1f}s and retrying")
+                limiter.pause(backoff_seconds)
+                time.sleep(backoff_seconds)
+                continue
+            raise
+
+    lines = []
+    for region in result.regions:
+        for line in region.lines:
+            lines.append(str(" ".join([word.text for word in line.words])))
+
+    return lines
 
-    print("\nSearching for relevant Images\n")
 
+def PDFtoAzureOCRTXT(input_filepath, content_hash=None, use_cache=True):
+    
+    print("\n\nProcessing Document - PDF to Azure OCR TXT\n\n")
+    
     try:
-        read_return = read_config(['sqlite_images_db'])
-        sqlite_images_db = read_return['sqlite_images_db']
+        read_return = read_config(['azure_ocr_endpoint', 'azure_ocr_subscription_key', 'ocr_pdfs', 'azure_cv_free_tier', 'azure_ocr_requests_per_minute', 'ocr_max_in_flight', 'ocr_max_retries'])
+        azure_ocr_endpoint = read_return['azure_ocr_endpoint']
+        azure_ocr_subscription_key = read_return['azure_ocr_subscription_key']
+        ocr_pdfs = read_return['ocr_pdfs']
+        azure_cv_free_tier = read_return['azure_cv_free_tier']
+        azure_ocr_requests_per_minute = int(read_return['azure_ocr_requests_per_minute'])
+        ocr_max_in_flight = max(1, int(read_return['ocr_max_in_flight']))
+        ocr_max_retries = int(read_return['ocr_max_retries'])
     except Exception as e:
-        handle_local_error("Missing sqlite_images_db in config.json for method find_images_in_db. Error: ", e)
+        handle_local_error("Missing Azure OCR Endpoint URL & Subscription Key for PDFtoAzureOCRTXT, please provide required API config. Error: ", e)
 
-    matched_images = []
-    matched_images_found = False
+    if azure_cv_free_tier:
+        azure_ocr_requests_per_minute = min(azure_ocr_requests_per_minute, 20)  #free tier restrictions!
 
     try:
-        conn = sqlite3.connect(sqlite_images_db)
-        conn.row_factory = sqlite3.Row
-        print("Database connected for image search")
+        source_filename = os.path.basename(input_filepath)
     except Exception as e:
-        handle_local_error("Could not connect to images DB for image search, encountered error: ", e)
-
-    for file_path, content in reference_pages.items():
+        handle_local_error("Could not extract filename, encountered error: ", e)
 
-        for item in content:
-            # Each item in the list has two elements
-            page_text, page_number = item
+    # Set output path
+    output_text_file_name = source_filename.replace(".pdf",".txt")
+    output_text_file_path = os.path.join(ocr_pdfs, output_text_file_name).replace("\\","/")
 
-            # Only search for non-empty search strings
-            if page_text:
-                try:
-                    images = conn.execute('SELECT DISTINCT id, image_data FROM images WHERE surrounding_text LIKE ?', ('%' + page_text[:50] + '%',)).fetchall()
-                except Exception as e:
-                    handle_error_no_return("Could not select images from Images DB, encountered error: ", e)
-                for row in images:
-                    print("Matching image found!")
-                    matched_images_found = True
-                    image_id = row['id']
-                    image_data = row['image_data']
-                    matched_images.append((image_id, image_data))
-        
-    conn.close()
-    matched_images = set(matched_images)
-    return matched_images_found, matched_images
+    try:
+        if content_hash is None:
+            content_hash = compute_file_hash(input_filepath)
+        if use_cache and restore_cached_extraction(content_hash, 'azure_vision', output_text_file_path):
+            print("Text for this document's content has already been extracted via azure_vision! Returning cached file.")
+            return output_text_file_path
+    except Exception as e:
+        handle_error_no_return("Could not check the content cache, proceeding to extract text. Encountered error: ", e)
 
+    try:
+        computervision_client = ComputerVisionClient(azure_ocr_endpoint, CognitiveServicesCredentials(azure_ocr_subscription_key))
+    except Exception as e:
+        handle_local_error("Could not create ComputerVisionClient for Azure OCR, encountered error: ", e)
 
-def highlight_text_on_page(highlight_list, stream_session_id):
+    limiter = get_azure_ocr_rate_limiter(azure_ocr_endpoint, azure_ocr_requests_per_minute)
 
-    print("\nHighlighting Document\n")
-    threshold = 80
+    with ThreadPoolExecutor(max_workers=ocr_max_in_flight) as executor:
+        submit_page = lambda png_bytes: executor.submit(recognize_page_via_azure_ocr, computervision_client, png_bytes, limiter, ocr_max_retries)
+        run_ocr_page_pipeline(input_filepath, output_text_file_path, content_hash, 'azure_vision', submit_page)
 
     try:
-        read_return = read_config(['upload_folder', 'highlighted_docs'])
-        upload_folder = read_return['upload_folder']
-        highlighted_pdfs_path = read_return['highlighted_docs']
+        if use_cache:
+            record_cached_extraction(content_hash, 'azure_vision', output_text_file_path)
     except Exception as e:
-        handle_local_error("Missing upload_folder in config.json for method highlight_text_on_page. Error: ", e)
-    
-    for index, doc in enumerate(highlight_list, start=1):
-
-        try:
-            pdf_path = os.path.join(upload_folder, doc).replace("\\","/")
-            output_file_extension = "_" + stream_session_id + '.pdf'
-            output_file_name = doc.replace(".pdf",output_file_extension) 
-            output_pdf_path = os.path.join(highlighted_pdfs_path, output_file_name).replace("\\","/")
-            highlight_doc = fitz.open(pdf_path)
-        except Exception as e:
-            handle_error_no_return("Could not open doc for highlighting, encountered error: ", e)
-            continue
-        
-        for target in highlight_list[doc]:
-            try:
-                text_to_highlight = str(target[1])
-                text_to_highlight = re.sub(r'Row \d+, Column \d+: ', '', text_to_highlight)
-                page_number = int(target[0])
-                page = highlight_doc.load_page(page_number-1)
-                page_text = page.get_text("text")
-
-                # Split the page text into overlapping phrases
-                words = page_text.split()
-                phrases = [' '.join(words[i:i+len(text_to_highlight.split())]) for i in range(len(words))]
+        handle_error_no_return("Could not record extracted text to the content cache, encountered error: ", e)
 
-                # Find fuzzy matches
-                good_matches = []
-                for phrase in phrases:
-                    score = fuzz.partial_ratio(text_to_highlight.lower(), phrase.lower())
-                    if score >= threshold:
-                        good_matches.append(phrase)
+    return output_text_file_path
 
-                for match in good_matches:
-                    if len(str(match)) > 3:
-                        text_instances = page.search_for(match)
-                        for inst in text_instances:
-                            try:
-                                #print(f"HIGHLIGHTING inst {inst} in document {doc}")
-                                page.add_highlight_annot(inst)
-                            except Exception as e:
-                                handle_error_no_return("Could not highlight text instance, encountered error: ", e)
-                                continue
 
-            except Exception as e:
-                handle_error_no_return("Error loading page or searching for text to highlight, encountered error: ", e)
-                continue
-            
-        try:
-            highlight_doc.save(output_pdf_path, garbage=0, deflate=False, clean=False)
-        except Exception as e:
-            handle_error_no_return("Could not save highlighted doc, encountered error: ", e)
-            continue
+#########################------------Local OCR-------------###############################
+# Offline OCR via Tesseract for deployments that can't reach Azure, selected with ocr_service_choice 'LocalTesseract'. Pages flow through the
+# same windowed pipeline as Azure OCR, recognized across a process pool of local_ocr_workers (0 = one per core) and written in the same
+# [PAGE:n] format.
+LOCAL_OCR_POOL = None
+LOCAL_OCR_POOL_LOCK = threading.Lock()
 
-    return True
 
+def get_local_ocr_pool():
+    global LOCAL_OCR_POOL
 
-def highlighter_interface(reference_pages, stream_session_id):
+    try:
+        local_ocr_workers = int(read_config(['local_ocr_workers'])['local_ocr_workers'])
+    except Exception as e:
+        handle_local_error("Missing local_ocr_workers in config.json for method get_local_ocr_pool. Error: ", e)
 
-    user_should_refer_pages_in_doc = {}
-    highlight_list = {}
-    docs_have_relevant_info = False
+    with LOCAL_OCR_POOL_LOCK:
+        if LOCAL_OCR_POOL is None:
+            max_workers = local_ocr_workers if local_ocr_workers > 0 else (os.cpu_count() or 1)
+            LOCAL_OCR_POOL = (ProcessPoolExecutor(max_workers=max_workers), max_workers)
+            atexit.register(LOCAL_OCR_POOL[0].shutdown, wait=False)
 
-    print(f"\n\nreference_pages: {reference_pages}\n\n")
+    return LOCAL_OCR_POOL
 
-    for file_path, content in reference_pages.items():
-        source_filename = os.path.basename(file_path)
-        print(f"\nsource_filename basename: {source_filename}\n")
-        output_file_extension = "_" + stream_session_id + '.pdf'
-        output_file_name = source_filename.replace(".pdf",output_file_extension) 
-        page_numbers = set()
-        highlight_strings = set()
 
-        for item in content:
-            # Each item in the list has two elements
-            page_text, page_number = item
-            page_numbers.add(int(page_number))
-            highlight_strings.add((int(page_number), str(page_text[:50])))
+# Process pool entry-point
+def recognize_page_via_tesseract(png_bytes, tesseract_lang, tesseract_config):
 
-        if page_numbers:
-            user_should_refer_pages_in_doc[output_file_name] = page_numbers
-            docs_have_relevant_info = True
+    # Pages are already recognized in parallel, stop each tesseract process from spreading itself across every core as well:
+    os.environ['OMP_THREAD_LIMIT'] = '1'
 
-        if highlight_strings:
-            highlight_list[source_filename] = list(highlight_strings)
+    with Image.open(io.BytesIO(png_bytes)) as page_image:
+        text = pytesseract.image_to_string(page_image, lang=tesseract_lang, config=tesseract_config)
 
-    if docs_have_relevant_info:
-        try:
-            highlight_text_on_page(highlight_list, str(stream_session_id))
-        except Exception as e:
-            handle_error_no_return("Could not highlight text, encountered error: ", e)
+    return [line.strip() for line in text.splitlines() if line.strip()]
 
-    return docs_have_relevant_info, user_should_refer_pages_in_doc
 
+def PDFtoLocalOCRTXT(input_filepath, content_hash=None, use_cache=True):
 
-def determine_sequence_id_for_chat(chat_id):
+    print("\n\nProcessing Document - PDF to Local Tesseract OCR TXT\n\n")
 
     try:
-        read_return = read_config(['sqlite_history_db'])
-        sqlite_history_db = read_return['sqlite_history_db']
+        read_return = read_config(['ocr_pdfs', 'tesseract_lang', 'tesseract_config'])
+        ocr_pdfs = read_return['ocr_pdfs']
+        tesseract_lang = read_return['tesseract_lang']
+        tesseract_config = read_return['tesseract_config']
     except Exception as e:
-        handle_local_error("Missing keys in config.json for method store_chat_history_to_db. Error: ", e)
+        handle_local_error("Missing ocr_pdfs or Tesseract settings in config.json for PDFtoLocalOCRTXT. Error: ", e)
 
-    # Connect to or create the DB
     try:
-        conn = sqlite3.connect(sqlite_history_db)
-        cursor = conn.cursor()
+        source_filename = os.path.basename(input_filepath)
     except Exception as e:
-        handle_local_error("Could not establish connection to DB for chat history storage, encountered error: ", e)
+        handle_local_error("Could not extract filename, encountered error: ", e)
+
+    # Set output path
+    output_text_file_name = source_filename.replace(".pdf",".txt")
+    output_text_file_path = os.path.join(ocr_pdfs, output_text_file_name).replace("\\","/")
 
     try:
-        # Determine sequence_id
-        cursor.execute("SELECT COALESCE(MAX(sequence_id), 0) FROM chat_history WHERE chat_id = ?", (int(chat_id),))
-        # "The COALESCE function accepts two or more arguments and returns the first non-null argument."
-        # This accounts for a new chat!
-        # Note that trailing comma! Without it, the simple select query will produce an error: "parameters are of unsupported type" !!
-        # This is because the SQLite3 module can have trouble recognizing single-item tuples as tuples, so a trailing comma helps alleviate this! 
+        if content_hash is None:
+            content_hash = compute_file_hash(input_filepath)
+        if use_cache and restore_cached_extraction(content_hash, 'local_tesseract', output_text_file_path):
+            print("Text for this document's content has already been extracted via local_tesseract! Returning cached file.")
+            return output_text_file_path
+    except Exception as e:
+        handle_error_no_return("Could not check the content cache, proceeding to extract text. Encountered error: ", e)
 
-        result = cursor.fetchone()
-        current_sequence_id = result[0]     # 'result' will be a list, so extract the first value
-        
+    local_ocr_pool, local_ocr_workers = get_local_ocr_pool()
+    submit_page = lambda png_bytes: local_ocr_pool.submit(recognize_page_via_tesseract, png_bytes, tesseract_lang, tesseract_config)
+    run_ocr_page_pipeline(input_filepath, output_text_file_path, content_hash, 'local_tesseract', submit_page, max_in_flight=local_ocr_workers * 2)
+
+    try:
+        if use_cache:
+            record_cached_extraction(content_hash, 'local_tesseract', output_text_file_path)
     except Exception as e:
-        handle_local_error("Could not determine sequence ID for storage to chat history DB, encountered error: ", e)
+        handle_error_no_return("Could not record extracted text to the content cache, encountered error: ", e)
 
-    return int(current_sequence_id)
+    return output_text_file_path
+
+#########################-------------------------------------###############################
 
 
-def store_llama_cpp_chat_history_to_db(chat_id, sequence_id, user_query_for_history_db, model_response_for_history_db, current_prompt_template):
+#########################------------Selective OCR-------------###############################
+# With ocr_mode 'hybrid', each page is classified by its text layer: born-digital pages take the local text extraction path, and only pages
+# with fewer than ocr_min_text_chars_per_page characters of text (scans) are copied into a smaller PDF for the configured OCR backend.
+# The results are merged back into a single page-ordered text file. ocr_mode 'full' sends every page to the OCR backend as before.
+def get_ocr_backend(ocr_service_choice):
+    ocr_backends = {
+        'AzureVision': (PDFtoAzureOCRTXT, 'azure_vision'),
+        'AzureDocAi': (PDFtoAzureDocAiTXT, 'azure_doc_ai'),
+        'LocalTesseract': (PDFtoLocalOCRTXT, 'local_tesseract'),
+    }
+    return ocr_backends.get(ocr_service_choice)
 
-    global SEQUENCE_ID
 
-    print(f"\n\nStoring chat history for chat with CHAT_ID: {chat_id}")
+# Method to read an OCR output file into {page_number: [lines]}, page numbers being those within the OCR'd PDF
+def read_ocr_output_by_page(ocr_text_file_path):
+
+    lines_by_page = {}
+    current_page = 1
+
+    with open(ocr_text_file_path, 'r', encoding='utf-8') as ocr_text_file:
+        for line in ocr_text_file:
+            if line.startswith('[PAGE:'):
+                current_page = int(line.strip()[6:-1])
+                continue
+            if line.strip():
+                lines_by_page.setdefault(current_page, []).append(line.rstrip('\n'))
+
+    return lines_by_page
+
+
+def get_hybrid_extractor_name(ocr_extractor):
+    return f"hybrid_{get_local_text_extractor_name()}_{ocr_extractor}"
+
+
+def PDFtoHybridTXT(input_filepath, ocr_service_choice, content_hash=None):
+
+    print("\n\nProcessing Document - PDF to TXT, OCR-ing only pages without a text layer\n\n")
 
     try:
-        read_return = read_config(['sqlite_history_db', 'model_choice', 'base_template'])
-        sqlite_history_db = read_return['sqlite_history_db']
-        model_choice = read_return['model_choice']
+        ocr_function, ocr_extractor = get_ocr_backend(ocr_service_choice)
     except Exception as e:
-        handle_local_error("Missing keys in config.json for method store_chat_history_to_db. Error: ", e)
+        handle_local_error(f"Unknown ocr_service_choice {ocr_service_choice} for PDFtoHybridTXT, encountered error: ", e)
 
-    # Connect to or create the DB
     try:
-        conn = sqlite3.connect(sqlite_history_db)
-        cursor = conn.cursor()
+        read_return = read_config(['ocr_pdfs', 'ocr_min_text_chars_per_page', 'pdf_text_extractor', 'pdf_extraction_workers', 'pdf_extraction_pages_per_shard', 'pdf_extraction_parallel_page_threshold'])
+        ocr_pdfs = read_return['ocr_pdfs']
+        ocr_min_text_chars_per_page = int(read_return['ocr_min_text_chars_per_page'])
+        pdf_text_extractor = read_return['pdf_text_extractor']
+        pdf_extraction_workers = int(read_return['pdf_extraction_workers'])
+        pdf_extraction_pages_per_shard = max(1, int(read_return['pdf_extraction_pages_per_shard']))
+        pdf_extraction_parallel_page_threshold = int(read_return['pdf_extraction_parallel_page_threshold'])
     except Exception as e:
-        handle_local_error("Could not establish connection to DB for chat history storage, encountered error: ", e)
+        handle_local_error("Missing ocr_pdfs or text extraction settings in config.json for PDFtoHybridTXT. Error: ", e)
+
+    extractor_name = get_hybrid_extractor_name(ocr_extractor)
+
+    # Set output path
+    source_filename = os.path.basename(input_filepath)
+    output_text_file_path = os.path.join(ocr_pdfs, source_filename.replace(".pdf",".txt")).replace("\\","/")
 
     try:
-        prev_sequence_id = determine_sequence_id_for_chat(chat_id)
-        #print("prev_sequence_id: ", prev_sequence_id)
-        SEQUENCE_ID = prev_sequence_id + 1
-        #print("current_sequence_id: ", SEQUENCE_ID)
+        if content_hash is None:
+            content_hash = compute_file_hash(input_filepath)
+        if restore_cached_extraction(content_hash, extractor_name, output_text_file_path):
+            print(f"Text for this document's content has already been extracted via {extractor_name}! Returning cached file.")
+            return output_text_file_path
     except Exception as e:
-        handle_local_error("Could not determine sequence ID for storage to chat history DB, encountered error: ", e)
-       
-    # print(type(CHAT_ID))
-    # print(type(current_sequence_id))
-    # print(type(user_query_for_history_db))
-    # print(type(model_response_for_history_db))
+        handle_error_no_return("Could not check the content cache, proceeding to extract text. Encountered error: ", e)
 
+    ### 1 - Extract the text layer of every page, which also classifies each page
     try:
-        # Store conversation history into DB
-        cursor.execute("INSERT INTO chat_history (chat_id, sequence_id, user_query, llm_response, llm_model, prompt_template) VALUES (?, ?, ?, ?, ?, ?)", (int(chat_id), int(sequence_id), user_query_for_history_db, model_response_for_history_db, model_choice, str(current_prompt_template)))
-        conn.commit()
+        page_count = get_pdf_page_count(input_filepath)
+        text_extractor = select_pdf_text_extractor(input_filepath, page_count) if pdf_text_extractor == 'auto' else pdf_text_extractor
+        page_texts = dict(extract_pdf_text_pages(input_filepath, text_extractor, page_count, pdf_extraction_workers, pdf_extraction_pages_per_shard, pdf_extraction_parallel_page_threshold))
     except Exception as e:
-        handle_local_error("Could not insert chat history into DB, encountered error: ", e)
-
-
-
-def store_chat_history_to_db(user_query_for_history_db, model_response_for_history_db, current_historical_summary):
+        handle_local_error("Could not extract the text layer of the PDF file, encountered error: ", e)
 
-    global SEQUENCE_ID
+    scanned_pages = [page_number for page_number in range(1, page_count + 1) if len(page_texts.get(page_number, "")) < ocr_min_text_chars_per_page]
+    print(f"{len(scanned_pages)} of {page_count} pages have no usable text layer and will be OCR'd")
 
-    print(f"\n\nStoring chat history for chat with CHAT_ID: {CHAT_ID}")
+    ### 2 - OCR only the scanned pages, via a PDF holding just those pages
+    ocr_lines_by_page = {}
+    if scanned_pages:
+        scanned_pages_dir = tempfile.mkdtemp()
+        try:
+            scanned_pages_pdf_path = os.path.join(scanned_pages_dir, source_filename.replace(".pdf", "_scanned_pages.pdf"))
+            with fitz.open(input_filepath) as source_pdf, fitz.open() as scanned_pages_pdf:
+                for page_number in scanned_pages:
+                    scanned_pages_pdf.insert_pdf(source_pdf, from_page=page_number - 1, to_page=page_number - 1)
+                scanned_pages_pdf.save(scanned_pages_pdf_path)
+
+            ocr_text_file_path = ocr_function(scanned_pages_pdf_path, use_cache=False)
+            for ocr_page_number, lines in read_ocr_output_by_page(ocr_text_file_path).items():
+                ocr_lines_by_page[scanned_pages[ocr_page_number - 1]] = lines
+        finally:
+            shutil.rmtree(scanned_pages_dir, ignore_errors=True)
+            # The scanned pages' OCR output (& any OCR progress left by a failure) lives in ocr_pdfs, drop it now the pages are merged
+            scanned_pages_text_file_path = os.path.join(ocr_pdfs, source_filename.replace(".pdf", "_scanned_pages.txt")).replace("\\","/")
+            for leftover_path in [scanned_pages_text_file_path, get_ocr_progress_path(scanned_pages_text_file_path)]:
+                try:
+                    os.remove(leftover_path)
+                except FileNotFoundError:
+                    pass
 
+    ### 3 - Merge into a single page-ordered text file
     try:
-        read_return = read_config(['sqlite_history_db', 'model_choice', 'base_template'])
-        sqlite_history_db = read_return['sqlite_history_db']
-        model_choice = read_return['model_choice']
-        base_template = read_return['base_template']
+        with open(output_text_file_path, 'w', encoding='utf-8') as output_text_file:
+            for page_number in range(1, page_count + 1):
+                if page_number in ocr_lines_by_page:
+                    for line in ocr_lines_by_page[page_number]:
+                        output_text_file.write(f"[PAGE:{page_number}]\n{line}\n")
+                else:
+                    output_text_file.write(f"[PAGE:{page_number}]\n{page_texts.get(page_number, '')}\n")
     except Exception as e:
-        handle_local_error("Missing keys in config.json for method store_chat_history_to_db. Error: ", e)
+        handle_local_error("Could not write to output text file, encountered error: ", e)
 
-    # Connect to or create the DB
     try:
-        conn = sqlite3.connect(sqlite_history_db)
-        cursor = conn.cursor()
+        record_cached_extraction(content_hash, extractor_name, output_text_file_path)
     except Exception as e:
-        handle_local_error("Could not establish connection to DB for chat history storage, encountered error: ", e)
+        handle_error_no_return("Could not record extracted text to the content cache, encountered error: ", e)
 
-    try:
-        prev_sequence_id = determine_sequence_id_for_chat(CHAT_ID)
-        #print("prev_sequence_id: ", prev_sequence_id)
-        SEQUENCE_ID = prev_sequence_id + 1
-        #print("current_sequence_id: ", SEQUENCE_ID)
-    except Exception as e:
-        handle_local_error("Could not determine sequence ID for storage to chat history DB, encountered error: ", e)
-       
-    # print(type(CHAT_ID))
-    # print(type(current_sequence_id))
-    # print(type(user_query_for_history_db))
-    # print(type(model_response_for_history_db))
+    return output_text_file_path
 
+#########################-------------------------------------###############################
+
+
+#########################------------PDF Text Extraction Engine-------------###############################
+# Local text extraction via PyMuPDF, pdfminer or PyPDF2 (pdf_text_extractor in config.json), or 'auto' to pick per document the fastest
+# extractor yielding a usable text layer on a sample of pages. Documents with more than pdf_extraction_parallel_page_threshold pages are
+# sharded into page ranges of pdf_extraction_pages_per_shard pages across a process pool, with results written out in page order.
+PDF_TEXT_EXTRACTORS_FASTEST_FIRST = ['pymupdf', 'pdfminer', 'pypdf2']
+PDF_EXTRACTION_POOL = None
+PDF_EXTRACTION_POOL_LOCK = threading.Lock()
+
+
+def get_pdf_page_count(input_file):
+    with fitz.open(input_file) as pdf_doc:
+        return pdf_doc.page_count
+
+
+# Yields (page_number, raw_text) for pages first_page..last_page inclusive, page numbers being 1-indexed
+def iter_page_range_raw_text(extractor, input_file, first_page, last_page):
+
+    if extractor == 'pymupdf':
+        with fitz.open(input_file) as pdf_doc:
+            for page_number in range(first_page, last_page + 1):
+                yield page_number, pdf_doc.load_page(page_number - 1).get_text("text")
+
+    elif extractor == 'pdfminer':
+        # pdfminer separates pages with a form-feed, pages with no text still emit one
+        page_texts = extract_text(input_file, page_numbers=list(range(first_page - 1, last_page))).split('\f')
+        for offset, page_number in enumerate(range(first_page, last_page + 1)):
+            yield page_number, page_texts[offset] if offset < len(page_texts) else ""
+
+    elif extractor == 'pypdf2':
+        with open(input_file, 'rb') as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            for page_number in range(first_page, last_page + 1):
+                yield page_number, pdf_reader.pages[page_number - 1].extract_text()
+
+    else:
+        raise ValueError(f"Unknown pdf_text_extractor: {extractor}")
+
+
+# Should a page fail to extract, the rest of the range is retried a page at a time, with any page that still fails logged & left empty so
+# one bad page neither fails the document nor shifts the page numbers after it
+def iter_page_range_text(extractor, input_file, first_page, last_page):
+
+    next_page = first_page
     try:
-        # Store conversation history into DB
-        cursor.execute("INSERT INTO chat_history (chat_id, sequence_id, user_query, llm_response, llm_model, prompt_template, history_summary) VALUES (?, ?, ?, ?, ?, ?, ?)", (int(CHAT_ID), int(SEQUENCE_ID), user_query_for_history_db, model_response_for_history_db, model_choice, str(base_template), str(current_historical_summary)))
-        conn.commit()
+        for page_number, text in iter_page_range_raw_text(extractor, input_file, first_page, last_page):
+            yield page_number, clean_text_string(text or "")
+            next_page = page_number + 1
     except Exception as e:
-        handle_local_error("Could not insert chat history into DB, encountered error: ", e)
+        handle_error_no_return(f"Could not extract pages {next_page} to {last_page} of {os.path.basename(input_file)} via {extractor}, extracting them one at a time. Encountered error: ", e)
 
-    conn.close()
+    for page_number in range(next_page, last_page + 1):
+        try:
+            _, text = next(iter_page_range_raw_text(extractor, input_file, page_number, page_number))
+        except Exception as e:
+            handle_error_no_return(f"Could not extract page {page_number} of {os.path.basename(input_file)} via {extractor}, leaving it empty. Encountered error: ", e)
+            text = ""
+        yield page_number, clean_text_string(text or "")
 
 
-@app.route('/login_to_google_drive')
-def login_to_google_drive():
-    global GDRIVE_CREDS
-    if os.path.exists("gdrive_token.json"):
-        GDRIVE_CREDS = Credentials.from_authorized_user_file("gdrive_token.json", GDRIVE_SCOPES)
-    if not GDRIVE_CREDS or not GDRIVE_CREDS.valid:
-        if GDRIVE_CREDS and GDRIVE_CREDS.expired and GDRIVE_CREDS.refresh_token:
-            GDRIVE_CREDS.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "gdrive_credentials.json", GDRIVE_SCOPES
-            )
-            GDRIVE_CREDS = flow.run_local_server(port=0)
-            with open("gdrive_token.json", "w") as token:
-                token.write(GDRIVE_CREDS.to_json())
-    return jsonify(success=True)
+# Process pool entry-point, hence returns a list rather than a generator
+def extract_page_range_text(extractor, input_file, first_page, last_page):
+    return list(iter_page_range_text(extractor, input_file, first_page, last_page))
 
 
-def categorize_mimetype(mimetype):
-    mimetype = mimetype.lower()
+def is_usable_text_layer(page_texts, min_chars_per_page=20):
+    if not page_texts:
+        return False
+    total_chars = sum(len(text) for text in page_texts)
+    replacement_chars = sum(text.count('\ufffd') for text in page_texts)  # undecodable glyphs, typical of broken font encodings
+    return total_chars >= min_chars_per_page * len(page_texts) and replacement_chars <= 0.05 * total_chars
 
-    word_mimetypes = {
-        # Microsoft Word (modern formats)
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        "application/vnd.ms-word.document.macroEnabled.12",
-        "application/vnd.ms-word.template.macroEnabled.12",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.template",
 
-        # Microsoft Word (legacy format)
-        "application/msword",
+def select_pdf_text_extractor(input_file, page_count, sample_size=3):
 
-        # Google Docs
-        "application/vnd.google-apps.document",
+    # Sample evenly spaced pages:
+    step = max(1, page_count // sample_size)
+    sample_pages = sorted(set(range(1, page_count + 1, step)))[:sample_size]
 
-        # OpenDocument Presentation
-        "application/vnd.oasis.opendocument.text",
-        "application/vnd.oasis.opendocument.text-template",
-        "application/vnd.oasis.opendocument.text-web"
-    }
+    for extractor in PDF_TEXT_EXTRACTORS_FASTEST_FIRST:
+        try:
+            sample_texts = [text for page in sample_pages for _, text in iter_page_range_raw_text(extractor, input_file, page, page)]
+            if is_usable_text_layer([clean_text_string(text or "") for text in sample_texts]):
+                return extractor
+        except Exception as e:
+            handle_error_no_return(f"Extractor {extractor} failed on sampled pages, trying the next. Encountered error: ", e)
 
-    excel_mimetypes = {
-        # Microsoft Excel (modern formats)
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        "application/vnd.ms-excel.sheet.macroEnabled.12",
-        "application/vnd.ms-excel.template.macroEnabled.12",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.template",
+    # No extractor found a text layer (likely a scanned document), fall back to the fastest:
+    return PDF_TEXT_EXTRACTORS_FASTEST_FIRST[0]
 
-        # Microsoft Excel (legacy format)
-        "application/vnd.ms-excel",
 
-        # Google Sheets
-        "application/vnd.google-apps.spreadsheet",
+def get_pdf_extraction_pool(pdf_extraction_workers):
+    global PDF_EXTRACTION_POOL
 
-        # OpenDocument Presentation
-        "application/vnd.oasis.opendocument.spreadsheet",
-        "application/vnd.oasis.opendocument.spreadsheet-template",
-        "text/csv",
-        "text/tab-separated-values"
-    }
+    with PDF_EXTRACTION_POOL_LOCK:
+        if PDF_EXTRACTION_POOL is None:
+            max_workers = pdf_extraction_workers if pdf_extraction_workers > 0 else (os.cpu_count() or 1)
+            PDF_EXTRACTION_POOL = ProcessPoolExecutor(max_workers=max_workers)
+            atexit.register(PDF_EXTRACTION_POOL.shutdown, wait=False)
 
-    presentation_mimetypes = {
-        # Microsoft PowerPoint (modern formats)
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation",  # .pptx
-        "application/vnd.ms-powerpoint.presentation.macroEnabled.12",  # .pptm
-        "application/vnd.openxmlformats-officedocument.presentationml.template",  # .potx
-        "application/vnd.ms-powerpoint.template.macroEnabled.12",  # .potm
-        "application/vnd.openxmlformats-officedocument.presentationml.slideshow",  # .ppsx
-        "application/vnd.ms-powerpoint.slideshow.macroEnabled.12",  # .ppsm
+    return PDF_EXTRACTION_POOL
 
-        # Microsoft PowerPoint (legacy format)
-        "application/vnd.ms-powerpoint",  # .ppt, .pot, .pps
 
-        # Google Slides
-        "application/vnd.google-apps.presentation",
+# Yields (page_number, clean_text) for every page in page order
+def extract_pdf_text_pages(input_file, extractor, page_count, pdf_extraction_workers, pages_per_shard, parallel_page_threshold):
 
-        # OpenDocument Presentation
-        "application/vnd.oasis.opendocument.presentation",  # .odp
-        "application/vnd.oasis.opendocument.presentation-template"  # .otp
-    }
+    if page_count <= parallel_page_threshold or pdf_extraction_workers == 1:
+        yield from iter_page_range_text(extractor, input_file, 1, page_count)
+        return
 
-    pdf_mimetypes = {
-        "application/pdf",
-        "application/x-pdf",
-        "application/acrobat",
-        "application/vnd.pdf",
-        "text/pdf",
-        "text/x-pdf"
-    }
+    shards = [(first_page, min(first_page + pages_per_shard - 1, page_count)) for first_page in range(1, page_count + 1, pages_per_shard)]
+    print(f"Extracting {page_count} pages across {len(shards)} shards")
 
-    text_mimetypes = {
-        "application/rtf",
-        "text/rtf",
-        "text/plain"
-    }
+    pool = get_pdf_extraction_pool(pdf_extraction_workers)
+    futures = [pool.submit(extract_page_range_text, extractor, input_file, first_page, last_page) for first_page, last_page in shards]
 
-    image_mimetypes = {
-        "image/jpeg",
-        "image/png",
-        "image/gif",
-        "image/bmp",
-        "image/webp",
-        "image/svg+xml",
-        "image/tiff",
-        "image/x-icon",
-        "image/vnd.microsoft.icon",
-        "image/heic",
-        "image/heif"
-    }
+    # Consume in submission order so output remains in page order, each shard being written as soon as it and all prior shards are done
+    for (first_page, last_page), future in zip(shards, futures):
+        try:
+            page_texts = future.result()
+        except Exception as e:
+            # The worker itself failed (ex: it crashed), pages are already isolated from each other within a shard
+            handle_error_no_return(f"Could not extract pages {first_page} to {last_page} in the process pool, extracting them here instead. Encountered error: ", e)
+            page_texts = iter_page_range_text(extractor, input_file, first_page, last_page)
+        yield from page_texts
 
-    video_mimetypes = {
-        "video/mp4",
-        "video/mpeg",
-        "video/x-msvideo",
-        "video/quicktime",
-        "video/x-ms-wmv",
-        "video/x-flv",
-        "video/webm",
-        "video/3gpp",
-        "video/3gpp2",
-        "video/x-matroska"
-    }
+#########################-------------------------------------###############################
 
-    audio_mimetypes = {
-        "audio/mpeg",
-        "audio/x-wav",
-        "audio/wav",
-        "audio/x-m4a",
-        "audio/aac",
-        "audio/ogg",
-        "audio/webm",
-        "audio/flac",
-        "audio/x-ms-wma",
-        "audio/x-aiff"
-    }
 
-    folder_mimetypes = {
-        "application/vnd.google-apps.folder",  # Google Drive folder
-        "application/x-directory",             # Generic directory mime type
-        "inode/directory",                     # Often used in Unix-like systems
-        "folder",                              # Some systems might use this
-    }
+def PDFtoTXT(input_file, content_hash=None):
 
-    # Word file
-    if mimetype in word_mimetypes:
-        return "word"
-    # Excel files
-    elif mimetype in excel_mimetypes:
-        return "excel"
-    # Presentation files
-    elif mimetype in presentation_mimetypes:
-        return "presentation"
-    # Text files
-    elif mimetype in text_mimetypes:
-        return "text"
-    # PDFs
-    elif mimetype in pdf_mimetypes:
-        return "pdf"
-    # Images
-    elif mimetype in image_mimetypes:
-        return "image"
-    # Videos
-    elif mimetype in video_mimetypes:
-        return "video"
-    # Audio files
-    elif mimetype in audio_mimetypes:
-        return "audio"
-    # Folders
-    elif mimetype in folder_mimetypes:
-        return "folder"
-    # Other
-    else:
-        return "other"
+    print("\n\nProcessing Document - PDF to TXT\n\n")
 
-@app.route('/fetch_file_list_from_google_drive')
-def fetch_file_list_from_google_drive():
-    gdrive_files = []
     try:
-        service = build("drive", "v3", credentials=GDRIVE_CREDS)
-
-        about_result = service.about().get(fields="storageQuota,user").execute()
-        print(f"about_result: {about_result}")
-
-        results = (
-            service.files().list(
-                q="trashed=false",
-                pageSize=1000,
-                fields="nextPageToken, files(id, name, mimeType, version)"
-            ).execute()
-        )
-        
-        items = results.get("files", [])
-        print(f"len(items): {len(items)}")
-
-        if not items:
-            print("No files found.")
-            return jsonify(success=True, gdrive_files=gdrive_files)
-        else:
-            # print("\n\nFiles:\n\n")
-            # print("Name       ID      mimeType        fileExtension       Category      version")
-            for item in items:
-                category = categorize_mimetype(item['mimeType'])
-                #print(f"{item['name']}      ({item['id']})      {item['mimeType']}      {category}        {item['version']}")
-                gdrive_files.append({
-                    'name': item['name'],
-                    'id': item['id'],
-                    'mimeType': item['mimeType'],
-                    'version': item['version'],
-                    'type': category
-                })
-
+        read_return = read_config(['pdfs_to_txts', 'pdf_text_extractor', 'pdf_extraction_workers', 'pdf_extraction_pages_per_shard', 'pdf_extraction_parallel_page_threshold'])
+        pdfs_to_txts = read_return['pdfs_to_txts']
+        pdf_text_extractor = read_return['pdf_text_extractor']
+        pdf_extraction_workers = int(read_return['pdf_extraction_workers'])
+        pdf_extraction_pages_per_shard = max(1, int(read_return['pdf_extraction_pages_per_shard']))
+        pdf_extraction_parallel_page_threshold = int(read_return['pdf_extraction_parallel_page_threshold'])
     except Exception as e:
-        return handle_api_error("Could not fetch GDrive files, encountered error: ", e)
-    
-    return jsonify({'success': True, 'gdrive_files': gdrive_files})
-
-
-def download_folder(service, folder_id, path, indent=''):
-
-    print(f"\n\nDownloading GoogleDrive Folder with id: {folder_id}\n\n")
+        handle_local_error("Missing pdfs_to_txts directory or text extraction settings for PDFtoTXT in config.json, encountered error: ", e)
 
     try:
-        if not os.path.exists(path):
-            os.makedirs(path)
+        source_filename = os.path.basename(input_file)
     except Exception as e:
-        return handle_api_error("Server-side error - could not create nested directory in the download_folder() method: ", e)
-
-    query = f"'{folder_id}' in parents"
-    fields = "files(id, name, mimeType)"
-    
-    gdrive_folder_contents = service.files().list(q=query, fields=fields).execute()
-    items = gdrive_folder_contents.get('files', [])
-
-    for item in items:
-        file_id = item['id']
-        filename = item['name']
-        mime_type = item['mimeType']
-        print(f"folder item mime_type f{mime_type}")
-
-        if "folder" in str(mime_type):
-            sub_folder_path = os.path.join(path, filename)    # in this case, filename will be the folder name
-
-            try:
-                download_folder(service, file_id, sub_folder_path)  # in this case, file_or_folder_id will be the folder id
-            except Exception as e:
-                return handle_api_error("Could not download_folder in the download_folder() method, encountered error: ", e)
-        else:
-            try:
-                filename_with_extension, file_content = download_gdrive_file(service, file_id, filename, mime_type)
-            except Exception as e:
-                return handle_api_error("Server-side error - could not get_file_content in the download_folder() method: ", e)
-
-            try:
-                # filepath = os.path.join(path, secure_filename(filename_with_extension))
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename_with_extension))
-                print(f"Saving {filename_with_extension} to {filepath}")
-                with open(filepath, 'wb') as f:
-                    f.write(file_content)
-
-                try:
-                    vector_embed_filepath(filename_with_extension, filepath)
-                except Exception as e:
-                    return handle_api_error("Could not vector_embed_filepath() in the download_folder() method, encountered error: ", e)
-
-            except Exception as e:
-                return handle_api_error("Server-side error - could not save Google Drive file in the download_folder() method: ", e)
-
-    return True
-
-
-def download_gdrive_file(service, file_id, filename, mime_type):
-
-    print(f"\n\nDownloading GoogleDrive File with mime_type: {mime_type}\n\n")
-
-    file_mime_category = categorize_mimetype(mime_type)
+        handle_local_error("Could not open PDF file, encountered error: ", e)
 
-    filename_with_extension = filename
+    # Set output path
+    output_text_file_name = source_filename.replace(".pdf",".txt")
+    output_text_file_path = os.path.join(pdfs_to_txts, output_text_file_name).replace("\\","/")
 
     try:
-        if file_mime_category in ["word", "excel", "presentation"]:
-            # Handle Google Docs Editors files
-            if 'google-apps' in mime_type:
-                if file_mime_category == "word":
-                    export_mime_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                    file_extension = '.docx'
-                elif file_mime_category == "excel":
-                    export_mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                    file_extension = '.xlsx'
-                elif file_mime_category == "presentation":
-                    export_mime_type = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
-                    file_extension = '.pptx'
-                
-                print(f"Downloading google-apps file with mimeType {file_mime_category}")
-                gdrive_request = service.files().export_media(fileId=file_id, mimeType=export_mime_type)
-                if not filename.endswith(file_extension):
-                    filename_with_extension += file_extension
-            
-            else:
-                # For non-Google formats, use get_media
-                print(f"Downloading office file with non google-apps mimeType {file_mime_category}")
-                gdrive_request = service.files().get_media(fileId=file_id)
-        else:
-            print(f"Downloading non-office file with mimeType {file_mime_category}")
-            gdrive_request = service.files().get_media(fileId=file_id)
-        
-        file = io.BytesIO()
-        downloader = MediaIoBaseDownload(file, gdrive_request)
-        
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            print(f"Download {int(status.progress() * 100)}%.")
-    
+        if content_hash is None:
+            content_hash = compute_file_hash(input_file)
+        if restore_cached_extraction(content_hash, pdf_text_extractor, output_text_file_path):
+            print(f"Text for this document's content has already been extracted via {pdf_text_extractor}! Returning cached file.")
+            return output_text_file_path
     except Exception as e:
-        return handle_api_error("Error downloading file from Google Drive in the download_gdrive_file() method: ", e)
-    
+        handle_error_no_return("Could not check the content cache, proceeding to extract text. Encountered error: ", e)
+
     try:
-        file_content = file.getvalue()
+        page_count = get_pdf_page_count(input_file)
     except Exception as e:
-        return handle_api_error("Server-side error - could not getValue() for downloaded Google Drive file  in the download_gdrive_file() method: ", e)
-
-    return filename_with_extension, file_content
-
+        handle_local_error("Could not open PDF file to determine page count, encountered error: ", e)
 
-def gdrive_downloader(service, file_or_folder_id, filename, mime_type, path=app.config['UPLOAD_FOLDER']):
-    file_mime_category = categorize_mimetype(mime_type)
-
-    if file_mime_category == "folder":
-        download_path = os.path.join(path, secure_filename(filename))    # in this case, filename will be the folder name
-        download_folder(service, file_or_folder_id, download_path)
-        return filename, None    # Return None for file_content as it's a folder
-    else:
-        filename_with_extension, file_content = download_gdrive_file(service, file_or_folder_id, filename, mime_type)
-        return filename_with_extension, file_content
+    extractor = pdf_text_extractor
+    if extractor == 'auto':
+        extractor = select_pdf_text_extractor(input_file, page_count)
+    print(f"Extracting text from {page_count} pages via {extractor}")
 
-
-@app.route('/google_drive_loader', methods=['POST'])
-def google_drive_loader():
-
-    try:
-        gdrive_file_id = str(request.form['file_id'])
-        gdrive_file_mimeType = str(request.form['file_mimeType'])
-    except Exception as e:
-        return handle_api_error("Server-side error reading Google Drive file details for download in the google_drive_loader() method: ", e)
-    
+    # Initialize text output
     try:
-        service = build("drive", "v3", credentials=GDRIVE_CREDS)
+        output_text_file = open(output_text_file_path, 'w', encoding='utf-8')
     except Exception as e:
-        return handle_api_error("Could not create Google service handler in the google_drive_loader() method, check credentials and re-try: ", e)
+        handle_local_error("Could not initialize/access output text file, encountered error: ", e)
 
+    # Loop through all the pages and write out the extracted text
     try:
-        file_metadata = service.files().get(fileId=gdrive_file_id, fields='name, mimeType').execute()
-        original_filename = file_metadata.get('name', 'untitled')
-        mime_type = file_metadata.get('mimeType', gdrive_file_mimeType)
+        for page_number, clean_text in extract_pdf_text_pages(input_file, extractor, page_count, pdf_extraction_workers, pdf_extraction_pages_per_shard, pdf_extraction_parallel_page_threshold):
+            output_text_file.write(f"[PAGE:{page_number}]\n{clean_text}\n")
     except Exception as e:
-        return handle_api_error("Could not read GoogleDrive file metadata in the google_drive_loader() method, encountered error: ", e)
-    
+        output_text_file.close()
+        os.remove(output_text_file_path)    # don't leave a partial extraction behind
+        handle_local_error(f"Could not extract text via {extractor}, encountered error: ", e)
+
+    # Close all files
+    output_text_file.close()
+
     try:
-        filename_with_extension, file_content = gdrive_downloader(service, gdrive_file_id, original_filename, mime_type)
+        record_cached_extraction(content_hash, pdf_text_extractor, output_text_file_path)
     except Exception as e:
-        return handle_api_error("Server-side error - could not getValue() for downloaded Google Drive file in the google_drive_loader() method: ", e)
-
-    if file_content is not None:
-        try:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename_with_extension))
+        handle_error_no_return("Could not record extracted text to the content cache, encountered error: ", e)
 
-            print(f"Saving {filename_with_extension} to {filepath}")
-            with open(filepath, 'wb') as f:
-                f.write(file_content)
+    return output_text_file_path
 
-            try:
-                vector_embed_filepath(filename_with_extension, filepath)
-            except Exception as e:
-                return handle_api_error("Could not vector_embed_filepath() in the google_drive_loader() method, encountered error: ", e)
 
-        except Exception as e:
-            return handle_api_error("Server-side error - could not save file downloaded from Google Drive in the google_drive_loader() method: ", e)
+def extract_images_from_pdf(pdf_path):
     
-    return jsonify({'success': True})
-
-
-# Route for loading all models from model dir
-@app.route('/load_local_models')
-def load_local_models():
+    print("Extracting Images from PDF")
 
     try:
-        read_return = read_config(['model_dir'])
-        model_dir = read_return['model_dir']
+        source_filename = os.path.basename(pdf_path)
     except Exception as e:
-        return handle_api_error("Missing model_dir in config.json for method load_local_models. Error: ", e)
+        handle_local_error("Could not extract filename, encountered error: ", e)
     
-    try:
-        models = [f for f in os.listdir(model_dir) if os.path.isfile(os.path.join(model_dir, f))]
-    except Exception as e:
-        return handle_api_error("Could not load list of local models, encountered error: ", e)
+    with open(pdf_path, 'rb') as file:
         
-    #print(f"locally available models: {models}")
-    return jsonify({'success': True, 'models': models})
-
+        try:
+            pdf_reader = PyPDF2.PdfReader(file)
+        except Exception as e:
+            handle_local_error("Could not read PDF, encountered error: ", e)
 
-@app.route('/upload_new_llm', methods=['POST'])
-def upload_new_llm():
+        images = []
 
-    try:
-        read_return = read_config(['model_dir'])
-        model_dir = read_return['model_dir']
-    except Exception as e:
-        return handle_api_error("Could not determine model_dir in upload_new_llm. Error: ", e)
+        for page_num in range(len(pdf_reader.pages)):
+            page = pdf_reader.pages[page_num]
 
-    try:
-        input_file = request.files['file']
-    except Exception as e:
-        return handle_api_error("Server-side error recieving LLM file: ", e)
+            text = page.extract_text().strip()
+            if not text:
+                print("Scanned page, skipping")
+                continue
 
-    # Ensure the filename is secure
-    filename = secure_filename(input_file.filename)
+            if '/XObject' in page['/Resources']:
+                xObject = page['/Resources']['/XObject'].get_object()
+                for obj in xObject:
+                    if xObject[obj]['/Subtype'] == '/Image':
 
-    try:
-        filepath = os.path.join(model_dir, filename)
+                        # Log details about the image object:
+                        try:
+                            image_obj = xObject[obj]
+                            obj_details = {
+                                'Object Reference': obj,
+                                'Width': image_obj.get('/Width', 'Unknown'),
+                                'Height': image_obj.get('/Height', 'Unknown'),
+                                'Color Space': image_obj.get('/ColorSpace', 'Unkown'),
+                                'Filter': image_obj.get('/Filter', 'Unknown'),
+                                'Bits Per Component': image_obj.get('/BitsPerComponent', 'Unknown')
+                            }
+                            #print(f"\n\nImage Object Details: {obj_details}\n\n")   # Filter is indicative of format: '/DCTDecode': 'JPEG', '/FlateDecode': 'PNG or others','/JPXDecode': 'JPEG 2000', etc.
 
-        print("Loading new LLM - filename: ", filename)
-        print("Loading new LLM - filepath: ", filepath)
+                            # data  = image_obj._data
 
-        # Save the uploaded file to the specified path
-        input_file.save(filepath)
-    except Exception as e:
-        return handle_api_error("Failed to save LLM to model_dir, encountered error: ", e)
+                            if obj_details['Filter'] == '/FlateDecode':
+                                #print("\n\nDecoding PNG!\n\n")
+                                try:
+                                    data  = image_obj._data
+                                    decompressed_data = zlib.decompress(data)
+                                except Exception as e:
+                                    error_message = f"\n\nPNG decompression exception: {e}\n\n"
+                                    if logger:
+                                        logger.error(error_message)
+                                        print(error_message)
+                                    else:
+                                        print(error_message)
+                            else:
+                                decompressed_data  = image_obj._data
 
-    return jsonify(success=True)
+                            text = page.extract_text()  
+                            # clean_text = text
 
+                            # Clean text
+                            clean_text = clean_text_string(text)
 
-# Route to handle the submission of the first form (LLM & embeddings model and GPU selection)
-@app.route('/process_model', methods=['POST'])
-def process_model():
-    
-    global HF_BGE_EMBEDDINGS
+                            try:
+                                if obj_details['Filter'] == '/FlateDecode':
+                                    # Determine Color Space:
+                                    color_space = image_obj.get('/ColorSpace')
 
-    ###---New config.json---###
+                                    if color_space == '/DeviceRGB':
+                                        mode = 'RGB'
+                                    elif color_space == '/DeviceCMYK':
+                                        mode = 'CMYK'
+                                    elif color_space == '/DeviceGray':
+                                        mode = 'L'
+                                    else:
+                                        mode = 'L'  # Default to grayscale if unsure
 
-    config_update_dict = {}
+                                    # Create image from bytes
+                                    image = Image.frombytes(mode, ((obj_details['Width']), (obj_details['Height'])), decompressed_data) # 'L' for 8-bit pixels, black and white
+                                    with io.BytesIO() as output:
+                                        image.save(output, format='JPEG')
+                                        binary_data = output.getvalue()
+                                        format = "JPEG"
+                                        images.append((binary_data,clean_text,format))
 
-    use_azure_open_ai = 'use_azure' in request.form
-    use_openai_embeddings = 'use_openai_embeddings' in request.form
-    use_sbert_embeddings = 'use_sbert_embeddings' in request.form
-    use_bge_large_embeddings = 'use_bge_large_embeddings' in request.form
-    use_bge_base_embeddings = 'use_bge_base_embeddings' in request.form
-    use_gpu_for_embeddings = request.form.get('use_gpu_for_embeds', False)    # default no
-    model_choice = str(request.form['model_choice'])
-    use_gpu = request.form.get('use_gpu', False)
+                                else:
+                                    # Load image from bytes
+                                    image = Image.open(io.BytesIO(decompressed_data))
 
-    config_update_dict.update({'use_azure_open_ai':use_azure_open_ai, 'use_openai_embeddings':use_openai_embeddings, 'use_sbert_embeddings':use_sbert_embeddings, 'use_bge_large_embeddings':use_bge_large_embeddings, 'use_bge_base_embeddings':use_bge_base_embeddings, 'use_gpu_for_embeddings':use_gpu_for_embeddings, 'model_choice':model_choice, 'use_gpu':use_gpu})
+                                    # Determine format (JPEG)
+                                    format = image.format
+                                    
+                                    #print(f"\n\nImage format: {format}\n\n")  # This will print the format
 
-    try:
-        if use_bge_base_embeddings or use_bge_large_embeddings:
-            model_name = ""
-            if use_bge_base_embeddings:
-                model_name = "BAAI/bge-base-en"
-            elif use_bge_large_embeddings:
-                model_name = "BAAI/bge-large-en"
-            model_kwargs = {}
-            if use_gpu_for_embeddings:
-                model_kwargs.update({"device": "cuda"})
-            else:
-                model_kwargs.update({"device": "cpu"})
-            encode_kwargs = {"normalize_embeddings": True}
-            HF_BGE_EMBEDDINGS = HuggingFaceBgeEmbeddings(
-                model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
-            )
-    except Exception as e:
-        return handle_api_error("Could not load BGE embeddings in process_model, encountered error: ", e)
-    
-    try:
-        write_config(config_update_dict)
-    except Exception as e:
-        handle_local_error("Could not write updates to config.json, encountered error: ", e)
+                                    # If image loads, append image to images DB
+                                    images.append((decompressed_data,clean_text,format))
 
-    # Redirect to the next step
-    return redirect(url_for('load_file'))
+                            except Exception as e:
+                                error_message = f"\n\nEncountered unrecognized or invalid image data for object detailed below. Exception: {e}\n\n"
+                                if logger:
+                                    logger.error(error_message)
+                                    logger.error(obj_details)
+                                    print(error_message)
+                                    print(f"\n\nImage Object Details: {obj_details}\n\n")   # Filter is indicative of format: '/DCTDecode': 'JPEG', '/FlateDecode': 'PNG or others','/JPXDecode': 'JPEG 2000', etc.
 
+                                else:
+                                    print(error_message)
+                                    print(f"\n\nImage Object Details: {obj_details}\n\n")   # Filter is indicative of format: '/DCTDecode': 'JPEG', '/FlateDecode': 'PNG or others','/JPXDecode': 'JPEG 2000', etc.
 
-def convert_to_pdf_with_unoconv(input_file_path, output_file_path):
-    print("\n\nConverting non-PDF document to PDF format\n\n")
-    if platform.system() == 'Windows':
-        subprocess.run(['python', 'unoconv.py', '-f', 'pdf', '-o', output_file_path, input_file_path], check=True)
-    else:
-        subprocess.run(['unoconv', '-f', 'pdf', '-o', output_file_path, input_file_path], check=True)
 
+                        except Exception as e:
+                            handle_error_no_return("Could not process image object. Exception: ", e)
+
+        # print("Images array:")
+        # print(images)
+        return images
 
-def reload_vector_store():
-    global VECTOR_STORE
-    print("\nRe-Loading VectorDB: ChromaDB")
 
-    vectordb_used = ""
+def store_images_to_db(images):
+
+    print("\n\nStoring Images to Database\n\n")
 
     try:
-        read_return = read_config(['use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings', 'vectordb_sbert_folder', 'vectordb_openai_folder', 'vectordb_bge_base_folder', 'vectordb_bge_large_folder', 'embedding_model_choice'])
-        use_sbert_embeddings = read_return['use_sbert_embeddings']
-        use_openai_embeddings = read_return['use_openai_embeddings']
-        use_bge_base_embeddings = read_return['use_bge_base_embeddings']
-        use_bge_large_embeddings = read_return['use_bge_large_embeddings']
-        vectordb_sbert_folder = read_return['vectordb_sbert_folder']
-        vectordb_openai_folder = read_return['vectordb_openai_folder']
-        vectordb_bge_base_folder = read_return['vectordb_bge_base_folder']
-        vectordb_bge_large_folder = read_return['vectordb_bge_large_folder']
-        embedding_model_choice = read_return['embedding_model_choice']
+        read_return = read_config(['sqlite_images_db'])
+        sqlite_images_db = read_return['sqlite_images_db']
     except Exception as e:
-        handle_local_error("Missing values in config.json when reloading VectorDB, could not fully complete process_new_file. Please try restarting the application. Error: ", e)
+        handle_local_error("Missing sqlite_images_db in config.json for method store_images_to_db. Error: ", e)
 
     try:
-        if use_sbert_embeddings:
-            VECTOR_STORE = Chroma(persist_directory=vectordb_sbert_folder, embedding_function=HuggingFaceEmbeddings())
-            vectordb_used = vectordb_sbert_folder
-        elif use_openai_embeddings:
-            VECTOR_STORE = Chroma(persist_directory=vectordb_openai_folder, embedding_function=AZURE_OPENAI_EMBEDDINGS)
-            vectordb_used = vectordb_openai_folder
-        elif use_bge_base_embeddings:
-            VECTOR_STORE = Chroma(persist_directory=vectordb_bge_base_folder, embedding_function=HF_BGE_EMBEDDINGS)
-            vectordb_used = vectordb_bge_base_folder
-        elif use_bge_large_embeddings:
-            VECTOR_STORE = Chroma(persist_directory=vectordb_bge_large_folder, embedding_function=HF_BGE_EMBEDDINGS)
-            vectordb_used = vectordb_bge_large_folder
+        conn = sqlite3.connect(sqlite_images_db)
+        cursor = conn.cursor()
     except Exception as e:
-        handle_local_error("Could not reload VectorDB when trying to process_new_file. Please try restarting the application. Error: ", e)
+        handle_local_error("Could not establish connection to Images DB, encountered error: ", e)
     
-    return embedding_model_choice, vectordb_used
-
-
-def convert_non_pdf_to_pdf_with_unoconv(filename, filepath):
-    print("Converting to PDF file")
-
+    # If the database does not currently exist...
     try:
-        conv_filename = os.path.splitext(filename)[0] + '.pdf'
-        conv_filepath = os.path.join(app.config['UPLOAD_FOLDER'], conv_filename)
-
-        convert_to_pdf_with_unoconv(filepath, conv_filepath)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                    id INTEGER PRIMARY KEY,
+                    image_data BLOB NOT NULL,
+                    surrounding_text TEXT,
+                    metadata TEXT,
+                    format TEXT
+            )
+        ''')
 
-        return conv_filename, conv_filepath
-    except subprocess.CalledProcessError as e:
-        return handle_api_error("Could not convert file to PDF, encountered error: ", e)
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not create Images DB, encountered error: ", e)
+    
+    try:
+        for image_data, surrounding_text, format in images:
+            #print("surrounding_text: ", surrounding_text)
+            # Check if the image_data already exists in the database:
+            cursor.execute("SELECT COUNT(*) FROM images WHERE image_data = ?", (image_data,))
+            if cursor.fetchone()[0] == 0:
+                print("\nInserting new image into images DB\n")
+                cursor.execute("INSERT INTO images (image_data, surrounding_text, format) VALUES (?, ?, ?)", (image_data, surrounding_text, format))
+        conn.commit()
     except Exception as e:
-        return handle_api_error("Unexpected error when converting file to PDF, encountered error: ", e)
+        handle_local_error("Could not store images to Images DB, encountered error: ", e)
+    finally:
+        conn.close()
 
 
-def vector_embed_filepath(filename, filepath):
-    print("Vector Embedding Document")
+#########################------------Document Records-------------###############################
+# document_records holds a row per document per VectorDB, along with the .txt source its chunks were made from & the ids of those chunks.
+# Chunk ids are derived from the source & chunk index, so re-ingesting a document reproduces them, and a single document's chunks can be deleted
+# or re-indexed without a reset_vector_db_on_disk. Rows recorded before chunk ids were tracked fall back to a lookup by source in the VectorDB.
+DOCUMENT_RECORDS_ADDED_COLUMNS = {'source': 'TEXT', 'chunk_ids': 'TEXT'}
 
-    if not filename.lower().endswith('.pdf'):
-        _, filepath = convert_non_pdf_to_pdf_with_unoconv(filename, filepath)
 
-    use_ocr = False
-    try:
-        read_return = read_config(['use_ocr', 'ocr_service_choice'])
-        use_ocr = read_return['use_ocr']
-        ocr_service_choice = read_return['ocr_service_choice']
-    except Exception as e:
-        handle_local_error("Could not determine use_ocr in config.json for process_new_file. Disabling OCR and proceeding. Error: ", e)
-    
-    print("Processing PDF file")
-    
-    if use_ocr:
-        try:
-            if ocr_service_choice == 'AzureVision':
-                input_file = PDFtoAzureOCRTXT(filepath)
-            elif ocr_service_choice == 'AzureDocAi':
-                input_file = PDFtoAzureDocAiTXT(filepath)
-        except Exception as e:
-            handle_error_no_return("Failed to OCR text from PDF. Will now attempt to extract text via PyPDF2. Encountered error: ", e)
-            try:
-                input_file = PDFtoTXT(filepath)
-            except Exception as e:
-                handle_local_error("Failed to extract text from the PDF document, even via fallback PyPDF2, encountered error: ", e)
-    else:
-        try:
-            input_file = PDFtoTXT(filepath)
-        except Exception as e:
-            handle_local_error("Failed to extract text from the PDF document, even via fallback PyPDF2, encountered error: ", e)
-    
-    # try:
-    #     images = extract_images_from_pdf(filepath)
-    # except Exception as e:
-    #     handle_error_no_return("Failed to extract images from the PDF document, encountered error: ", e)
+def connect_to_docs_loaded_db():
 
-    # try:
-    #     store_images_to_db(images)
-    # except Exception as e:
-    #     handle_error_no_return("Failed to save images to database, encountered error: ", e)
-    
     try:
-        chunk_size, chunk_overlap = LoadNewDocument(input_file)
+        read_return = read_config(['sqlite_docs_loaded_db'])
+        sqlite_docs_loaded_db = read_return['sqlite_docs_loaded_db']
     except Exception as e:
-        handle_local_error("Failed to extract text from PDF: ", e)
-    
+        handle_local_error("Missing sqlite_docs_loaded_db in config.json for method connect_to_docs_loaded_db. Error: ", e)
+
     try:
-        embedding_model_choice, vectordb_used = reload_vector_store()
+        conn = sqlite3.connect(sqlite_docs_loaded_db, timeout=30)
+        conn.row_factory = sqlite3.Row
     except Exception as e:
-        handle_local_error("Could not reload vector store when attempting to vector_embed_filepath(), encountered error: ", e)
+        handle_local_error("Could not establish connection to document_records DB, encountered error: ", e)
 
+    # If the database does not currently exist...
     try:
-        record_doc_loaded_to_db(filename, embedding_model_choice, vectordb_used, chunk_size, chunk_overlap)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_records (
+                    id INTEGER PRIMARY KEY,
+                    document_name TEXT NOT NULL,
+                    embedding_model TEXT NOT NULL,
+                    vectordb_used TEXT,
+                    chunk_size INTEGER,
+                    chunk_overlap INTEGER,
+                    source TEXT,
+                    chunk_ids TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_sets (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    vectordb_used TEXT NOT NULL,
+                    UNIQUE (name, vectordb_used)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_set_members (
+                    document_set_id INTEGER NOT NULL,
+                    document_id INTEGER NOT NULL,
+                    PRIMARY KEY (document_set_id, document_id)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS vectordb_compaction (
+                    vectordb_used TEXT PRIMARY KEY,
+                    deleted_chunks INTEGER NOT NULL DEFAULT 0,
+                    last_compacted_at TEXT
+            )
+        ''')
+
+        # ...or predates the source & chunk_ids columns:
+        existing_columns = [row['name'] for row in conn.execute("PRAGMA table_info(document_records)").fetchall()]
+        for column_name, column_type in DOCUMENT_RECORDS_ADDED_COLUMNS.items():
+            if column_name not in existing_columns:
+                conn.execute(f"ALTER TABLE document_records ADD COLUMN {column_name} {column_type}")
+
+        conn.commit()
     except Exception as e:
-        handle_error_no_return("Unable to record document loading to records DB, encountered error: ", e)
+        handle_local_error("Could not create document_records DB, encountered error: ", e)
 
-    return True
+    return conn
 
 
-# Route to handle the submission of the second form (file loading)
-@app.route('/process_new_file', methods=['POST'])
-def process_new_file():
+def record_doc_loaded_to_db(document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap, source=None, chunk_ids=None):
 
+    print("\n\nRecording document loading to records DB\n\n")
+
+    conn = connect_to_docs_loaded_db()
+
+    # A re-ingested document updates its existing row, keeping its id:
     try:
-        input_file = request.files['file']
+        chunk_ids_json = json.dumps(chunk_ids) if chunk_ids is not None else None
+        existing_row = conn.execute("SELECT id FROM document_records WHERE document_name = ? AND vectordb_used = ? ORDER BY id DESC", (document_name, vectordb_used)).fetchone()
+        if existing_row is None:
+            conn.execute("INSERT INTO document_records (document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap, source, chunk_ids) VALUES (?, ?, ?, ?, ?, ?, ?)", (document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap, source, chunk_ids_json))
+        else:
+            conn.execute("UPDATE document_records SET embedding_model = ?, chunk_size = ?, chunk_overlap = ?, source = ?, chunk_ids = ? WHERE id = ?", (embedding_model, chunk_size, chunk_overlap, source, chunk_ids_json, existing_row['id']))
+        conn.commit()
     except Exception as e:
-        return handle_api_error("Server-side error recieving file: ", e)
+        handle_local_error("Could not update document_records DB, encountered error: ", e)
+    finally:
+        conn.close()
 
-    # Ensure the filename is secure
-    filename = secure_filename(input_file.filename)
-    if "PDF" in filename:
-        filename = filename.replace("PDF", "pdf")
 
+def fetch_document_record(document_id):
+
+    conn = connect_to_docs_loaded_db()
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        row = conn.execute("SELECT id, document_name, embedding_model, vectordb_used, chunk_size, chunk_overlap, source, chunk_ids FROM document_records WHERE id = ?", (document_id,)).fetchone()
+    finally:
+        conn.close()
 
-        print("Loading new file - filename: ", filename)
-        print("Loading new file - filepath: ", filepath)
+    return dict(row) if row else None
 
-        # Save the uploaded file to the specified path
-        input_file.save(filepath)
-    except Exception as e:
-        return handle_api_error("Failed to save document to app folder, encountered error: ", e)
 
-    try:
-        vector_embed_filepath(filename, filepath)
-    except Exception as e:
-        return handle_api_error("Could not vector_embed_filepath() in the process_new_file() method, encountered error: ", e)
+# Stable id of the chunk_index'th chunk of source, the same every time that source is chunked
+def get_document_chunk_id(source, chunk_index):
+    source_key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:20]
+    return f"{source_key}-{chunk_index}"
 
-    return jsonify(success=True)
 
+# .txt sources a document's chunks may have been stored under: the recorded one, else wherever PDFtoTXT or OCR would have placed it
+def get_document_sources(document_record):
 
-# Route to store user rating: 
-# ATTN: comment out print() statements, as users may elect to leave a rating as a response is being generated, which is when the stdout is redirected to the event stream! 
-@app.route('/store_user_rating', methods=['POST'])
-def store_user_rating():
-    
-    # print("Stroing user rating")
+    if document_record['source']:
+        return [document_record['source']]
 
-    try:
-        read_return = read_config(['sqlite_history_db'])
-        sqlite_history_db = read_return['sqlite_history_db']
-    except Exception as e:
-        handle_local_error("Missing sqlite_history_db in config.json for method store_user_rating. Error: ", e)
-    
-    try:
-        user_rating = request.form['rating']
-        chat_id_for_rating = request.form['chat_id']
-        sequence_id_for_rating = request.form['sequence_id']
-    except Exception as e:
-        return handle_api_error("Server-side error, could not read user rating or failed to obtain chat/sequence ID, encountered error: ", e)
+    read_return = read_config(['pdfs_to_txts', 'ocr_pdfs'])
+    text_file_name = os.path.splitext(document_record['document_name'])[0] + '.txt'
+    return [os.path.join(read_return[folder_key], text_file_name).replace("\\","/") for folder_key in ('pdfs_to_txts', 'ocr_pdfs')]
+
+
+def find_chunk_ids_for_source(vector_store, source):
+    return vector_store._collection.get(where={'source': source}, include=[])['ids']
 
-    # print("user_rating: ", user_rating)
-    # print("chat_id_for_rating: ", chat_id_for_rating)
-    # print("sequence_id_for_rating: ", sequence_id_for_rating)
+
+# Method to delete chunk_ids from a VectorDB & the lexical index, counting them towards the VectorDB's next compaction
+def delete_chunks_from_vectordb(vector_store, vectordb_used, chunk_ids):
+
+    if not chunk_ids:
+        return
+
+    max_batch_size = get_chroma_max_batch_size(vector_store)
+    for chunk_ids_batch in iter_batches(chunk_ids, max_batch_size):
+        vector_store._collection.delete(ids=chunk_ids_batch)
 
     try:
-        conn = sqlite3.connect(sqlite_history_db)
-        cursor = conn.cursor()
+        remove_chunks_from_lexical_index(chunk_ids)
     except Exception as e:
-        return handle_api_error("Could not connect to chat history DB for storage of user-rating, encountered error: ", e)
+        handle_error_no_return("Could not remove deleted chunks from the lexical index, encountered error: ", e)
+
+    # Only once both indexes have dropped the chunks, or a query in between would cache results citing them under the new version
+    bump_corpus_version(vectordb_used)
 
     try:
-        cursor.execute(
-            '''
-            UPDATE chat_history
-            SET user_rating = ?
-            WHERE chat_id = ? AND sequence_id = ?
-            ''',
-            (user_rating, chat_id_for_rating, sequence_id_for_rating)
-        )
-        conn.commit()
+        record_deleted_chunks(vectordb_used, len(chunk_ids))
     except Exception as e:
-        return handle_api_error("Could not store user-rating to chat history db, encountered error: ", e)
+        handle_error_no_return("Could not record deleted chunks for compaction, encountered error: ", e)
 
-    conn.close()
 
-    return jsonify(success=True)
+# Method to remove any chunks stored for source, so that re-ingesting it doesn't leave chunks of its previous version behind
+def delete_source_chunks_from_vectordb(vector_store, vectordb_used, source):
+    chunk_ids = find_chunk_ids_for_source(vector_store, source)
+    if chunk_ids:
+        print(f"Removing {len(chunk_ids)} previously stored chunks of {os.path.basename(source)} from the VectorDB")
+        delete_chunks_from_vectordb(vector_store, vectordb_used, chunk_ids)
 
 
+def delete_document(document_id):
 
-def is_local_server_online(server_to_check):
-    server_health_url = ''
-    if server_to_check == 'llama-cpp':
-        server_health_url = 'http://localhost:8080/health'
-    elif server_to_check == 'hf-waitress':
-        server_health_url = 'http://localhost:9069/health'
-    else:
-        return handle_api_error("Invalid server_to_check in method is_local_server_online, encountered error: ", e)
+    document_record = fetch_document_record(document_id)
+    if document_record is None:
+        raise KeyError(f"No document_records row with id {document_id}")
 
-    print(f"\n\nChecking {server_to_check} server status\n\n")
+    vectordb_used = document_record['vectordb_used']
+    sources = get_document_sources(document_record)
 
-    try:
-        response = requests.get(server_health_url)
-        
-        if response.status_code == 200:
-            data = response.json()  # parse the JSON response to determine the server status
-            if data['status'] == 'ok' and server_to_check == 'llama-cpp':
-                #print(f"llama.cpp Server ready: {data['slots_idle']} idle slots, {data['slots_processing']} processing slots.")
-                print(f"llama.cpp Server ready. No slot information available.")
-                return {"server_available":True, "loading_model":False, "status_code":200}
-            elif data['status'] == 'ok' and server_to_check == 'hf-waitress':
-                print(f"hf-waitress Server ready and online")
-                return {"server_available":True, "loading_model":False, "status_code":200}
-            elif data['status'] == 'no slot available':
-                print("No slots available. Server is running but cannot handle more requests.")
-                return {"server_available":False, "loading_model":False, "status_code":200}
-            
-        elif response.status_code == 503:   # model still loading or no slots
-            data = response.json()
-            if data['status'] == 'loading model':
-                print("Server is loading the selected LLM, please wait")
-                return {"server_available":False, "loading_model":True, "status_code":503}
-            else:
-                print("No slots available. Server is running but cannot handle more requests.")
-                return {"server_available":False, "loading_model":False, "status_code":503}
-        
-        elif response.status_code == 500:
-            print("Server error: Failed to load LLM.")
-            logger.error("Local LLM Server - 500 event")
-            return {"server_available":False, "loading_model":False, "status_code":500}
-        
-        else:
-            return {"server_available":False, "loading_model":False, "status_code":500}
-    
-    except requests.exceptions.ConnectionError as e:
-        error_message = "\n\nECONNREFUSED event\n\n"
-        if logger:
-            logger.error(error_message)
-            print(error_message)
-        else:
-            print(error_message)
-        return {"server_available":False, "loading_model":True, "status_code":500}
-    except Exception as e:
-        error_message = f"\n\nCould not check local LLM Server health, encountered error: {e}\n\n"
-        if logger:
-            logger.error(error_message)
-            print(error_message)
-        else:
-            print(error_message)
-        return {"server_available":False, "loading_model":False, "status_code":500}
-    
+    with VECTORDB_WRITE_LOCK:
+        vector_store = get_vector_store(vectordb_used)
 
-def send_ctrl_c_to_process(process):
-    if process.poll() is None:  # check if process is still running via poll(), which returns None if a process is still running 
-        if platform.system() == 'Windows':
-            process.send_signal(signal.CTRL_BREAK_EVENT)
+        if document_record['chunk_ids']:
+            chunk_ids = json.loads(document_record['chunk_ids'])
         else:
-            process.send_signal(signal.SIGINT)
+            chunk_ids = [chunk_id for source in sources for chunk_id in find_chunk_ids_for_source(vector_store, source)]
+
+        print(f"Deleting {len(chunk_ids)} chunks of {document_record['document_name']} from {vectordb_used}")
+        delete_chunks_from_vectordb(vector_store, vectordb_used, chunk_ids)
+
+        for source in sources:
+            forget_cached_embeddings_for_source(source, vectordb_used)
+
+        conn = connect_to_docs_loaded_db()
         try:
-            # Wait a bit for the process to terminate gracefully:
-            process.wait(timeout=3)
-        except subprocess.TimeoutExpired:
-            print("\n\nProcess did not terminate within timeout, will be force-killed.\n\n")
-            process.kill()  # Sends 'SIGKILL' on Unix-like to force-kill immediately / 'TerminateProcess' on Windows which still allows for graceful termination
-            process.wait()
-            if process.poll() is not None:
-                print("\n\nProcess has been killed successfully.\n\n")
-            else:
-                print("\n\nProcess still running after force kill attempt.\n\n")
+            conn.execute("DELETE FROM document_records WHERE id = ?", (document_id,))
+            conn.execute("DELETE FROM document_set_members WHERE document_id = ?", (document_id,))
+            conn.commit()
+        finally:
+            conn.close()
 
+    return document_record
 
-def terminate_local_llm_server_process(process):
-    try:
-        # process.terminate() sends 'SIGTERM' on Unix-like systems / 'TerminateProcess' on Windows, allows for graceful termination
-        # process.wait()
-        send_ctrl_c_to_process(process)
-        if process.poll() is not None:  # process has indeed terminated
-            print("\n\nProcess terminated gracefully.\n\n")
-    except Exception as e:
-        handle_local_error("Failed to terminate local LLM server process, encountered error: ", e)
 
+# Method to queue a document for ingestion again, replacing its chunks in place once re-embedded | returns the ingestion job_id
+def reindex_document(document_id):
 
-@app.route('/llama_cpp_server_starter')
-def llama_cpp_server_starter():
-    print("\n\nStarting llama.cpp Server\n\n")
+    document_record = fetch_document_record(document_id)
+    if document_record is None:
+        raise KeyError(f"No document_records row with id {document_id}")
 
-    global LLM_CHANGE_RELOAD_TRIGGER_SET
-    global LLAMA_CPP_PROCESS
-    global HF_WAITRESS_PROCESS
-    global LLM_LOADED_UP
+    # Ingestion always writes to the VectorDB in use:
+    if document_record['vectordb_used'] != get_vectordb_folder_in_use():
+        raise ValueError(f"{document_record['document_name']} is stored in {document_record['vectordb_used']}, which is not the VectorDB in use. Switch to its embedding model to re-index it.")
 
-    other_server_running = False
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], document_record['document_name'])
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"The uploaded file {filepath} no longer exists, it must be uploaded again")
 
-    # Before attempting to start the llama.cpp server, check if HF-Waitress is running and if so, shut it down:
-    try:
-        if is_local_server_online('hf-waitress')['server_available']:
-            print("\n\nThe HF-Waitress server is running. Attempting to shut it down before starting the llama.cpp server.\n\n")
-            try:
-                if HF_WAITRESS_PROCESS is not None:
-                    terminate_local_llm_server_process(HF_WAITRESS_PROCESS)
-                    HF_WAITRESS_PROCESS = None
-                    LLM_LOADED_UP = False
-                else:
-                    raise Exception("HF_WAITRESS_PROCESS is None but server_available")
-            except Exception as e:
-                LLM_LOADED_UP = True    # We know the HF-Waitress server is running, which means `hf_waitress.py` is available, so we set LLM_LOADED_UP to True
-                other_server_running = True # Set to True as we've determined the other server is running and we failed to terminate it
-                handle_error_no_return("Warning: Failed to terminate running HF-Waitress process before launching llama.cpp. It was likely launched by a previous session or external process. Consider manually shutting down this server to conserve memory. Technical error-details follow: ", e)
-    except Exception as e:
-        handle_error_no_return("Warning: Could not check if HF-Waitress server is running. Proceeding to launch llama.cpp server. Encountered error: ", e)   
+    # Otherwise LoadNewDocument would find the document already embedded & skip it:
+    for source in get_document_sources(document_record):
+        forget_cached_embeddings_for_source(source, document_record['vectordb_used'])
 
-    is_llama_cpp_running = False
-    try:
-        is_llama_cpp_running = is_local_server_online('llama-cpp')['server_available']
-    except Exception as e:
-        handle_error_no_return("Warning: Could not check if llama.cpp server is running. Proceeding to launch llama.cpp server. Encountered error: ", e)
+    return submit_ingestion_job(document_record['document_name'], filepath)
 
-    model_choice = 'undefined'
-    try:
-        read_return = read_config(['model_choice'])
-        model_choice = read_return['model_choice']
-    except Exception as e:
-        handle_error_no_return("Missing model_choice in config.json in method llama_cpp_server_starter. Printing error and proceeding with model_choice: 'undefined' ", e)
+#########################-------------------------------------###############################
 
-    if is_llama_cpp_running and not LLM_CHANGE_RELOAD_TRIGGER_SET:
-        LLM_LOADED_UP = True
-        print(f'\n\nThe llama.cpp server is already loaded and the reload trigger is not set. Simply returning with model choice: {model_choice}\n\n')
-        return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
-    
-    elif is_llama_cpp_running and LLM_CHANGE_RELOAD_TRIGGER_SET:
-        print("\n\nllama.cpp server online and LLM_CHANGE_RELOAD_TRIGGER_SET is set. Attempting to terminate and reload from config.json\n\n")
-        try:
-            terminate_local_llm_server_process(LLAMA_CPP_PROCESS)
-            LLAMA_CPP_PROCESS = None
-            LLM_CHANGE_RELOAD_TRIGGER_SET = False
-        except Exception as e:
-            LLM_LOADED_UP = True  # We know the llama.cpp server is running but there was an error terminating it, so we set LLM_LOADED_UP to True while leaving LLM_CHANGE_RELOAD_TRIGGER_SET to True as we know the server needs to be re-loaded.
-            handle_error_no_return("Failed to terminate running llama.cpp process, server was likely launched by a previous session. Returning with the currently loaded LLM. To change, shutdown the previously launched server manually and reload this page. Technical error-details follow: ", e)
-            return jsonify({'success': True, 'llm_model': 'undefined', 'other_server_running': other_server_running})   # We still return success:True as we've at least determined llama.cpp is running and loaded with a model, even if we cannot reload it.
-                 
-    elif LLM_CHANGE_RELOAD_TRIGGER_SET: # llama.cpp is not running, set flags to false and new settings will be loaded on next llama.cpp launch
-        print("\n\nResetting the LLM_CHANGE_RELOAD_TRIGGER_SET flag and attemping to launch the server with the currently selected LLM.\n\n")
-        LLM_CHANGE_RELOAD_TRIGGER_SET = False
-        LLM_LOADED_UP = False
 
+#########################------------Document Sets & Scoped Retrieval-------------###############################
+# A chat may be scoped to a selection of documents and/or named document sets, resolved to the .txt sources of their chunks. The scope is applied
+# as a metadata filter within the similarity search (and the lexical search), so that k candidates are drawn from the scoped documents alone.
+def save_document_set(name, vectordb_used, document_ids):
 
+    conn = connect_to_docs_loaded_db()
     try:
-        read_return = read_config(['model_dir', 'model_choice', 'local_llm_context_length', 'local_llm_max_new_tokens', 'local_llm_gpu_layers', 'server_timeout_seconds', 'server_retry_attempts', 'use_gpu'])
-        model_dir = read_return['model_dir']
-        model_choice = read_return['model_choice']
-        local_llm_context_length = read_return['local_llm_context_length']
-        local_llm_max_new_tokens = read_return['local_llm_max_new_tokens']
-        local_llm_gpu_layers = read_return['local_llm_gpu_layers']
-        server_timeout_seconds = read_return['server_timeout_seconds']
-        server_retry_attempts = read_return['server_retry_attempts']
-        use_gpu = read_return['use_gpu']
-    except Exception as e:
-        return handle_api_error("Missing values in config.json when preparing to launch llama.cpp server, encountered error: ", e)
+        conn.execute("INSERT INTO document_sets (name, vectordb_used) VALUES (?, ?) ON CONFLICT(name, vectordb_used) DO NOTHING", (name, vectordb_used))
+        document_set_id = conn.execute("SELECT id FROM document_sets WHERE name = ? AND vectordb_used = ?", (name, vectordb_used)).fetchone()['id']
+
+        # Saving over an existing set replaces its members:
+        conn.execute("DELETE FROM document_set_members WHERE document_set_id = ?", (document_set_id,))
+        conn.executemany("INSERT OR IGNORE INTO document_set_members (document_set_id, document_id) VALUES (?, ?)", [(document_set_id, document_id) for document_id in document_ids])
+        conn.commit()
+    finally:
+        conn.close()
+
+    return document_set_id
 
 
+def delete_document_set(document_set_id):
+
+    conn = connect_to_docs_loaded_db()
     try:
-        cpp_model = os.path.join(model_dir, model_choice)
-    except Exception as e:
-        return handle_api_error("Could not os.join path to model file to launch llama.cpp server, encountered error: ", e)
+        conn.execute("DELETE FROM document_set_members WHERE document_set_id = ?", (document_set_id,))
+        conn.execute("DELETE FROM document_sets WHERE id = ?", (document_set_id,))
+        conn.commit()
+    finally:
+        conn.close()
 
-    if not use_gpu:
-        local_llm_gpu_layers = 0
 
+# Documents & document sets a chat may be scoped to within vectordb_used | returns documents: [{id, name}], document_sets: [{id, name, document_ids}]
+def fetch_document_scope_options(vectordb_used):
+
+    conn = connect_to_docs_loaded_db()
     try:
-        cpp_app = ['llama-server', '-m', cpp_model, '-ngl', str(local_llm_gpu_layers), '-c', str(local_llm_context_length), '-n', str(local_llm_max_new_tokens), '--host', '0.0.0.0']
+        documents = [dict(row) for row in conn.execute("SELECT id, document_name AS name FROM document_records WHERE vectordb_used = ? ORDER BY document_name", (vectordb_used,)).fetchall()]
+        document_sets = [dict(row) for row in conn.execute("SELECT id, name FROM document_sets WHERE vectordb_used = ? ORDER BY name", (vectordb_used,)).fetchall()]
+        for document_set in document_sets:
+            document_set['document_ids'] = [row['document_id'] for row in conn.execute("SELECT document_id FROM document_set_members WHERE document_set_id = ?", (document_set['id'],)).fetchall()]
+    finally:
+        conn.close()
 
-        if platform.system() == 'Windows':
-            LLAMA_CPP_PROCESS = subprocess.Popen(cpp_app, creationflags=subprocess.CREATE_NEW_CONSOLE)  # Windows only! Comment when containerizing or deploying to Linux/MacOS!
-        else:           
-            # Platform & container agnostic:
-            with open('llama_cpp_server_output_log.txt', 'w') as f:
-                LLAMA_CPP_PROCESS = subprocess.Popen(cpp_app, stdout=f, stderr=subprocess.STDOUT, text=True)    #stdout has already been redirected to the file, so simply direct stderr to stdout!
+    return documents, document_sets
 
-    except Exception as e:
-        return handle_api_error("Could not launch llama.cpp process, encountered error: ", e)
 
+# Method to resolve a scope to the sources of its documents | returns None when unscoped, else a (possibly empty) list of sources
+def resolve_scope_sources(document_ids, document_set_ids, vectordb_used):
 
-    timeout = server_timeout_seconds   
-    attempts = server_retry_attempts
+    if not document_ids and not document_set_ids:
+        return None
+
+    scoped_document_ids = set(int(document_id) for document_id in document_ids or [])
 
+    conn = connect_to_docs_loaded_db()
     try:
-        for _ in range(attempts):
-            if is_local_server_online('llama-cpp')['server_available']:
-                print("\n\nllama.cpp server launched succesfully! Returning.\n\n")
-                LLM_LOADED_UP = True
-                return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
-            time.sleep(timeout)
-    except Exception as e:
-        handle_error_no_return("Could not check server status after launch attempt, printing error and retrying: ", e)
+        for document_set_id in document_set_ids or []:
+            scoped_document_ids.update(row['document_id'] for row in conn.execute("SELECT document_id FROM document_set_members WHERE document_set_id = ?", (int(document_set_id),)).fetchall())
 
-    return handle_api_error("Failed to start llama.cpp local-server")
+        document_records = [dict(row) for row in conn.execute(f"SELECT document_name, source FROM document_records WHERE vectordb_used = ? AND id IN ({', '.join('?' for _ in scoped_document_ids)})", [vectordb_used] + list(scoped_document_ids)).fetchall()] if scoped_document_ids else []
+    finally:
+        conn.close()
 
+    return sorted(set(source for document_record in document_records for source in get_document_sources(document_record)))
 
-@app.route('/hf_waitress_server_starter')
-def hf_waitress_server_starter():
-    print("\n\nStarting HF-Waitress Server\n\n")
 
-    global LLM_CHANGE_RELOAD_TRIGGER_SET
-    global LLM_LOADED_UP
-    global HF_WAITRESS_PROCESS
-    global LLAMA_CPP_PROCESS
+# Chroma where-filter restricting a search to chunks of sources
+def build_source_filter(sources):
 
-    other_server_running = False
+    if sources is None:
+        return None
+    if len(sources) == 1:
+        return {'source': sources[0]}
 
-    # Before attempting to start the HF-Waitress server, check if llama.cpp is running and if so, shut it down:
+    return {'$or': [{'source': source} for source in sources]}
+
+#########################-------------------------------------###############################
+
+
+#########################------------VectorDB Compaction-------------###############################
+# Deleting chunks leaves free pages in Chroma's SQLite file, the lexical index & the content cache. Compaction VACUUMs these (and merges the FTS5
+# segments) once enough chunks have been deleted from a VectorDB, checked every vectordb_compaction_interval_hours, or on demand.
+# Chroma 0.4's HNSW segment offers no rebuild, its deleted entries are only reclaimed by a reset_vector_db_on_disk; the faiss_hnsw backend's are.
+VECTORDB_COMPACTION_STOP_EVENT = threading.Event()
+
+
+def record_deleted_chunks(vectordb_used, deleted_chunk_count):
+
+    conn = connect_to_docs_loaded_db()
     try:
-        if is_local_server_online('llama-cpp')['server_available']:
-            print("\n\nThe llama.cpp server is running. Attempting to shut it down before starting the HF-Waitress server.\n\n")
-            try:
-                if LLAMA_CPP_PROCESS is not None:
-                    terminate_local_llm_server_process(LLAMA_CPP_PROCESS)
-                    LLAMA_CPP_PROCESS = None
-                    LLM_LOADED_UP = False
-                else:
-                    raise Exception("LLAMA_CPP_PROCESS is None but server_available")
+        conn.execute("INSERT INTO vectordb_compaction (vectordb_used, deleted_chunks) VALUES (?, ?) ON CONFLICT(vectordb_used) DO UPDATE SET deleted_chunks = deleted_chunks + excluded.deleted_chunks", (vectordb_used, deleted_chunk_count))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def vacuum_sqlite_db(sqlite_db_path):
+    conn = sqlite3.connect(sqlite_db_path, timeout=30)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+# Method to compact a VectorDB | returns True if every step succeeded, only then is its deleted chunk count reset (so a failed compaction is retried)
+def compact_vectordb(vectordb_used):
+
+    print(f"\n\nCompacting VectorDB {vectordb_used}\n\n")
+    compaction_succeeded = True
+
+    # Writes are held off for the duration, VACUUM needs the databases to itself:
+    with VECTORDB_WRITE_LOCK:
+        # The ANN index reclaims its deleted entries by being rewritten:
+        if read_config(['vector_backend'])['vector_backend'] == 'faiss_hnsw':
+            try:
+                get_vector_store(vectordb_used).compact()
             except Exception as e:
-                LLM_LOADED_UP = True    # We know the llama.cpp server is running, which means `llama-server` is available, so we set LLM_LOADED_UP to True
-                other_server_running = True # Set to True as we've determined the other server is running and we failed to terminate it
-                handle_error_no_return("Warning: Failed to terminate running llama.cpp process before launching HF-Waitress. It was likely launched by a previous session or external process. Consider manually shutting down this server to conserve memory. Technical error-details follow: ", e)
+                compaction_succeeded = False
+                handle_error_no_return("Could not compact the ANN index, encountered error: ", e)
+
+        chroma_sqlite_db = os.path.join(vectordb_used, 'chroma.sqlite3')
+        if os.path.exists(chroma_sqlite_db):
+            try:
+                vacuum_sqlite_db(chroma_sqlite_db)
+            except Exception as e:
+                compaction_succeeded = False
+                handle_error_no_return("Could not VACUUM the VectorDB's SQLite database, encountered error: ", e)
+
+        try:
+            conn = connect_to_lexical_index_db()
+            try:
+                conn.execute("INSERT INTO lexical_chunks_fts(lexical_chunks_fts) VALUES('optimize')")
+                conn.commit()
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        except Exception as e:
+            compaction_succeeded = False
+            handle_error_no_return("Could not compact the lexical index, encountered error: ", e)
+
+        try:
+            vacuum_sqlite_db(read_config(['sqlite_content_cache_db'])['sqlite_content_cache_db'])
+        except Exception as e:
+            compaction_succeeded = False
+            handle_error_no_return("Could not VACUUM the content cache, encountered error: ", e)
+
+    if not compaction_succeeded:
+        return False
+
+    conn = connect_to_docs_loaded_db()
+    try:
+        conn.execute("INSERT INTO vectordb_compaction (vectordb_used, deleted_chunks, last_compacted_at) VALUES (?, 0, ?) ON CONFLICT(vectordb_used) DO UPDATE SET deleted_chunks = 0, last_compacted_at = excluded.last_compacted_at", (vectordb_used, datetime.datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+
+    return True
+
+
+# Thread entry-point for on-demand compaction, VACUUMing a large VectorDB can take far longer than a request should be held open for
+def compact_vectordb_in_background(vectordb_used):
+    try:
+        compact_vectordb(vectordb_used)
+    except Exception as e:
+        handle_error_no_return(f"Could not compact the VectorDB {vectordb_used}, encountered error: ", e)
+
+
+def compact_vectordbs_with_deletions(min_deleted_chunks):
+
+    conn = connect_to_docs_loaded_db()
+    try:
+        rows = conn.execute("SELECT vectordb_used FROM vectordb_compaction WHERE deleted_chunks >= ? AND deleted_chunks > 0", (min_deleted_chunks,)).fetchall()
+    finally:
+        conn.close()
+
+    for row in rows:
+        compact_vectordb(row['vectordb_used'])
+
+
+def vectordb_compaction_scheduler():
+
+    while True:
+        try:
+            read_return = read_config(['vectordb_compaction_interval_hours', 'vectordb_compaction_min_deleted_chunks'])
+            vectordb_compaction_interval_hours = float(read_return['vectordb_compaction_interval_hours'])
+            vectordb_compaction_min_deleted_chunks = int(read_return['vectordb_compaction_min_deleted_chunks'])
+        except Exception as e:
+            vectordb_compaction_interval_hours, vectordb_compaction_min_deleted_chunks = 24, 1000
+            handle_error_no_return("Could not read VectorDB compaction values from config.json, proceeding with defaults. Error: ", e)
+
+        if VECTORDB_COMPACTION_STOP_EVENT.wait(vectordb_compaction_interval_hours * 3600):
+            return
+
+        try:
+            compact_vectordbs_with_deletions(vectordb_compaction_min_deleted_chunks)
+        except Exception as e:
+            handle_error_no_return("Scheduled VectorDB compaction failed, will retry at the next interval. Encountered error: ", e)
+
+
+def start_vectordb_compaction_scheduler():
+    Thread(target=vectordb_compaction_scheduler, daemon=True).start()
+
+#########################-------------------------------------###############################
+
+
+# List-splitter function for a large number of embeddings!
+def split_embeddings_list(all_splits, max_emmbeddings_list_size):
+    for i in range(0, len(all_splits), max_emmbeddings_list_size):  # Step through the large list in steps of max size
+        yield all_splits[i:i + max_emmbeddings_list_size]   # Yield a slice of all_splits from index i upto but NOT including i+max_size 
+
+
+class Document:
+    __slots__ = ('page_content', 'metadata')    # no per-instance __dict__, chunks being created in bulk
+
+    def __init__(self, page_content, metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+    def __repr__(self): #to provide string-representation of an object
+        return f"Document(page_content='{self.page_content[:50]}...', metadata={self.metadata})"
+
+
+
+# Sentence ends within a line; line breaks are treated as boundaries too, as OCR output carries one visual line per line
+SENTENCE_BOUNDARY_REGEX = re.compile(r'(?<=[.!?])\s+')
+
+
+# Yields (page_number, text) for each page of an extracted text file, pages being delimited by [PAGE:n] lines
+def iter_pages_of_text_file(input_file):
+    current_page = 1
+    page_lines = []
+
+    with open(input_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.startswith('[PAGE:'):
+                new_page = int(line.strip()[6:-1])
+                if new_page != current_page:
+                    if page_lines:
+                        yield current_page, "".join(page_lines)
+                    page_lines = []
+                    current_page = new_page
+                continue
+            page_lines.append(line)
+
+    if page_lines:
+        yield current_page, "".join(page_lines)
+
+
+def split_into_sentences(page_text):
+    sentences = []
+    for line in page_text.splitlines():
+        sentences.extend(sentence for sentence in SENTENCE_BOUNDARY_REGEX.split(line.strip()) if sentence)
+    return sentences
+
+
+# Method to obtain a function counting tokens the way the embedding model will, and the model's maximum tokens per input (None if unknown)
+def get_chunk_token_counter(embedding_function):
+
+    sentence_transformer = getattr(embedding_function, 'client', None)
+    tokenizer = getattr(sentence_transformer, 'tokenizer', None)
+
+    if tokenizer is not None:
+        count_tokens = lambda texts: [len(input_ids) for input_ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+        max_seq_length = getattr(sentence_transformer, 'max_seq_length', None)
+        return count_tokens, (max_seq_length - 2 if max_seq_length else None)   # leaving room for the special tokens
+
+    return count_embedding_tokens, AZURE_EMBEDDING_MAX_TOKENS_PER_INPUT
+
+
+# Yields chunks of up to chunk_size tokens (as counted by count_tokens) packed from whole sentences, never spanning pages, with up to
+# chunk_overlap tokens of trailing sentences repeated at the start of the next chunk on the same page. Sentences longer than chunk_size
+# are packed word by word instead, so they too are windowed with chunk_overlap tokens of overlap. Text extracted via clean_text_string()
+# has no punctuation left, making each page a single such "sentence".
+def chunk_docs_with_page_numbers(input_file, chunk_size, chunk_overlap, count_tokens):
+
+    try:
+        for page_number, page_text in iter_pages_of_text_file(input_file):
+            sentences = split_into_sentences(page_text)
+            if not sentences:
+                continue
+
+            units = []  # (text, tokens)
+            for sentence, tokens in zip(sentences, count_tokens(sentences)):
+                if tokens <= chunk_size:
+                    units.append((sentence, tokens))
+                    continue
+                words = sentence.split()
+                units.extend(zip(words, count_tokens(words)))
+
+            current_units = []
+            current_tokens = 0
+            for text, tokens in units:
+                if current_units and current_tokens + tokens > chunk_size:
+                    yield Document(page_content=" ".join(unit_text for unit_text, _ in current_units), metadata={'source': input_file, 'page_number': page_number})
+
+                    # Carry trailing sentences over as overlap, unless that leaves no room for the next sentence:
+                    overlap_units = []
+                    overlap_tokens = 0
+                    for unit in reversed(current_units):
+                        if overlap_tokens + unit[1] > chunk_overlap:
+                            break
+                        overlap_units.insert(0, unit)
+                        overlap_tokens += unit[1]
+                    current_units, current_tokens = (overlap_units, overlap_tokens) if overlap_tokens + tokens <= chunk_size else ([], 0)
+
+                current_units.append((text, tokens))
+                current_tokens += tokens
+
+            if current_units:
+                yield Document(page_content=" ".join(unit_text for unit_text, _ in current_units), metadata={'source': input_file, 'page_number': page_number})
+
+    except Exception as e:
+        handle_local_error("Could not chunk document, encountered error: ", e)
+
+
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+#########################------------Azure OpenAI Embedding Client-------------###############################
+# Embeds chunks for the Azure OpenAI text-ada path directly against the deployment's REST endpoint (azure_openai_text_ada_api_url, so a
+# local stub endpoint works too). Requests are paced by token buckets for the deployment's tokens- & requests-per-minute quota using real
+# token counts, run concurrently, retried with backoff on 429s & 5xx, and each completed batch is journaled to SQLite so an interrupted
+# document resumes where it left off instead of re-embedding from scratch.
+AZURE_EMBEDDING_RATE_LIMITERS = {}  # deployment -> (tokens bucket, requests bucket), shared across documents as the quota is per deployment
+AZURE_EMBEDDING_RATE_LIMITERS_LOCK = threading.Lock()
+AZURE_EMBEDDING_MAX_TOKENS_PER_INPUT = 8191
+
+
+class TokenBucket:
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until amount tokens are available, amounts larger than the bucket are capped to its capacity
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait_seconds = (amount - self.tokens) / self.refill_per_second
+            time.sleep(wait_seconds)
+
+    # Empties the bucket for the given number of seconds (ex: when the service responds with a Retry-After)
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.refill_per_second
+            self.updated_at = time.monotonic()
+
+
+def get_azure_embedding_rate_limiters(deployment, tokens_per_minute, requests_per_minute):
+
+    with AZURE_EMBEDDING_RATE_LIMITERS_LOCK:
+        limiters = AZURE_EMBEDDING_RATE_LIMITERS.get(deployment)
+        if limiters is None or limiters[0].capacity != tokens_per_minute or limiters[1].capacity != requests_per_minute:
+            limiters = (TokenBucket(tokens_per_minute, tokens_per_minute / 60.0), TokenBucket(requests_per_minute, requests_per_minute / 60.0))
+            AZURE_EMBEDDING_RATE_LIMITERS[deployment] = limiters
+
+    return limiters
+
+
+def count_embedding_tokens(texts):
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")     # text-embedding-ada-002's encoding
+        return [len(encoding.encode(text)) for text in texts]
+    except Exception as e:
+        handle_error_no_return("Could not count tokens via tiktoken, estimating from character counts instead. Encountered error: ", e)
+        return [len(text) // 4 + 1 for text in texts]
+
+
+def connect_to_embedding_journal_db():
+
+    try:
+        read_return = read_config(['sqlite_embedding_journal_db'])
+        sqlite_embedding_journal_db = read_return['sqlite_embedding_journal_db']
+    except Exception as e:
+        handle_local_error("Missing sqlite_embedding_journal_db in config.json for method connect_to_embedding_journal_db. Error: ", e)
+
+    try:
+        conn = sqlite3.connect(sqlite_embedding_journal_db, timeout=30)
+        conn.row_factory = sqlite3.Row
+    except Exception as e:
+        handle_local_error("Could not establish connection to embedding journal DB, encountered error: ", e)
+
+    # If the database does not currently exist...
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_journal (
+                    journal_key TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (journal_key, chunk_index)
+            )
+        ''')
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not create embedding_journal table, encountered error: ", e)
+
+    return conn
+
+
+# A document's journal is keyed by its VectorDB, deployment and exact chunk texts, so a resume only re-uses vectors for identical chunking
+def compute_embedding_journal_key(vectordb_used, deployment, texts):
+    journal_hash = hashlib.sha256(f"{vectordb_used}|{deployment}".encode('utf-8'))
+    for text in texts:
+        journal_hash.update(b"\0" + text.encode('utf-8'))
+    return journal_hash.hexdigest()
+
+
+def forget_embedding_journal(journal_key):
+
+    conn = connect_to_embedding_journal_db()
+    try:
+        conn.execute("DELETE FROM embedding_journal WHERE journal_key = ?", (journal_key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def request_azure_openai_embeddings(texts, token_count, endpoint_url, api_key, limiters, max_retries):
+
+    tokens_bucket, requests_bucket = limiters
+
+    for attempt in range(max_retries + 1):
+        tokens_bucket.acquire(token_count)
+        requests_bucket.acquire(1)
+
+        response = requests.post(endpoint_url, headers={'api-key': api_key, 'Content-Type': 'application/json'}, json={'input': texts}, timeout=120)
+
+        if response.status_code == 429 or response.status_code >= 500:
+            if attempt == max_retries:
+                response.raise_for_status()
+            retry_after = response.headers.get('Retry-After')
+            backoff_seconds = float(retry_after) if retry_after else min(60, 2 ** attempt) + random.uniform(0, 1)
+            print(f"Azure OpenAI embeddings responded {response.status_code}, retrying in {backoff_seconds:.1f}s")
+            if response.status_code == 429:
+                tokens_bucket.pause(backoff_seconds)    # other in-flight workers should back off as well
+            time.sleep(backoff_seconds)
+            continue
+
+        response.raise_for_status()
+        return [item['embedding'] for item in sorted(response.json()['data'], key=lambda item: item['index'])]
+
+
+# Method to embed texts via Azure OpenAI text-ada | returns one vector per text, in order
+def embed_texts_via_azure_openai(texts, vectordb_used):
+
+    try:
+        read_return = read_config(['azure_openai_text_ada_api_url', 'azure_openai_text_ada_api_key', 'azure_openai_api_version', 'azure_openai_text_ada_deployment_name', 'azure_openai_embeddings_tokens_per_minute', 'azure_openai_embeddings_requests_per_minute', 'azure_openai_embeddings_max_concurrency', 'azure_openai_embeddings_batch_size', 'azure_openai_embeddings_max_retries'])
+        azure_openai_text_ada_api_url = read_return['azure_openai_text_ada_api_url']
+        azure_openai_text_ada_api_key = read_return['azure_openai_text_ada_api_key']
+        azure_openai_api_version = read_return['azure_openai_api_version']
+        azure_openai_text_ada_deployment_name = read_return['azure_openai_text_ada_deployment_name']
+        tokens_per_minute = int(read_return['azure_openai_embeddings_tokens_per_minute'])
+        requests_per_minute = int(read_return['azure_openai_embeddings_requests_per_minute'])
+        max_concurrency = max(1, int(read_return['azure_openai_embeddings_max_concurrency']))
+        batch_size = max(1, int(read_return['azure_openai_embeddings_batch_size']))
+        max_retries = int(read_return['azure_openai_embeddings_max_retries'])
+    except Exception as e:
+        handle_local_error("Missing values for Azure OpenAI Embeddings in config.json for method embed_texts_via_azure_openai. Error: ", e)
+
+    endpoint_url = f"{azure_openai_text_ada_api_url.rstrip('/')}/openai/deployments/{azure_openai_text_ada_deployment_name}/embeddings?api-version={azure_openai_api_version}"
+    limiters = get_azure_embedding_rate_limiters(azure_openai_text_ada_deployment_name, tokens_per_minute, requests_per_minute)
+    journal_key = compute_embedding_journal_key(vectordb_used, azure_openai_text_ada_deployment_name, texts)
+
+    vectors = {}
+    conn = connect_to_embedding_journal_db()
+    try:
+        for row in conn.execute("SELECT chunk_index, vector FROM embedding_journal WHERE journal_key = ?", (journal_key,)):
+            vectors[row['chunk_index']] = np.frombuffer(row['vector'], dtype=np.float32).tolist()
+        if vectors:
+            print(f"Resuming embedding: {len(vectors)} of {len(texts)} chunks already embedded")
+
+        # Batch the remaining chunks by input count, and by tokens so no batch exceeds what the bucket can ever grant
+        remaining_indexes = [idx for idx in range(len(texts)) if idx not in vectors]
+        token_counts = dict(zip(remaining_indexes, count_embedding_tokens([texts[idx] for idx in remaining_indexes])))
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        for idx in remaining_indexes:
+            if current_batch and (len(current_batch) >= batch_size or current_tokens + token_counts[idx] > tokens_per_minute):
+                batches.append((current_batch, current_tokens))
+                current_batch, current_tokens = [], 0
+            current_batch.append(idx)
+            current_tokens += min(token_counts[idx], AZURE_EMBEDDING_MAX_TOKENS_PER_INPUT)
+        if current_batch:
+            batches.append((current_batch, current_tokens))
+
+        # Journal each batch as it completes, from this thread, so the SQLite connection isn't shared across workers. After a failure, batches
+        # not yet started are cancelled but those already in flight are still journaled, so a retry resumes from every batch that completed
+        batch_error = None
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(request_azure_openai_embeddings, [texts[idx] for idx in batch], batch_tokens, endpoint_url, azure_openai_text_ada_api_key, limiters, max_retries): batch for batch, batch_tokens in batches}
+            for completed, future in enumerate(as_completed(futures), start=1):
+                if future.cancelled():
+                    continue
+                batch = futures[future]
+                try:
+                    batch_vectors = future.result()
+                except Exception as e:
+                    if batch_error is None:
+                        batch_error = e
+                        for pending_future in futures:
+                            pending_future.cancel()
+                    continue
+                conn.executemany("INSERT OR REPLACE INTO embedding_journal (journal_key, chunk_index, vector) VALUES (?, ?, ?)", [(journal_key, idx, np.asarray(vector, dtype=np.float32).tobytes()) for idx, vector in zip(batch, batch_vectors)])
+                conn.commit()
+                vectors.update(zip(batch, batch_vectors))
+                print(f"Embedded batch {completed} of {len(batches)}")
+
+        if batch_error is not None:
+            raise batch_error
+    finally:
+        conn.close()
+
+    return [vectors[idx] for idx in range(len(texts))], journal_key
+
+#########################-------------------------------------###############################
+
+
+# The Chroma client only reports max_batch_size in releases after the pinned 0.4.7, which takes default_max_batch_size instead
+def get_chroma_max_batch_size(vector_store, default_max_batch_size=5000):
+    if isinstance(vector_store, FaissHnswVectorStore):
+        return vector_store.max_batch_size
+    max_batch_size = getattr(getattr(vector_store, '_client', None), 'max_batch_size', None)
+    return int(max_batch_size) if max_batch_size else default_max_batch_size
+
+
+# Method to read chunk_size & chunk_overlap, capped for embedding_function | returns (chunk_sz, chunk_olp, count_tokens)
+# Chunks are sized in the embedding model's own tokens, and can't usefully exceed what it reads per input
+def get_chunking_for_embedding_function(embedding_function):
+
+    try:
+        read_return = read_config(['chunk_size', 'chunk_overlap'])
+        chunk_sz = int(read_return['chunk_size'])
+        chunk_olp = int(read_return['chunk_overlap'])
+    except Exception as e:
+        handle_local_error("Missing chunk_size or chunk_overlap in config.json, could not determine chunking. Error: ", e)
+
+    count_tokens, max_tokens_per_input = get_chunk_token_counter(embedding_function)
+    if max_tokens_per_input:
+        chunk_sz = min(chunk_sz, max_tokens_per_input)
+    chunk_olp = min(chunk_olp, chunk_sz // 2)
+
+    return chunk_sz, chunk_olp, count_tokens
+
+
+# Method to chunk input_file & add its chunks to vector_store (the VectorDB at persist_directory, embedding with embedding_model_choice), lazily &
+# in batches of Chroma's max batch size so only one batch is held in memory | returns the ids of the chunks stored
+def store_document_chunks(input_file, vector_store, persist_directory, embedding_model_choice, chunk_sz, chunk_olp, count_tokens):
+
+    max_batch_size = get_chroma_max_batch_size(vector_store)
+    all_chunk_ids = []
+
+    for numbered_splits in iter_batches(chunk_docs_with_page_numbers(input_file, chunk_sz, chunk_olp, count_tokens), max_batch_size):
+
+        # Explicit, stable ids so the stored chunks can be looked up via the content cache & document_records:
+        chunk_ids = [get_document_chunk_id(input_file, chunk_index) for chunk_index in range(len(all_chunk_ids), len(all_chunk_ids) + len(numbered_splits))]
+
+        # Store Chunks in VectorDB:
+        print(f"Storing {len(numbered_splits)} chunks to VectorDB: ChromaDB")
+        try:
+            if embedding_model_choice == 'openai_text_ada':
+                print("Using OpenAI Text Ada Model via Azure OpenAI")
+
+                embeddings, journal_key = embed_texts_via_azure_openai([doc.page_content for doc in numbered_splits], persist_directory)
+
+                # Vectors are already computed, so add them to the collection directly
+                vector_store._collection.add(ids=chunk_ids, embeddings=embeddings, documents=[doc.page_content for doc in numbered_splits], metadatas=[doc.metadata for doc in numbered_splits])
+
+                forget_embedding_journal(journal_key)
+
+            elif embedding_model_choice is not None:
+                vector_store.add_documents(numbered_splits, ids=chunk_ids)
+
+        except Exception as e:
+            handle_local_error("Could not store to VectorDB, encountered error: ", e)
+
+        all_chunk_ids.extend(chunk_ids)
+
+        # Add chunks to the lexical index & precompute reranker vectors:
+        try:
+            index_chunks_lexically(persist_directory, chunk_ids, numbered_splits)
+        except Exception as e:
+            handle_error_no_return("Could not add chunks to the lexical index, they will be added on next load of the VectorDB. Encountered error: ", e)
+
+        # Only once both indexes hold the chunks, or a query in between would cache results missing their lexical hits under the new version
+        bump_corpus_version(persist_directory)
+
+        try:
+            precompute_rerank_vectors(numbered_splits)
+        except Exception as e:
+            handle_error_no_return("Could not precompute reranker vectors, they will be computed at query time instead. Encountered error: ", e)
+
+    return all_chunk_ids
+
+
+# Document vectorization and chunking
+# content_hash & extractor identify the extracted text in the content cache: when supplied, chunks already embedded for the same content, chunking
+# and embedding model are re-used instead of being embedded again, and stale chunks of a replaced file are removed from the VectorDB
+def LoadNewDocument(input_file, content_hash=None, extractor=None):
+
+    ### L1 - Load Data from Source ###
+    print("\nLoading Document")
+
+    try:
+        read_return = read_config(['embedding_model_choice'])
+        embedding_model_choice = read_return['embedding_model_choice']
+    except Exception as e:
+        handle_local_error("Missing values in config.json, could not LoadNewDocument. Error: ", e)
+
+    # Determine the embedding function & VectorDB folder in use:
+    embedding_model_choice_in_use = get_embedding_model_choice_in_use()
+    persist_directory = get_vectordb_folder_in_use()
+    embedding_function = get_embedding_function()   # shared, warm instance from the Embedding Model Registry
+
+    chunk_sz, chunk_olp, count_tokens = get_chunking_for_embedding_function(embedding_function)
+
+    use_content_cache = content_hash is not None and extractor is not None
+
+    ### L2 - Check the content cache for chunks already embedded for this content ###
+    if use_content_cache:
+        try:
+            vector_store = get_vector_store(persist_directory)
+
+            # A replaced file (same source, different content) would otherwise leave its old chunks behind in the VectorDB:
+            stale_embeddings = find_stale_embeddings_for_source(content_hash, input_file, persist_directory)
+            if stale_embeddings:
+                print("Removing chunks of the previous version of this document from the VectorDB")
+                for _, stale_chunk_ids in stale_embeddings:
+                    delete_chunks_from_vectordb(vector_store, persist_directory, stale_chunk_ids)
+                forget_cached_embeddings([row_id for row_id, _ in stale_embeddings])
+
+            for cached_source, cached_chunk_ids in find_cached_embeddings(content_hash, extractor, chunk_sz, chunk_olp, embedding_model_choice, persist_directory):
+                stored_chunks = vector_store._collection.get(ids=cached_chunk_ids, include=['embeddings', 'documents', 'metadatas'])
+                if len(stored_chunks['ids']) != len(cached_chunk_ids):
+                    continue    # chunks no longer in the VectorDB (ex: it was reset), try another or fall through to embedding
+
+                if cached_source == input_file:
+                    print("Document content already embedded in the VectorDB, skipping embedding")
+                    index_chunks_lexically(persist_directory, cached_chunk_ids, [Document(page_content=content, metadata=metadata) for content, metadata in zip(stored_chunks['documents'], stored_chunks['metadatas'])])
+                    return chunk_sz, chunk_olp, cached_chunk_ids
+
+                # Renamed or duplicate upload: store the existing vectors against this source rather than re-embedding
+                print(f"Re-using {len(cached_chunk_ids)} stored chunk vectors from {os.path.basename(cached_source)}")
+                delete_source_chunks_from_vectordb(vector_store, persist_directory, input_file)
+                chunk_ids = [get_document_chunk_id(input_file, chunk_index) for chunk_index in range(len(cached_chunk_ids))]
+                metadatas = [dict(metadata, source=input_file) for metadata in stored_chunks['metadatas']]
+                vector_store._collection.add(ids=chunk_ids, embeddings=stored_chunks['embeddings'], documents=stored_chunks['documents'], metadatas=metadatas)
+                index_chunks_lexically(persist_directory, chunk_ids, [Document(page_content=content, metadata=metadata) for content, metadata in zip(stored_chunks['documents'], metadatas)])
+                bump_corpus_version(persist_directory)
+                record_cached_embeddings(content_hash, extractor, chunk_sz, chunk_olp, embedding_model_choice, persist_directory, input_file, chunk_ids)
+                return chunk_sz, chunk_olp, chunk_ids
+        except Exception as e:
+            handle_error_no_return("Could not re-use cached embeddings, proceeding to embed the document. Encountered error: ", e)
+
+    # Batches are added incrementally to the already-open collection:
+    try:
+        vector_store = get_vector_store(persist_directory)
+    except Exception as e:
+        handle_local_error("Could not open VectorDB to store to, encountered error: ", e)
+
+    # Chunk ids are stable per source, so any chunks of a previous ingestion of this source must go first:
+    try:
+        delete_source_chunks_from_vectordb(vector_store, persist_directory, input_file)
+    except Exception as e:
+        handle_local_error("Could not remove previously stored chunks of this document from the VectorDB, encountered error: ", e)
+
+    ### L3 - Chunk Source Data & store the chunks to the VectorDB, in batches ###
+    print(f"Chunking Doc into chunks of up to {chunk_sz} tokens, overlapping by up to {chunk_olp}")
+    all_chunk_ids = store_document_chunks(input_file, vector_store, persist_directory, embedding_model_choice_in_use, chunk_sz, chunk_olp, count_tokens)
+
+    if use_content_cache:
+        try:
+            record_cached_embeddings(content_hash, extractor, chunk_sz, chunk_olp, embedding_model_choice, persist_directory, input_file, all_chunk_ids)
+        except Exception as e:
+            handle_error_no_return("Could not record stored chunks to the content cache, encountered error: ", e)
+
+    return chunk_sz, chunk_olp, all_chunk_ids
+
+
+def find_images_in_db(reference_pages):
+
+    print("\nSearching for relevant Images\n")
+
+    try:
+        read_return = read_config(['sqlite_images_db'])
+        sqlite_images_db = read_return['sqlite_images_db']
+    except Exception as e:
+        handle_local_error("Missing sqlite_images_db in config.json for method find_images_in_db. Error: ", e)
+
+    matched_images = []
+    matched_images_found = False
+
+    try:
+        conn = sqlite3.connect(sqlite_images_db)
+        conn.row_factory = sqlite3.Row
+        print("Database connected for image search")
+    except Exception as e:
+        handle_local_error("Could not connect to images DB for image search, encountered error: ", e)
+
+    for file_path, content in reference_pages.items():
+
+        for item in content:
+            # Each item in the list has two elements
+            page_text, page_number = item
+
+            # Only search for non-empty search strings
+            if page_text:
+                try:
+                    images = conn.execute('SELECT DISTINCT id, image_data FROM images WHERE surrounding_text LIKE ?', ('%' + page_text[:50] + '%',)).fetchall()
+                except Exception as e:
+                    handle_error_no_return("Could not select images from Images DB, encountered error: ", e)
+                for row in images:
+                    print("Matching image found!")
+                    matched_images_found = True
+                    image_id = row['id']
+                    image_data = row['image_data']
+                    matched_images.append((image_id, image_data))
+        
+    conn.close()
+    matched_images = set(matched_images)
+    return matched_images_found, matched_images
+
+
+def highlight_text_on_page(highlight_list, stream_session_id):
+
+    print("\nHighlighting Document\n")
+    threshold = 80
+
+    try:
+        read_return = read_config(['upload_folder', 'highlighted_docs'])
+        upload_folder = read_return['upload_folder']
+        highlighted_pdfs_path = read_return['highlighted_docs']
+    except Exception as e:
+        handle_local_error("Missing upload_folder in config.json for method highlight_text_on_page. Error: ", e)
+    
+    for index, doc in enumerate(highlight_list, start=1):
+
+        try:
+            pdf_path = os.path.join(upload_folder, doc).replace("\\","/")
+            output_file_extension = "_" + stream_session_id + '.pdf'
+            output_file_name = doc.replace(".pdf",output_file_extension) 
+            output_pdf_path = os.path.join(highlighted_pdfs_path, output_file_name).replace("\\","/")
+            highlight_doc = fitz.open(pdf_path)
+        except Exception as e:
+            handle_error_no_return("Could not open doc for highlighting, encountered error: ", e)
+            continue
+        
+        for target in highlight_list[doc]:
+            try:
+                text_to_highlight = str(target[1])
+                text_to_highlight = re.sub(r'Row \d+, Column \d+: ', '', text_to_highlight)
+                page_number = int(target[0])
+                page = highlight_doc.load_page(page_number-1)
+                page_text = page.get_text("text")
+
+                # Split the page text into overlapping phrases
+                words = page_text.split()
+                phrases = [' '.join(words[i:i+len(text_to_highlight.split())]) for i in range(len(words))]
+
+                # Find fuzzy matches
+                good_matches = []
+                for phrase in phrases:
+                    score = fuzz.partial_ratio(text_to_highlight.lower(), phrase.lower())
+                    if score >= threshold:
+                        good_matches.append(phrase)
+
+                for match in good_matches:
+                    if len(str(match)) > 3:
+                        text_instances = page.search_for(match)
+                        for inst in text_instances:
+                            try:
+                                #print(f"HIGHLIGHTING inst {inst} in document {doc}")
+                                page.add_highlight_annot(inst)
+                            except Exception as e:
+                                handle_error_no_return("Could not highlight text instance, encountered error: ", e)
+                                continue
+
+            except Exception as e:
+                handle_error_no_return("Error loading page or searching for text to highlight, encountered error: ", e)
+                continue
+            
+        try:
+            highlight_doc.save(output_pdf_path, garbage=0, deflate=False, clean=False)
+        except Exception as e:
+            handle_error_no_return("Could not save highlighted doc, encountered error: ", e)
+            continue
+
+    return True
+
+
+def highlighter_interface(reference_pages, stream_session_id):
+
+    user_should_refer_pages_in_doc = {}
+    highlight_list = {}
+    docs_have_relevant_info = False
+
+    print(f"\n\nreference_pages: {reference_pages}\n\n")
+
+    for file_path, content in reference_pages.items():
+        source_filename = os.path.basename(file_path)
+        print(f"\nsource_filename basename: {source_filename}\n")
+        output_file_extension = "_" + stream_session_id + '.pdf'
+        output_file_name = source_filename.replace(".pdf",output_file_extension) 
+        page_numbers = set()
+        highlight_strings = set()
+
+        for item in content:
+            # Each item in the list has two elements
+            page_text, page_number = item
+            page_numbers.add(int(page_number))
+            highlight_strings.add((int(page_number), str(page_text[:50])))
+
+        if page_numbers:
+            user_should_refer_pages_in_doc[output_file_name] = page_numbers
+            docs_have_relevant_info = True
+
+        if highlight_strings:
+            highlight_list[source_filename] = list(highlight_strings)
+
+    if docs_have_relevant_info:
+        try:
+            highlight_text_on_page(highlight_list, str(stream_session_id))
+        except Exception as e:
+            handle_error_no_return("Could not highlight text, encountered error: ", e)
+
+    return docs_have_relevant_info, user_should_refer_pages_in_doc
+
+
+def determine_sequence_id_for_chat(chat_id):
+
+    try:
+        read_return = read_config(['sqlite_history_db'])
+        sqlite_history_db = read_return['sqlite_history_db']
+    except Exception as e:
+        handle_local_error("Missing keys in config.json for method store_chat_history_to_db. Error: ", e)
+
+    # Connect to or create the DB
+    try:
+        conn = sqlite3.connect(sqlite_history_db)
+        cursor = conn.cursor()
+    except Exception as e:
+        handle_local_error("Could not establish connection to DB for chat history storage, encountered error: ", e)
+
+    try:
+        # Determine sequence_id
+        cursor.execute("SELECT COALESCE(MAX(sequence_id), 0) FROM chat_history WHERE chat_id = ?", (int(chat_id),))
+        # "The COALESCE function accepts two or more arguments and returns the first non-null argument."
+        # This accounts for a new chat!
+        # Note that trailing comma! Without it, the simple select query will produce an error: "parameters are of unsupported type" !!
+        # This is because the SQLite3 module can have trouble recognizing single-item tuples as tuples, so a trailing comma helps alleviate this! 
+
+        result = cursor.fetchone()
+        current_sequence_id = result[0]     # 'result' will be a list, so extract the first value
+        
+    except Exception as e:
+        handle_local_error("Could not determine sequence ID for storage to chat history DB, encountered error: ", e)
+
+    return int(current_sequence_id)
+
+
+def store_llama_cpp_chat_history_to_db(chat_id, sequence_id, user_query_for_history_db, model_response_for_history_db, current_prompt_template):
+
+    global SEQUENCE_ID
+
+    print(f"\n\nStoring chat history for chat with CHAT_ID: {chat_id}")
+
+    try:
+        read_return = read_config(['sqlite_history_db', 'model_choice', 'base_template'])
+        sqlite_history_db = read_return['sqlite_history_db']
+        model_choice = read_return['model_choice']
+    except Exception as e:
+        handle_local_error("Missing keys in config.json for method store_chat_history_to_db. Error: ", e)
+
+    # Connect to or create the DB
+    try:
+        conn = sqlite3.connect(sqlite_history_db)
+        cursor = conn.cursor()
+    except Exception as e:
+        handle_local_error("Could not establish connection to DB for chat history storage, encountered error: ", e)
+
+    try:
+        prev_sequence_id = determine_sequence_id_for_chat(chat_id)
+        #print("prev_sequence_id: ", prev_sequence_id)
+        SEQUENCE_ID = prev_sequence_id + 1
+        #print("current_sequence_id: ", SEQUENCE_ID)
+    except Exception as e:
+        handle_local_error("Could not determine sequence ID for storage to chat history DB, encountered error: ", e)
+       
+    # print(type(CHAT_ID))
+    # print(type(current_sequence_id))
+    # print(type(user_query_for_history_db))
+    # print(type(model_response_for_history_db))
+
+    try:
+        # Store conversation history into DB
+        cursor.execute("INSERT INTO chat_history (chat_id, sequence_id, user_query, llm_response, llm_model, prompt_template) VALUES (?, ?, ?, ?, ?, ?)", (int(chat_id), int(sequence_id), user_query_for_history_db, model_response_for_history_db, model_choice, str(current_prompt_template)))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not insert chat history into DB, encountered error: ", e)
+
+
+
+def store_chat_history_to_db(user_query_for_history_db, model_response_for_history_db, current_historical_summary):
+
+    global SEQUENCE_ID
+
+    print(f"\n\nStoring chat history for chat with CHAT_ID: {CHAT_ID}")
+
+    try:
+        read_return = read_config(['sqlite_history_db', 'model_choice', 'base_template'])
+        sqlite_history_db = read_return['sqlite_history_db']
+        model_choice = read_return['model_choice']
+        base_template = read_return['base_template']
+    except Exception as e:
+        handle_local_error("Missing keys in config.json for method store_chat_history_to_db. Error: ", e)
+
+    # Connect to or create the DB
+    try:
+        conn = sqlite3.connect(sqlite_history_db)
+        cursor = conn.cursor()
+    except Exception as e:
+        handle_local_error("Could not establish connection to DB for chat history storage, encountered error: ", e)
+
+    try:
+        prev_sequence_id = determine_sequence_id_for_chat(CHAT_ID)
+        #print("prev_sequence_id: ", prev_sequence_id)
+        SEQUENCE_ID = prev_sequence_id + 1
+        #print("current_sequence_id: ", SEQUENCE_ID)
+    except Exception as e:
+        handle_local_error("Could not determine sequence ID for storage to chat history DB, encountered error: ", e)
+       
+    # print(type(CHAT_ID))
+    # print(type(current_sequence_id))
+    # print(type(user_query_for_history_db))
+    # print(type(model_response_for_history_db))
+
+    try:
+        # Store conversation history into DB
+        cursor.execute("INSERT INTO chat_history (chat_id, sequence_id, user_query, llm_response, llm_model, prompt_template, history_summary) VALUES (?, ?, ?, ?, ?, ?, ?)", (int(CHAT_ID), int(SEQUENCE_ID), user_query_for_history_db, model_response_for_history_db, model_choice, str(base_template), str(current_historical_summary)))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not insert chat history into DB, encountered error: ", e)
+
+    conn.close()
+
+
+@app.route('/login_to_google_drive')
+def login_to_google_drive():
+    global GDRIVE_CREDS
+    if os.path.exists("gdrive_token.json"):
+        GDRIVE_CREDS = Credentials.from_authorized_user_file("gdrive_token.json", GDRIVE_SCOPES)
+    if not GDRIVE_CREDS or not GDRIVE_CREDS.valid:
+        if GDRIVE_CREDS and GDRIVE_CREDS.expired and GDRIVE_CREDS.refresh_token:
+            GDRIVE_CREDS.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                "gdrive_credentials.json", GDRIVE_SCOPES
+            )
+            GDRIVE_CREDS = flow.run_local_server(port=0)
+            with open("gdrive_token.json", "w") as token:
+                token.write(GDRIVE_CREDS.to_json())
+    return jsonify(success=True)
+
+
+def categorize_mimetype(mimetype):
+    mimetype = mimetype.lower()
+
+    word_mimetypes = {
+        # Microsoft Word (modern formats)
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.ms-word.document.macroEnabled.12",
+        "application/vnd.ms-word.template.macroEnabled.12",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.template",
+
+        # Microsoft Word (legacy format)
+        "application/msword",
+
+        # Google Docs
+        "application/vnd.google-apps.document",
+
+        # OpenDocument Presentation
+        "application/vnd.oasis.opendocument.text",
+        "application/vnd.oasis.opendocument.text-template",
+        "application/vnd.oasis.opendocument.text-web"
+    }
+
+    excel_mimetypes = {
+        # Microsoft Excel (modern formats)
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "application/vnd.ms-excel.sheet.macroEnabled.12",
+        "application/vnd.ms-excel.template.macroEnabled.12",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.template",
+
+        # Microsoft Excel (legacy format)
+        "application/vnd.ms-excel",
+
+        # Google Sheets
+        "application/vnd.google-apps.spreadsheet",
+
+        # OpenDocument Presentation
+        "application/vnd.oasis.opendocument.spreadsheet",
+        "application/vnd.oasis.opendocument.spreadsheet-template",
+        "text/csv",
+        "text/tab-separated-values"
+    }
+
+    presentation_mimetypes = {
+        # Microsoft PowerPoint (modern formats)
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",  # .pptx
+        "application/vnd.ms-powerpoint.presentation.macroEnabled.12",  # .pptm
+        "application/vnd.openxmlformats-officedocument.presentationml.template",  # .potx
+        "application/vnd.ms-powerpoint.template.macroEnabled.12",  # .potm
+        "application/vnd.openxmlformats-officedocument.presentationml.slideshow",  # .ppsx
+        "application/vnd.ms-powerpoint.slideshow.macroEnabled.12",  # .ppsm
+
+        # Microsoft PowerPoint (legacy format)
+        "application/vnd.ms-powerpoint",  # .ppt, .pot, .pps
+
+        # Google Slides
+        "application/vnd.google-apps.presentation",
+
+        # OpenDocument Presentation
+        "application/vnd.oasis.opendocument.presentation",  # .odp
+        "application/vnd.oasis.opendocument.presentation-template"  # .otp
+    }
+
+    pdf_mimetypes = {
+        "application/pdf",
+        "application/x-pdf",
+        "application/acrobat",
+        "application/vnd.pdf",
+        "text/pdf",
+        "text/x-pdf"
+    }
+
+    text_mimetypes = {
+        "application/rtf",
+        "text/rtf",
+        "text/plain"
+    }
+
+    image_mimetypes = {
+        "image/jpeg",
+        "image/png",
+        "image/gif",
+        "image/bmp",
+        "image/webp",
+        "image/svg+xml",
+        "image/tiff",
+        "image/x-icon",
+        "image/vnd.microsoft.icon",
+        "image/heic",
+        "image/heif"
+    }
+
+    video_mimetypes = {
+        "video/mp4",
+        "video/mpeg",
+        "video/x-msvideo",
+        "video/quicktime",
+        "video/x-ms-wmv",
+        "video/x-flv",
+        "video/webm",
+        "video/3gpp",
+        "video/3gpp2",
+        "video/x-matroska"
+    }
+
+    audio_mimetypes = {
+        "audio/mpeg",
+        "audio/x-wav",
+        "audio/wav",
+        "audio/x-m4a",
+        "audio/aac",
+        "audio/ogg",
+        "audio/webm",
+        "audio/flac",
+        "audio/x-ms-wma",
+        "audio/x-aiff"
+    }
+
+    folder_mimetypes = {
+        "application/vnd.google-apps.folder",  # Google Drive folder
+        "application/x-directory",             # Generic directory mime type
+        "inode/directory",                     # Often used in Unix-like systems
+        "folder",                              # Some systems might use this
+    }
+
+    # Word file
+    if mimetype in word_mimetypes:
+        return "word"
+    # Excel files
+    elif mimetype in excel_mimetypes:
+        return "excel"
+    # Presentation files
+    elif mimetype in presentation_mimetypes:
+        return "presentation"
+    # Text files
+    elif mimetype in text_mimetypes:
+        return "text"
+    # PDFs
+    elif mimetype in pdf_mimetypes:
+        return "pdf"
+    # Images
+    elif mimetype in image_mimetypes:
+        return "image"
+    # Videos
+    elif mimetype in video_mimetypes:
+        return "video"
+    # Audio files
+    elif mimetype in audio_mimetypes:
+        return "audio"
+    # Folders
+    elif mimetype in folder_mimetypes:
+        return "folder"
+    # Other
+    else:
+        return "other"
+
+@app.route('/fetch_file_list_from_google_drive')
+def fetch_file_list_from_google_drive():
+    gdrive_files = []
+    try:
+        service = build("drive", "v3", credentials=GDRIVE_CREDS)
+
+        about_result = service.about().get(fields="storageQuota,user").execute()
+        print(f"about_result: {about_result}")
+
+        results = (
+            service.files().list(
+                q="trashed=false",
+                pageSize=1000,
+                fields="nextPageToken, files(id, name, mimeType, version)"
+            ).execute()
+        )
+        
+        items = results.get("files", [])
+        print(f"len(items): {len(items)}")
+
+        if not items:
+            print("No files found.")
+            return jsonify(success=True, gdrive_files=gdrive_files)
+        else:
+            # print("\n\nFiles:\n\n")
+            # print("Name       ID      mimeType        fileExtension       Category      version")
+            for item in items:
+                category = categorize_mimetype(item['mimeType'])
+                #print(f"{item['name']}      ({item['id']})      {item['mimeType']}      {category}        {item['version']}")
+                gdrive_files.append({
+                    'name': item['name'],
+                    'id': item['id'],
+                    'mimeType': item['mimeType'],
+                    'version': item['version'],
+                    'type': category
+                })
+
+    except Exception as e:
+        return handle_api_error("Could not fetch GDrive files, encountered error: ", e)
+    
+    return jsonify({'success': True, 'gdrive_files': gdrive_files})
+
+
+def download_folder(service, folder_id, path, indent='', batch_id=None):
+
+    print(f"\n\nDownloading GoogleDrive Folder with id: {folder_id}\n\n")
+
+    try:
+        if not os.path.exists(path):
+            os.makedirs(path)
+    except Exception as e:
+        return handle_api_error("Server-side error - could not create nested directory in the download_folder() method: ", e)
+
+    query = f"'{folder_id}' in parents"
+    fields = "files(id, name, mimeType)"
+    
+    gdrive_folder_contents = service.files().list(q=query, fields=fields).execute()
+    items = gdrive_folder_contents.get('files', [])
+
+    for item in items:
+        file_id = item['id']
+        filename = item['name']
+        mime_type = item['mimeType']
+        print(f"folder item mime_type f{mime_type}")
+
+        if "folder" in str(mime_type):
+            sub_folder_path = os.path.join(path, filename)    # in this case, filename will be the folder name
+
+            try:
+                download_folder(service, file_id, sub_folder_path, batch_id=batch_id)  # in this case, file_or_folder_id will be the folder id
+            except Exception as e:
+                return handle_api_error("Could not download_folder in the download_folder() method, encountered error: ", e)
+        else:
+            try:
+                filename_with_extension, file_content = download_gdrive_file(service, file_id, filename, mime_type)
+            except Exception as e:
+                return handle_api_error("Server-side error - could not get_file_content in the download_folder() method: ", e)
+
+            try:
+                # filepath = os.path.join(path, secure_filename(filename_with_extension))
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename_with_extension))
+                print(f"Saving {filename_with_extension} to {filepath}")
+                with open(filepath, 'wb') as f:
+                    f.write(file_content)
+
+                try:
+                    submit_ingestion_job(filename_with_extension, filepath, batch_id)
+                except Exception as e:
+                    return handle_api_error("Could not queue ingestion job in the download_folder() method, encountered error: ", e)
+
+            except Exception as e:
+                return handle_api_error("Server-side error - could not save Google Drive file in the download_folder() method: ", e)
+
+    return True
+
+
+def download_gdrive_file(service, file_id, filename, mime_type):
+
+    print(f"\n\nDownloading GoogleDrive File with mime_type: {mime_type}\n\n")
+
+    file_mime_category = categorize_mimetype(mime_type)
+
+    filename_with_extension = filename
+
+    try:
+        if file_mime_category in ["word", "excel", "presentation"]:
+            # Handle Google Docs Editors files
+            if 'google-apps' in mime_type:
+                if file_mime_category == "word":
+                    export_mime_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+                    file_extension = '.docx'
+                elif file_mime_category == "excel":
+                    export_mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                    file_extension = '.xlsx'
+                elif file_mime_category == "presentation":
+                    export_mime_type = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+                    file_extension = '.pptx'
+                
+                print(f"Downloading google-apps file with mimeType {file_mime_category}")
+                gdrive_request = service.files().export_media(fileId=file_id, mimeType=export_mime_type)
+                if not filename.endswith(file_extension):
+                    filename_with_extension += file_extension
+            
+            else:
+                # For non-Google formats, use get_media
+                print(f"Downloading office file with non google-apps mimeType {file_mime_category}")
+                gdrive_request = service.files().get_media(fileId=file_id)
+        else:
+            print(f"Downloading non-office file with mimeType {file_mime_category}")
+            gdrive_request = service.files().get_media(fileId=file_id)
+        
+        file = io.BytesIO()
+        downloader = MediaIoBaseDownload(file, gdrive_request)
+        
+        done = False
+        while done is False:
+            status, done = downloader.next_chunk()
+            print(f"Download {int(status.progress() * 100)}%.")
+    
+    except Exception as e:
+        return handle_api_error("Error downloading file from Google Drive in the download_gdrive_file() method: ", e)
+    
+    try:
+        file_content = file.getvalue()
+    except Exception as e:
+        return handle_api_error("Server-side error - could not getValue() for downloaded Google Drive file  in the download_gdrive_file() method: ", e)
+
+    return filename_with_extension, file_content
+
+
+def gdrive_downloader(service, file_or_folder_id, filename, mime_type, path=app.config['UPLOAD_FOLDER'], batch_id=None):
+    file_mime_category = categorize_mimetype(mime_type)
+
+    if file_mime_category == "folder":
+        download_path = os.path.join(path, secure_filename(filename))    # in this case, filename will be the folder name
+        download_folder(service, file_or_folder_id, download_path, batch_id=batch_id)
+        return filename, None    # Return None for file_content as it's a folder
+    else:
+        filename_with_extension, file_content = download_gdrive_file(service, file_or_folder_id, filename, mime_type)
+        return filename_with_extension, file_content
+
+
+@app.route('/google_drive_loader', methods=['POST'])
+def google_drive_loader():
+
+    try:
+        gdrive_file_id = str(request.form['file_id'])
+        gdrive_file_mimeType = str(request.form['file_mimeType'])
+    except Exception as e:
+        return handle_api_error("Server-side error reading Google Drive file details for download in the google_drive_loader() method: ", e)
+    
+    try:
+        service = build("drive", "v3", credentials=GDRIVE_CREDS)
+    except Exception as e:
+        return handle_api_error("Could not create Google service handler in the google_drive_loader() method, check credentials and re-try: ", e)
+
+    try:
+        file_metadata = service.files().get(fileId=gdrive_file_id, fields='name, mimeType').execute()
+        original_filename = file_metadata.get('name', 'untitled')
+        mime_type = file_metadata.get('mimeType', gdrive_file_mimeType)
+    except Exception as e:
+        return handle_api_error("Could not read GoogleDrive file metadata in the google_drive_loader() method, encountered error: ", e)
+    
+    batch_id = str(uuid.uuid4())    # all files of a Google Drive folder are queued under one batch
+
+    try:
+        filename_with_extension, file_content = gdrive_downloader(service, gdrive_file_id, original_filename, mime_type, batch_id=batch_id)
+    except Exception as e:
+        return handle_api_error("Server-side error - could not getValue() for downloaded Google Drive file in the google_drive_loader() method: ", e)
+
+    if file_content is not None:
+        try:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename_with_extension))
+
+            print(f"Saving {filename_with_extension} to {filepath}")
+            with open(filepath, 'wb') as f:
+                f.write(file_content)
+
+            try:
+                submit_ingestion_job(filename_with_extension, filepath, batch_id)
+            except Exception as e:
+                return handle_api_error("Could not queue ingestion job in the google_drive_loader() method, encountered error: ", e)
+
+        except Exception as e:
+            return handle_api_error("Server-side error - could not save file downloaded from Google Drive in the google_drive_loader() method: ", e)
+    
+    return jsonify({'success': True, 'batch_id': batch_id})
+
+
+# Route for loading all models from model dir
+@app.route('/load_local_models')
+def load_local_models():
+
+    try:
+        read_return = read_config(['model_dir'])
+        model_dir = read_return['model_dir']
+    except Exception as e:
+        return handle_api_error("Missing model_dir in config.json for method load_local_models. Error: ", e)
+    
+    try:
+        models = [f for f in os.listdir(model_dir) if os.path.isfile(os.path.join(model_dir, f))]
+    except Exception as e:
+        return handle_api_error("Could not load list of local models, encountered error: ", e)
+        
+    #print(f"locally available models: {models}")
+    return jsonify({'success': True, 'models': models})
+
+
+@app.route('/upload_new_llm', methods=['POST'])
+def upload_new_llm():
+
+    try:
+        read_return = read_config(['model_dir'])
+        model_dir = read_return['model_dir']
+    except Exception as e:
+        return handle_api_error("Could not determine model_dir in upload_new_llm. Error: ", e)
+
+    try:
+        input_file = request.files['file']
+    except Exception as e:
+        return handle_api_error("Server-side error recieving LLM file: ", e)
+
+    # Ensure the filename is secure
+    filename = secure_filename(input_file.filename)
+
+    try:
+        filepath = os.path.join(model_dir, filename)
+
+        print("Loading new LLM - filename: ", filename)
+        print("Loading new LLM - filepath: ", filepath)
+
+        # Save the uploaded file to the specified path
+        input_file.save(filepath)
+    except Exception as e:
+        return handle_api_error("Failed to save LLM to model_dir, encountered error: ", e)
+
+    return jsonify(success=True)
+
+
+# Route to handle the submission of the first form (LLM & embeddings model and GPU selection)
+@app.route('/process_model', methods=['POST'])
+def process_model():
+    
+    ###---New config.json---###
+
+    config_update_dict = {}
+
+    use_azure_open_ai = 'use_azure' in request.form
+    use_openai_embeddings = 'use_openai_embeddings' in request.form
+    use_sbert_embeddings = 'use_sbert_embeddings' in request.form
+    use_bge_large_embeddings = 'use_bge_large_embeddings' in request.form
+    use_bge_base_embeddings = 'use_bge_base_embeddings' in request.form
+    use_gpu_for_embeddings = request.form.get('use_gpu_for_embeds', False)    # default no
+    model_choice = str(request.form['model_choice'])
+    use_gpu = request.form.get('use_gpu', False)
+
+    config_update_dict.update({'use_azure_open_ai':use_azure_open_ai, 'use_openai_embeddings':use_openai_embeddings, 'use_sbert_embeddings':use_sbert_embeddings, 'use_bge_large_embeddings':use_bge_large_embeddings, 'use_bge_base_embeddings':use_bge_base_embeddings, 'use_gpu_for_embeddings':use_gpu_for_embeddings, 'model_choice':model_choice, 'use_gpu':use_gpu})
+
+    try:
+        write_config(config_update_dict)
+    except Exception as e:
+        handle_local_error("Could not write updates to config.json, encountered error: ", e)
+
+    # Warm up the newly selected embedding model (any other is unloaded via the config change subscriber):
+    try:
+        if use_bge_base_embeddings or use_bge_large_embeddings:
+            get_embedding_function()
+    except Exception as e:
+        return handle_api_error("Could not load BGE embeddings in process_model, encountered error: ", e)
+
+    # Redirect to the next step
+    return redirect(url_for('load_file'))
+
+
+#########################------------Office Conversion Pool-------------###############################
+# Every plain `unoconv` call cold-starts a LibreOffice instance, which dominates conversion time. Instead, we keep a pool of long-lived
+# `unoconv --listener` processes, each on its own port & user-profile (LibreOffice instances cannot share a profile), and point `unoconv --no-launch`
+# at a free listener for each conversion. Listeners are health-checked before use, recycled after office_pool_max_conversions_per_listener
+# conversions, and restarted if a conversion exceeds office_conversion_timeout_seconds as the office instance is likely hung.
+def get_unoconv_base_command():
+    if platform.system() == 'Windows':
+        return ['python', 'unoconv.py']
+    return ['unoconv']
+
+
+class OfficeListener:
+    def __init__(self, port, profile_dir):
+        self.port = port
+        self.profile_dir = profile_dir
+        self.process = None
+        self.conversions = 0
+
+    def __repr__(self):
+        return f"OfficeListener(port={self.port}, conversions={self.conversions}, running={self.process is not None and self.process.poll() is None})"
+
+    def is_port_accepting(self):
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def is_healthy(self):
+        return self.process is not None and self.process.poll() is None and self.is_port_accepting()
+
+    def start(self, startup_timeout_seconds):
+        print(f"Starting office listener on port {self.port}")
+        os.makedirs(self.profile_dir, exist_ok=True)
+        listener_command = get_unoconv_base_command() + ['--listener', '--port', str(self.port), '--user-profile', self.profile_dir]
+        self.process = subprocess.Popen(listener_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.conversions = 0
+
+        deadline = time.monotonic() + startup_timeout_seconds
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise Exception(f"Office listener on port {self.port} exited during startup with code {self.process.returncode}")
+            if self.is_port_accepting():
+                return
+            time.sleep(0.5)
+
+        self.stop()
+        raise Exception(f"Office listener on port {self.port} did not start accepting connections within {startup_timeout_seconds} seconds")
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+        except Exception as e:
+            handle_error_no_return(f"Could not stop office listener on port {self.port}, encountered error: ", e)
+        self.process = None
+
+    def convert(self, input_file_path, output_file_path, timeout_seconds):
+        convert_command = get_unoconv_base_command() + ['--no-launch', '--port', str(self.port), '-f', 'pdf', '-o', output_file_path, input_file_path]
+        subprocess.run(convert_command, check=True, timeout=timeout_seconds)
+        self.conversions += 1
+
+
+class OfficeConversionPool:
+    def __init__(self, size, base_port, profiles_dir, max_conversions_per_listener, conversion_timeout_seconds, startup_timeout_seconds):
+        self.max_conversions_per_listener = max_conversions_per_listener
+        self.conversion_timeout_seconds = conversion_timeout_seconds
+        self.startup_timeout_seconds = startup_timeout_seconds
+        self.listeners = [OfficeListener(base_port + index, os.path.join(profiles_dir, f"listener_{base_port + index}")) for index in range(size)]
+        self.available_listeners = queue.Queue()
+        for listener in self.listeners:
+            self.available_listeners.put(listener)
+
+    def ensure_healthy(self, listener):
+        if listener.process is not None and listener.conversions >= self.max_conversions_per_listener:
+            print(f"Recycling office listener on port {listener.port} after {listener.conversions} conversions")
+            listener.stop()
+        if not listener.is_healthy():
+            listener.stop()
+            listener.start(self.startup_timeout_seconds)
+
+    def convert(self, input_file_path, output_file_path):
+        # Blocks until a listener is free, so at most len(self.listeners) conversions run concurrently
+        listener = self.available_listeners.get()
+        try:
+            self.ensure_healthy(listener)
+            try:
+                listener.convert(input_file_path, output_file_path, self.conversion_timeout_seconds)
+            except subprocess.TimeoutExpired:
+                listener.stop()     # likely hung on this document, next conversion will get a fresh instance
+                raise
+            except subprocess.CalledProcessError as e:
+                if listener.is_healthy():
+                    raise   # the listener is fine, so it's the document that failed to convert
+                listener.stop()
+                raise Exception(f"Office listener on port {listener.port} went down during the conversion") from e
+        finally:
+            self.available_listeners.put(listener)
+
+    def shutdown(self):
+        for listener in self.listeners:
+            listener.stop()
+
+
+OFFICE_CONVERSION_POOL = None
+OFFICE_CONVERSION_POOL_LOCK = threading.Lock()
+
+
+def get_office_conversion_pool():
+    global OFFICE_CONVERSION_POOL
+
+    with OFFICE_CONVERSION_POOL_LOCK:
+        if OFFICE_CONVERSION_POOL is None:
+            read_return = read_config(['base_directory', 'office_pool_size', 'office_pool_base_port', 'office_pool_max_conversions_per_listener', 'office_conversion_timeout_seconds', 'office_listener_startup_timeout_seconds'])
+            OFFICE_CONVERSION_POOL = OfficeConversionPool(
+                size=max(1, int(read_return['office_pool_size'])),
+                base_port=int(read_return['office_pool_base_port']),
+                profiles_dir=os.path.join(read_return['base_directory'], 'office_profiles'),
+                max_conversions_per_listener=int(read_return['office_pool_max_conversions_per_listener']),
+                conversion_timeout_seconds=int(read_return['office_conversion_timeout_seconds']),
+                startup_timeout_seconds=int(read_return['office_listener_startup_timeout_seconds'])
+            )
+            atexit.register(OFFICE_CONVERSION_POOL.shutdown)
+
+    return OFFICE_CONVERSION_POOL
+
+
+def convert_to_pdf_with_unoconv(input_file_path, output_file_path):
+    print("\n\nConverting non-PDF document to PDF format\n\n")
+
+    use_office_conversion_pool = True
+    office_conversion_timeout_seconds = None
+    try:
+        read_return = read_config(['use_office_conversion_pool', 'office_conversion_timeout_seconds'])
+        use_office_conversion_pool = read_return['use_office_conversion_pool']
+        office_conversion_timeout_seconds = int(read_return['office_conversion_timeout_seconds'])
+    except Exception as e:
+        handle_error_no_return("Could not read office conversion pool settings from config.json, proceeding with defaults. Error: ", e)
+
+    if use_office_conversion_pool:
+        try:
+            get_office_conversion_pool().convert(input_file_path, output_file_path)
+            return
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError):
+            raise   # the document itself failed or hung, a one-off conversion would only do the same
+        except Exception as e:
+            handle_error_no_return("Could not convert via the office conversion pool, falling back to a one-off unoconv conversion. Encountered error: ", e)
+
+    subprocess.run(get_unoconv_base_command() + ['-f', 'pdf', '-o', output_file_path, input_file_path], check=True, timeout=office_conversion_timeout_seconds)
+
+#########################-------------------------------------###############################
+
+
+def convert_non_pdf_to_pdf_with_unoconv(filename, filepath):
+    print("Converting to PDF file")
+
+    try:
+        conv_filename = os.path.splitext(filename)[0] + '.pdf'
+        conv_filepath = os.path.join(app.config['UPLOAD_FOLDER'], conv_filename)
+
+        convert_to_pdf_with_unoconv(filepath, conv_filepath)
+
+        return conv_filename, conv_filepath
+    except subprocess.TimeoutExpired as e:
+        handle_local_error("Timed out converting file to PDF, encountered error: ", e)
+    except subprocess.CalledProcessError as e:
+        handle_local_error("Could not convert file to PDF, encountered error: ", e)
+    except Exception as e:
+        handle_local_error("Unexpected error when converting file to PDF, encountered error: ", e)
+
+
+# Name under which PDFtoTXT output is cached, the configured pdf_text_extractor ('auto' being deterministic for a given document)
+def get_local_text_extractor_name():
+    return read_config(['pdf_text_extractor'])['pdf_text_extractor']
+
+
+def vector_embed_filepath(filename, filepath, progress_callback=None):
+    print("Vector Embedding Document")
+
+    # progress_callback(stage, progress) is supplied by the ingestion job workers, progress being a 0-1 float:
+    def report_progress(stage, progress):
+        if progress_callback is not None:
+            try:
+                progress_callback(stage, progress)
+            except Exception as e:
+                handle_error_no_return("Could not report ingestion progress, printing error and proceeding: ", e)
+
+    if not filename.lower().endswith('.pdf'):
+        report_progress('converting', 0.05)
+        _, filepath = convert_non_pdf_to_pdf_with_unoconv(filename, filepath)
+
+    use_ocr = False
+    try:
+        read_return = read_config(['use_ocr', 'ocr_service_choice', 'ocr_mode'])
+        use_ocr = read_return['use_ocr']
+        ocr_service_choice = read_return['ocr_service_choice']
+        ocr_mode = read_return['ocr_mode']
+    except Exception as e:
+        handle_local_error("Could not determine use_ocr in config.json for process_new_file. Disabling OCR and proceeding. Error: ", e)
+
+    # Hash the PDF once, it keys both the extraction and embedding caches:
+    content_hash = None
+    try:
+        content_hash = compute_file_hash(filepath)
+    except Exception as e:
+        handle_error_no_return("Could not hash document for the content cache, proceeding without it. Encountered error: ", e)
+    
+    print("Processing PDF file")
+    report_progress('extracting', 0.15)
+    
+    extractor = get_local_text_extractor_name()
+    if use_ocr:
+        try:
+            if ocr_mode == 'hybrid' and get_ocr_backend(ocr_service_choice) is not None:
+                input_file = PDFtoHybridTXT(filepath, ocr_service_choice, content_hash)
+                extractor = get_hybrid_extractor_name(get_ocr_backend(ocr_service_choice)[1])
+            elif ocr_service_choice == 'AzureVision':
+                input_file = PDFtoAzureOCRTXT(filepath, content_hash)
+                extractor = 'azure_vision'
+            elif ocr_service_choice == 'AzureDocAi':
+                input_file = PDFtoAzureDocAiTXT(filepath, content_hash)
+                extractor = 'azure_doc_ai'
+            elif ocr_service_choice == 'LocalTesseract':
+                input_file = PDFtoLocalOCRTXT(filepath, content_hash)
+                extractor = 'local_tesseract'
+        except Exception as e:
+            handle_error_no_return("Failed to OCR text from PDF. Will now attempt to extract text via PyPDF2. Encountered error: ", e)
+            try:
+                input_file = PDFtoTXT(filepath, content_hash)
+                extractor = get_local_text_extractor_name()
+            except Exception as e:
+                handle_local_error("Failed to extract text from the PDF document, even via fallback PyPDF2, encountered error: ", e)
+    else:
+        try:
+            input_file = PDFtoTXT(filepath, content_hash)
+        except Exception as e:
+            handle_local_error("Failed to extract text from the PDF document, even via fallback PyPDF2, encountered error: ", e)
+    
+    # try:
+    #     images = extract_images_from_pdf(filepath)
+    # except Exception as e:
+    #     handle_error_no_return("Failed to extract images from the PDF document, encountered error: ", e)
+
+    # try:
+    #     store_images_to_db(images)
+    # except Exception as e:
+    #     handle_error_no_return("Failed to save images to database, encountered error: ", e)
+
+    # Conversion & extraction above can run concurrently across ingestion workers, but VECTOR_STORE is a single shared handle so writes are serialized:
+    report_progress('embedding', 0.6)
+    with VECTORDB_WRITE_LOCK:
+        try:
+            chunk_size, chunk_overlap, chunk_ids = LoadNewDocument(input_file, content_hash, extractor)
+        except Exception as e:
+            handle_local_error("Failed to extract text from PDF: ", e)
+
+    # LoadNewDocument added to the open VECTOR_STORE, so there's nothing to reload:
+    try:
+        embedding_model_choice = read_config(['embedding_model_choice'])['embedding_model_choice']
+        vectordb_used = get_vectordb_folder_in_use()
+    except Exception as e:
+        handle_local_error("Could not determine the embedding model & VectorDB in use when attempting to vector_embed_filepath(), encountered error: ", e)
+
+    report_progress('recording', 0.95)
+    try:
+        record_doc_loaded_to_db(filename, embedding_model_choice, vectordb_used, chunk_size, chunk_overlap, input_file, chunk_ids)
+    except Exception as e:
+        handle_error_no_return("Unable to record document loading to records DB, encountered error: ", e)
+
+    return True
+
+
+# Route to handle the submission of the second form (file loading)
+# Files are saved and queued for ingestion, the request returns immediately with the job IDs which may be polled via /ingestion_jobs_status or streamed via /ingestion_job_events
+@app.route('/process_new_file', methods=['POST'])
+def process_new_file():
+
+    try:
+        input_files = request.files.getlist('file')
+        if not input_files:
+            raise KeyError('file')
+    except Exception as e:
+        return handle_api_error("Server-side error recieving file: ", e)
+
+    try:
+        batch_id = str(uuid.uuid4())
+    except Exception as e:
+        return handle_api_error("Could not create batch_id for ingestion jobs, encountered error: ", e)
+
+    filenames = []
+    for input_file in input_files:
+
+        # Ensure the filename is secure
+        filename = secure_filename(input_file.filename)
+        if "PDF" in filename:
+            filename = filename.replace("PDF", "pdf")
+        filenames.append(filename)
+
+    # Each file is saved to the upload folder under its name & non-PDFs are converted to <name>.pdf next to it, so files of a batch
+    # sharing either would overwrite each other before their jobs run
+    upload_folder_names = collections.Counter(name for filename in filenames for name in {filename, os.path.splitext(filename)[0] + '.pdf'})
+    clashing_names = sorted(name for name, count in upload_folder_names.items() if count > 1)
+    if clashing_names:
+        return jsonify({'success': False, 'error': f"Files in this batch would overwrite each other as {', '.join(clashing_names)}, please upload them separately or rename them"}), 400
+
+    job_ids = []
+
+    for input_file, filename in zip(input_files, filenames):
+
+        try:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+            print("Loading new file - filename: ", filename)
+            print("Loading new file - filepath: ", filepath)
+
+            # Save the uploaded file to the specified path
+            input_file.save(filepath)
+        except Exception as e:
+            return handle_api_error("Failed to save document to app folder, encountered error: ", e)
+
+        try:
+            job_ids.append(submit_ingestion_job(filename, filepath, batch_id))
+        except Exception as e:
+            return handle_api_error("Could not queue ingestion job in the process_new_file() method, encountered error: ", e)
+
+    return jsonify({'success': True, 'batch_id': batch_id, 'job_ids': job_ids, 'job_id': job_ids[0]})
+
+
+#########################------------Ingestion Job Queue-------------###############################
+# Conversion, extraction/OCR, chunking & embedding of a document can take minutes, so uploads are recorded as jobs in the ingestion_jobs DB and
+# processed by a pool of worker threads. Jobs survive an app restart: anything left 'queued' or 'running' is re-queued on boot.
+INGESTION_JOB_QUEUE = queue.Queue()
+INGESTION_WORKERS = []
+INGESTION_TERMINAL_STATUSES = ('completed', 'failed')
+VECTORDB_WRITE_LOCK = threading.Lock()
+
+
+def connect_to_ingestion_jobs_db():
+
+    try:
+        read_return = read_config(['sqlite_ingestion_jobs_db'])
+        sqlite_ingestion_jobs_db = read_return['sqlite_ingestion_jobs_db']
+    except Exception as e:
+        handle_local_error("Missing sqlite_ingestion_jobs_db in config.json for method connect_to_ingestion_jobs_db. Error: ", e)
+
+    try:
+        conn = sqlite3.connect(sqlite_ingestion_jobs_db, timeout=30)
+        conn.row_factory = sqlite3.Row
+    except Exception as e:
+        handle_local_error("Could not establish connection to ingestion_jobs DB, encountered error: ", e)
+
+    # If the database does not currently exist...
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    batch_id TEXT,
+                    filename TEXT NOT NULL,
+                    filepath TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL DEFAULT 0,
+                    error TEXT,
+                    created_at TEXT,
+                    started_at TEXT,
+                    finished_at TEXT
+            )
+        ''')
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not create ingestion_jobs DB, encountered error: ", e)
+
+    return conn
+
+
+def update_ingestion_job(job_id, **fields):
+
+    columns = ", ".join(f"{column} = ?" for column in fields)
+
+    conn = connect_to_ingestion_jobs_db()
+    try:
+        conn.execute(f"UPDATE ingestion_jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not update ingestion_jobs DB, encountered error: ", e)
+    finally:
+        conn.close()
+
+
+def submit_ingestion_job(filename, filepath, batch_id=None):
+
+    job_id = str(uuid.uuid4())
+
+    conn = connect_to_ingestion_jobs_db()
+    try:
+        conn.execute("INSERT INTO ingestion_jobs (job_id, batch_id, filename, filepath, status, stage, progress, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (job_id, batch_id, filename, filepath, 'queued', 'queued', 0, datetime.datetime.now().isoformat()))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not insert ingestion job into ingestion_jobs DB, encountered error: ", e)
+    finally:
+        conn.close()
+
+    INGESTION_JOB_QUEUE.put(job_id)
+    print(f"Queued ingestion job {job_id} for {filename}")
+
+    return job_id
+
+
+def fetch_ingestion_jobs(job_ids=None, batch_id=None):
+
+    query = "SELECT job_id, batch_id, filename, status, stage, progress, error, created_at, started_at, finished_at FROM ingestion_jobs"
+    params = []
+
+    if job_ids:
+        query += f" WHERE job_id IN ({', '.join('?' for _ in job_ids)})"
+        params = list(job_ids)
+    elif batch_id:
+        query += " WHERE batch_id = ?"
+        params = [batch_id]
+
+    query += " ORDER BY created_at"
+
+    conn = connect_to_ingestion_jobs_db()
+    try:
+        jobs = [dict(row) for row in conn.execute(query, params).fetchall()]
+    except Exception as e:
+        handle_local_error("Could not read ingestion jobs from ingestion_jobs DB, encountered error: ", e)
+    finally:
+        conn.close()
+
+    return jobs
+
+
+def run_ingestion_job(job_id):
+
+    conn = connect_to_ingestion_jobs_db()
+    try:
+        job = conn.execute("SELECT filename, filepath FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+    if job is None:
+        handle_error_no_return(f"Ingestion job {job_id} not found in ingestion_jobs DB, skipping.")
+        return
+
+    update_ingestion_job(job_id, status='running', stage='starting', progress=0, error=None, started_at=datetime.datetime.now().isoformat())
+
+    def progress_callback(stage, progress):
+        update_ingestion_job(job_id, stage=stage, progress=progress)
+
+    try:
+        with app.app_context():
+            vector_embed_filepath(job['filename'], job['filepath'], progress_callback=progress_callback)
+        update_ingestion_job(job_id, status='completed', stage='completed', progress=1, finished_at=datetime.datetime.now().isoformat())
+        print(f"Ingestion job {job_id} completed for {job['filename']}")
+    except Exception as e:
+        handle_error_no_return(f"Ingestion job {job_id} failed for {job['filename']}, encountered error: ", e)
+        update_ingestion_job(job_id, status='failed', stage='failed', error=str(e), finished_at=datetime.datetime.now().isoformat())
+
+
+def ingestion_worker():
+
+    while True:
+        job_id = INGESTION_JOB_QUEUE.get()
+
+        # Embedding functions are only set once the VectorDB has been loaded, so hold off on picking up jobs until then:
+        while not VECTORDB_LOADED_UP:
+            time.sleep(1)
+
+        try:
+            run_ingestion_job(job_id)
+        except Exception as e:
+            handle_error_no_return(f"Ingestion worker could not process job {job_id}, encountered error: ", e)
+        finally:
+            INGESTION_JOB_QUEUE.task_done()
+
+
+def start_ingestion_workers():
+
+    try:
+        read_return = read_config(['ingestion_worker_count'])
+        ingestion_worker_count = max(1, int(read_return['ingestion_worker_count']))
+    except Exception as e:
+        ingestion_worker_count = 1
+        handle_error_no_return("Could not read ingestion_worker_count from config.json, proceeding with a single worker. Error: ", e)
+
+    # Jobs interrupted by a shutdown are restarted from scratch:
+    conn = connect_to_ingestion_jobs_db()
+    try:
+        unfinished_jobs = conn.execute("SELECT job_id FROM ingestion_jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+        conn.execute("UPDATE ingestion_jobs SET status = 'queued', stage = 'queued', progress = 0 WHERE status = 'running'")
+        conn.commit()
+    finally:
+        conn.close()
+
+    for row in unfinished_jobs:
+        INGESTION_JOB_QUEUE.put(row['job_id'])
+
+    if unfinished_jobs:
+        print(f"Re-queued {len(unfinished_jobs)} unfinished ingestion jobs")
+
+    for _ in range(ingestion_worker_count):
+        worker = Thread(target=ingestion_worker, daemon=True)
+        worker.start()
+        INGESTION_WORKERS.append(worker)
+
+
+@app.route('/ingestion_jobs_status', methods=['POST'])
+def ingestion_jobs_status():
+
+    try:
+        job_ids = request.json.get('job_ids', [])
+        batch_id = request.json.get('batch_id', None)
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read job_ids or batch_id for ingestion_jobs_status request. Encountered error:", e)
+
+    try:
+        jobs = fetch_ingestion_jobs(job_ids=job_ids, batch_id=batch_id)
+    except Exception as e:
+        return handle_api_error("Could not fetch ingestion jobs status, encountered error: ", e)
+
+    all_done = all(job['status'] in INGESTION_TERMINAL_STATUSES for job in jobs)
+
+    return jsonify({'success': True, 'jobs': jobs, 'all_done': all_done})
+
+
+@app.route('/ingestion_job_status/<job_id>')
+def ingestion_job_status(job_id):
+
+    try:
+        jobs = fetch_ingestion_jobs(job_ids=[job_id])
+    except Exception as e:
+        return handle_api_error("Could not fetch ingestion job status, encountered error: ", e)
+
+    if not jobs:
+        return jsonify({'success': False, 'error': f"Ingestion job {job_id} not found"}), 404
+
+    return jsonify({'success': True, 'job': jobs[0]})
+
+
+# Server-Sent Events stream of a batch's job statuses, closed once every job in the batch has completed or failed
+@app.route('/ingestion_job_events/<batch_id>')
+def ingestion_job_events(batch_id):
+
+    def generate():
+        last_payload = None
+        while True:
+            try:
+                jobs = fetch_ingestion_jobs(batch_id=batch_id)
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                return
+
+            payload = json.dumps({'jobs': jobs})
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload = payload
+
+            if all(job['status'] in INGESTION_TERMINAL_STATUSES for job in jobs):
+                yield "event: done\ndata: {}\n\n"
+                return
+
+            time.sleep(1)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+#########################-------------------------------------###############################
+
+
+#########################------------Embedding Migration-------------###############################
+# Switching embedding models otherwise points the app at an empty VectorDB, leaving every document to be uploaded, converted & extracted again.
+# A migration instead re-embeds the .txt sources already extracted for the documents of the VectorDB in use (per document_records) into a new
+# VectorDB folder for the target model, one document at a time on a background thread. Progress is kept per document in the ingestion_jobs DB,
+# so a migration interrupted by a restart resumes with the documents not yet migrated. Once every document is done, the target model's folder
+# key (and, if requested, the embedding model choice) is written to config.json, which swaps the new VectorDB in via the Retriever.
+EMBEDDING_MODEL_FLAGS_BY_MODEL_CHOICE = {'sbert_mpnet_base_v2': 'use_sbert_embeddings', 'openai_text_ada': 'use_openai_embeddings', 'bge_base': 'use_bge_base_embeddings', 'bge_large': 'use_bge_large_embeddings'}
+EMBEDDING_MIGRATION_ACTIVE_STATUSES = ('queued', 'running')
+EMBEDDING_MIGRATION_THREAD = None
+EMBEDDING_MIGRATION_THREAD_LOCK = threading.Lock()
+
+
+def connect_to_embedding_migrations_db():
+
+    conn = connect_to_ingestion_jobs_db()
+
+    # If the tables do not currently exist...
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_migrations (
+                    migration_id TEXT PRIMARY KEY,
+                    source_vectordb TEXT NOT NULL,
+                    target_model_choice TEXT NOT NULL,
+                    target_vectordb TEXT NOT NULL,
+                    switch_model INTEGER NOT NULL DEFAULT 1,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL DEFAULT 0,
+                    error TEXT,
+                    created_at TEXT,
+                    started_at TEXT,
+                    finished_at TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_migration_documents (
+                    migration_id TEXT NOT NULL,
+                    document_id INTEGER NOT NULL,
+                    document_name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    chunk_count INTEGER,
+                    error TEXT,
+                    PRIMARY KEY (migration_id, document_id)
+            )
+        ''')
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not create embedding_migrations tables in the ingestion_jobs DB, encountered error: ", e)
+
+    return conn
+
+
+def update_embedding_migration(migration_id, **fields):
+
+    columns = ", ".join(f"{column} = ?" for column in fields)
+
+    conn = connect_to_embedding_migrations_db()
+    try:
+        conn.execute(f"UPDATE embedding_migrations SET {columns} WHERE migration_id = ?", (*fields.values(), migration_id))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not update embedding_migrations in the ingestion_jobs DB, encountered error: ", e)
+    finally:
+        conn.close()
+
+
+def update_embedding_migration_document(migration_id, document_id, **fields):
+
+    columns = ", ".join(f"{column} = ?" for column in fields)
+
+    conn = connect_to_embedding_migrations_db()
+    try:
+        conn.execute(f"UPDATE embedding_migration_documents SET {columns} WHERE migration_id = ? AND document_id = ?", (*fields.values(), migration_id, document_id))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not update embedding_migration_documents in the ingestion_jobs DB, encountered error: ", e)
+    finally:
+        conn.close()
+
+
+# Method to add the documents of source_vectordb not yet part of the migration, ex: uploaded while it was running | returns the number added
+def add_documents_to_embedding_migration(migration_id, source_vectordb):
+
+    docs_conn = connect_to_docs_loaded_db()
+    try:
+        document_rows = docs_conn.execute("SELECT id, document_name FROM document_records WHERE vectordb_used = ?", (source_vectordb,)).fetchall()
+    finally:
+        docs_conn.close()
+
+    conn = connect_to_embedding_migrations_db()
+    try:
+        documents_before = conn.execute("SELECT COUNT(*) FROM embedding_migration_documents WHERE migration_id = ?", (migration_id,)).fetchone()[0]
+        conn.executemany("INSERT OR IGNORE INTO embedding_migration_documents (migration_id, document_id, document_name, status) VALUES (?, ?, ?, 'queued')", [(migration_id, row['id'], row['document_name']) for row in document_rows])
+        conn.commit()
+        documents_after = conn.execute("SELECT COUNT(*) FROM embedding_migration_documents WHERE migration_id = ?", (migration_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+    return documents_after - documents_before
+
+
+# Method to queue a migration of the VectorDB in use to target_model_choice | returns the migration_id
+def submit_embedding_migration(target_model_choice, switch_model=True):
+
+    if target_model_choice not in VECTORDB_FOLDER_PREFIXES_BY_MODEL_CHOICE:
+        raise ValueError(f"Unknown embedding model: {target_model_choice}")
+    if target_model_choice == get_embedding_model_choice_in_use():
+        raise ValueError(f"{target_model_choice} is already the embedding model in use")
+
+    active_migration = fetch_embedding_migration(active_only=True)
+    if active_migration is not None:
+        raise ValueError(f"A migration to {active_migration['target_model_choice']} is already in progress")
+
+    try:
+        base_directory = read_config(['base_directory'])['base_directory']
+    except Exception as e:
+        handle_local_error("Could not read base_directory from config.json for submit_embedding_migration. Error: ", e)
+
+    migration_id = str(uuid.uuid4())
+    source_vectordb = get_vectordb_folder_in_use()
+    formatted_datetime = datetime.datetime.now().strftime('%Y-%m-%d-%Hhr-%Mmin-%Ssec')
+    target_vectordb = base_directory + '/' + VECTORDB_FOLDER_PREFIXES_BY_MODEL_CHOICE[target_model_choice] + '-' + formatted_datetime
+
+    conn = connect_to_embedding_migrations_db()
+    try:
+        conn.execute("INSERT INTO embedding_migrations (migration_id, source_vectordb, target_model_choice, target_vectordb, switch_model, status, stage, progress, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (migration_id, source_vectordb, target_model_choice, target_vectordb, int(bool(switch_model)), 'queued', 'queued', 0, datetime.datetime.now().isoformat()))
+        conn.commit()
+    except Exception as e:
+        handle_local_error("Could not insert embedding migration into the ingestion_jobs DB, encountered error: ", e)
+    finally:
+        conn.close()
+
+    document_count = add_documents_to_embedding_migration(migration_id, source_vectordb)
+    print(f"Queued embedding migration {migration_id} of {document_count} documents from {source_vectordb} to {target_model_choice}")
+
+    start_embedding_migration_thread(migration_id)
+
+    return migration_id
+
+
+# Method to queue a failed migration again, retrying the documents that failed | returns the migration_id
+def resume_embedding_migration(migration_id):
+
+    migration = fetch_embedding_migration(migration_id)
+    if migration is None:
+        raise KeyError(f"No embedding migration with id {migration_id}")
+    if migration['status'] == 'completed':
+        raise ValueError("This embedding migration has already completed")
+    if migration['status'] in EMBEDDING_MIGRATION_ACTIVE_STATUSES:
+        raise ValueError("This embedding migration is already in progress")
+
+    conn = connect_to_embedding_migrations_db()
+    try:
+        conn.execute("UPDATE embedding_migration_documents SET status = 'queued', error = NULL WHERE migration_id = ? AND status = 'failed'", (migration_id,))
+        conn.execute("UPDATE embedding_migrations SET status = 'queued', stage = 'queued', error = NULL WHERE migration_id = ?", (migration_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    start_embedding_migration_thread(migration_id)
+
+    return migration_id
+
+
+# Method to fetch a migration (default: the most recent) along with its document counts & the documents that failed or were skipped | None if there's none
+def fetch_embedding_migration(migration_id=None, active_only=False):
+
+    query = "SELECT * FROM embedding_migrations"
+    params = []
+
+    if migration_id:
+        query += " WHERE migration_id = ?"
+        params = [migration_id]
+    elif active_only:
+        query += f" WHERE status IN ({', '.join('?' for _ in EMBEDDING_MIGRATION_ACTIVE_STATUSES)})"
+        params = list(EMBEDDING_MIGRATION_ACTIVE_STATUSES)
+
+    query += " ORDER BY created_at DESC LIMIT 1"
+
+    conn = connect_to_embedding_migrations_db()
+    try:
+        row = conn.execute(query, params).fetchone()
+        if row is None:
+            return None
+
+        migration = dict(row)
+        status_counts = {status_row['status']: status_row['count'] for status_row in conn.execute("SELECT status, COUNT(*) AS count FROM embedding_migration_documents WHERE migration_id = ? GROUP BY status", (migration['migration_id'],)).fetchall()}
+        migration['documents_total'] = sum(status_counts.values())
+        migration['documents_done'] = status_counts.get('completed', 0)
+        migration['documents_skipped'] = [dict(document_row) for document_row in conn.execute("SELECT document_id, document_name, error FROM embedding_migration_documents WHERE migration_id = ? AND status = 'skipped'", (migration['migration_id'],)).fetchall()]
+        migration['documents_failed'] = [dict(document_row) for document_row in conn.execute("SELECT document_id, document_name, error FROM embedding_migration_documents WHERE migration_id = ? AND status = 'failed'", (migration['migration_id'],)).fetchall()]
+    finally:
+        conn.close()
+
+    return migration
+
+
+# The extracted text a document's chunks were made from, if still on disk: it's re-chunked & re-embedded rather than the upload being re-extracted
+def find_document_text_source(document_record):
+    for source in get_document_sources(document_record):
+        if os.path.exists(source):
+            return source
+    return None
+
+
+# Method to re-embed a single document into the target VectorDB | returns the number of chunks stored
+def migrate_document_embeddings(document_record, target_model_choice, target_vectordb, vector_store, chunking):
+
+    source = find_document_text_source(document_record)
+    if source is None:
+        raise FileNotFoundError(f"The extracted text of {document_record['document_name']} is no longer on disk, it must be uploaded again")
+
+    chunk_sz, chunk_olp, count_tokens = chunking
+
+    # Chunk ids are stable per source, so a document interrupted part-way through by a restart is replaced rather than duplicated.
+    # The lock is taken per document, so ingestion & deletes interleave with the migration while compaction never runs mid-write:
+    with VECTORDB_WRITE_LOCK:
+        delete_source_chunks_from_vectordb(vector_store, target_vectordb, source)
+        chunk_ids = store_document_chunks(source, vector_store, target_vectordb, target_model_choice, chunk_sz, chunk_olp, count_tokens)
+    record_doc_loaded_to_db(document_record['document_name'], target_model_choice, target_vectordb, chunk_sz, chunk_olp, source, chunk_ids)
+
+    return len(chunk_ids)
+
+
+# Method to bring the target VectorDB's records in line with the source once all documents are migrated: documents deleted from the source
+# in the meantime are deleted from the target, and the source's document sets are re-created against the target's document ids
+def reconcile_migrated_document_records(source_vectordb, target_vectordb, vector_store):
+
+    conn = connect_to_docs_loaded_db()
+    try:
+        source_ids_by_name = {row['document_name']: row['id'] for row in conn.execute("SELECT id, document_name FROM document_records WHERE vectordb_used = ?", (source_vectordb,)).fetchall()}
+        target_rows = conn.execute("SELECT id, document_name, chunk_ids FROM document_records WHERE vectordb_used = ?", (target_vectordb,)).fetchall()
+        source_document_sets = [(row['name'], [member['document_id'] for member in conn.execute("SELECT document_id FROM document_set_members WHERE document_set_id = ?", (row['id'],)).fetchall()]) for row in conn.execute("SELECT id, name FROM document_sets WHERE vectordb_used = ?", (source_vectordb,)).fetchall()]
+    finally:
+        conn.close()
+
+    target_ids_by_name = {}
+    for row in target_rows:
+        if row['document_name'] in source_ids_by_name:
+            target_ids_by_name[row['document_name']] = row['id']
+            continue
+
+        print(f"Removing {row['document_name']} from the migrated VectorDB, it was deleted from {source_vectordb} during the migration")
+        with VECTORDB_WRITE_LOCK:
+            delete_chunks_from_vectordb(vector_store, target_vectordb, json.loads(row['chunk_ids'] or '[]'))
+        conn = connect_to_docs_loaded_db()
+        try:
+            conn.execute("DELETE FROM document_records WHERE id = ?", (row['id'],))
+            conn.commit()
+        finally:
+            conn.close()
+
+    source_names_by_id = {document_id: document_name for document_name, document_id in source_ids_by_name.items()}
+    for name, source_document_ids in source_document_sets:
+        save_document_set(name, target_vectordb, [target_ids_by_name[source_names_by_id[document_id]] for document_id in source_document_ids if source_names_by_id.get(document_id) in target_ids_by_name])
+
+
+def run_embedding_migration(migration_id):
+
+    migration = fetch_embedding_migration(migration_id)
+    if migration is None:
+        handle_error_no_return(f"Embedding migration {migration_id} not found in the ingestion_jobs DB, skipping.")
+        return
+
+    target_model_choice = migration['target_model_choice']
+    target_vectordb = migration['target_vectordb']
+    update_embedding_migration(migration_id, status='running', stage='loading embedding model', error=None, started_at=datetime.datetime.now().isoformat())
+
+    try:
+        embedding_function = get_embedding_function(target_model_choice)
+        chunking = get_chunking_for_embedding_function(embedding_function)
+        vector_store = get_vector_store(target_vectordb, target_model_choice)
+    except Exception as e:
+        handle_error_no_return(f"Could not open the {target_model_choice} VectorDB for embedding migration {migration_id}, encountered error: ", e)
+        update_embedding_migration(migration_id, status='failed', stage='failed', error=str(e), finished_at=datetime.datetime.now().isoformat())
+        return
+
+    # Work through the pending documents, then pick up any uploaded to the source VectorDB in the meantime, until there are none left:
+    while True:
+        conn = connect_to_embedding_migrations_db()
+        try:
+            pending_documents = conn.execute("SELECT document_id, document_name FROM embedding_migration_documents WHERE migration_id = ? AND status IN ('queued', 'running') ORDER BY document_id", (migration_id,)).fetchall()
+        finally:
+            conn.close()
+
+        if not pending_documents and not add_documents_to_embedding_migration(migration_id, migration['source_vectordb']):
+            break
+
+        for document in pending_documents:
+            progress_migration = fetch_embedding_migration(migration_id)
+            documents_finished = progress_migration['documents_done'] + len(progress_migration['documents_skipped']) + len(progress_migration['documents_failed'])
+            update_embedding_migration(migration_id, stage=f"embedding {document['document_name']}", progress=documents_finished / max(progress_migration['documents_total'], 1))
+            update_embedding_migration_document(migration_id, document['document_id'], status='running')
+
+            document_record = fetch_document_record(document['document_id'])
+            if document_record is None:
+                update_embedding_migration_document(migration_id, document['document_id'], status='skipped', error="Deleted from the VectorDB in use")
+                continue
+
+            try:
+                chunk_count = migrate_document_embeddings(document_record, target_model_choice, target_vectordb, vector_store, chunking)
+                update_embedding_migration_document(migration_id, document['document_id'], status='completed', chunk_count=chunk_count)
+            except FileNotFoundError as e:
+                handle_error_no_return(f"Skipping {document['document_name']} in embedding migration {migration_id}: ", e)
+                update_embedding_migration_document(migration_id, document['document_id'], status='skipped', error=str(e))
+            except Exception as e:
+                handle_error_no_return(f"Could not migrate {document['document_name']} in embedding migration {migration_id}, encountered error: ", e)
+                update_embedding_migration_document(migration_id, document['document_id'], status='failed', error=str(e))
+
+    migration = fetch_embedding_migration(migration_id)
+    if migration['documents_failed']:
+        update_embedding_migration(migration_id, status='failed', stage='failed', error=f"{len(migration['documents_failed'])} documents could not be migrated, resume the migration to retry them", finished_at=datetime.datetime.now().isoformat())
+        return
+
+    ### Swap the migrated VectorDB in ###
+    try:
+        update_embedding_migration(migration_id, stage='swapping')
+        reconcile_migrated_document_records(migration['source_vectordb'], target_vectordb, vector_store)
+
+        config_updates = {VECTORDB_FOLDER_KEYS_BY_MODEL_CHOICE[target_model_choice]: target_vectordb}
+        if migration['switch_model']:
+            config_updates['embedding_model_choice'] = target_model_choice
+            config_updates.update({flag_key: model_choice == target_model_choice for model_choice, flag_key in EMBEDDING_MODEL_FLAGS_BY_MODEL_CHOICE.items()})
+        write_config(config_updates)   # the Retriever swaps VECTOR_STORE over if the migrated VectorDB is now the one in use
+    except Exception as e:
+        handle_error_no_return(f"Could not swap in the VectorDB of embedding migration {migration_id}, encountered error: ", e)
+        update_embedding_migration(migration_id, status='failed', stage='failed', error=str(e), finished_at=datetime.datetime.now().isoformat())
+        return
+
+    update_embedding_migration(migration_id, status='completed', stage='completed', progress=1, finished_at=datetime.datetime.now().isoformat())
+    print(f"Embedding migration {migration_id} to {target_model_choice} completed: {migration['documents_done']} documents migrated, {len(migration['documents_skipped'])} skipped")
+
+
+def embedding_migration_worker(migration_id):
+    try:
+        run_embedding_migration(migration_id)
+    except Exception as e:
+        handle_error_no_return(f"Embedding migration {migration_id} stopped unexpectedly, encountered error: ", e)
+        update_embedding_migration(migration_id, status='failed', stage='failed', error=str(e), finished_at=datetime.datetime.now().isoformat())
+
+
+# A single migration runs at a time, it shares the embedding hardware with ingestion & queries
+def start_embedding_migration_thread(migration_id):
+    global EMBEDDING_MIGRATION_THREAD
+
+    with EMBEDDING_MIGRATION_THREAD_LOCK:
+        if EMBEDDING_MIGRATION_THREAD is not None and EMBEDDING_MIGRATION_THREAD.is_alive():
+            raise ValueError("An embedding migration is already running")
+        EMBEDDING_MIGRATION_THREAD = Thread(target=embedding_migration_worker, args=(migration_id,), daemon=True)
+        EMBEDDING_MIGRATION_THREAD.start()
+
+
+# Migrations interrupted by a shutdown resume with the documents not yet migrated:
+def resume_unfinished_embedding_migrations():
+
+    migration = fetch_embedding_migration(active_only=True)
+    if migration is not None:
+        print(f"Resuming embedding migration {migration['migration_id']} to {migration['target_model_choice']}")
+        start_embedding_migration_thread(migration['migration_id'])
+
+
+@app.route('/start_embedding_migration', methods=['POST'])
+def start_embedding_migration():
+
+    try:
+        target_model_choice = request.form['embedding_model_choice']
+        switch_model = request.form.get('switch_model', 'true').lower() == 'true'
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read embedding_model_choice from the POST request in method start_embedding_migration, encountered error: ", e)
+
+    try:
+        migration_id = submit_embedding_migration(target_model_choice, switch_model)
+    except Exception as e:
+        return handle_api_error("Could not start the embedding migration, encountered error: ", e)
+
+    return jsonify({'success': True, 'migration_id': migration_id})
+
+
+@app.route('/resume_embedding_migration', methods=['POST'])
+def resume_embedding_migration_for_vector_db():
+
+    try:
+        migration_id = request.form['migration_id']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read migration_id from the POST request in method resume_embedding_migration_for_vector_db, encountered error: ", e)
+
+    try:
+        resume_embedding_migration(migration_id)
+    except Exception as e:
+        return handle_api_error("Could not resume the embedding migration, encountered error: ", e)
+
+    return jsonify({'success': True, 'migration_id': migration_id})
+
+
+@app.route('/embedding_migration_status')
+def embedding_migration_status():
+
+    try:
+        migration = fetch_embedding_migration(request.args.get('migration_id'))
+    except Exception as e:
+        return handle_api_error("Could not fetch embedding migration status, encountered error: ", e)
+
+    return jsonify({'success': True, 'migration': migration})
+
+#########################-------------------------------------###############################
+
+
+# Route to store user rating: 
+# ATTN: comment out print() statements, as users may elect to leave a rating as a response is being generated, which is when the stdout is redirected to the event stream! 
+@app.route('/store_user_rating', methods=['POST'])
+def store_user_rating():
+    
+    # print("Stroing user rating")
+
+    try:
+        read_return = read_config(['sqlite_history_db'])
+        sqlite_history_db = read_return['sqlite_history_db']
+    except Exception as e:
+        handle_local_error("Missing sqlite_history_db in config.json for method store_user_rating. Error: ", e)
+    
+    try:
+        user_rating = request.form['rating']
+        chat_id_for_rating = request.form['chat_id']
+        sequence_id_for_rating = request.form['sequence_id']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read user rating or failed to obtain chat/sequence ID, encountered error: ", e)
+
+    # print("user_rating: ", user_rating)
+    # print("chat_id_for_rating: ", chat_id_for_rating)
+    # print("sequence_id_for_rating: ", sequence_id_for_rating)
+
+    try:
+        conn = sqlite3.connect(sqlite_history_db)
+        cursor = conn.cursor()
+    except Exception as e:
+        return handle_api_error("Could not connect to chat history DB for storage of user-rating, encountered error: ", e)
+
+    try:
+        cursor.execute(
+            '''
+            UPDATE chat_history
+            SET user_rating = ?
+            WHERE chat_id = ? AND sequence_id = ?
+            ''',
+            (user_rating, chat_id_for_rating, sequence_id_for_rating)
+        )
+        conn.commit()
+    except Exception as e:
+        return handle_api_error("Could not store user-rating to chat history db, encountered error: ", e)
+
+    conn.close()
+
+    return jsonify(success=True)
+
+
+
+def is_local_server_online(server_to_check):
+    server_health_url = ''
+    if server_to_check == 'llama-cpp':
+        server_health_url = 'http://localhost:8080/health'
+    elif server_to_check == 'hf-waitress':
+        server_health_url = 'http://localhost:9069/health'
+    else:
+        return handle_api_error("Invalid server_to_check in method is_local_server_online, encountered error: ", e)
+
+    print(f"\n\nChecking {server_to_check} server status\n\n")
+
+    try:
+        response = requests.get(server_health_url)
+        
+        if response.status_code == 200:
+            data = response.json()  # parse the JSON response to determine the server status
+            if data['status'] == 'ok' and server_to_check == 'llama-cpp':
+                #print(f"llama.cpp Server ready: {data['slots_idle']} idle slots, {data['slots_processing']} processing slots.")
+                print(f"llama.cpp Server ready. No slot information available.")
+                return {"server_available":True, "loading_model":False, "status_code":200}
+            elif data['status'] == 'ok' and server_to_check == 'hf-waitress':
+                print(f"hf-waitress Server ready and online")
+                return {"server_available":True, "loading_model":False, "status_code":200}
+            elif data['status'] == 'no slot available':
+                print("No slots available. Server is running but cannot handle more requests.")
+                return {"server_available":False, "loading_model":False, "status_code":200}
+            
+        elif response.status_code == 503:   # model still loading or no slots
+            data = response.json()
+            if data['status'] == 'loading model':
+                print("Server is loading the selected LLM, please wait")
+                return {"server_available":False, "loading_model":True, "status_code":503}
+            else:
+                print("No slots available. Server is running but cannot handle more requests.")
+                return {"server_available":False, "loading_model":False, "status_code":503}
+        
+        elif response.status_code == 500:
+            print("Server error: Failed to load LLM.")
+            logger.error("Local LLM Server - 500 event")
+            return {"server_available":False, "loading_model":False, "status_code":500}
+        
+        else:
+            return {"server_available":False, "loading_model":False, "status_code":500}
+    
+    except requests.exceptions.ConnectionError as e:
+        error_message = "\n\nECONNREFUSED event\n\n"
+        if logger:
+            logger.error(error_message)
+            print(error_message)
+        else:
+            print(error_message)
+        return {"server_available":False, "loading_model":True, "status_code":500}
+    except Exception as e:
+        error_message = f"\n\nCould not check local LLM Server health, encountered error: {e}\n\n"
+        if logger:
+            logger.error(error_message)
+            print(error_message)
+        else:
+            print(error_message)
+        return {"server_available":False, "loading_model":False, "status_code":500}
+    
+
+def send_ctrl_c_to_process(process):
+    if process.poll() is None:  # check if process is still running via poll(), which returns None if a process is still running 
+        if platform.system() == 'Windows':
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            process.send_signal(signal.SIGINT)
+        try:
+            # Wait a bit for the process to terminate gracefully:
+            process.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            print("\n\nProcess did not terminate within timeout, will be force-killed.\n\n")
+            process.kill()  # Sends 'SIGKILL' on Unix-like to force-kill immediately / 'TerminateProcess' on Windows which still allows for graceful termination
+            process.wait()
+            if process.poll() is not None:
+                print("\n\nProcess has been killed successfully.\n\n")
+            else:
+                print("\n\nProcess still running after force kill attempt.\n\n")
+
+
+def terminate_local_llm_server_process(process):
+    try:
+        # process.terminate() sends 'SIGTERM' on Unix-like systems / 'TerminateProcess' on Windows, allows for graceful termination
+        # process.wait()
+        send_ctrl_c_to_process(process)
+        if process.poll() is not None:  # process has indeed terminated
+            print("\n\nProcess terminated gracefully.\n\n")
+    except Exception as e:
+        handle_local_error("Failed to terminate local LLM server process, encountered error: ", e)
+
+
+@app.route('/llama_cpp_server_starter')
+def llama_cpp_server_starter():
+    print("\n\nStarting llama.cpp Server\n\n")
+
+    global LLM_CHANGE_RELOAD_TRIGGER_SET
+    global LLAMA_CPP_PROCESS
+    global HF_WAITRESS_PROCESS
+    global LLM_LOADED_UP
+
+    other_server_running = False
+
+    # Before attempting to start the llama.cpp server, check if HF-Waitress is running and if so, shut it down:
+    try:
+        if is_local_server_online('hf-waitress')['server_available']:
+            print("\n\nThe HF-Waitress server is running. Attempting to shut it down before starting the llama.cpp server.\n\n")
+            try:
+                if HF_WAITRESS_PROCESS is not None:
+                    terminate_local_llm_server_process(HF_WAITRESS_PROCESS)
+                    HF_WAITRESS_PROCESS = None
+                    LLM_LOADED_UP = False
+                else:
+                    raise Exception("HF_WAITRESS_PROCESS is None but server_available")
+            except Exception as e:
+                LLM_LOADED_UP = True    # We know the HF-Waitress server is running, which means `hf_waitress.py` is available, so we set LLM_LOADED_UP to True
+                other_server_running = True # Set to True as we've determined the other server is running and we failed to terminate it
+                handle_error_no_return("Warning: Failed to terminate running HF-Waitress process before launching llama.cpp. It was likely launched by a previous session or external process. Consider manually shutting down this server to conserve memory. Technical error-details follow: ", e)
+    except Exception as e:
+        handle_error_no_return("Warning: Could not check if HF-Waitress server is running. Proceeding to launch llama.cpp server. Encountered error: ", e)   
+
+    is_llama_cpp_running = False
+    try:
+        is_llama_cpp_running = is_local_server_online('llama-cpp')['server_available']
+    except Exception as e:
+        handle_error_no_return("Warning: Could not check if llama.cpp server is running. Proceeding to launch llama.cpp server. Encountered error: ", e)
+
+    model_choice = 'undefined'
+    try:
+        read_return = read_config(['model_choice'])
+        model_choice = read_return['model_choice']
+    except Exception as e:
+        handle_error_no_return("Missing model_choice in config.json in method llama_cpp_server_starter. Printing error and proceeding with model_choice: 'undefined' ", e)
+
+    if is_llama_cpp_running and not LLM_CHANGE_RELOAD_TRIGGER_SET:
+        LLM_LOADED_UP = True
+        print(f'\n\nThe llama.cpp server is already loaded and the reload trigger is not set. Simply returning with model choice: {model_choice}\n\n')
+        return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
+    
+    elif is_llama_cpp_running and LLM_CHANGE_RELOAD_TRIGGER_SET:
+        print("\n\nllama.cpp server online and LLM_CHANGE_RELOAD_TRIGGER_SET is set. Attempting to terminate and reload from config.json\n\n")
+        try:
+            terminate_local_llm_server_process(LLAMA_CPP_PROCESS)
+            LLAMA_CPP_PROCESS = None
+            LLM_CHANGE_RELOAD_TRIGGER_SET = False
+        except Exception as e:
+            LLM_LOADED_UP = True  # We know the llama.cpp server is running but there was an error terminating it, so we set LLM_LOADED_UP to True while leaving LLM_CHANGE_RELOAD_TRIGGER_SET to True as we know the server needs to be re-loaded.
+            handle_error_no_return("Failed to terminate running llama.cpp process, server was likely launched by a previous session. Returning with the currently loaded LLM. To change, shutdown the previously launched server manually and reload this page. Technical error-details follow: ", e)
+            return jsonify({'success': True, 'llm_model': 'undefined', 'other_server_running': other_server_running})   # We still return success:True as we've at least determined llama.cpp is running and loaded with a model, even if we cannot reload it.
+                 
+    elif LLM_CHANGE_RELOAD_TRIGGER_SET: # llama.cpp is not running, set flags to false and new settings will be loaded on next llama.cpp launch
+        print("\n\nResetting the LLM_CHANGE_RELOAD_TRIGGER_SET flag and attemping to launch the server with the currently selected LLM.\n\n")
+        LLM_CHANGE_RELOAD_TRIGGER_SET = False
+        LLM_LOADED_UP = False
+
+
+    try:
+        read_return = read_config(['model_dir', 'model_choice', 'local_llm_context_length', 'local_llm_max_new_tokens', 'local_llm_gpu_layers', 'server_timeout_seconds', 'server_retry_attempts', 'use_gpu'])
+        model_dir = read_return['model_dir']
+        model_choice = read_return['model_choice']
+        local_llm_context_length = read_return['local_llm_context_length']
+        local_llm_max_new_tokens = read_return['local_llm_max_new_tokens']
+        local_llm_gpu_layers = read_return['local_llm_gpu_layers']
+        server_timeout_seconds = read_return['server_timeout_seconds']
+        server_retry_attempts = read_return['server_retry_attempts']
+        use_gpu = read_return['use_gpu']
+    except Exception as e:
+        return handle_api_error("Missing values in config.json when preparing to launch llama.cpp server, encountered error: ", e)
+
+
+    try:
+        cpp_model = os.path.join(model_dir, model_choice)
+    except Exception as e:
+        return handle_api_error("Could not os.join path to model file to launch llama.cpp server, encountered error: ", e)
+
+    if not use_gpu:
+        local_llm_gpu_layers = 0
+
+    try:
+        cpp_app = ['llama-server', '-m', cpp_model, '-ngl', str(local_llm_gpu_layers), '-c', str(local_llm_context_length), '-n', str(local_llm_max_new_tokens), '--host', '0.0.0.0']
+
+        if platform.system() == 'Windows':
+            LLAMA_CPP_PROCESS = subprocess.Popen(cpp_app, creationflags=subprocess.CREATE_NEW_CONSOLE)  # Windows only! Comment when containerizing or deploying to Linux/MacOS!
+        else:           
+            # Platform & container agnostic:
+            with open('llama_cpp_server_output_log.txt', 'w') as f:
+                LLAMA_CPP_PROCESS = subprocess.Popen(cpp_app, stdout=f, stderr=subprocess.STDOUT, text=True)    #stdout has already been redirected to the file, so simply direct stderr to stdout!
+
+    except Exception as e:
+        return handle_api_error("Could not launch llama.cpp process, encountered error: ", e)
+
+
+    timeout = server_timeout_seconds   
+    attempts = server_retry_attempts
+
+    try:
+        for _ in range(attempts):
+            if is_local_server_online('llama-cpp')['server_available']:
+                print("\n\nllama.cpp server launched succesfully! Returning.\n\n")
+                LLM_LOADED_UP = True
+                return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
+            time.sleep(timeout)
+    except Exception as e:
+        handle_error_no_return("Could not check server status after launch attempt, printing error and retrying: ", e)
+
+    return handle_api_error("Failed to start llama.cpp local-server")
+
+
+@app.route('/hf_waitress_server_starter')
+def hf_waitress_server_starter():
+    print("\n\nStarting HF-Waitress Server\n\n")
+
+    global LLM_CHANGE_RELOAD_TRIGGER_SET
+    global LLM_LOADED_UP
+    global HF_WAITRESS_PROCESS
+    global LLAMA_CPP_PROCESS
+
+    other_server_running = False
+
+    # Before attempting to start the HF-Waitress server, check if llama.cpp is running and if so, shut it down:
+    try:
+        if is_local_server_online('llama-cpp')['server_available']:
+            print("\n\nThe llama.cpp server is running. Attempting to shut it down before starting the HF-Waitress server.\n\n")
+            try:
+                if LLAMA_CPP_PROCESS is not None:
+                    terminate_local_llm_server_process(LLAMA_CPP_PROCESS)
+                    LLAMA_CPP_PROCESS = None
+                    LLM_LOADED_UP = False
+                else:
+                    raise Exception("LLAMA_CPP_PROCESS is None but server_available")
+            except Exception as e:
+                LLM_LOADED_UP = True    # We know the llama.cpp server is running, which means `llama-server` is available, so we set LLM_LOADED_UP to True
+                other_server_running = True # Set to True as we've determined the other server is running and we failed to terminate it
+                handle_error_no_return("Warning: Failed to terminate running llama.cpp process before launching HF-Waitress. It was likely launched by a previous session or external process. Consider manually shutting down this server to conserve memory. Technical error-details follow: ", e)
+    except Exception as e:
+        handle_error_no_return("Could not check if llama.cpp server is running. Proceeding to launch HF-Waitress server. Encountered error: ", e)
+
+    is_awq = False
+    model_choice = 'microsoft/Phi-3-mini-4k-instruct'   # match default in hf_waitress.py as this will only be used in the very first run, as the hf_config.json file is created in the first run!
+    use_flash_attention_2 = False
+    try:
+        with open('hf_config.json', 'r') as file:
+            hf_config = json.load(file)
+            is_awq = hf_config['awq']
+            use_flash_attention_2 = hf_config['use_flash_attention_2']
+            model_choice = hf_config['model_id']
+    except Exception as e:
+        handle_error_no_return("Could not read hf_config.json in method hf_waitress_server_starter. Continuing with defaults. encountered error: ", e)
+
+    if is_local_server_online('hf-waitress')['server_available']:
+        print("\n\nHF-Waitress server already running. Resetting LLM_CHANGE_RELOAD_TRIGGER_SET and simply returning!\n\n")
+        LLM_LOADED_UP = True
+        LLM_CHANGE_RELOAD_TRIGGER_SET = False   # The only instance where we're in this method and LLM_CHANGE_RELOAD_TRIGGER_SET is set while the HF-Waitress server is running is when we're trying to switch back to it after running llama.cpp. So we simply reset the flag and return.
+        return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
+    elif LLM_CHANGE_RELOAD_TRIGGER_SET:  # Switching to HF-Waitress and it's offline, so we set LLM_CHANGE_RELOAD_TRIGGER_SET to False and proceed to launch the server.
+        print('\n\nProceeding to reload the LLM & resetting the LLM_CHANGE_RELOAD_TRIGGER_SET flag.\n\n')
+        LLM_CHANGE_RELOAD_TRIGGER_SET = False
+        LLM_LOADED_UP = False
+    
+    print("\n\nProceeding to launch HF-Waitress server\n\n")
+
+    launch_args = ' '
+    if is_awq:
+        launch_args += '--awq '
+    if use_flash_attention_2:
+        launch_args += '--use_flash_attention_2 '
+    
+    launch_args = launch_args.strip()
+    base_command = 'python' if platform.system() == 'Windows' else 'python3'
+    full_command = f"{base_command} hf_waitress.py {launch_args}"
+
+    try:
+        if platform.system() == 'Windows':
+            HF_WAITRESS_PROCESS = subprocess.Popen(full_command, creationflags=subprocess.CREATE_NEW_CONSOLE)   #Popen is non-blocking, so the server will keep running in the background
+        else:
+            # Platform & container agnostic:
+            with open('hf_waitress_output_log.txt', 'w') as f:
+                HF_WAITRESS_PROCESS = subprocess.Popen(full_command, stdout=f, stderr=subprocess.STDOUT, text=True)
+
+    except Exception as e:
+        return handle_api_error("Could not launch HF-Waitress process, encountered error: ", e)
+
+    timeout = 5   # seconds
+    attempts = 25
+
+    try:
+        for _ in range(attempts):
+            if is_local_server_online('hf-waitress')['server_available']:
+                print("\n\nHF-Waitress server launched succesfully! Returning.\n\n")
+                LLM_LOADED_UP = True
+                return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
+            time.sleep(timeout)
+    except Exception as e:
+        handle_error_no_return("Could not check server status after launch attempt, printing error and retrying: ", e)
+
+    return handle_api_error("Failed to start HF-Waitress Server. It may be taking a while to download the model, try refreshing LARS in a few minutes.")
+
+
+@app.route('/check_local_llm_server_status', methods=['POST'])
+def check_local_llm_server_status():
+    
+    server_online = False
+    
+    try:
+        server_to_check = request.form['server_to_check']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read server_to_check from the POST request in method check_local_llm_server_status, encountered error: ", e)
+    
+    try:
+        server_online = is_local_server_online(server_to_check)['server_available']
+    except Exception as e:
+        return handle_api_error(f"Error checking {server_to_check} server status in method check_local_llm_server_status, encountered error: ", e)
+
+    return jsonify({'success': True, 'server_online': server_online})
+
+
+@app.route('/local_llm_server_starter')
+def local_llm_server_starter():
+    print("Starting Local LLM Server")
+
+    try:
+        read_return = read_config(['local_llm_server'])
+        server_to_start = read_return['local_llm_server']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read local_llm_server from config.json in method local_llm_server_starter, encountered error: ", e)
+
+    try:
+        if server_to_start == 'hf-waitress':
+            return hf_waitress_server_starter()
+        elif server_to_start == 'llama-cpp':
+            return llama_cpp_server_starter()
+        else:
+            return handle_api_error(f"Invalid local LLM server choice in method local_llm_server_starter: {server_to_start}")
+    except Exception as e:
+        return handle_api_error("Server-side error, could not start local LLM server in method local_llm_server_starter, encountered error: ", e)
+
+    return jsonify({'success': True})
+
+
+@app.route('/load_vectordb')
+def load_vectordb():
+
+    global VECTORDB_CHANGE_RELOAD_TRIGGER_SET
+    global VECTORDB_LOADED_UP
+
+    if VECTORDB_LOADED_UP and not VECTORDB_CHANGE_RELOAD_TRIGGER_SET:
+        print(f'\n\nVectorDB already loaded! Simply returning.\n\n')
+        return jsonify({'success': True})
+    elif VECTORDB_CHANGE_RELOAD_TRIGGER_SET:
+        print('\n\nProceeding to reload VectorDB & resetting the VECTORDB_CHANGE_RELOAD_TRIGGER_SET flag.\n\n')
+        VECTORDB_CHANGE_RELOAD_TRIGGER_SET = False
+
+    ### 1 - Open the VectorDB in use & point VECTOR_STORE at it
+    print("\n\nLoading VectorDB: ChromaDB\n\n")
+    try:
+        vector_store, persist_directory = activate_vector_store()
+    except Exception as e:
+        return handle_api_error("Could not load VectorDB, encountered error: ", e)
+
+    ### 2 - Bring the lexical index up to date with the VectorDB
+    try:
+        backfill_lexical_index(vector_store, persist_directory)
+    except Exception as e:
+        handle_error_no_return("Could not backfill the lexical index, hybrid search will miss documents not yet indexed. Encountered error: ", e)
+
+    ### 3 - Warm up the reranker so the first query doesn't pay for loading it
+    try:
+        get_reranker_model(read_config(['reranker_bi_encoder_model'])['reranker_bi_encoder_model'])
+    except Exception as e:
+        handle_error_no_return("Could not pre-load the reranker model, it will be loaded on first query. Encountered error: ", e)
+    
+    VECTORDB_LOADED_UP = True
+    return jsonify(success=True)
+
+
+@app.route('/set_prompt_template', methods=['POST'])
+def set_prompt_template():
+
+    base_template = ""
+
+    try:
+        base_template = request.form['prompt_template']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read prompt_template from the POST request in method set_prompt_template, encountered error: ", e)
+    
+    try:
+        write_config({'base_template':base_template})
+    except Exception as e:
+        return handle_api_error("Could not update base_template in method set_prompt_template, encountered error: ", e)
+
+    return jsonify({'success':True})
+
+
+@app.route('/fetch_file_list_for_vector_db', methods=['POST'])
+def fetch_file_list_for_vector_db():
+
+    print("Loading file list for selected VectorDB")
+
+    try:
+        selected_embedding_model_choice = request.form['embedding_model_choice']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read embedding_model_choice from the POST request in method fetch_file_list_for_vector_db, encountered error: ", e)
+
+    # For the VectorDB presently picked by the user in the dropdown, obtain the associated VectorDB folder for the select query:
+    vdb_for_select = ""
+    try:
+        vdb_for_select = get_vectordb_folder_for_model_choice(selected_embedding_model_choice)
+        vdb_for_select = '%' + os.path.basename(vdb_for_select)
+        print(f'vdb_for_select: {vdb_for_select}')
+
+    except Exception as e:
+        return handle_api_error("Could not create new VectorDB in reset_vector_db_on_disk, encountered error: ", e)
+
+    file_row_list = []
+    
+    try:
+        conn = connect_to_docs_loaded_db()
+        c = conn.cursor()
+    except Exception as e:
+        return handle_api_error("Could not connect to sqlite_docs_loaded_db database to load file list, encountered error: ", e)
+
+    try:
+        c.execute("SELECT document_name, vectordb_used, chunk_size, chunk_overlap, id FROM document_records where vectordb_used LIKE ?", (vdb_for_select,))
+    except Exception as e:
+        return handle_api_error("Could not get document list from document_records db, encountered error: ", e)
+    
+    try:
+        result = c.fetchall()
+
+        for list_item in result:
+            file_row_list.append(list(list_item))
+    except Exception as e:
+        return handle_api_error("Could not parse document list from document_records db, encountered error: ", e)
+
+    #print(f'returning docs loaded list: {file_row_list}')
+
+    return jsonify({'success': True, 'file_row_list': file_row_list})
+
+
+@app.route('/reset_vector_db_on_disk', methods=['POST'])
+def reset_vector_db_on_disk():
+
+    print("Resetting selected VectorDB")
+
+    try:
+        selected_embedding_model_choice = request.form['embedding_model_choice']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read embedding_model_choice from the POST request in method reset_vector_db_on_disk, encountered error: ", e)
+
+    try:
+        read_return = read_config(['base_directory'])
+        base_directory = read_return['base_directory']
+    except Exception as e:
+        handle_local_error("Could not read base_directory from config.json for reset_vector_db_on_disk. Error: ", e)
+
+    try:
+        current_datetime = datetime.datetime.now()
+        formatted_datetime = current_datetime.strftime('%Y-%m-%d-%Hhr-%Mmin-%Ssec')
+    except Exception as e:
+        return handle_api_error("Could not obtain timestamp in reset_vector_db_on_disk, encountered error: ", e)
+
+    # Now that we have all pre-requisite data to create a new VectorDB, proceed to do so by checking the model the user had currently picked from the dropdown: 
+    try:
+        folder_key = VECTORDB_FOLDER_KEYS_BY_MODEL_CHOICE[selected_embedding_model_choice]
+        new_vectordb_folder = base_directory + '/' + VECTORDB_FOLDER_PREFIXES_BY_MODEL_CHOICE[selected_embedding_model_choice] + '-' + formatted_datetime
+        write_config({folder_key:new_vectordb_folder})     # swaps VECTOR_STORE over to the new folder if it's the one in use
+
+    except Exception as e:
+        return handle_api_error("Could not create new VectorDB in reset_vector_db_on_disk, encountered error: ", e)
+
+    restart_required = True
+    global VECTORDB_CHANGE_RELOAD_TRIGGER_SET
+    VECTORDB_CHANGE_RELOAD_TRIGGER_SET = True
+    try:
+        read_return = read_config(['embedding_model_choice'])
+        set_embedding_model_choice = read_return['embedding_model_choice']
+        if set_embedding_model_choice != selected_embedding_model_choice:
+            restart_required = False
+            VECTORDB_CHANGE_RELOAD_TRIGGER_SET = False
+    except Exception as e:
+        handle_error_no_return("Could not compare selected and set embedding models when determining if restart_required in reset_vector_db_on_disk(), encountered error: ", e)
+
+    #print(f'returning docs loaded list: {file_row_list}')
+
+    return jsonify({'success': True, "restart_required": restart_required})
+
+
+@app.route('/delete_document', methods=['POST'])
+def delete_document_from_vector_db():
+
+    try:
+        document_id = int(request.form['document_id'])
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read document_id from the POST request in method delete_document_from_vector_db, encountered error: ", e)
+
+    try:
+        document_record = delete_document(document_id)
+    except Exception as e:
+        return handle_api_error("Could not delete document from the VectorDB, encountered error: ", e)
+
+    print(f"Deleted {document_record['document_name']} from the VectorDB")
+
+    return jsonify({'success': True})
+
+
+@app.route('/reindex_document', methods=['POST'])
+def reindex_document_in_vector_db():
+
+    try:
+        document_id = int(request.form['document_id'])
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read document_id from the POST request in method reindex_document_in_vector_db, encountered error: ", e)
+
+    try:
+        job_id = reindex_document(document_id)
+    except Exception as e:
+        return handle_api_error("Could not queue document for re-indexing, encountered error: ", e)
+
+    return jsonify({'success': True, 'job_ids': [job_id], 'job_id': job_id})
+
+
+@app.route('/fetch_document_scope_options')
+def fetch_document_scope_options_for_vector_db():
+
+    try:
+        documents, document_sets = fetch_document_scope_options(get_vectordb_folder_in_use())
+    except Exception as e:
+        return handle_api_error("Could not fetch documents & document sets to scope chats to, encountered error: ", e)
+
+    return jsonify({'success': True, 'documents': documents, 'document_sets': document_sets})
+
+
+@app.route('/save_document_set', methods=['POST'])
+def save_document_set_for_vector_db():
+
+    try:
+        name = request.json['name'].strip()
+        document_ids = [int(document_id) for document_id in request.json['document_ids']]
+        if not name:
+            raise ValueError("Document set name cannot be empty")
     except Exception as e:
-        handle_error_no_return("Could not check if llama.cpp server is running. Proceeding to launch HF-Waitress server. Encountered error: ", e)
+        return handle_api_error("Server-side error, could not read name & document_ids from the POST request in method save_document_set_for_vector_db, encountered error: ", e)
 
-    is_awq = False
-    model_choice = 'microsoft/Phi-3-mini-4k-instruct'   # match default in hf_waitress.py as this will only be used in the very first run, as the hf_config.json file is created in the first run!
-    use_flash_attention_2 = False
     try:
-        with open('hf_config.json', 'r') as file:
-            hf_config = json.load(file)
-            is_awq = hf_config['awq']
-            use_flash_attention_2 = hf_config['use_flash_attention_2']
-            model_choice = hf_config['model_id']
+        document_set_id = save_document_set(name, get_vectordb_folder_in_use(), document_ids)
     except Exception as e:
-        handle_error_no_return("Could not read hf_config.json in method hf_waitress_server_starter. Continuing with defaults. encountered error: ", e)
+        return handle_api_error("Could not save document set, encountered error: ", e)
 
-    if is_local_server_online('hf-waitress')['server_available']:
-        print("\n\nHF-Waitress server already running. Resetting LLM_CHANGE_RELOAD_TRIGGER_SET and simply returning!\n\n")
-        LLM_LOADED_UP = True
-        LLM_CHANGE_RELOAD_TRIGGER_SET = False   # The only instance where we're in this method and LLM_CHANGE_RELOAD_TRIGGER_SET is set while the HF-Waitress server is running is when we're trying to switch back to it after running llama.cpp. So we simply reset the flag and return.
-        return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
-    elif LLM_CHANGE_RELOAD_TRIGGER_SET:  # Switching to HF-Waitress and it's offline, so we set LLM_CHANGE_RELOAD_TRIGGER_SET to False and proceed to launch the server.
-        print('\n\nProceeding to reload the LLM & resetting the LLM_CHANGE_RELOAD_TRIGGER_SET flag.\n\n')
-        LLM_CHANGE_RELOAD_TRIGGER_SET = False
-        LLM_LOADED_UP = False
+    return jsonify({'success': True, 'document_set_id': document_set_id})
+
+
+@app.route('/delete_document_set', methods=['POST'])
+def delete_document_set_for_vector_db():
+
+    try:
+        document_set_id = int(request.json['document_set_id'])
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read document_set_id from the POST request in method delete_document_set_for_vector_db, encountered error: ", e)
+
+    try:
+        delete_document_set(document_set_id)
+    except Exception as e:
+        return handle_api_error("Could not delete document set, encountered error: ", e)
+
+    return jsonify({'success': True})
+
+
+@app.route('/compact_vector_db', methods=['POST'])
+def compact_vector_db():
+
+    try:
+        selected_embedding_model_choice = request.form['embedding_model_choice']
+    except Exception as e:
+        return handle_api_error("Server-side error, could not read embedding_model_choice from the POST request in method compact_vector_db, encountered error: ", e)
+
+    try:
+        Thread(target=compact_vectordb_in_background, args=(get_vectordb_folder_for_model_choice(selected_embedding_model_choice),), daemon=True).start()
+    except Exception as e:
+        return handle_api_error("Could not start compacting the VectorDB, encountered error: ", e)
+
+    return jsonify({'success': True})
+
+
+@app.route('/load_chat_history_list')
+def load_chat_history_list():
+
+    print("loading chat history list for sidebar")
+
+    try:
+        read_return = read_config(['sqlite_history_db'])
+        sqlite_history_db = read_return['sqlite_history_db']
+    except Exception as e:
+        return handle_api_error("Missing sqlite_history_db in config.json in method load_chat_history_list. Error: ", e)
+
+    history_id_list = []
     
-    print("\n\nProceeding to launch HF-Waitress server\n\n")
+    try:
+        conn = sqlite3.connect(sqlite_history_db)
+        c = conn.cursor()
+    except Exception as e:
+        return handle_api_error("Could not connect to sqlite_history_db database to load chat history list, encountered error: ", e)
 
-    launch_args = ' '
-    if is_awq:
-        launch_args += '--awq '
-    if use_flash_attention_2:
-        launch_args += '--use_flash_attention_2 '
+    try:
+        c.execute("SELECT DISTINCT chat_id FROM chat_history")
+    except Exception as e:
+        return handle_api_error("Could not get list from chat history db, encountered error: ", e)
     
-    launch_args = launch_args.strip()
-    base_command = 'python' if platform.system() == 'Windows' else 'python3'
-    full_command = f"{base_command} hf_waitress.py {launch_args}"
+    try:
+        result = c.fetchall()
+
+        for list_item in result:
+            history_id_list.append(list_item)
+    except Exception as e:
+        return handle_api_error("Could not parse chat history list from db, encountered error: ", e)
+
+    #print(f'returning chat hsitory list: {history_id_list}')
+
+    return jsonify({'success': True, 'history_list': history_id_list})
+
+
+@app.route('/load_chat_history', methods=['POST'])
+def load_chat_history():
+
+    global CHAT_ID
+    global SEQUENCE_ID
+    global HISTORY_SUMMARY
+    global HISTORY_MEMORY_WITH_BUFFER
+
+    print("loading chat history")
 
     try:
-        if platform.system() == 'Windows':
-            HF_WAITRESS_PROCESS = subprocess.Popen(full_command, creationflags=subprocess.CREATE_NEW_CONSOLE)   #Popen is non-blocking, so the server will keep running in the background
-        else:
-            # Platform & container agnostic:
-            with open('hf_waitress_output_log.txt', 'w') as f:
-                HF_WAITRESS_PROCESS = subprocess.Popen(full_command, stdout=f, stderr=subprocess.STDOUT, text=True)
+        read_return = read_config(['sqlite_history_db'])
+        sqlite_history_db = read_return['sqlite_history_db']
+    except Exception as e:
+        handle_local_error("Missing sqlite_history_db in config.json in method load_chat_history. Error: ", e)
+
+    # Clear chat history of current chat, prep for loading historical chat summary:
+    # try:
+    #     HISTORY_MEMORY_WITH_BUFFER.chat_memory.clear()
+    #     HISTORY_MEMORY_WITH_BUFFER = ConversationSummaryBufferMemory(llm=LLM, max_token_limit=300, return_messages=False)
+    #     HISTORY_SUMMARY = {}
+    # except Exception as e:
+    #     handle_error_no_return("Could not clear memory when loading chat history, encountered error: ", e)
+
+    try:
+        chat_id_for_history_search = request.form['chat_id']
+        CHAT_ID = request.form['chat_id']
+    except Exception as e:
+        return handle_api_error("Could not retrieve Chat ID from request form, encountered error: ", e)
+
+    try:
+        conn = sqlite3.connect(sqlite_history_db)
+        c = conn.cursor()
+    except Exception as e:
+        return handle_api_error("Could not connect to chat history database, encountered error: ", e)
+
+    sequence_id_for_history_search = 1
+    retrieve_history = True
+    chat_history = []
+    old_chat_model = ""
+
+    while(retrieve_history):
+
+        try:
+            c.execute("SELECT user_query FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
+            result = c.fetchone()
+            
+            user_message = str(result[0])
+
+            user_message = user_message.strip('\n')
+            regex_to_swap_multiple_spaces_with_newline = r' {2,}'
+            user_message = re.sub(regex_to_swap_multiple_spaces_with_newline, '<br>', user_message)
+
+            user_message = '<div class="user-message">' + user_message + '</div>'
+
+            chat_history.append(user_message)
+
+            c.execute("SELECT llm_response FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
+            result = c.fetchone()
+
+            result = str(result[0])
+            result_parts = result.split("pdf_pane_data=",1)
+            # llm_response = '<div class="llm-wrapper"> <div class="llm-response">' + str(result[0]) + '</div>'
+            llm_response = '<div class="response-and-viewer-container"><div class="llm-wrapper"> <div class="llm-response">' + result_parts[0]
+
+        except Exception as e:
+            return handle_api_error("Could not retrieve chat history, encountered error: ", e)
+        
+        llm_response = llm_response.strip('\n')
+        llm_response = llm_response.replace('\n\n', '<br><br>')
+        llm_response = llm_response.replace('\n', '<br>')
+        
+        try:
+            c.execute("SELECT user_rating FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
+            result = c.fetchone()
+        except Exception as e:
+            handle_error_no_return("Could not fetch user rating, encountered error: ", e)
+
+        response_rated = False
+        user_rating_for_history_chat = None
+
+        if result[0]:
+            response_rated = True
+            try:
+                user_rating_for_history_chat = int(result[0])
+                #print(f'rating exists: {user_rating_for_history_chat}')
+            except Exception as e:
+                handle_error_no_return("Could not retrieve integer value of user rating, encountered error: ", e)
+
+
+        llm_rating = f'''<div class="star-rating" data-rated={response_rated} rating-chat-id={chat_id_for_history_search} rating-sequence-id={sequence_id_for_history_search}>
+        <i class="far fa-star" data-rate="1"></i>
+        <i class="far fa-star" data-rate="2"></i>
+        <i class="far fa-star" data-rate="3"></i>
+        <i class="far fa-star" data-rate="4"></i>
+        <i class="far fa-star" data-rate="5"></i>
+        </div>
+        </div>
+        </div>'''
+
+
+        if user_rating_for_history_chat:
+            rating_parts = llm_rating.split("far", user_rating_for_history_chat)
+            if len(rating_parts) <= user_rating_for_history_chat:
+                llm_rating = "fas".join(rating_parts)
+            else:
+                llm_rating = "fas".join(rating_parts[:-1]) + "fas" + "far".join(rating_parts[-1:])
+
+        llm_response += llm_rating
+
+        if len(result_parts) > 1:
+            llm_response += result_parts[1]
+            llm_response += "</div>"
+            llm_response = llm_response.strip('\n')
+            llm_response = llm_response.replace('\n\n', '<br><br>')
+            llm_response = llm_response.replace('\n', '<br>')
+
+        chat_history.append(llm_response)
+
+        # Increment sequence ID for next iteration:
+        sequence_id_for_history_search += 1
+
+        # But first, check to see if next sequence exists!
+        try:
+            c.execute("SELECT EXISTS(SELECT 1 FROM chat_history WHERE chat_id = ? AND sequence_id = ?)", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
+            exists = c.fetchone()[0]
+        except Exception as e:
+            return handle_api_error("Could not determine if next sequence exists in chat history DB, encountered error: ", e)
+            
+        if not exists:
+            SEQUENCE_ID = sequence_id_for_history_search - 1
+            retrieve_history = False
+            try:
+                c.execute("SELECT llm_model FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (CHAT_ID, SEQUENCE_ID))
+                result = c.fetchone()
+                old_chat_model = str(result[0])
+            except Exception as e:
+                handle_error_no_return("Could not determine previously used LLM in chat, encountered error: ", e)
+            try:
+                c.execute("SELECT history_summary FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (CHAT_ID, SEQUENCE_ID))
+                result = c.fetchone()
+                history_summary_dict = str(result[0])
+            except Exception as e:
+                handle_error_no_return("Could not fetch history summary of last chat, encountered error: ", e)
+            c.close()
+
+    # Convert History Summary and add a new key indicating it was recently cleared!
+    if history_summary_dict is not None and history_summary_dict != "" and history_summary_dict != 'None':
+        print(f"\n\history_summary_dict string from old chat: {history_summary_dict}\n\n")
+        try:
+            HISTORY_SUMMARY = ast.literal_eval(history_summary_dict)    #cast as dictionary
+            HISTORY_SUMMARY["has_been_reset"] = True
+        except Exception as e:
+            handle_error_no_return("Could not cast history summary string from DB to dict and/or set has_been_reset boolean, encountered error: ", e)
+
+    # Temp prints:
+    # print(f"\n\nHISTORY_SUMMARY: {HISTORY_SUMMARY}\n\n")
+    # print(f"\n\history_summary_dict: {history_summary_dict}\n\n")
+    # print(f"\n\nHISTORY_MEMORY_WITH_BUFFER.summary: {HISTORY_MEMORY_WITH_BUFFER.summary}\n\n")
+    # print(f"\n\nHISTORY_MEMORY_WITH_BUFFER.chat_memory.messages: {HISTORY_MEMORY_WITH_BUFFER.chat_memory.messages}\n\n")
+    print(f'\n\nChat history loaded for chat with model: {old_chat_model}\n\n')
+
+    return jsonify({'success': True, 'chat_history': chat_history, 'old_chat_model': old_chat_model})
 
-    except Exception as e:
-        return handle_api_error("Could not launch HF-Waitress process, encountered error: ", e)
 
-    timeout = 5   # seconds
-    attempts = 25
+@app.route('/init_chat_history_db')
+def init_chat_history_db():
+
+    global CHAT_ID
 
     try:
-        for _ in range(attempts):
-            if is_local_server_online('hf-waitress')['server_available']:
-                print("\n\nHF-Waitress server launched succesfully! Returning.\n\n")
-                LLM_LOADED_UP = True
-                return jsonify({'success': True, 'llm_model': model_choice, 'other_server_running': other_server_running})
-            time.sleep(timeout)
+        read_return = read_config(['sqlite_history_db'])
+        sqlite_history_db = read_return['sqlite_history_db']
     except Exception as e:
-        handle_error_no_return("Could not check server status after launch attempt, printing error and retrying: ", e)
-
-    return handle_api_error("Failed to start HF-Waitress Server. It may be taking a while to download the model, try refreshing LARS in a few minutes.")
-
+        return handle_api_error("Missing sqlite_history_db in config.json in method init_chat_history_db. Error: ", e)
 
-@app.route('/check_local_llm_server_status', methods=['POST'])
-def check_local_llm_server_status():
-    
-    server_online = False
-    
+    # Connect to chat_history.db to determine appropriate chat_id
     try:
-        server_to_check = request.form['server_to_check']
+        conn = sqlite3.connect(sqlite_history_db)
+        c = conn.cursor()
     except Exception as e:
-        return handle_api_error("Server-side error, could not read server_to_check from the POST request in method check_local_llm_server_status, encountered error: ", e)
-    
+        return handle_api_error("Could not connect to chat history database, encountered error: ", e)
+
+    # If the database does not currently exist...
     try:
-        server_online = is_local_server_online(server_to_check)['server_available']
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                        id INTEGER PRIMARY KEY,
+                        chat_id INTEGER,
+                        sequence_id INTEGER,
+                        user_query TEXT,
+                        llm_response TEXT,
+                        user_rating INTEGER,
+                        llm_model TEXT, 
+                        prompt_template TEXT,
+                        history_summary TEXT
+            )
+        ''')
+        conn.commit()
     except Exception as e:
-        return handle_api_error(f"Error checking {server_to_check} server status in method check_local_llm_server_status, encountered error: ", e)
+        return handle_api_error("Could not create new chat history db, encountered error: ", e)
 
-    return jsonify({'success': True, 'server_online': server_online})
+    try:
+        c.execute("SELECT COALESCE(MAX(chat_id), 0) FROM chat_history")
+        # "The COALESCE function accepts two or more arguments and returns the first non-null argument."
+        # This accounts for an empty DB!
 
+        result = c.fetchone()
 
-@app.route('/local_llm_server_starter')
-def local_llm_server_starter():
-    print("Starting Local LLM Server")
+        # 'result' will be a tuple, so extract the first element
+        max_chat_id = result[0]
 
-    try:
-        read_return = read_config(['local_llm_server'])
-        server_to_start = read_return['local_llm_server']
-    except Exception as e:
-        return handle_api_error("Server-side error, could not read local_llm_server from config.json in method local_llm_server_starter, encountered error: ", e)
+        new_chat_id = max_chat_id + 1
+        CHAT_ID = new_chat_id
 
-    try:
-        if server_to_start == 'hf-waitress':
-            return hf_waitress_server_starter()
-        elif server_to_start == 'llama-cpp':
-            return llama_cpp_server_starter()
-        else:
-            return handle_api_error(f"Invalid local LLM server choice in method local_llm_server_starter: {server_to_start}")
+        print(f"Chat history DB initialised with CHAT_ID: {CHAT_ID}")
     except Exception as e:
-        return handle_api_error("Server-side error, could not start local LLM server in method local_llm_server_starter, encountered error: ", e)
-
-    return jsonify({'success': True})
+        return handle_api_error("Could not set CHAT_ID, encountered error: ", e)
 
+    conn.close()
 
-@app.route('/load_vectordb')
-def load_vectordb():
+    return jsonify({'success': True, 'chat_id': CHAT_ID})
 
-    global VECTOR_STORE
-    global HF_BGE_EMBEDDINGS
-    global AZURE_OPENAI_EMBEDDINGS
-    global VECTORDB_CHANGE_RELOAD_TRIGGER_SET
-    global VECTORDB_LOADED_UP
 
-    if VECTORDB_LOADED_UP and not VECTORDB_CHANGE_RELOAD_TRIGGER_SET:
-        print(f'\n\nVectorDB already loaded! Simply returning.\n\n')
-        return jsonify({'success': True})
-    elif VECTORDB_CHANGE_RELOAD_TRIGGER_SET:
-        print('\n\nProceeding to reload VectorDB & resetting the VECTORDB_CHANGE_RELOAD_TRIGGER_SET flag.\n\n')
-        VECTORDB_CHANGE_RELOAD_TRIGGER_SET = False
+def fetch_image_from_db(image_id):
 
     try:
-        read_return = read_config(['use_gpu_for_embeddings', 'use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings', 'vectordb_sbert_folder', 'vectordb_openai_folder', 'vectordb_bge_base_folder', 'vectordb_bge_large_folder'])
-        use_gpu_for_embeddings = read_return['use_gpu_for_embeddings']
-        use_sbert_embeddings = read_return['use_sbert_embeddings']
-        use_openai_embeddings = read_return['use_openai_embeddings']
-        use_bge_base_embeddings = read_return['use_bge_base_embeddings']
-        use_bge_large_embeddings = read_return['use_bge_large_embeddings']
-        vectordb_sbert_folder = read_return['vectordb_sbert_folder']
-        vectordb_openai_folder = read_return['vectordb_openai_folder']
-        vectordb_bge_base_folder = read_return['vectordb_bge_base_folder']
-        vectordb_bge_large_folder = read_return['vectordb_bge_large_folder']
+        read_return = read_config(['sqlite_images_db'])
+        sqlite_images_db = read_return['sqlite_images_db']
     except Exception as e:
-        return handle_api_error("Missing values in config.json when attempting to load_vectordb. Error: ", e)
+        handle_local_error("Missing sqlite_history_db in config.json in method fetch_image_from_db. Error: ", e)
     
+    # 1 - Connect to DB
+    try:
+        conn = sqlite3.connect(sqlite_images_db)
+    except Exception as e:
+        handle_local_error("Could not connect to images database, encountered error: ", e)
     
-    ### 1 - Load VectorDB from disk
-    print("\n\nLoading VectorDB: ChromaDB\n\n")
+    # 2 - Get Images
     try:
-        if use_sbert_embeddings:
-            VECTOR_STORE = Chroma(persist_directory=vectordb_sbert_folder, embedding_function=HuggingFaceEmbeddings())
-            # try:
-            #     # chroma_client = VECTOR_STORE.PersistentClient
-            #     # max_batch_size = chroma_client._producer.max_batch_size
-            #     max_batch_size = VECTOR_STORE.max_batch_size
-            #     print(f"max_batch_size: {max_batch_size}")
-            # except Exception as e:
-            #     print(f"Could not get max_batch_size. Error: {e}")
-        
-        elif use_openai_embeddings:
-
-            try:
-                read_return = read_config(['azure_openai_text_ada_api_url', 'azure_openai_text_ada_api_key', 'azure_openai_api_type', 'azure_openai_api_version', 'azure_openai_text_ada_deployment_name'])
-                azure_openai_text_ada_api_url = read_return['azure_openai_text_ada_api_url']
-                azure_openai_text_ada_api_key = read_return['azure_openai_text_ada_api_key']
-                azure_openai_api_type = read_return['azure_openai_api_type']
-                azure_openai_api_version = read_return['azure_openai_api_version']
-                azure_openai_text_ada_deployment_name = read_return['azure_openai_text_ada_deployment_name']
-            except Exception as e:
-                return handle_api_error("Missing values for Azure OpenAI Embeddings in method load_model_and_vectordb in config.json. Error: ", e)
-            
-            try:
-                os.environ["OPENAI_API_BASE"] = azure_openai_text_ada_api_url
-                os.environ["OPENAI_API_KEY"] = azure_openai_text_ada_api_key
-                os.environ["OPENAI_API_TYPE"] = azure_openai_api_type
-                os.environ["OPENAI_API_VERSION"] = azure_openai_api_version
-            except Exception as e:
-                return handle_api_error("Could not set OS environment variables for Azure OpenAI Embeddings in load_model_and_vectordb, encountered error: ", e)
-
-            
-            AZURE_OPENAI_EMBEDDINGS = OpenAIEmbeddings(deployment=azure_openai_text_ada_deployment_name)
-            VECTOR_STORE = Chroma(persist_directory=vectordb_openai_folder, embedding_function=AZURE_OPENAI_EMBEDDINGS)
-        
-        elif use_bge_base_embeddings:
-            model_name = "BAAI/bge-base-en"
-            model_kwargs = {}
-            if use_gpu_for_embeddings:
-                model_kwargs.update({"device": "cuda"})
-            else:
-                model_kwargs.update({"device": "cpu"})
-            encode_kwargs = {"normalize_embeddings": True}
-            HF_BGE_EMBEDDINGS = HuggingFaceBgeEmbeddings(
-                model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
-            )
-            VECTOR_STORE = Chroma(persist_directory=vectordb_bge_base_folder, embedding_function=HF_BGE_EMBEDDINGS)
-                
-        
-        elif use_bge_large_embeddings:
-            model_name = "BAAI/bge-large-en"
-            model_kwargs = {}
-            if use_gpu_for_embeddings:
-                model_kwargs.update({"device": "cuda"})
-            else:
-                model_kwargs.update({"device": "cpu"})
-            encode_kwargs = {"normalize_embeddings": True}
-            HF_BGE_EMBEDDINGS = HuggingFaceBgeEmbeddings(
-                model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
-            )
-            VECTOR_STORE = Chroma(persist_directory=vectordb_bge_large_folder, embedding_function=HF_BGE_EMBEDDINGS)
-        
-        #VECTOR_STORE = Chroma(persist_directory=VECTORDB_SBERT_FOLDER, embedding_function=HuggingFaceEmbeddings())
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT image_data FROM images WHERE id = ?', (image_id,)).fetchone()
+        images_bytes = row['image_data'] if row else None
     except Exception as e:
-        return handle_api_error("Could not load VectorDB, encountered error: ", e)
+        handle_local_error("Could not fetch image from DB, encountered error: ", e)
     
-    VECTORDB_LOADED_UP = True
-    return jsonify(success=True)
-
+    conn.close()
+    
+    return images_bytes
 
-@app.route('/set_prompt_template', methods=['POST'])
-def set_prompt_template():
 
-    base_template = ""
+@app.route('/image_display/<int:image_id>')
+def image_display(image_id):
+    print(f"\n\nprepping image for display: {image_id}\n\n")
 
-    try:
-        base_template = request.form['prompt_template']
+    try: 
+        image_bytes = fetch_image_from_db(image_id)
     except Exception as e:
-        return handle_api_error("Server-side error, could not read prompt_template from the POST request in method set_prompt_template, encountered error: ", e)
+        handle_local_error("Could not fetch image for display, encountered error: ", e)
     
     try:
-        write_config({'base_template':base_template})
+        encoded = base64.b64encode(image_bytes).decode('utf-8')
     except Exception as e:
-        return handle_api_error("Could not update base_template in method set_prompt_template, encountered error: ", e)
+        handle_local_error("Could not encode image for display URI, encountered error: ", e)
 
-    return jsonify({'success':True})
+    # Return an HTML response with the embedded image:
+    data_uri = f"data:image/jpeg;base64,{encoded}"
+    html_content = f'<img src="{data_uri}" alt="Image">'
 
+    return html_content
 
-@app.route('/fetch_file_list_for_vector_db', methods=['POST'])
-def fetch_file_list_for_vector_db():
 
-    print("Loading file list for selected VectorDB")
+def extract_significant_phrases(query):
+    print("Extracting significant phrases")
 
     try:
-        selected_embedding_model_choice = request.form['embedding_model_choice']
+        nltk.download('stopwords')
+        stop_words = set(stopwords.words('english'))
     except Exception as e:
-        return handle_api_error("Server-side error, could not read embedding_model_choice from the POST request in method fetch_file_list_for_vector_db, encountered error: ", e)
-
-    # For the VectorDB presently picked by the user in the dropdown, obtain the associated VectorDB folder for the select query:
-    vdb_for_select = ""
+        handle_error_no_return("Failed to download & set stopwords, encountered error: ", e)
+    
     try:
-        if selected_embedding_model_choice == 'bge_large':
-            read_return = read_config(['vectordb_bge_large_folder'])
-            vdb_for_select = read_return['vectordb_bge_large_folder']
-            
-        elif selected_embedding_model_choice == 'bge_base':
-            read_return = read_config(['vectordb_bge_base_folder'])
-            vdb_for_select = read_return['vectordb_bge_base_folder']
-
-        elif selected_embedding_model_choice == 'sbert_mpnet_base_v2':
-            read_return = read_config(['vectordb_sbert_folder'])
-            vdb_for_select = read_return['vectordb_sbert_folder']
-
-        elif selected_embedding_model_choice == 'openai_text_ada':
-            read_return = read_config(['vectordb_openai_folder'])
-            vdb_for_select = read_return['vectordb_openai_folder']
+        tokens = [token for token in query.lower().split() if token not in stop_words]
+    except Exception as e:
+        handle_local_error("Could not extract significant tokens, encountered error: ", e)
 
-        vdb_for_select = '%' + os.path.basename(vdb_for_select)
-        print(f'vdb_for_select: {vdb_for_select}')
+    print(f"\nReturning tokens: {tokens}\n")
+    return tokens
 
-    except Exception as e:
-        return handle_api_error("Could not create new VectorDB in reset_vector_db_on_disk, encountered error: ", e)
 
+def calculate_relevance_score(phrases, document_content):
+    #print("calculating relevance score")
+    
     try:
-        read_return = read_config(['sqlite_docs_loaded_db'])
-        sqlite_docs_loaded_db = read_return['sqlite_docs_loaded_db']
+        content_lower = document_content.lower()
     except Exception as e:
-        return handle_api_error("Missing sqlite_docs_loaded_db in config.json in method fetch_file_list_for_vector_db. Error: ", e)
-
-    file_row_list = []
+        handle_local_error("Could not read document_content in calculate_relevance_score(), encountered error: ", e)
+    
+    #print(f"document content: {content_lower}")
+    
+    #score = sum(1 for phrase in phrases if phrase in content_lower)
     
+    score = 0
     try:
-        conn = sqlite3.connect(sqlite_docs_loaded_db)
-        c = conn.cursor()
+        for phrase in phrases:
+            if phrase in content_lower:
+                print(f"Match found to enable RAG: {phrase}")
+                score += 1
     except Exception as e:
-        return handle_api_error("Could not connect to sqlite_docs_loaded_db database to load file list, encountered error: ", e)
+        handle_local_error("Could not compare phrases in calculate_relevance_score(), encountered error: ", e)
+    
+    return score
 
-    # If the database does not currently exist...
-    try:
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS document_records (
-                    id INTEGER PRIMARY KEY,
-                    document_name TEXT NOT NULL,
-                    embedding_model TEXT NOT NULL,
-                    vectordb_used TEXT,
-                    chunk_size INTEGER,
-                    chunk_overlap INTEGER
-            )
-        ''')
 
-        conn.commit()
-    except Exception as e:
-        handle_local_error("Could not create document_records DB, encountered error: ", e)
+def filter_relevant_documents(query, search_results, threshold=1):
+
+    print("Checking relevant docs to determin if RAG is required")
+
+    do_rag = False
+    page_contents = []
 
     try:
-        c.execute("SELECT document_name, vectordb_used, chunk_size, chunk_overlap FROM document_records where vectordb_used LIKE ?", (vdb_for_select,))
+        significant_phrases = extract_significant_phrases(query)
     except Exception as e:
-        return handle_api_error("Could not get document list from document_records db, encountered error: ", e)
+        handle_local_error("Could not extract significant phrases, encountered error: ", e)
     
+    print(f"significant tokens: {significant_phrases}")
+    #relevant_documents = []
+
     try:
-        result = c.fetchall()
+        for document in search_results:
+            # check for non-empty source field
+            if document.page_content:
+                page_contents.append(document.page_content)
+
+            if not do_rag:  # if do_rag has already been set to true, why look?
+                if document.metadata.get('source'):
+                    score = calculate_relevance_score(significant_phrases, document.page_content)
+                    if score >= threshold:
+                        #relevant_documents.append(document)
+                        print("Must do RAG!")
+                        do_rag = True
+    except Exception as e:
+        handle_local_error("Could not read calculate relevance score, encountered error: ", e)
+
+    #return relevant_documents
+    return page_contents, do_rag
+
+
+#########################------------Reranker-------------###############################
+# The bi-encoder & cross-encoder models are loaded once and kept warm. Bi-encoder vectors for each chunk are computed at ingestion time and
+# stored keyed by a hash of the chunk's text, so reranking a query needs a single query encode plus a vectorized cosine over the candidates.
+# With reranker_mode 'cross_encoder', the top reranker_candidate_budget candidates by bi-encoder score are re-scored via the cross-encoder.
+RERANKER_MODELS = {}    # model name -> SentenceTransformer or CrossEncoder instance
+RERANKER_MODELS_LOCK = threading.Lock()
 
-        for list_item in result:
-            file_row_list.append(list(list_item))
-    except Exception as e:
-        return handle_api_error("Could not parse document list from document_records db, encountered error: ", e)
 
-    #print(f'returning docs loaded list: {file_row_list}')
+def get_reranker_model(model_name, cross_encoder=False):
 
-    return jsonify({'success': True, 'file_row_list': file_row_list})
+    with RERANKER_MODELS_LOCK:
+        model = RERANKER_MODELS.get(model_name)
+        if model is None:
+            print(f"\n\nLoading reranker model {model_name}\n\n")
+            model = CrossEncoder(model_name) if cross_encoder else SentenceTransformer(model_name)
+            RERANKER_MODELS[model_name] = model
 
+    return model
 
-@app.route('/reset_vector_db_on_disk', methods=['POST'])
-def reset_vector_db_on_disk():
 
-    print("Resetting selected VectorDB")
+def compute_chunk_text_hash(chunk_text):
+    return hashlib.sha1(chunk_text.encode('utf-8')).hexdigest()
+
+
+def connect_to_rerank_vectors_db():
 
     try:
-        selected_embedding_model_choice = request.form['embedding_model_choice']
+        read_return = read_config(['sqlite_rerank_vectors_db'])
+        sqlite_rerank_vectors_db = read_return['sqlite_rerank_vectors_db']
     except Exception as e:
-        return handle_api_error("Server-side error, could not read embedding_model_choice from the POST request in method reset_vector_db_on_disk, encountered error: ", e)
+        handle_local_error("Missing sqlite_rerank_vectors_db in config.json for method connect_to_rerank_vectors_db. Error: ", e)
 
     try:
-        read_return = read_config(['base_directory'])
-        base_directory = read_return['base_directory']
+        conn = sqlite3.connect(sqlite_rerank_vectors_db, timeout=30)
+        conn.row_factory = sqlite3.Row
     except Exception as e:
-        handle_local_error("Could not read base_directory from config.json for reset_vector_db_on_disk. Error: ", e)
+        handle_local_error("Could not establish connection to rerank vectors DB, encountered error: ", e)
 
+    # If the database does not currently exist...
     try:
-        current_datetime = datetime.datetime.now()
-        formatted_datetime = current_datetime.strftime('%Y-%m-%d-%Hhr-%Mmin-%Ssec')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rerank_vectors (
+                    chunk_text_hash TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (chunk_text_hash, model_name)
+            )
+        ''')
+        conn.commit()
     except Exception as e:
-        return handle_api_error("Could not obtain timestamp in reset_vector_db_on_disk, encountered error: ", e)
+        handle_local_error("Could not create rerank_vectors table, encountered error: ", e)
 
-    # Now that we have all pre-requisite data to create a new VectorDB, proceed to do so by checking the model the user had currently picked from the dropdown: 
-    try:
-        if selected_embedding_model_choice == 'bge_large':
-            vectordb_bge_large_folder = base_directory + '/chroma_db_bge_large_embeddings' + '-' + formatted_datetime
-            write_config({'vectordb_bge_large_folder':vectordb_bge_large_folder})
-            
-        elif selected_embedding_model_choice == 'bge_base':
-            vectordb_bge_base_folder = base_directory + '/chroma_db_bge_base_embeddings' + '-' + formatted_datetime
-            write_config({'vectordb_bge_base_folder':vectordb_bge_base_folder})
+    return conn
 
-        elif selected_embedding_model_choice == 'sbert_mpnet_base_v2':
-            vectordb_sbert_folder = base_directory + '/chroma_db_sbert_embeddings' + '-' + formatted_datetime
-            write_config({'vectordb_sbert_folder':vectordb_sbert_folder})
 
-        elif selected_embedding_model_choice == 'openai_text_ada':
-            vectordb_openai_folder = base_directory + '/chroma_db_openai_embeddings' + '-' + formatted_datetime
-            write_config({'vectordb_openai_folder':vectordb_openai_folder})
+# Method to fetch stored bi-encoder vectors, encoding & storing any missing (ex: chunks ingested before vectors were precomputed) | returns a float32 matrix, one normalized row per text
+def get_rerank_vectors(chunk_texts, model_name):
 
-    except Exception as e:
-        return handle_api_error("Could not create new VectorDB in reset_vector_db_on_disk, encountered error: ", e)
+    chunk_text_hashes = [compute_chunk_text_hash(chunk_text) for chunk_text in chunk_texts]
+    vectors_by_hash = {}
 
-    restart_required = True
-    global VECTORDB_CHANGE_RELOAD_TRIGGER_SET
-    VECTORDB_CHANGE_RELOAD_TRIGGER_SET = True
+    conn = connect_to_rerank_vectors_db()
     try:
-        read_return = read_config(['embedding_model_choice'])
-        set_embedding_model_choice = read_return['embedding_model_choice']
-        if set_embedding_model_choice != selected_embedding_model_choice:
-            restart_required = False
-            VECTORDB_CHANGE_RELOAD_TRIGGER_SET = False
-    except Exception as e:
-        handle_error_no_return("Could not compare selected and set embedding models when determining if restart_required in reset_vector_db_on_disk(), encountered error: ", e)
-
-    #print(f'returning docs loaded list: {file_row_list}')
+        unique_hashes = list(set(chunk_text_hashes))
+        for i in range(0, len(unique_hashes), 500):     # stay within SQLite's host parameter limit
+            batch = unique_hashes[i:i+500]
+            rows = conn.execute(f"SELECT chunk_text_hash, vector FROM rerank_vectors WHERE model_name = ? AND chunk_text_hash IN ({','.join('?' * len(batch))})", [model_name] + batch).fetchall()
+            for row in rows:
+                vectors_by_hash[row['chunk_text_hash']] = np.frombuffer(row['vector'], dtype=np.float32)
 
-    return jsonify({'success': True, "restart_required": restart_required})
+        missing = {chunk_text_hash: chunk_text for chunk_text_hash, chunk_text in zip(chunk_text_hashes, chunk_texts) if chunk_text_hash not in vectors_by_hash}
+        if missing:
+            model = get_reranker_model(model_name)
+            missing_vectors = model.encode(list(missing.values()), batch_size=64, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+            conn.executemany('INSERT OR REPLACE INTO rerank_vectors (chunk_text_hash, model_name, vector) VALUES (?, ?, ?)', [(chunk_text_hash, model_name, vector.tobytes()) for chunk_text_hash, vector in zip(missing.keys(), missing_vectors)])
+            conn.commit()
+            vectors_by_hash.update(zip(missing.keys(), missing_vectors))
+    finally:
+        conn.close()
 
+    return np.vstack([vectors_by_hash[chunk_text_hash] for chunk_text_hash in chunk_text_hashes])
 
-@app.route('/load_chat_history_list')
-def load_chat_history_list():
 
-    print("loading chat history list for sidebar")
+# Called at ingestion time so queries don't have to encode candidate chunks
+def precompute_rerank_vectors(documents):
 
     try:
-        read_return = read_config(['sqlite_history_db'])
-        sqlite_history_db = read_return['sqlite_history_db']
+        model_name = read_config(['reranker_bi_encoder_model'])['reranker_bi_encoder_model']
     except Exception as e:
-        return handle_api_error("Missing sqlite_history_db in config.json in method load_chat_history_list. Error: ", e)
+        handle_local_error("Missing reranker_bi_encoder_model in config.json for method precompute_rerank_vectors. Error: ", e)
 
-    history_id_list = []
-    
-    try:
-        conn = sqlite3.connect(sqlite_history_db)
-        c = conn.cursor()
-    except Exception as e:
-        return handle_api_error("Could not connect to sqlite_history_db database to load chat history list, encountered error: ", e)
+    get_rerank_vectors([doc.page_content for doc in documents], model_name)
+
+
+def rerank_results_ml(query, documents, top_n=5):
+
+    if not documents:
+        return []
 
     try:
-        c.execute("SELECT DISTINCT chat_id FROM chat_history")
+        read_return = read_config(['reranker_mode', 'reranker_bi_encoder_model', 'reranker_cross_encoder_model', 'reranker_candidate_budget'])
+        reranker_mode = read_return['reranker_mode']
+        reranker_bi_encoder_model = read_return['reranker_bi_encoder_model']
+        reranker_cross_encoder_model = read_return['reranker_cross_encoder_model']
+        reranker_candidate_budget = int(read_return['reranker_candidate_budget'])
     except Exception as e:
-        return handle_api_error("Could not get list from chat history db, encountered error: ", e)
+        handle_local_error("Missing reranker values in config.json for method rerank_results_ml. Error: ", e)
+
+    # Encode the query, and cosine against the stored (normalized) document vectors
+    model = get_reranker_model(reranker_bi_encoder_model)
+    query_embedding = model.encode(query, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+    doc_embeddings = get_rerank_vectors([doc.page_content for doc in documents], reranker_bi_encoder_model)
+    cosine_scores = doc_embeddings @ query_embedding
+
+    # Sort by score in descending order
+    sorted_indexes = np.argsort(-cosine_scores, kind='stable')
+
+    if reranker_mode == 'cross_encoder':
+        candidate_indexes = sorted_indexes[:max(top_n, reranker_candidate_budget)]
+        try:
+            cross_encoder = get_reranker_model(reranker_cross_encoder_model, cross_encoder=True)
+            cross_scores = cross_encoder.predict([(query, documents[idx].page_content) for idx in candidate_indexes])
+            sorted_indexes = candidate_indexes[np.argsort(-np.asarray(cross_scores), kind='stable')]
+        except Exception as e:
+            handle_error_no_return("Could not rerank via the cross-encoder, using bi-encoder ranking. Encountered error: ", e)
+
+    # Reorder the original documents based on the sorted indexes
+    ranked_documents = [documents[idx] for idx in sorted_indexes[:top_n]]
     
-    try:
-        result = c.fetchall()
+    return ranked_documents
 
-        for list_item in result:
-            history_id_list.append(list_item)
-    except Exception as e:
-        return handle_api_error("Could not parse chat history list from db, encountered error: ", e)
+#########################-------------------------------------###############################
 
-    #print(f'returning chat hsitory list: {history_id_list}')
 
-    return jsonify({'success': True, 'history_list': history_id_list})
+#########################------------Retrieval Cache-------------###############################
+# Bounded in-memory LRU caches for the query path, so a question asked again (in another tab, or by another user) skips the query embedding,
+# similarity search & rerank. Query vectors are keyed on (normalized query, embedding model), reranked chunk lists additionally on the VectorDB,
+# its corpus version, the chat's scope & hybrid search. A VectorDB's corpus version is bumped whenever chunks are added to or deleted from it,
+# so results cached for its previous contents are never served again and simply age out; a reset starts a new VectorDB folder altogether.
+# Both caches are cleared when a config key affecting retrieval changes.
+RETRIEVAL_CACHE_CONFIG_KEYS = VECTOR_STORE_CONFIG_KEYS + ['use_hybrid_search', 'hybrid_search_lexical_k', 'hybrid_search_rrf_k', 'retrieval_fetch_k', 'retrieval_max_distance', 'retrieval_collapse_same_page', 'retrieval_use_mmr', 'retrieval_mmr_lambda', 'retrieval_mmr_k', 'reranker_mode', 'reranker_bi_encoder_model', 'reranker_cross_encoder_model', 'reranker_candidate_budget']
+CORPUS_VERSIONS = {}    # vectordb_used -> int
+CORPUS_VERSIONS_LOCK = threading.Lock()
 
 
-@app.route('/load_chat_history', methods=['POST'])
-def load_chat_history():
+class LRUCache:
 
-    global CHAT_ID
-    global SEQUENCE_ID
-    global HISTORY_SUMMARY
-    global HISTORY_MEMORY_WITH_BUFFER
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
 
-    print("loading chat history")
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
 
-    try:
-        read_return = read_config(['sqlite_history_db'])
-        sqlite_history_db = read_return['sqlite_history_db']
-    except Exception as e:
-        handle_local_error("Missing sqlite_history_db in config.json in method load_chat_history. Error: ", e)
+    # max_entries is passed per call so a change in config.json applies straight away, 0 disables the cache
+    def put(self, key, value, max_entries):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(0, max_entries):
+                self._entries.popitem(last=False)
 
-    # Clear chat history of current chat, prep for loading historical chat summary:
-    # try:
-    #     HISTORY_MEMORY_WITH_BUFFER.chat_memory.clear()
-    #     HISTORY_MEMORY_WITH_BUFFER = ConversationSummaryBufferMemory(llm=LLM, max_token_limit=300, return_messages=False)
-    #     HISTORY_SUMMARY = {}
-    # except Exception as e:
-    #     handle_error_no_return("Could not clear memory when loading chat history, encountered error: ", e)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
-    try:
-        chat_id_for_history_search = request.form['chat_id']
-        CHAT_ID = request.form['chat_id']
-    except Exception as e:
-        return handle_api_error("Could not retrieve Chat ID from request form, encountered error: ", e)
 
+QUERY_EMBEDDING_CACHE = LRUCache()      # (normalized query, embedding model key) -> query vector
+RETRIEVAL_RESULT_CACHE = LRUCache()     # (normalized query, embedding model key, vectordb_used, corpus version, scope, use_hybrid_search, top_n) -> reranked docs
+
+
+def get_corpus_version(vectordb_used):
+    with CORPUS_VERSIONS_LOCK:
+        return CORPUS_VERSIONS.get(vectordb_used, 0)
+
+
+# Method to mark vectordb_used's contents as changed, called after chunks are added to or deleted from it
+def bump_corpus_version(vectordb_used):
+    with CORPUS_VERSIONS_LOCK:
+        CORPUS_VERSIONS[vectordb_used] = CORPUS_VERSIONS.get(vectordb_used, 0) + 1
+
+
+# Case & whitespace differences don't make for a different question:
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+def read_retrieval_cache_sizes():
     try:
-        conn = sqlite3.connect(sqlite_history_db)
-        c = conn.cursor()
+        read_return = read_config(['query_embedding_cache_max_entries', 'retrieval_cache_max_entries'])
+        return int(read_return['query_embedding_cache_max_entries']), int(read_return['retrieval_cache_max_entries'])
     except Exception as e:
-        return handle_api_error("Could not connect to chat history database, encountered error: ", e)
+        handle_error_no_return("Could not read the retrieval cache sizes from config.json, caching disabled. Error: ", e)
+        return 0, 0
 
-    sequence_id_for_history_search = 1
-    retrieve_history = True
-    chat_history = []
-    old_chat_model = ""
 
-    while(retrieve_history):
+# Whether embedding_function (the configured model's) is the one vector_store searches with: not so while VECTOR_STORE is being swapped over,
+# in which case nothing is cached under the configured model's key
+def is_cacheable_embedding_function(vector_store, embedding_function):
+    return embedding_function is not None and getattr(vector_store, '_embedding_function', None) is embedding_function
 
-        try:
-            c.execute("SELECT user_query FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
-            result = c.fetchone()
-            
-            user_message = str(result[0])
 
-            user_message = user_message.strip('\n')
-            regex_to_swap_multiple_spaces_with_newline = r' {2,}'
-            user_message = re.sub(regex_to_swap_multiple_spaces_with_newline, '<br>', user_message)
+# Method to embed query with vector_store's embedding model, re-using the vector when the same (normalized) query was embedded before
+def get_query_embedding(query, vector_store, embedding_function):
 
-            user_message = '<div class="user-message">' + user_message + '</div>'
+    if not is_cacheable_embedding_function(vector_store, embedding_function):
+        return vector_store._embedding_function.embed_query(query)
 
-            chat_history.append(user_message)
+    cache_key = (normalize_query(query), get_embedding_model_key())
+    query_embedding = QUERY_EMBEDDING_CACHE.get(cache_key)
+    if query_embedding is None:
+        query_embedding = embedding_function.embed_query(query)
+        QUERY_EMBEDDING_CACHE.put(cache_key, query_embedding, read_retrieval_cache_sizes()[0])
 
-            c.execute("SELECT llm_response FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
-            result = c.fetchone()
+    return query_embedding
 
-            result = str(result[0])
-            result_parts = result.split("pdf_pane_data=",1)
-            # llm_response = '<div class="llm-wrapper"> <div class="llm-response">' + str(result[0]) + '</div>'
-            llm_response = '<div class="response-and-viewer-container"><div class="llm-wrapper"> <div class="llm-response">' + result_parts[0]
 
-        except Exception as e:
-            return handle_api_error("Could not retrieve chat history, encountered error: ", e)
-        
-        llm_response = llm_response.strip('\n')
-        llm_response = llm_response.replace('\n\n', '<br><br>')
-        llm_response = llm_response.replace('\n', '<br>')
-        
-        try:
-            c.execute("SELECT user_rating FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
-            result = c.fetchone()
-        except Exception as e:
-            handle_error_no_return("Could not fetch user rating, encountered error: ", e)
+# Method to obtain the top_n reranked chunks for query, served from the cache when the same (normalized) query was last answered against the
+# same corpus version & scope | raises if the similarity search fails, so a failure is never cached
+def retrieve_reranked_docs(query, vector_store, embedding_function, use_hybrid_search, sources=None, top_n=5):
 
-        response_rated = False
-        user_rating_for_history_chat = None
+    cache_key = None
+    if is_cacheable_embedding_function(vector_store, embedding_function):
+        vectordb_used = vector_store._persist_directory
+        scope_key = tuple(sorted(sources)) if sources is not None else None
+        cache_key = (normalize_query(query), get_embedding_model_key(), vectordb_used, get_corpus_version(vectordb_used), scope_key, use_hybrid_search, top_n)
 
-        if result[0]:
-            response_rated = True
-            try:
-                user_rating_for_history_chat = int(result[0])
-                #print(f'rating exists: {user_rating_for_history_chat}')
-            except Exception as e:
-                handle_error_no_return("Could not retrieve integer value of user rating, encountered error: ", e)
+        cached_docs = RETRIEVAL_RESULT_CACHE.get(cache_key)
+        if cached_docs is not None:
+            print("Re-using reranked chunks from the retrieval cache")
+            return list(cached_docs)
 
+    scored_candidates = retrieve_candidates(query, vector_store, embedding_function, use_hybrid_search, sources)
+    docs = rerank_results_ml(query, [doc for doc, _ in scored_candidates], top_n=top_n)
 
-        llm_rating = f'''<div class="star-rating" data-rated={response_rated} rating-chat-id={chat_id_for_history_search} rating-sequence-id={sequence_id_for_history_search}>
-        <i class="far fa-star" data-rate="1"></i>
-        <i class="far fa-star" data-rate="2"></i>
-        <i class="far fa-star" data-rate="3"></i>
-        <i class="far fa-star" data-rate="4"></i>
-        <i class="far fa-star" data-rate="5"></i>
-        </div>
-        </div>
-        </div>'''
+    if cache_key is not None:
+        RETRIEVAL_RESULT_CACHE.put(cache_key, list(docs), read_retrieval_cache_sizes()[1])
 
+    return docs
 
-        if user_rating_for_history_chat:
-            rating_parts = llm_rating.split("far", user_rating_for_history_chat)
-            if len(rating_parts) <= user_rating_for_history_chat:
-                llm_rating = "fas".join(rating_parts)
-            else:
-                llm_rating = "fas".join(rating_parts[:-1]) + "fas" + "far".join(rating_parts[-1:])
 
-        llm_response += llm_rating
+def clear_retrieval_caches_on_config_change(changed_keys, previous_config):
 
-        if len(result_parts) > 1:
-            llm_response += result_parts[1]
-            llm_response += "</div>"
-            llm_response = llm_response.strip('\n')
-            llm_response = llm_response.replace('\n\n', '<br><br>')
-            llm_response = llm_response.replace('\n', '<br>')
+    if any(key in changed_keys for key in RETRIEVAL_CACHE_CONFIG_KEYS):
+        QUERY_EMBEDDING_CACHE.clear()
+        RETRIEVAL_RESULT_CACHE.clear()
 
-        chat_history.append(llm_response)
+    return False
 
-        # Increment sequence ID for next iteration:
-        sequence_id_for_history_search += 1
 
-        # But first, check to see if next sequence exists!
-        try:
-            c.execute("SELECT EXISTS(SELECT 1 FROM chat_history WHERE chat_id = ? AND sequence_id = ?)", (int(chat_id_for_history_search), int(sequence_id_for_history_search)))
-            exists = c.fetchone()[0]
-        except Exception as e:
-            return handle_api_error("Could not determine if next sequence exists in chat history DB, encountered error: ", e)
-            
-        if not exists:
-            SEQUENCE_ID = sequence_id_for_history_search - 1
-            retrieve_history = False
-            try:
-                c.execute("SELECT llm_model FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (CHAT_ID, SEQUENCE_ID))
-                result = c.fetchone()
-                old_chat_model = str(result[0])
-            except Exception as e:
-                handle_error_no_return("Could not determine previously used LLM in chat, encountered error: ", e)
-            try:
-                c.execute("SELECT history_summary FROM chat_history WHERE chat_id = ? AND sequence_id = ?", (CHAT_ID, SEQUENCE_ID))
-                result = c.fetchone()
-                history_summary_dict = str(result[0])
-            except Exception as e:
-                handle_error_no_return("Could not fetch history summary of last chat, encountered error: ", e)
-            c.close()
+subscribe_to_config_changes(clear_retrieval_caches_on_config_change)
 
-    # Convert History Summary and add a new key indicating it was recently cleared!
-    if history_summary_dict is not None and history_summary_dict != "" and history_summary_dict != 'None':
-        print(f"\n\history_summary_dict string from old chat: {history_summary_dict}\n\n")
+#########################-------------------------------------###############################
+
+
+#########################------------Semantic Answer Cache-------------###############################
+# Opt-in (use_semantic_answer_cache) cache of the LLM's answers to the opening question of a chat, with their citation payloads, indexed by the
+# question's embedding: a new opening question within semantic_answer_cache_similarity_threshold (cosine similarity) of a cached one is answered
+# from the cache, provided the embedding model, the VectorDB & its corpus version, the chat's scope, the LLM & the system prompt (base_template)
+# all match. Follow-up questions depend on the chat so far and always go to the LLM. Entries expire semantic_answer_cache_ttl_seconds after being
+# stored. Kept in memory like the retrieval caches, since corpus versions restart with the app.
+SEMANTIC_ANSWER_CACHE_LLM_KEYS = LLM_TRIGGER_KEYS_FOR_APP_RESTART + ['force_enable_rag', 'force_disable_rag']
+SEMANTIC_ANSWER_CACHE = []      # entries, oldest first
+SEMANTIC_ANSWER_CACHE_LOCK = threading.Lock()
+SEMANTIC_ANSWER_CACHE_STATS = {'hits': 0, 'misses': 0, 'expired': 0, 'stored': 0, 'evicted': 0}
+
+
+def read_semantic_answer_cache_settings():
+    read_return = read_config(['use_semantic_answer_cache', 'semantic_answer_cache_similarity_threshold', 'semantic_answer_cache_ttl_seconds', 'semantic_answer_cache_max_entries'])
+    return bool(read_return['use_semantic_answer_cache']), float(read_return['semantic_answer_cache_similarity_threshold']), float(read_return['semantic_answer_cache_ttl_seconds']), int(read_return['semantic_answer_cache_max_entries'])
+
+
+# Fingerprint of the LLM settings & system prompt an answer is generated with. HF-Waitress keeps its model in hf_config.json rather than config.json
+def get_llm_fingerprint():
+
+    llm_settings = read_config(SEMANTIC_ANSWER_CACHE_LLM_KEYS)
+    if llm_settings['local_llm_server'] == 'hf-waitress':
         try:
-            HISTORY_SUMMARY = ast.literal_eval(history_summary_dict)    #cast as dictionary
-            HISTORY_SUMMARY["has_been_reset"] = True
+            with open('hf_config.json', 'r') as file:
+                llm_settings['hf_waitress_model_id'] = json.load(file)['model_id']
         except Exception as e:
-            handle_error_no_return("Could not cast history summary string from DB to dict and/or set has_been_reset boolean, encountered error: ", e)
+            handle_error_no_return("Could not read the HF-Waitress model_id from hf_config.json for the semantic answer cache. Encountered error: ", e)
 
-    # Temp prints:
-    # print(f"\n\nHISTORY_SUMMARY: {HISTORY_SUMMARY}\n\n")
-    # print(f"\n\history_summary_dict: {history_summary_dict}\n\n")
-    # print(f"\n\nHISTORY_MEMORY_WITH_BUFFER.summary: {HISTORY_MEMORY_WITH_BUFFER.summary}\n\n")
-    # print(f"\n\nHISTORY_MEMORY_WITH_BUFFER.chat_memory.messages: {HISTORY_MEMORY_WITH_BUFFER.chat_memory.messages}\n\n")
-    print(f'\n\nChat history loaded for chat with model: {old_chat_model}\n\n')
+    return hashlib.sha256(json.dumps(llm_settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
 
-    return jsonify({'success': True, 'chat_history': chat_history, 'old_chat_model': old_chat_model})
 
+# Method to obtain what a cached answer must match besides the question: None when the answer cache is disabled or cannot be used for this query
+def get_semantic_answer_cache_context(vector_store, embedding_function, use_hybrid_search, sources):
 
-@app.route('/init_chat_history_db')
-def init_chat_history_db():
+    use_semantic_answer_cache, _, _, _ = read_semantic_answer_cache_settings()
+    if not use_semantic_answer_cache or not is_cacheable_embedding_function(vector_store, embedding_function):
+        return None
 
-    global CHAT_ID
+    vectordb_used = vector_store._persist_directory
+    scope_key = tuple(sorted(sources)) if sources is not None else None
+    return (get_embedding_model_key(), vectordb_used, get_corpus_version(vectordb_used), scope_key, use_hybrid_search, get_llm_fingerprint())
 
-    try:
-        read_return = read_config(['sqlite_history_db'])
-        sqlite_history_db = read_return['sqlite_history_db']
-    except Exception as e:
-        return handle_api_error("Missing sqlite_history_db in config.json in method init_chat_history_db. Error: ", e)
 
-    # Connect to chat_history.db to determine appropriate chat_id
-    try:
-        conn = sqlite3.connect(sqlite_history_db)
-        c = conn.cursor()
-    except Exception as e:
-        return handle_api_error("Could not connect to chat history database, encountered error: ", e)
+def normalize_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def count_semantic_answer_cache_event(event, count=1):
+    with SEMANTIC_ANSWER_CACHE_LOCK:
+        SEMANTIC_ANSWER_CACHE_STATS[event] += count
+
+
+# Method to find the cached answer to the question closest to query_embedding under context, if within the similarity threshold | returns the entry or None
+def find_cached_answer(query_embedding, context):
+
+    _, similarity_threshold, _, _ = read_semantic_answer_cache_settings()
+    query_vector = normalize_vector(query_embedding)
+    now = time.time()
+
+    with SEMANTIC_ANSWER_CACHE_LOCK:
+        live_entries = [entry for entry in SEMANTIC_ANSWER_CACHE if entry['expires_at'] > now]
+        SEMANTIC_ANSWER_CACHE_STATS['expired'] += len(SEMANTIC_ANSWER_CACHE) - len(live_entries)
+        SEMANTIC_ANSWER_CACHE[:] = live_entries
+
+        candidates = [entry for entry in live_entries if entry['context'] == context]
+        best_entry = None
+        if candidates:
+            similarities = np.stack([entry['query_vector'] for entry in candidates]) @ query_vector
+            best_index = int(np.argmax(similarities))
+            if similarities[best_index] >= similarity_threshold:
+                best_entry = candidates[best_index]
+                print(f"Semantic answer cache hit, similarity {similarities[best_index]:.4f} to: {best_entry['user_query']}")
+
+        SEMANTIC_ANSWER_CACHE_STATS['hits' if best_entry is not None else 'misses'] += 1
+
+    return best_entry
+
+
+def store_answer_in_cache(query_embedding, context, user_query, do_rag, docs, llm_response, reference_response, download_link_html, stream_session_id, highlighted_file_names):
+
+    _, _, ttl_seconds, max_entries = read_semantic_answer_cache_settings()
+    now = time.time()
+    entry = {
+        'query_vector': normalize_vector(query_embedding),
+        'context': context,
+        'user_query': user_query,
+        'do_rag': do_rag,
+        'docs': list(docs),
+        'llm_response': llm_response,
+        'reference_response': reference_response,
+        'download_link_html': download_link_html,
+        'stream_session_id': stream_session_id,
+        'highlighted_file_names': list(highlighted_file_names),
+        'created_at': now,
+        'expires_at': now + ttl_seconds,
+    }
+
+    with SEMANTIC_ANSWER_CACHE_LOCK:
+        SEMANTIC_ANSWER_CACHE.append(entry)
+        SEMANTIC_ANSWER_CACHE_STATS['stored'] += 1
+        evicted_count = max(0, len(SEMANTIC_ANSWER_CACHE) - max(0, max_entries))
+        del SEMANTIC_ANSWER_CACHE[:evicted_count]
+        SEMANTIC_ANSWER_CACHE_STATS['evicted'] += evicted_count
+
 
-    # If the database does not currently exist...
-    try:
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS chat_history (
-                        id INTEGER PRIMARY KEY,
-                        chat_id INTEGER,
-                        sequence_id INTEGER,
-                        user_query TEXT,
-                        llm_response TEXT,
-                        user_rating INTEGER,
-                        llm_model TEXT, 
-                        prompt_template TEXT,
-                        history_summary TEXT
-            )
-        ''')
-        conn.commit()
-    except Exception as e:
-        return handle_api_error("Could not create new chat history db, encountered error: ", e)
+# The citation payload's element ids & highlighted PDFs are named after the stream_session_id it was built for: copy the highlighted PDFs over to
+# the new stream_session_id's names, so the chat's (& chat history's) copies stay independent | raises if a highlighted PDF is gone
+def reissue_cached_citations(entry, stream_session_id):
 
-    try:
-        c.execute("SELECT COALESCE(MAX(chat_id), 0) FROM chat_history")
-        # "The COALESCE function accepts two or more arguments and returns the first non-null argument."
-        # This accounts for an empty DB!
+    highlighted_pdfs_path = read_config(['highlighted_docs'])['highlighted_docs']
+    for file_name in entry['highlighted_file_names']:
+        shutil.copyfile(os.path.join(highlighted_pdfs_path, file_name), os.path.join(highlighted_pdfs_path, file_name.replace(entry['stream_session_id'], stream_session_id)))
 
-        result = c.fetchone()
+    return entry['reference_response'].replace(entry['stream_session_id'], stream_session_id), entry['download_link_html'].replace(entry['stream_session_id'], stream_session_id)
 
-        # 'result' will be a tuple, so extract the first element
-        max_chat_id = result[0]
 
-        new_chat_id = max_chat_id + 1
-        CHAT_ID = new_chat_id
+def fetch_semantic_answer_cache_stats():
+    with SEMANTIC_ANSWER_CACHE_LOCK:
+        stats = dict(SEMANTIC_ANSWER_CACHE_STATS)
+        stats['entries'] = len(SEMANTIC_ANSWER_CACHE)
 
-        print(f"Chat history DB initialised with CHAT_ID: {CHAT_ID}")
-    except Exception as e:
-        return handle_api_error("Could not set CHAT_ID, encountered error: ", e)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
 
-    conn.close()
 
-    return jsonify({'success': True, 'chat_id': CHAT_ID})
+# Answers cached under other retrieval settings would no longer be the ones given, so they go, the LLM & system prompt are part of each entry's context
+def clear_semantic_answer_cache_on_config_change(changed_keys, previous_config):
 
+    if any(key in changed_keys for key in RETRIEVAL_CACHE_CONFIG_KEYS):
+        with SEMANTIC_ANSWER_CACHE_LOCK:
+            SEMANTIC_ANSWER_CACHE.clear()
 
-def fetch_image_from_db(image_id):
+    return False
 
-    try:
-        read_return = read_config(['sqlite_images_db'])
-        sqlite_images_db = read_return['sqlite_images_db']
-    except Exception as e:
-        handle_local_error("Missing sqlite_history_db in config.json in method fetch_image_from_db. Error: ", e)
-    
-    # 1 - Connect to DB
-    try:
-        conn = sqlite3.connect(sqlite_images_db)
-    except Exception as e:
-        handle_local_error("Could not connect to images database, encountered error: ", e)
-    
-    # 2 - Get Images
-    try:
-        conn.row_factory = sqlite3.Row
-        row = conn.execute('SELECT image_data FROM images WHERE id = ?', (image_id,)).fetchone()
-        images_bytes = row['image_data'] if row else None
-    except Exception as e:
-        handle_local_error("Could not fetch image from DB, encountered error: ", e)
-    
-    conn.close()
-    
-    return images_bytes
 
+subscribe_to_config_changes(clear_semantic_answer_cache_on_config_change)
 
-@app.route('/image_display/<int:image_id>')
-def image_display(image_id):
-    print(f"\n\nprepping image for display: {image_id}\n\n")
 
-    try: 
-        image_bytes = fetch_image_from_db(image_id)
-    except Exception as e:
-        handle_local_error("Could not fetch image for display, encountered error: ", e)
-    
+@app.route('/semantic_answer_cache_stats')
+def semantic_answer_cache_stats():
     try:
-        encoded = base64.b64encode(image_bytes).decode('utf-8')
+        return jsonify({'success': True, 'stats': fetch_semantic_answer_cache_stats()})
     except Exception as e:
-        handle_local_error("Could not encode image for display URI, encountered error: ", e)
+        return handle_api_error("Could not fetch the semantic answer cache's stats, encountered error: ", e)
 
-    # Return an HTML response with the embedded image:
-    data_uri = f"data:image/jpeg;base64,{encoded}"
-    html_content = f'<img src="{data_uri}" alt="Image">'
+#########################-------------------------------------###############################
 
-    return html_content
 
+#########################------------Retrieval-------------###############################
+# Candidates are carried as (document, score) pairs through each stage: similarity search (score = Chroma distance), a distance threshold,
+# optional fusion with lexical results (score = RRF score), collapsing of chunks from the same page, and MMR diversification. Reranking
+# then only sees the candidates that survived, rather than a fixed k.
+def apply_distance_threshold(scored_docs, max_distance):
+    if max_distance is None:
+        return scored_docs
+    return [(doc, distance) for doc, distance in scored_docs if distance <= max_distance]
 
-def extract_significant_phrases(query):
-    print("Extracting significant phrases")
 
-    try:
-        nltk.download('stopwords')
-        stop_words = set(stopwords.words('english'))
-    except Exception as e:
-        handle_error_no_return("Failed to download & set stopwords, encountered error: ", e)
-    
-    try:
-        tokens = [token for token in query.lower().split() if token not in stop_words]
-    except Exception as e:
-        handle_local_error("Could not extract significant tokens, encountered error: ", e)
+# Keeps the best-ranked chunk per (source, page), as the references & highlighting work per page anyway
+def collapse_same_page_chunks(scored_docs):
 
-    print(f"\nReturning tokens: {tokens}\n")
-    return tokens
+    seen_pages = set()
+    collapsed = []
 
+    for doc, score in scored_docs:
+        page_key = (doc.metadata.get('source'), doc.metadata.get('page_number'))
+        if page_key in seen_pages:
+            continue
+        seen_pages.add(page_key)
+        collapsed.append((doc, score))
+
+    return collapsed
+
+
+# Maximal marginal relevance over the (precomputed) reranker vectors: picks up to k candidates, trading relevance to the query for
+# dissimilarity to candidates already picked via mmr_lambda (1.0 = pure relevance)
+def mmr_select(query, scored_docs, k, mmr_lambda):
+
+    if len(scored_docs) <= 1:
+        return scored_docs[:k]
 
-def calculate_relevance_score(phrases, document_content):
-    #print("calculating relevance score")
-    
-    try:
-        content_lower = document_content.lower()
-    except Exception as e:
-        handle_local_error("Could not read document_content in calculate_relevance_score(), encountered error: ", e)
-    
-    #print(f"document content: {content_lower}")
-    
-    #score = sum(1 for phrase in phrases if phrase in content_lower)
-    
-    score = 0
     try:
-        for phrase in phrases:
-            if phrase in content_lower:
-                print(f"Match found to enable RAG: {phrase}")
-                score += 1
+        model_name = read_config(['reranker_bi_encoder_model'])['reranker_bi_encoder_model']
     except Exception as e:
-        handle_local_error("Could not compare phrases in calculate_relevance_score(), encountered error: ", e)
-    
-    return score
+        handle_local_error("Missing reranker_bi_encoder_model in config.json for method mmr_select. Error: ", e)
 
+    doc_embeddings = get_rerank_vectors([doc.page_content for doc, _ in scored_docs], model_name)
+    query_embedding = get_reranker_model(model_name).encode(query, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+    query_similarities = doc_embeddings @ query_embedding
+    doc_similarities = doc_embeddings @ doc_embeddings.T
 
-def filter_relevant_documents(query, search_results, threshold=1):
+    selected = [int(np.argmax(query_similarities))]
+    remaining = [idx for idx in range(len(scored_docs)) if idx != selected[0]]
 
-    print("Checking relevant docs to determin if RAG is required")
+    while remaining and len(selected) < k:
+        redundancy = doc_similarities[np.ix_(remaining, selected)].max(axis=1)
+        mmr_scores = mmr_lambda * query_similarities[remaining] - (1 - mmr_lambda) * redundancy
+        best = remaining[int(np.argmax(mmr_scores))]
+        selected.append(best)
+        remaining.remove(best)
 
-    do_rag = False
-    page_contents = []
+    return [scored_docs[idx] for idx in selected]
+
+
+# Method to obtain the candidates for reranking | returns (document, score) pairs, best-first
+def retrieve_candidates(query, vector_store, embedding_function, use_hybrid_search, sources=None):
 
     try:
-        significant_phrases = extract_significant_phrases(query)
+        read_return = read_config(['retrieval_fetch_k', 'retrieval_max_distance', 'retrieval_collapse_same_page', 'retrieval_use_mmr', 'retrieval_mmr_lambda', 'retrieval_mmr_k'])
+        retrieval_fetch_k = int(read_return['retrieval_fetch_k'])
+        retrieval_max_distance = read_return['retrieval_max_distance']
+        retrieval_collapse_same_page = read_return['retrieval_collapse_same_page']
+        retrieval_use_mmr = read_return['retrieval_use_mmr']
+        retrieval_mmr_lambda = float(read_return['retrieval_mmr_lambda'])
+        retrieval_mmr_k = int(read_return['retrieval_mmr_k'])
     except Exception as e:
-        handle_local_error("Could not extract significant phrases, encountered error: ", e)
-    
-    print(f"significant tokens: {significant_phrases}")
-    #relevant_documents = []
+        handle_local_error("Missing retrieval values in config.json for method retrieve_candidates. Error: ", e)
 
-    try:
-        for document in search_results:
-            # check for non-empty source field
-            if document.page_content:
-                page_contents.append(document.page_content)
+    # A scope resolving to no documents leaves nothing to search:
+    if sources == []:
+        return []
 
-            if not do_rag:  # if do_rag has already been set to true, why look?
-                if document.metadata.get('source'):
-                    score = calculate_relevance_score(significant_phrases, document.page_content)
-                    if score >= threshold:
-                        #relevant_documents.append(document)
-                        print("Must do RAG!")
-                        do_rag = True
-    except Exception as e:
-        handle_local_error("Could not read calculate relevance score, encountered error: ", e)
+    # docs_with_relevance_score = vector_store.similarity_search_with_relevance_scores(query, 10, embedding_fn=embedding_function)
+    query_embedding = get_query_embedding(query, vector_store, embedding_function)
+    scored_docs = vector_store.similarity_search_by_vector_with_relevance_scores(query_embedding, retrieval_fetch_k, filter=build_source_filter(sources))
+    scored_docs = apply_distance_threshold(scored_docs, retrieval_max_distance)
+    print(f"{len(scored_docs)} candidates within distance {retrieval_max_distance}")
 
-    #return relevant_documents
-    return page_contents, do_rag
+    if use_hybrid_search:
+        try:
+            scored_docs = fuse_with_lexical_results(query, [doc for doc, _ in scored_docs], vector_store._persist_directory, retrieval_fetch_k, sources)
+        except Exception as e:
+            handle_error_no_return("Could not fuse lexical search results, proceeding with similarity search results alone. Encountered error: ", e)
 
+    if retrieval_collapse_same_page:
+        scored_docs = collapse_same_page_chunks(scored_docs)
 
-def rerank_results_ml(query, documents, top_n=5):
-    # Load pre-trained SBERT model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    # Encode the query
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    
-    # Encode the documents
-    doc_embeddings = model.encode([doc.page_content for doc in documents], convert_to_tensor=True)
-    
-    # Compute cosine similarities
-    cosine_scores = util.pytorch_cos_sim(query_embedding, doc_embeddings)[0]
-    
-    # Create a list of (index, score) tuples
-    indexed_scores = list(enumerate(cosine_scores))
-    
-    # Sort by score in descending order
-    sorted_indexes = sorted(indexed_scores, key=lambda x: x[1], reverse=True)
-    
-    # Reorder the original documents based on the sorted indexes
-    ranked_documents = [documents[idx] for idx, _ in sorted_indexes[:top_n]]
-    
-    return ranked_documents
+    if retrieval_use_mmr:
+        try:
+            scored_docs = mmr_select(query, scored_docs, retrieval_mmr_k, retrieval_mmr_lambda)
+        except Exception as e:
+            handle_error_no_return("Could not diversify candidates via MMR, proceeding without. Encountered error: ", e)
+
+    return scored_docs
+
+#########################-------------------------------------###############################
 
 
 def determine_do_rag(query, docs, force_enable_rag, force_disable_rag):
@@ -3307,13 +6672,46 @@ def format_prompt_for_hf_waitress(formatted_prompt, user_query, current_sequence
     return formatted_prompt
 
 
+# Method to close the prompt's assistant turn with llm_response, so the chat can be continued from it
+def append_llm_response_to_prompt(formatted_user_prompt, llm_response, local_llm_server, local_llm_chat_template_format):
+
+    if local_llm_server == 'llama-cpp':
+        if local_llm_chat_template_format == 'llama3':
+            formatted_user_prompt += f"{llm_response}<|eot_id|>"
+        elif local_llm_chat_template_format == 'llama2':
+            formatted_user_prompt += f"{llm_response}</s>"
+        elif local_llm_chat_template_format == 'chatml':
+            formatted_user_prompt += f"{llm_response}<|im_end|>\n"
+        elif local_llm_chat_template_format == 'phi3':
+            formatted_user_prompt += f"{llm_response}<|end|>\n"
+        elif local_llm_chat_template_format == 'command-r':
+            formatted_user_prompt += f"{llm_response}<|END_OF_TURN_TOKEN|>"
+        elif local_llm_chat_template_format == 'deepseek':
+            formatted_user_prompt += f"{llm_response}\n<|EOT|>\n"
+        elif local_llm_chat_template_format == 'deepseek-coder-v2':
+            formatted_user_prompt += f"{llm_response}<|end_of_sentence|>"
+        elif local_llm_chat_template_format == 'vicuna':
+            formatted_user_prompt += f"{llm_response} </s>\n"
+        elif local_llm_chat_template_format == 'openchat':
+            formatted_user_prompt += f"{llm_response}<|end_of_turn|>"
+        elif local_llm_chat_template_format == 'gemma2':
+            formatted_user_prompt += f"{llm_response}<end_of_turn>\n"
+    elif local_llm_server == 'hf-waitress':
+        history_prompt_json = json.loads(formatted_user_prompt)
+        new_response = {"role":"assistant", "content":llm_response}
+        history_prompt_json['messages'].append(new_response)
+        updated_history_prompt_json = json.dumps(history_prompt_json, indent=4)
+        formatted_user_prompt = str(updated_history_prompt_json)
+
+    return formatted_user_prompt
+
+
 @app.route('/setup_for_llama_cpp_response', methods=['POST'])
 def setup_for_llama_cpp_response():
 
     global QUERIES
 
     do_rag = True
-    similarity_threshold = 0.8
 
     stream_session_id = ""
     key_for_vector_results = ""
@@ -3328,16 +6726,13 @@ def setup_for_llama_cpp_response():
 
     # Determine do_rag
     try:
-        read_return = read_config(['local_llm_server', 'use_sbert_embeddings', 'use_openai_embeddings', 'use_bge_base_embeddings', 'use_bge_large_embeddings', 'force_enable_rag', 'force_disable_rag', 'local_llm_chat_template_format', 'base_template'])
-        use_sbert_embeddings = read_return['use_sbert_embeddings']
-        use_openai_embeddings = read_return['use_openai_embeddings']
-        use_bge_base_embeddings = read_return['use_bge_base_embeddings']
-        use_bge_large_embeddings = read_return['use_bge_large_embeddings']
+        read_return = read_config(['local_llm_server', 'force_enable_rag', 'force_disable_rag', 'local_llm_chat_template_format', 'base_template', 'use_hybrid_search'])
         force_enable_rag = read_return['force_enable_rag']
         force_disable_rag = read_return['force_disable_rag']
         local_llm_chat_template_format = read_return['local_llm_chat_template_format']
         base_template = read_return['base_template']
         local_llm_server = read_return['local_llm_server']
+        use_hybrid_search = read_return['use_hybrid_search']
 
     except Exception as e:
         return handle_api_error("Missing values in config.json when attempting to setup_for_streaming_response. Error: ", e)
@@ -3346,6 +6741,8 @@ def setup_for_llama_cpp_response():
         # Attempt to get query data
         user_query = request.json['user_query']
         chat_id = request.json['chat_id']
+        scope_document_ids = request.json.get('document_ids', [])
+        scope_document_set_ids = request.json.get('document_set_ids', [])
 
         # Store the query associated with the ID
         QUERIES[stream_session_id] = user_query
@@ -3356,46 +6753,79 @@ def setup_for_llama_cpp_response():
 
     # Perform similarity search on the vector DB
     print("\n\nPerforming similarity search to determine if RAG necessary\n\n")
+    vector_store = VECTOR_STORE     # a single reference for the whole request, even if the store is swapped meanwhile
     embedding_function = None
     try:
-        if use_sbert_embeddings:
-            embedding_function=HuggingFaceEmbeddings()
-        elif use_openai_embeddings:
-            embedding_function=AZURE_OPENAI_EMBEDDINGS
-        elif use_bge_base_embeddings:
-            embedding_function=HF_BGE_EMBEDDINGS
-        elif use_bge_large_embeddings:
-            embedding_function=HF_BGE_EMBEDDINGS
+        embedding_function = get_embedding_function()
     except Exception as e:
         handle_error_no_return("Could not set embedding_function for similarity_search when attempting to setup_for_streaming_response, encountered error: ", e)
     
+    scope_sources = None
     try:
-        # docs = VECTOR_STORE.similarity_search(user_query, embedding_fn=embedding_function)
-        # docs_with_relevance_score = VECTOR_STORE.similarity_search_with_relevance_scores(user_query, 10, embedding_fn=embedding_function)
-        docs_list_with_cosine_distance = VECTOR_STORE.similarity_search_with_score(user_query, 11, embedding_fn=embedding_function)
+        scope_sources = resolve_scope_sources(scope_document_ids, scope_document_set_ids, vector_store._persist_directory)
+        if scope_sources is not None:
+            print(f"Searching within {len(scope_sources)} scoped document sources")
     except Exception as e:
-        handle_error_no_return("Could not perform similarity_search to determine do_rag when attempting to setup_for_streaming_response, encountered error: ", e)
+        handle_error_no_return("Could not resolve the chat's document scope, searching all documents instead. Encountered error: ", e)
+
+    current_sequence_id = determine_sequence_id_for_chat(chat_id)
+    user_query_for_history_db = str(user_query).strip('\n')
 
-    filtered_docs = [doc for doc, score in docs_list_with_cosine_distance]
+    # The opening question of a chat may be answered from the semantic answer cache, skipping retrieval & the LLM
+    answer_cache_context = None
+    query_embedding = None
+    cached_answer = None
+    if current_sequence_id == 0:
+        try:
+            answer_cache_context = get_semantic_answer_cache_context(vector_store, embedding_function, use_hybrid_search, scope_sources)
+            if answer_cache_context is not None:
+                query_embedding = get_query_embedding(user_query, vector_store, embedding_function)
+                cached_answer = find_cached_answer(query_embedding, answer_cache_context)
+        except Exception as e:
+            answer_cache_context = None
+            handle_error_no_return("Could not look up the semantic answer cache, generating a new answer. Encountered error: ", e)
+
+    cached_reference_response = ""
+    cached_download_link_html = ""
+    if cached_answer is not None:
+        try:
+            cached_reference_response, cached_download_link_html = reissue_cached_citations(cached_answer, stream_session_id)
+        except Exception as e:
+            cached_answer = None
+            handle_error_no_return("Could not re-use the cached answer's references, generating a new answer. Encountered error: ", e)
 
     docs = []
-    if filtered_docs:
-        docs = rerank_results_ml(user_query, filtered_docs, top_n=5)
-        do_rag = determine_do_rag(user_query, docs, force_enable_rag, force_disable_rag)
+    if cached_answer is not None:
+        docs = cached_answer['docs']
+        do_rag = cached_answer['do_rag']
+    else:
+        try:
+            docs = retrieve_reranked_docs(user_query, vector_store, embedding_function, use_hybrid_search, scope_sources, top_n=5)
+        except Exception as e:
+            handle_error_no_return("Could not perform similarity_search to determine do_rag when attempting to setup_for_streaming_response, encountered error: ", e)
+
+        if not docs:
+            print("No sufficiently similar documents found")
+        do_rag = determine_do_rag(user_query, docs, force_enable_rag, force_disable_rag)    # even without candidates, so force_enable_rag is still respected
     
     print(f'Do RAG? {do_rag}')
 
-    try:
-        write_config({'do_rag':do_rag})
-    except Exception as e:
-        handle_error_no_return("Could not write do_rag to config during setup_for_streaming_response, encountered error: ", e)
+    if cached_answer is None:
+        try:
+            write_config({'do_rag':do_rag})
+        except Exception as e:
+            handle_error_no_return("Could not write do_rag to config during setup_for_streaming_response, encountered error: ", e)
+
+        if answer_cache_context is not None:    # for get_references to cache the answer under
+            QUERIES["SemanticAnswerCacheforQueryID_" + stream_session_id] = (answer_cache_context, query_embedding)
 
     
     # Having determined do_rag, time to build the prompt template!
     
     if do_rag:  # add similarity search results for RAG!
         try:
-            QUERIES[key_for_vector_results] = docs
+            if cached_answer is None:
+                QUERIES[key_for_vector_results] = docs
             user_query += f"\n\nThe following context might be helpful in answering the user query above:\n{docs}"
             print(f"RAG formatted user_query: \n{user_query}\n")
         except Exception as e:
@@ -3405,7 +6835,6 @@ def setup_for_llama_cpp_response():
                 handle_error_no_return("Could not write do_rag to config during setup_for_streaming_response, encountered error: ", e)
             handle_error_no_return("RAG Error: Could not update QUERIES dict and user_query during setup_for_streaming_response, proceeding without RAG. Encountered error: ", e)
 
-    current_sequence_id = determine_sequence_id_for_chat(chat_id)
     formatted_prompt = ""
     print("current_sequence_id: ", current_sequence_id)
     if current_sequence_id > 0:    # get the last prompt so we can continue the completions
@@ -3425,6 +6854,24 @@ def setup_for_llama_cpp_response():
 
     # Return a bunch of stuff
     new_sequence_id = int(current_sequence_id) + 1
+
+    # A cached answer is returned in full, in place of the prompt to stream a new one with, so the chat history is stored here rather than in get_references
+    if cached_answer is not None:
+        llm_response = cached_answer['llm_response']
+        try:
+            model_response_for_history_db = str(llm_response)
+            if do_rag:
+                model_response_for_history_db += f"\n\n{cached_reference_response}"
+                model_response_for_history_db += f"\n\npdf_pane_data={cached_download_link_html}"
+            model_response_for_history_db = model_response_for_history_db.strip('\n')
+            formatted_prompt = append_llm_response_to_prompt(formatted_prompt, llm_response, local_llm_server, local_llm_chat_template_format)
+            store_llama_cpp_chat_history_to_db(chat_id, new_sequence_id, user_query_for_history_db, model_response_for_history_db, formatted_prompt)
+        except Exception as e:
+            handle_error_no_return("Could not store the cached answer to the chat history in setup_for_llama_cpp_response(), encountered error: ", e)
+
+        cached_answer_payload = {'llm_response': llm_response, 'response': cached_reference_response, 'pdf_frame': cached_download_link_html}
+        return jsonify({"success": True, "stream_session_id": stream_session_id, "do_rag": do_rag, "formatted_user_prompt": formatted_prompt, "sequence_id":new_sequence_id, "cached_answer": cached_answer_payload})
+
     return jsonify({"success": True, "stream_session_id": stream_session_id, "do_rag": do_rag, "formatted_user_prompt": formatted_prompt, "sequence_id":new_sequence_id})
 
 
@@ -3453,33 +6900,9 @@ def get_references():
     except Exception as e:
         return handle_api_error("Could not read request content in method get_references, encountered error: ", e)
 
-    if local_llm_server == 'llama-cpp':
-        if local_llm_chat_template_format == 'llama3':
-            formatted_user_prompt += f"{llm_response}<|eot_id|>"
-        elif local_llm_chat_template_format == 'llama2':
-            formatted_user_prompt += f"{llm_response}</s>"
-        elif local_llm_chat_template_format == 'chatml':
-            formatted_user_prompt += f"{llm_response}<|im_end|>\n"
-        elif local_llm_chat_template_format == 'phi3':
-            formatted_user_prompt += f"{llm_response}<|end|>\n"
-        elif local_llm_chat_template_format == 'command-r':
-            formatted_user_prompt += f"{llm_response}<|END_OF_TURN_TOKEN|>"
-        elif local_llm_chat_template_format == 'deepseek':
-            formatted_user_prompt += f"{llm_response}\n<|EOT|>\n"
-        elif local_llm_chat_template_format == 'deepseek-coder-v2':
-            formatted_user_prompt += f"{llm_response}<|end_of_sentence|>"
-        elif local_llm_chat_template_format == 'vicuna':
-            formatted_user_prompt += f"{llm_response} </s>\n"
-        elif local_llm_chat_template_format == 'openchat':
-            formatted_user_prompt += f"{llm_response}<|end_of_turn|>"
-        elif local_llm_chat_template_format == 'gemma2':
-            formatted_user_prompt += f"{llm_response}<end_of_turn>\n"
-    elif local_llm_server == 'hf-waitress':
-        history_prompt_json = json.loads(formatted_user_prompt)
-        new_response = {"role":"assistant", "content":llm_response}
-        history_prompt_json['messages'].append(new_response)
-        updated_history_prompt_json = json.dumps(history_prompt_json, indent=4)
-        formatted_user_prompt = str(updated_history_prompt_json)
+    answer_cache_context, query_embedding = QUERIES.pop("SemanticAnswerCacheforQueryID_" + stream_session_id, (None, None))
+
+    formatted_user_prompt = append_llm_response_to_prompt(formatted_user_prompt, llm_response, local_llm_server, local_llm_chat_template_format)
 
     if not do_rag:
         print("\n\nSkipping RAG, storing chat history and returning\n\n")
@@ -3487,6 +6910,12 @@ def get_references():
             store_llama_cpp_chat_history_to_db(chat_id, sequence_id, user_query, llm_response, formatted_user_prompt)
         except Exception as e:
             handle_error_no_return("Could not store_llama_cpp_chat_history_to_db in get_references(), encountered error: ", e)
+
+        if answer_cache_context is not None and llm_response:
+            try:
+                store_answer_in_cache(query_embedding, answer_cache_context, user_query, False, [], llm_response, "", "", stream_session_id, [])
+            except Exception as e:
+                handle_error_no_return("Could not store the answer in the semantic answer cache, encountered error: ", e)
         return jsonify({'success': True})
         
     try:
@@ -3684,9 +7113,34 @@ def get_references():
     except Exception as e:
         handle_error_no_return("Could not store_chat_history_to_db in get_references(), encountered error: ", e)
 
+    if answer_cache_context is not None and llm_response:
+        try:
+            highlighted_file_names = list(user_should_refer_pages_in_doc) if docs_have_relevant_info else []
+            store_answer_in_cache(query_embedding, answer_cache_context, user_query, True, docs, llm_response, reference_response, download_link_html, stream_session_id, highlighted_file_names)
+        except Exception as e:
+            handle_error_no_return("Could not store the answer in the semantic answer cache, encountered error: ", e)
+
     return jsonify({'success': True, 'response': reference_response, 'pdf_frame':download_link_html})
 
 
+# Process pool workers using the 'spawn' start method (Windows, MacOS) re-import this module, they must not start ingestion workers of their own:
+if multiprocessing.current_process().name == 'MainProcess':
+    try:
+        start_ingestion_workers()
+    except Exception as e:
+        handle_error_no_return("Could not start ingestion workers, documents will not be processed until the app is restarted. Encountered error: ", e)
+
+    try:
+        start_vectordb_compaction_scheduler()
+    except Exception as e:
+        handle_error_no_return("Could not start the VectorDB compaction scheduler, deleted chunks will only be compacted on demand. Encountered error: ", e)
+
+    try:
+        resume_unfinished_embedding_migrations()
+    except Exception as e:
+        handle_error_no_return("Could not resume the unfinished embedding migration, it may be resumed from the VectorDB settings. Encountered error: ", e)
+
+
 if __name__ == '__main__':
     # app.run(debug=True)
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
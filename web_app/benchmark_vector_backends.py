@@ -0,0 +1,179 @@
+from ann_vector_store import FaissHnswVectorStore
+
+import numpy as np
+import tempfile
+import argparse
+import chromadb
+import shutil
+import json
+import time
+import os
+
+
+# Benchmark of the Chroma & FAISS HNSW (faiss_hnsw) vector backends: recall@k against exact search, and p50/p99 query latency, per ef_search.
+# faiss_hnsw is measured per quantization mode, along with the size of its indexes against the float32 vectors they'd otherwise hold.
+# Vectors are read from an existing VectorDB folder's Chroma collection, or generated at random. Usage, from within web_app:
+#   python benchmark_vector_backends.py --vectordb-folder <path to a chroma_db_*_embeddings folder> --queries 500 --ef-search 32 64 128
+#   python benchmark_vector_backends.py --synthetic-count 1000000 --dimension 768 --quantization none int8 binary
+# For memory saved vs recall on the sample corpus, load documents/sample_docs into a VectorDB in LARS & point --vectordb-folder at it, with --skip-chroma.
+
+
+def load_vectors_from_chroma(vectordb_folder, page_size=5000):
+
+    collection = chromadb.PersistentClient(path=vectordb_folder).get_collection('langchain')    # langchain's default collection name
+
+    pages = []
+    offset = 0
+    while True:
+        stored_chunks = collection.get(include=['embeddings'], limit=page_size, offset=offset)
+        if not stored_chunks['ids']:
+            break
+        pages.append(np.asarray(stored_chunks['embeddings'], dtype=np.float32))
+        offset += page_size
+
+    return np.concatenate(pages)
+
+
+def generate_synthetic_vectors(count, dimension, seed):
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)     # embedding models in use produce (near) unit vectors
+
+
+# Queries are perturbed copies of stored vectors, so each has a meaningful neighbourhood without being an exact match
+def make_queries(vectors, query_count, seed):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=query_count, replace=False)]
+    return (queries + rng.normal(scale=0.05 * float(vectors.std()), size=queries.shape)).astype(np.float32)
+
+
+# Exact k nearest neighbours by squared L2 distance, the metric both backends use | returns a set of labels per query
+def exact_neighbours(vectors, queries, k, block_size=20000):
+
+    squared_norms = (vectors ** 2).sum(axis=1)
+    best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_labels = np.full((len(queries), k), -1, dtype=np.int64)
+
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        distances = squared_norms[start:start + block_size][None, :] - 2 * queries @ block.T    # the queries' own norms don't change the ranking
+        candidate_distances = np.concatenate([best_distances, distances], axis=1)
+        candidate_labels = np.concatenate([best_labels, np.broadcast_to(np.arange(start, start + len(block)), distances.shape)], axis=1)
+        keep = np.argpartition(candidate_distances, k - 1, axis=1)[:, :k]
+        best_distances = np.take_along_axis(candidate_distances, keep, axis=1)
+        best_labels = np.take_along_axis(candidate_labels, keep, axis=1)
+
+    return [set(labels.tolist()) for labels in best_labels]
+
+
+def folder_size_mb(folder):
+    return sum(os.path.getsize(os.path.join(root, file_name)) for root, _, file_names in os.walk(folder) for file_name in file_names) / (1024 * 1024)
+
+
+def measure(search, queries, true_neighbours, k):
+
+    latencies_ms = []
+    recalls = []
+    for query, true_labels in zip(queries, true_neighbours):
+        start = time.perf_counter()
+        found_labels = search(query)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(true_labels & set(found_labels)) / k)
+
+    return {'recall_at_k': float(np.mean(recalls)), 'p50_ms': float(np.percentile(latencies_ms, 50)), 'p99_ms': float(np.percentile(latencies_ms, 99))}
+
+
+def benchmark_chroma(vectors, queries, true_neighbours, k, m, ef_construction, ef_search, work_folder, batch_size=5000):
+
+    chroma_folder = os.path.join(work_folder, f'chroma_ef{ef_search}')
+    client = chromadb.PersistentClient(path=chroma_folder)
+    collection = client.create_collection('benchmark', metadata={'hnsw:space': 'l2', 'hnsw:M': m, 'hnsw:construction_ef': ef_construction, 'hnsw:search_ef': ef_search})
+
+    start = time.perf_counter()
+    batch_size = min(batch_size, getattr(client, 'max_batch_size', batch_size))
+    for first in range(0, len(vectors), batch_size):
+        collection.add(ids=[str(label) for label in range(first, min(first + batch_size, len(vectors)))], embeddings=vectors[first:first + batch_size].tolist())
+    build_seconds = time.perf_counter() - start
+
+    def search(query):
+        return [int(label) for label in collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])['ids'][0]]
+
+    result = measure(search, queries, true_neighbours, k)
+    result.update({'backend': 'chroma', 'quantization': 'none', 'ef_search': ef_search, 'build_seconds': build_seconds, 'index_mb': None, 'disk_mb': folder_size_mb(chroma_folder)})
+    return result
+
+
+def benchmark_faiss_hnsw(vectors, queries, true_neighbours, k, m, ef_construction, ef_search_values, segment_size, quantization, rescore_multiplier, work_folder, batch_size=5000):
+
+    ann_folder = os.path.join(work_folder, f'faiss_hnsw_{quantization}')
+    store = FaissHnswVectorStore(ann_folder, m=m, ef_construction=ef_construction, segment_size=segment_size, quantization=quantization, rescore_multiplier=rescore_multiplier)
+
+    start = time.perf_counter()
+    for first in range(0, len(vectors), batch_size):
+        labels = range(first, min(first + batch_size, len(vectors)))
+        store.add(ids=[str(label) for label in labels], embeddings=vectors[first:first + batch_size], documents=[''] * len(labels), metadatas=[{} for _ in labels])
+    build_seconds = time.perf_counter() - start
+    index_mb = store.index_size_bytes() / (1024 * 1024)
+
+    # Labels are assigned in insertion order, so they match the vectors' row numbers
+    results = []
+    for ef_search in ef_search_values:
+        store.ef_search = ef_search
+        result = measure(lambda query: [label for label, _ in store.search_by_vector(query, k)], queries, true_neighbours, k)
+        result.update({'backend': 'faiss_hnsw', 'quantization': quantization, 'ef_search': ef_search, 'build_seconds': build_seconds, 'index_mb': index_mb, 'disk_mb': folder_size_mb(ann_folder)})
+        results.append(result)
+
+    store.close()
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the Chroma & FAISS HNSW vector backends on recall@k and p50/p99 query latency")
+    parser.add_argument('--vectordb-folder', help="VectorDB folder whose Chroma collection supplies the vectors")
+    parser.add_argument('--synthetic-count', type=int, default=100000, help="Number of random unit vectors to use when no --vectordb-folder is given")
+    parser.add_argument('--dimension', type=int, default=768, help="Dimension of the random vectors")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--m', type=int, default=32, help="HNSW M, for both backends")
+    parser.add_argument('--ef-construction', type=int, default=200, help="HNSW ef_construction, for both backends")
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[32, 64, 128], help="HNSW ef_search values to measure, for both backends")
+    parser.add_argument('--segment-size', type=int, default=100000, help="Vectors per sealed faiss_hnsw segment")
+    parser.add_argument('--quantization', nargs='+', default=['none'], choices=['none', 'int8', 'binary'], help="faiss_hnsw quantization modes to measure")
+    parser.add_argument('--rescore-multiplier', type=int, default=4, help="Candidates fetched per result by quantized faiss_hnsw searches, before float rescoring")
+    parser.add_argument('--skip-chroma', action='store_true', help="Only benchmark faiss_hnsw (Chroma is rebuilt per ef_search value)")
+    parser.add_argument('--output-json', help="Also write the results to this file")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.vectordb_folder:
+        vectors = load_vectors_from_chroma(args.vectordb_folder)
+    else:
+        vectors = generate_synthetic_vectors(args.synthetic_count, args.dimension, args.seed)
+    print(f"Benchmarking {len(vectors)} vectors of dimension {vectors.shape[1]} ({vectors.nbytes / (1024 * 1024):.1f} MB as float32), {args.queries} queries, k={args.k}")
+
+    queries = make_queries(vectors, args.queries, args.seed)
+    true_neighbours = exact_neighbours(vectors, queries, args.k)
+
+    work_folder = tempfile.mkdtemp(prefix='vector_backend_benchmark_')
+    results = []
+    try:
+        for quantization in args.quantization:
+            results += benchmark_faiss_hnsw(vectors, queries, true_neighbours, args.k, args.m, args.ef_construction, args.ef_search, args.segment_size, quantization, args.rescore_multiplier, work_folder)
+        if not args.skip_chroma:
+            for ef_search in args.ef_search:
+                results.append(benchmark_chroma(vectors, queries, true_neighbours, args.k, args.m, args.ef_construction, ef_search, work_folder))
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    print(f"\n{'backend':<12}{'quant':>8}{'ef_search':>10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}{'index MB':>10}{'disk MB':>10}")
+    for result in sorted(results, key=lambda result: (result['ef_search'], result['backend'], result['quantization'])):
+        index_mb = f"{result['index_mb']:>10.1f}" if result['index_mb'] is not None else f"{'-':>10}"
+        print(f"{result['backend']:<12}{result['quantization']:>8}{result['ef_search']:>10}{result['recall_at_k']:>10.4f}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['build_seconds']:>10.1f}{index_mb}{result['disk_mb']:>10.1f}")
+
+    if args.output_json:
+        with open(args.output_json, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
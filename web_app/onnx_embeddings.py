@@ -0,0 +1,265 @@
+import numpy as np
+import threading
+import argparse
+import json
+import time
+import os
+
+
+#########################------------ONNX Embeddings-------------###############################
+# A CPU embedding backend for the sentence-transformers models in use (all-mpnet-base-v2, bge-base-en, bge-large-en): the model's transformer is
+# exported once to ONNX, optionally int8 dynamically quantized, & cached on disk under export_root along with its tokenizer. Encode calls then run
+# through ONNX Runtime, with the same pooling (mean or CLS), normalization & truncation as the sentence-transformers model it was exported from.
+# Each exported graph is checked against the PyTorch model's output on a fixed set of texts when first exported; the lowest cosine similarity seen
+# is kept in the export's info file, & a graph whose vectors stray further than parity_tolerance from PyTorch's is refused, so vectors stored in
+# existing VectorDB folders remain comparable with the ones it produces.
+# It exposes the subset of langchain's HuggingFaceEmbeddings / HuggingFaceBgeEmbeddings used by the app (embed_documents, embed_query, and
+# client.tokenizer & client.max_seq_length for token-based chunking).
+ONNX_EXPORT_INFO_FILE_NAME = 'onnx_export_info.json'
+ONNX_EXPORT_OPSET = 14
+ONNX_PARITY_TEXTS = [
+    "What were the main findings of the report?",
+    "The quarterly revenue increased by 12% compared to the same period last year, driven mostly by subscription sales.",
+    "Table 3: Row 2, Column 4: 1,024.5",
+    "Installation requires Python 3.10 or later; run the setup script from the project's root directory.",
+    "photosynthesis",
+    "Les résultats de l'étude montrent une amélioration significative de la qualité de l'eau.",
+    "If the pressure exceeds the rated limit, the relief valve opens and vents the excess gas to the atmosphere, after which the alarm must be reset manually before restarting the pump.",
+    "Page 7 of 112",
+]
+
+
+def get_onnx_export_folder(export_root, model_name):
+    return os.path.join(export_root, model_name.replace('/', '--'))
+
+
+def get_onnx_model_file_name(quantize):
+    return 'model.int8.onnx' if quantize else 'model.onnx'
+
+
+def read_onnx_export_info(export_folder):
+    info_path = os.path.join(export_folder, ONNX_EXPORT_INFO_FILE_NAME)
+    if not os.path.exists(info_path):
+        return None
+    with open(info_path, 'r') as file:
+        return json.load(file)
+
+
+def write_onnx_export_info(export_folder, export_info):
+    temp_path = os.path.join(export_folder, ONNX_EXPORT_INFO_FILE_NAME + '.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(export_info, file, indent=4)
+    os.replace(temp_path, os.path.join(export_folder, ONNX_EXPORT_INFO_FILE_NAME))
+
+
+def load_sentence_transformer(model_name):
+    from sentence_transformers import SentenceTransformer     # only needed to export & check parity, not to serve encode calls
+    return SentenceTransformer(model_name, device='cpu')
+
+
+# Method to export sentence_transformer's transformer to export_folder as model.onnx, its output being the last hidden state, & save its tokenizer
+# & pooling alongside | returns the export info
+def export_sentence_transformer_to_onnx(model_name, sentence_transformer, export_folder, opset=ONNX_EXPORT_OPSET):
+    import torch
+
+    transformer, pooling = sentence_transformer[0], sentence_transformer[1]
+    if pooling.pooling_mode_cls_token:
+        pooling_mode = 'cls'
+    elif pooling.pooling_mode_mean_tokens:
+        pooling_mode = 'mean'
+    else:
+        raise ValueError(f"Unsupported pooling for ONNX export of {model_name}, only CLS & mean pooling are supported")
+
+    tokenizer = transformer.tokenizer
+    example_inputs = tokenizer(["An example sentence to trace the model with"], return_tensors='pt')
+    input_names = list(example_inputs.keys())
+
+    class LastHiddenState(torch.nn.Module):
+
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    os.makedirs(export_folder, exist_ok=True)
+    temp_model_path = os.path.join(export_folder, 'model.onnx.tmp')
+    dynamic_axes = {input_name: {0: 'batch', 1: 'sequence'} for input_name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    print(f"\n\nExporting embedding model {model_name} to ONNX\n\n")
+    with torch.no_grad():
+        torch.onnx.export(LastHiddenState(transformer.auto_model.eval()), tuple(example_inputs[input_name] for input_name in input_names), temp_model_path,
+                          input_names=input_names, output_names=['last_hidden_state'], dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True)
+    os.replace(temp_model_path, os.path.join(export_folder, get_onnx_model_file_name(False)))
+    tokenizer.save_pretrained(export_folder)
+
+    return {
+        'model_name': model_name,
+        'input_names': input_names,
+        'pooling_mode': pooling_mode,
+        'normalize': any(type(module).__name__ == 'Normalize' for module in sentence_transformer),
+        'max_seq_length': int(sentence_transformer.max_seq_length),
+        'opset': opset,
+        'parity_min_cosine': {},    # model file name -> lowest cosine similarity to PyTorch's vectors over ONNX_PARITY_TEXTS
+    }
+
+
+# int8 dynamic quantization of the exported model's weights, activations being quantized on the fly: roughly a quarter of the size & faster matmuls on CPU
+def quantize_onnx_model(export_folder):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    temp_model_path = os.path.join(export_folder, 'model.int8.onnx.tmp')
+    quantize_dynamic(os.path.join(export_folder, get_onnx_model_file_name(False)), temp_model_path, weight_type=QuantType.QInt8)
+    os.replace(temp_model_path, os.path.join(export_folder, get_onnx_model_file_name(True)))
+
+
+def cosine_similarities(vectors_a, vectors_b):
+    vectors_a = vectors_a / np.maximum(np.linalg.norm(vectors_a, axis=1, keepdims=True), 1e-12)
+    vectors_b = vectors_b / np.maximum(np.linalg.norm(vectors_b, axis=1, keepdims=True), 1e-12)
+    return (vectors_a * vectors_b).sum(axis=1)
+
+
+# Method to compare encoder's vectors with sentence_transformer's on texts | returns the lowest cosine similarity & the largest absolute difference
+def check_onnx_parity(encoder, sentence_transformer, texts=ONNX_PARITY_TEXTS):
+    onnx_vectors = encoder.encode(texts)
+    pytorch_vectors = np.asarray(sentence_transformer.encode(texts, normalize_embeddings=encoder.normalize), dtype=np.float32)
+    return float(cosine_similarities(onnx_vectors, pytorch_vectors).min()), float(np.abs(onnx_vectors - pytorch_vectors).max())
+
+
+class OnnxSentenceEncoder:
+
+    def __init__(self, export_folder, model_file_name, export_info, intra_op_threads=0, batch_size=32):
+        import onnxruntime     # optional dependency, only needed when this backend is configured
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(export_folder)
+        self.max_seq_length = export_info['max_seq_length']
+        self.input_names = export_info['input_names']
+        self.pooling_mode = export_info['pooling_mode']
+        self.normalize = export_info['normalize']
+        self.batch_size = batch_size
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            session_options.intra_op_num_threads = int(intra_op_threads)    # 0 leaves ONNX Runtime to use one thread per physical core
+        self.session = onnxruntime.InferenceSession(os.path.join(export_folder, model_file_name), sess_options=session_options, providers=['CPUExecutionProvider'])
+
+    def pool(self, last_hidden_state, attention_mask):
+        if self.pooling_mode == 'cls':
+            return last_hidden_state[:, 0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (last_hidden_state * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    # Texts are encoded longest first, as sentence-transformers does, so each batch is padded to similar lengths | returns a float32 array
+    def encode(self, texts):
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        vectors = [None] * len(texts)
+        for start in range(0, len(texts), self.batch_size):
+            batch_indexes = order[start:start + self.batch_size]
+            inputs = self.tokenizer([texts[index] for index in batch_indexes], padding=True, truncation=True, max_length=self.max_seq_length, return_tensors='np')
+            feeds = {input_name: inputs[input_name].astype(np.int64) for input_name in self.input_names}
+            last_hidden_state = self.session.run(['last_hidden_state'], feeds)[0]
+            batch_vectors = self.pool(last_hidden_state, inputs['attention_mask'])
+            if self.normalize:
+                batch_vectors = batch_vectors / np.maximum(np.linalg.norm(batch_vectors, axis=1, keepdims=True), 1e-12)
+            for index, vector in zip(batch_indexes, batch_vectors):
+                vectors[index] = vector
+
+        return np.stack(vectors).astype(np.float32)
+
+
+EXPORT_LOCK = threading.Lock()
+
+
+# Method to obtain an encoder for model_name, exporting (& quantizing) it under export_root on first use & checking parity for each newly exported
+# model file | raises if the model file's vectors are further than parity_tolerance (1 - cosine similarity) from PyTorch's
+def load_onnx_sentence_encoder(model_name, export_root, quantize=False, intra_op_threads=0, parity_tolerance=0.02):
+
+    export_folder = get_onnx_export_folder(export_root, model_name)
+    model_file_name = get_onnx_model_file_name(quantize)
+
+    with EXPORT_LOCK:
+        export_info = read_onnx_export_info(export_folder)
+        sentence_transformer = None
+
+        if export_info is None or not os.path.exists(os.path.join(export_folder, get_onnx_model_file_name(False))):
+            sentence_transformer = load_sentence_transformer(model_name)
+            export_info = export_sentence_transformer_to_onnx(model_name, sentence_transformer, export_folder)
+            write_onnx_export_info(export_folder, export_info)
+
+        if quantize and not os.path.exists(os.path.join(export_folder, model_file_name)):
+            print(f"\n\nQuantizing ONNX embedding model {model_name} to int8\n\n")
+            quantize_onnx_model(export_folder)
+            export_info['parity_min_cosine'].pop(model_file_name, None)
+
+        encoder = OnnxSentenceEncoder(export_folder, model_file_name, export_info, intra_op_threads)
+
+        if model_file_name not in export_info['parity_min_cosine']:
+            if sentence_transformer is None:
+                sentence_transformer = load_sentence_transformer(model_name)
+            min_cosine, max_abs_difference = check_onnx_parity(encoder, sentence_transformer)
+            print(f"ONNX parity for {model_name} ({model_file_name}): min cosine similarity {min_cosine:.6f}, max abs difference {max_abs_difference:.6f}")
+            export_info['parity_min_cosine'][model_file_name] = min_cosine
+            write_onnx_export_info(export_folder, export_info)
+
+    min_cosine = export_info['parity_min_cosine'][model_file_name]
+    if 1 - min_cosine > parity_tolerance:
+        raise ValueError(f"ONNX model {model_file_name} for {model_name} is outside the parity tolerance: min cosine similarity to PyTorch {min_cosine:.6f}, tolerance {parity_tolerance}")
+
+    return encoder
+
+
+class OnnxEmbeddings:
+
+    def __init__(self, model_name, export_root, quantize=False, intra_op_threads=0, parity_tolerance=0.02, normalize_embeddings=False, query_instruction=""):
+        self.model_name = model_name
+        self.query_instruction = query_instruction  # prepended to queries, as HuggingFaceBgeEmbeddings does for the bge models
+        self.client = load_onnx_sentence_encoder(model_name, export_root, quantize, intra_op_threads, parity_tolerance)
+        self.client.normalize = self.client.normalize or normalize_embeddings
+
+    # Newlines are replaced with spaces before encoding, as langchain's sentence-transformers embeddings do
+    def embed_documents(self, texts):
+        return self.client.encode([text.replace("\n", " ") for text in texts]).tolist()
+
+    def embed_query(self, text):
+        return self.client.encode([self.query_instruction + text.replace("\n", " ")])[0].tolist()
+
+#########################-------------------------------------###############################
+
+
+# Exports a model ahead of time & compares ONNX Runtime with PyTorch on parity & encode latency. Usage, from within web_app:
+#   python onnx_embeddings.py --model sentence-transformers/all-mpnet-base-v2 --export-root <onnx_embedding_models folder> --quantize --intra-op-threads 4
+def main():
+
+    parser = argparse.ArgumentParser(description="Export a sentence-transformers embedding model to ONNX & compare it with PyTorch")
+    parser.add_argument('--model', required=True, help="e.g. sentence-transformers/all-mpnet-base-v2, BAAI/bge-base-en, BAAI/bge-large-en")
+    parser.add_argument('--export-root', required=True, help="Folder exported models are cached in, onnx_embedding_models_folder in config.json")
+    parser.add_argument('--quantize', action='store_true', help="int8 dynamic quantization")
+    parser.add_argument('--intra-op-threads', type=int, default=0, help="ONNX Runtime intra-op threads, 0 for its default")
+    parser.add_argument('--parity-tolerance', type=float, default=0.02, help="Largest accepted 1 - cosine similarity to PyTorch's vectors")
+    parser.add_argument('--repeats', type=int, default=20, help="Encode calls timed per backend")
+    args = parser.parse_args()
+
+    encoder = load_onnx_sentence_encoder(args.model, args.export_root, args.quantize, args.intra_op_threads, args.parity_tolerance)
+    sentence_transformer = load_sentence_transformer(args.model)
+    min_cosine, max_abs_difference = check_onnx_parity(encoder, sentence_transformer)
+    print(f"Parity: min cosine similarity {min_cosine:.6f}, max abs difference {max_abs_difference:.6f}")
+
+    for backend, encode in [('pytorch', lambda texts: sentence_transformer.encode(texts, normalize_embeddings=encoder.normalize)), ('onnx', encoder.encode)]:
+        for texts in [ONNX_PARITY_TEXTS[:1], ONNX_PARITY_TEXTS]:
+            encode(texts)   # warm up
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                encode(texts)
+            print(f"{backend:<8} batch of {len(texts)}: {(time.perf_counter() - start) * 1000 / args.repeats:.1f} ms per encode call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import pytest
+import json
+import sys
+import os
+
+# The app's modules live directly in web_app/ rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Imports app.py from a scratch directory: the app keeps config.json in its working directory & creates its storage folders on import
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+
+    app_directory = tmp_path_factory.mktemp('app')
+    base_directory = str(app_directory / 'lars_storage')
+
+    previous_cwd = os.getcwd()
+    os.chdir(app_directory)
+    with open('config.json', 'w') as file:
+        json.dump({'windows_base_directory': base_directory, 'unix_and_docker_base_directory': base_directory, 'mac_base_directory': base_directory}, file)
+
+    try:
+        import app
+    except ImportError as e:
+        os.chdir(previous_cwd)
+        pytest.skip(f"The app's dependencies are not installed: {e}")
+
+    yield app
+
+    os.chdir(previous_cwd)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('faiss')
+
+from ann_vector_store import FaissHnswVectorStore, ANN_QUANTIZATION_MODES
+
+
+DIMENSION = 32
+CHUNK_COUNT = 300
+SEGMENT_SIZE = 64   # sealed every other batch of 32, so the chunks span several segments plus the tail
+
+
+def make_chunks(seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((CHUNK_COUNT, DIMENSION)).astype(np.float32)
+    ids = [f"chunk-{i}" for i in range(CHUNK_COUNT)]
+    metadatas = [{'source': 'a.pdf' if i % 2 == 0 else 'b.pdf', 'chunk': i} for i in range(CHUNK_COUNT)]
+    documents = [f"text of chunk {i}" for i in range(CHUNK_COUNT)]
+    return vectors, ids, documents, metadatas
+
+
+def open_store(persist_directory, quantization):
+    return FaissHnswVectorStore(str(persist_directory), m=16, ef_construction=80, ef_search=64, segment_size=SEGMENT_SIZE, quantization=quantization)
+
+
+def nearest_chunks(store, vector, k=4, filter=None):
+    return [document.metadata['chunk'] for document, _ in store.similarity_search_by_vector_with_relevance_scores(vector.tolist(), k=k, filter=filter)]
+
+
+def fill_store(store, vectors, ids, documents, metadatas, batch_size=32):
+    for start in range(0, CHUNK_COUNT, batch_size):
+        end = start + batch_size
+        store.add(ids=ids[start:end], embeddings=vectors[start:end], documents=documents[start:end], metadatas=metadatas[start:end])
+
+
+@pytest.mark.parametrize('quantization', ANN_QUANTIZATION_MODES)
+def test_add_and_search_across_segments(tmp_path, quantization):
+
+    vectors, ids, documents, metadatas = make_chunks()
+    store = open_store(tmp_path, quantization)
+    fill_store(store, vectors, ids, documents, metadatas)
+
+    assert store.count() == CHUNK_COUNT
+    assert len(store._segments) == CHUNK_COUNT // SEGMENT_SIZE
+
+    for i in [0, 1, SEGMENT_SIZE + 3, CHUNK_COUNT - 1]:
+        assert nearest_chunks(store, vectors[i])[0] == i
+
+    # Re-adding stored ids leaves them as they are
+    store.add(ids=ids[:10], embeddings=vectors[:10], documents=documents[:10], metadatas=metadatas[:10])
+    assert store.count() == CHUNK_COUNT
+
+    store.close()
+
+
+@pytest.mark.parametrize('quantization', ANN_QUANTIZATION_MODES)
+def test_search_scoped_to_sources(tmp_path, quantization):
+
+    vectors, ids, documents, metadatas = make_chunks()
+    store = open_store(tmp_path, quantization)
+    fill_store(store, vectors, ids, documents, metadatas)
+
+    # Chunk 0 is in a.pdf, so a search scoped to b.pdf must not return it
+    scoped = nearest_chunks(store, vectors[0], k=8, filter={'source': 'b.pdf'})
+    assert scoped and all(i % 2 == 1 for i in scoped)
+
+    both = nearest_chunks(store, vectors[0], filter={'$or': [{'source': 'a.pdf'}, {'source': 'b.pdf'}]})
+    assert both[0] == 0
+
+    assert nearest_chunks(store, vectors[0], filter={'source': 'missing.pdf'}) == []
+
+    store.close()
+
+
+@pytest.mark.parametrize('quantization', ANN_QUANTIZATION_MODES)
+def test_delete_compact_and_reopen(tmp_path, quantization):
+
+    vectors, ids, documents, metadatas = make_chunks()
+    store = open_store(tmp_path, quantization)
+    fill_store(store, vectors, ids, documents, metadatas)
+
+    deleted = list(range(0, CHUNK_COUNT, 3))
+    store.delete([ids[i] for i in deleted])
+    live_count = CHUNK_COUNT - len(deleted)
+    assert store.count() == live_count
+
+    for i in deleted[:5]:
+        assert i not in nearest_chunks(store, vectors[i], k=8)
+    assert nearest_chunks(store, vectors[1])[0] == 1
+
+    store.compact()
+    assert store.count() == live_count
+    assert store._next_label == live_count
+    assert store.get(ids=[ids[0], ids[1]])['ids'] == [ids[1]]
+    for i in [1, 2, CHUNK_COUNT - 1]:
+        assert nearest_chunks(store, vectors[i])[0] == i
+    store.close()
+
+    store = open_store(tmp_path, quantization)
+    assert store.count() == live_count
+    assert nearest_chunks(store, vectors[CHUNK_COUNT - 1])[0] == CHUNK_COUNT - 1
+    assert store.get(ids=[ids[2]], include=['embeddings'])['embeddings'][0] == pytest.approx(vectors[2].tolist())
+    store.close()
+
+
+@pytest.mark.parametrize('quantization', ANN_QUANTIZATION_MODES)
+def test_reopen_with_another_quantization_rebuilds_the_index(tmp_path, quantization):
+
+    vectors, ids, documents, metadatas = make_chunks()
+    store = open_store(tmp_path, 'none')
+    fill_store(store, vectors, ids, documents, metadatas)
+    store.close()
+
+    store = open_store(tmp_path, quantization)
+    assert store.quantization == quantization
+    assert store.count() == CHUNK_COUNT
+    for i in [0, SEGMENT_SIZE + 3, CHUNK_COUNT - 1]:
+        assert nearest_chunks(store, vectors[i])[0] == i
+    store.close()
+
+
+def test_int8_recall_after_incremental_adds_from_a_single_vector(tmp_path):
+
+    # As documents are ingested one after another: the store's first add is a single chunk, & nothing is sealed
+    vectors, ids, documents, metadatas = make_chunks()
+    store = FaissHnswVectorStore(str(tmp_path), m=16, ef_construction=80, ef_search=64, segment_size=CHUNK_COUNT + 1, quantization='int8')
+    for start, end in [(0, 1)] + [(start, min(start + 20, CHUNK_COUNT)) for start in range(1, CHUNK_COUNT, 20)]:
+        store.add(ids=ids[start:end], embeddings=vectors[start:end], documents=documents[start:end], metadatas=metadatas[start:end])
+    assert store.count() == CHUNK_COUNT and not store._segments
+
+    queries = np.random.default_rng(1).standard_normal((50, DIMENSION)).astype(np.float32)
+    k = 10
+    hits = 0
+    for query in queries:
+        exact = set(np.argsort(((vectors - query) ** 2).sum(axis=1))[:k])
+        hits += len(exact.intersection(nearest_chunks(store, query, k=k)))
+    assert hits / (len(queries) * k) >= 0.95
+
+    store.close()
@@ -0,0 +1,131 @@
+import threading
+import requests
+import pytest
+
+
+BATCH_SIZE = 3
+
+
+def chunk_texts(count):
+    return [f"chunk {i}" for i in range(count)]
+
+
+def expected_vectors(count):
+    return [[float(i), 1.0] for i in range(count)]
+
+
+class StubResponse:
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return {'data': self.data}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} response from the stub endpoint")
+
+
+# Stands in for the deployment's embeddings endpoint: "chunk i" embeds to [i, 1.0], returned in reverse index order so callers must sort
+# by index. status_codes_by_text queues responses to give (in order) before succeeding for a batch holding that text, failing_texts always 400.
+class StubEmbeddingEndpoint:
+
+    def __init__(self, status_codes_by_text=None, failing_texts=()):
+        self.status_codes_by_text = {text: list(status_codes) for text, status_codes in (status_codes_by_text or {}).items()}
+        self.failing_texts = set(failing_texts)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        texts = json['input']
+        with self.lock:
+            self.requests.append(texts)
+            for text in texts:
+                if self.status_codes_by_text.get(text):
+                    return StubResponse(self.status_codes_by_text[text].pop(0), headers={'Retry-After': '0'})
+
+        if self.failing_texts.intersection(texts):
+            return StubResponse(400)
+
+        data = [{'index': index, 'embedding': [float(text.split()[-1]), 1.0]} for index, text in enumerate(texts)]
+        return StubResponse(200, list(reversed(data)))
+
+
+@pytest.fixture
+def embedding_endpoint(app_module, monkeypatch):
+
+    app_module.write_config({
+        'azure_openai_text_ada_api_url': 'http://stub-endpoint',
+        'azure_openai_text_ada_api_key': 'stub-key',
+        'azure_openai_api_version': '2023-05-15',
+        'azure_openai_text_ada_deployment_name': 'stub-deployment',
+        'azure_openai_embeddings_tokens_per_minute': 1000000,
+        'azure_openai_embeddings_requests_per_minute': 100000,
+        'azure_openai_embeddings_max_concurrency': 4,
+        'azure_openai_embeddings_batch_size': BATCH_SIZE,
+        'azure_openai_embeddings_max_retries': 2,
+    })
+    monkeypatch.setattr(app_module, 'count_embedding_tokens', lambda texts: [len(text.split()) for text in texts])   # tiktoken may need to download its encoding
+
+    def use_endpoint(endpoint):
+        monkeypatch.setattr(app_module.requests, 'post', endpoint.post)
+        return endpoint
+
+    return use_endpoint
+
+
+def test_vectors_are_returned_in_chunk_order(app_module, embedding_endpoint, tmp_path):
+
+    endpoint = embedding_endpoint(StubEmbeddingEndpoint())
+    vectors, _ = app_module.embed_texts_via_azure_openai(chunk_texts(10), str(tmp_path))
+
+    assert vectors == expected_vectors(10)
+    assert len(endpoint.requests) == 4
+    assert all(len(texts) <= BATCH_SIZE for texts in endpoint.requests)
+
+
+def test_throttled_and_failed_requests_are_retried(app_module, embedding_endpoint, tmp_path):
+
+    endpoint = embedding_endpoint(StubEmbeddingEndpoint(status_codes_by_text={'chunk 0': [429], 'chunk 4': [503, 429]}))
+    vectors, _ = app_module.embed_texts_via_azure_openai(chunk_texts(9), str(tmp_path))
+
+    assert vectors == expected_vectors(9)
+    assert len(endpoint.requests) == 3 + 3
+
+
+def test_requests_failing_past_max_retries_raise(app_module, embedding_endpoint, tmp_path):
+
+    embedding_endpoint(StubEmbeddingEndpoint(status_codes_by_text={'chunk 0': [429, 429, 429]}))
+
+    with pytest.raises(requests.HTTPError):
+        app_module.embed_texts_via_azure_openai(chunk_texts(3), str(tmp_path))
+
+
+def test_retry_after_a_failed_batch_resumes_from_the_journal(app_module, embedding_endpoint, tmp_path):
+
+    texts = chunk_texts(10)
+    failing_endpoint = embedding_endpoint(StubEmbeddingEndpoint(failing_texts={'chunk 4'}))
+    with pytest.raises(requests.HTTPError):
+        app_module.embed_texts_via_azure_openai(texts, str(tmp_path))
+
+    # Batches still queued when chunks 3 to 5 failed are cancelled, but every batch the endpoint answered was journaled
+    embedded = sorted(texts.index(text) for batch in failing_endpoint.requests if 'chunk 4' not in batch for text in batch)
+    assert embedded[:3] == [0, 1, 2]
+    journal_key = app_module.compute_embedding_journal_key(str(tmp_path), 'stub-deployment', texts)
+    conn = app_module.connect_to_embedding_journal_db()
+    try:
+        journaled = sorted(row['chunk_index'] for row in conn.execute("SELECT chunk_index FROM embedding_journal WHERE journal_key = ?", (journal_key,)))
+    finally:
+        conn.close()
+    assert journaled == embedded
+
+    endpoint = embedding_endpoint(StubEmbeddingEndpoint())
+    vectors, resumed_journal_key = app_module.embed_texts_via_azure_openai(texts, str(tmp_path))
+
+    assert vectors == expected_vectors(10)
+    assert resumed_journal_key == journal_key
+    assert sorted(text for batch in endpoint.requests for text in batch) == sorted(text for idx, text in enumerate(texts) if idx not in embedded)
+    assert ['chunk 3', 'chunk 4', 'chunk 5'] in endpoint.requests
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+import threading
+import random
+import time
+import fitz
+import pytest
+
+
+PAGE_COUNT = 7
+PAGES_PER_SHARD = 2
+SHARDS = [(1, 2), (3, 4), (5, 6), (7, 7)]
+
+
+def make_pdf(path, label):
+    with fitz.open() as pdf:
+        for page_number in range(1, PAGE_COUNT + 1):
+            pdf.new_page().insert_text((72, 72), f"{label} page {page_number}")
+        pdf.save(path)
+    return str(path)
+
+
+def expected_output(label):
+    return "".join(f"[PAGE:{page}]\nRow 0, Column 0: cell of {label} page {page}\n[PAGE:{page}]\n{label} page {page}\n" for page in range(1, PAGE_COUNT + 1))
+
+
+def stub_region(page_number, x):
+    return SimpleNamespace(page_number=page_number, polygon=[SimpleNamespace(x=x, y=0)])
+
+
+# Stands in for Azure's DocumentAnalysisClient: each page of the uploaded shard is analyzed to a table cell & a paragraph holding its text,
+# after a random delay so shards complete out of order. Shards holding failing_text raise.
+class StubDocumentAnalysisClient:
+
+    def __init__(self, failing_text=None):
+        self.failing_text = failing_text
+        self.analyzed_shards = []
+        self.lock = threading.Lock()
+
+    def begin_analyze_document(self, model_id, document):
+        with fitz.open(stream=document, filetype='pdf') as shard_pdf:
+            page_texts = [page.get_text().strip() for page in shard_pdf]
+
+        with self.lock:
+            self.analyzed_shards.append(int(page_texts[0].split()[-1]))
+        time.sleep(random.uniform(0, 0.02))
+        if self.failing_text in page_texts:
+            raise RuntimeError(f"DocAI failed for {self.failing_text}")
+
+        tables = [SimpleNamespace(cells=[SimpleNamespace(row_index=0, column_index=0, content=f"cell of {text}", bounding_regions=[stub_region(page_number, 1)]) for page_number, text in enumerate(page_texts, start=1)])]
+        paragraphs = [SimpleNamespace(content=text, bounding_regions=[stub_region(page_number, 2)]) for page_number, text in enumerate(page_texts, start=1)]
+        return SimpleNamespace(result=lambda: SimpleNamespace(tables=tables, paragraphs=paragraphs))
+
+
+@pytest.fixture
+def docai_client(app_module, monkeypatch, tmp_path):
+
+    app_module.write_config({'azure_doc_ai_endpoint': 'http://stub-endpoint', 'azure_doc_ai_subscription_key': 'stub-key', 'ocr_pdfs': str(tmp_path), 'azure_doc_ai_pages_per_shard': PAGES_PER_SHARD, 'azure_doc_ai_max_concurrent_shards': 2})
+
+    def use_client(client):
+        monkeypatch.setattr(app_module, 'DocumentAnalysisClient', lambda endpoint, credential: client)
+        return client
+
+    return use_client
+
+
+def read_text(path):
+    with open(path, encoding='utf-8') as text_file:
+        return text_file.read()
+
+
+def test_shards_are_merged_in_page_order(app_module, docai_client, tmp_path):
+
+    client = docai_client(StubDocumentAnalysisClient())
+    input_filepath = make_pdf(tmp_path / 'merged.pdf', 'merged')
+
+    output_text_file_path = app_module.PDFtoAzureDocAiTXT(input_filepath)
+
+    assert read_text(output_text_file_path) == expected_output('merged')
+    assert sorted(client.analyzed_shards) == [first_page for first_page, _ in SHARDS]
+
+
+def test_failed_document_resumes_from_cached_shards(app_module, docai_client, tmp_path):
+
+    input_filepath = make_pdf(tmp_path / 'resumed.pdf', 'resumed')
+    content_hash = app_module.compute_file_hash(input_filepath)
+
+    failing_client = docai_client(StubDocumentAnalysisClient(failing_text='resumed page 3'))
+    with pytest.raises(Exception):
+        app_module.PDFtoAzureDocAiTXT(input_filepath)
+
+    # Shards still queued when (3, 4) failed are cancelled, but every shard DocAI analyzed was cached
+    analyzed = [shard for shard in SHARDS if shard[0] in failing_client.analyzed_shards and shard != (3, 4)]
+    assert (1, 2) in analyzed
+    assert [shard for shard in SHARDS if app_module.find_cached_docai_shard(content_hash, *shard) is not None] == analyzed
+
+    client = docai_client(StubDocumentAnalysisClient())
+    output_text_file_path = app_module.PDFtoAzureDocAiTXT(input_filepath)
+
+    assert read_text(output_text_file_path) == expected_output('resumed')
+    assert sorted(client.analyzed_shards) == [shard[0] for shard in SHARDS if shard not in analyzed]
+
+    # With the merged text cached, the shards are pruned & a re-upload is served from the extraction cache
+    assert all(app_module.find_cached_docai_shard(content_hash, *shard) is None for shard in SHARDS)
+    client = docai_client(StubDocumentAnalysisClient())
+    assert read_text(app_module.PDFtoAzureDocAiTXT(input_filepath)) == expected_output('resumed')
+    assert client.analyzed_shards == []
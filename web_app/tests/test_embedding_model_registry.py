@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+import threading
+import pytest
+
+
+HANDOFF_TIMEOUT = 1
+JOIN_TIMEOUT = 5
+
+
+# Stands in for EMBEDDING_MODEL_REGISTRY: the loading thread's first lookup (made while it holds EMBEDDING_MODEL_REGISTRY_LOCK) signals
+# loader_holds_registry_lock & then waits for the config write to be underway, so the load completes while write_config() holds CONFIG_LOCK
+class HandoffRegistry(dict):
+
+    def __init__(self, loader_holds_registry_lock, writer_holds_config_lock):
+        super().__init__()
+        self.loader_holds_registry_lock = loader_holds_registry_lock
+        self.writer_holds_config_lock = writer_holds_config_lock
+        self.loader_thread = None
+
+    def get(self, key, default=None):
+        if threading.current_thread() is self.loader_thread and not self.loader_holds_registry_lock.is_set():
+            self.loader_holds_registry_lock.set()
+            self.writer_holds_config_lock.wait(HANDOFF_TIMEOUT)
+        return super().get(key, default)
+
+
+EMBEDDING_MODEL_SELECTION = {
+    'use_sbert_embeddings': False,
+    'use_openai_embeddings': False,
+    'use_bge_base_embeddings': False,
+    'use_bge_large_embeddings': False,
+    'use_gpu_for_embeddings': False,
+    'embedding_backend': 'pytorch',
+    'onnx_embedding_quantize': False,
+}
+
+
+# Each embedder reads config.json to load: (config selecting it, model loader to stub, config update made during its load, its registry key, its stubbed model)
+EMBEDDERS = {
+    'azure_openai': (
+        {'use_openai_embeddings': True, 'azure_openai_text_ada_deployment_name': 'stub-deployment', 'azure_openai_text_ada_api_url': 'http://stub-endpoint', 'azure_openai_text_ada_api_key': 'stub-key', 'azure_openai_api_type': 'azure', 'azure_openai_api_version': '2023-05-15'},
+        ('OpenAIEmbeddings', lambda deployment: SimpleNamespace(name=deployment)),
+        {'azure_openai_text_ada_deployment_name': 'other-deployment'},
+        ('azure-openai/stub-deployment', 'remote'),
+        'stub-deployment',
+    ),
+    'onnx': (
+        {'use_bge_base_embeddings': True, 'embedding_backend': 'onnx', 'onnx_embedding_intra_op_threads': 2, 'onnx_embedding_parity_tolerance': 0.01},
+        ('OnnxEmbeddings', lambda model_name, models_folder, quantize, intra_op_threads, parity_tolerance, **kwargs: SimpleNamespace(name=model_name)),
+        {'onnx_embedding_quantize': True},
+        ('BAAI/bge-base-en', 'onnx-cpu'),
+        'BAAI/bge-base-en',
+    ),
+}
+
+
+@pytest.fixture(params=list(EMBEDDERS))
+def embedder(app_module, monkeypatch, request):
+
+    config, (loader_name, stub_loader), config_update, model_key, model_name = EMBEDDERS[request.param]
+    app_module.write_config({**EMBEDDING_MODEL_SELECTION, **config})
+    monkeypatch.setattr(app_module, loader_name, stub_loader)
+    return config_update, model_key, model_name
+
+
+def test_config_write_during_a_model_load_does_not_deadlock(app_module, monkeypatch, embedder):
+
+    config_update, model_key, model_name = embedder
+
+    loader_holds_registry_lock = threading.Event()
+    writer_holds_config_lock = threading.Event()
+    registry = HandoffRegistry(loader_holds_registry_lock, writer_holds_config_lock)
+    monkeypatch.setattr(app_module, 'EMBEDDING_MODEL_REGISTRY', registry)
+
+    # Notified first, while write_config() holds CONFIG_LOCK & before the unload subscriber waits on the registry lock
+    def signal_config_lock_held(changed_keys, previous_config):
+        writer_holds_config_lock.set()
+        return False
+    monkeypatch.setattr(app_module, 'CONFIG_SUBSCRIBERS', [signal_config_lock_held] + app_module.CONFIG_SUBSCRIBERS)
+
+    loaded = []
+    loader = threading.Thread(target=lambda: loaded.append(app_module.get_embedding_function()), daemon=True)
+    writer = threading.Thread(target=app_module.write_config, args=(config_update,), daemon=True)
+    registry.loader_thread = loader
+
+    loader.start()
+    assert loader_holds_registry_lock.wait(JOIN_TIMEOUT)
+    writer.start()
+
+    loader.join(JOIN_TIMEOUT)
+    writer.join(JOIN_TIMEOUT)
+    assert not loader.is_alive() and not writer.is_alive()
+
+    assert loaded[0].name == model_name
+    assert app_module.read_config(list(config_update)) == config_update
+    assert model_key not in registry   # unloaded once the write went through
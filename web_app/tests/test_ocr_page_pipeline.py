@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import threading
+import random
+import json
+import time
+import pytest
+
+
+PAGE_COUNT = 10
+RENDER_WINDOW_PAGES = 3
+
+
+# Stands in for a pdf2image page: "rendering" it to PNG yields the bytes b"page <n>"
+class StubPageImage:
+
+    def __init__(self, page_number):
+        self.page_number = page_number
+
+    def save(self, stream, format=None):
+        stream.write(f"page {self.page_number}".encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+# Stands in for an OCR backend: each page recognizes to two lines, after a random delay so pages complete out of order
+class StubRecognizer:
+
+    def __init__(self, failing_page=None):
+        self.failing_page = failing_page
+        self.submitted_pages = []
+        self.lock = threading.Lock()
+
+    def recognize(self, png_bytes):
+        page_text = png_bytes.decode('utf-8')
+        time.sleep(random.uniform(0, 0.01))
+        if page_text == f"page {self.failing_page}":
+            raise RuntimeError(f"OCR failed for {page_text}")
+        return [f"{page_text} line 1", f"{page_text} line 2"]
+
+    def run_pipeline(self, app_module, output_text_file_path):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            def submit_page(png_bytes):
+                with self.lock:
+                    self.submitted_pages.append(int(png_bytes.decode('utf-8').split()[-1]))
+                return executor.submit(self.recognize, png_bytes)
+            app_module.run_ocr_page_pipeline('document.pdf', output_text_file_path, 'content-hash', 'stub_ocr', submit_page)
+
+
+def expected_output(first_page, last_page):
+    return "".join(f"[PAGE:{page}]\npage {page} line {line}\n" for page in range(first_page, last_page + 1) for line in (1, 2))
+
+
+@pytest.fixture
+def rendered_windows(app_module, monkeypatch):
+
+    app_module.write_config({'ocr_dpi': 300, 'ocr_render_window_pages': RENDER_WINDOW_PAGES, 'ocr_max_in_flight': 4})
+
+    windows = []
+    def convert_from_path(input_filepath, dpi, first_page, last_page):
+        windows.append((first_page, last_page))
+        return [StubPageImage(page_number) for page_number in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(app_module, 'get_pdf_page_count', lambda input_filepath: PAGE_COUNT)
+    monkeypatch.setattr(app_module, 'convert_from_path', convert_from_path)
+    return windows
+
+
+def test_pages_are_rendered_in_windows_and_written_in_order(app_module, rendered_windows, tmp_path):
+
+    output_text_file_path = str(tmp_path / 'document.txt')
+    StubRecognizer().run_pipeline(app_module, output_text_file_path)
+
+    with open(output_text_file_path, encoding='utf-8') as output_text_file:
+        assert output_text_file.read() == expected_output(1, PAGE_COUNT)
+    assert rendered_windows == [(1, 3), (4, 6), (7, 9), (10, 10)]
+    assert not (tmp_path / 'document.txt.progress').exists()
+
+
+def test_failed_pipeline_resumes_after_the_last_checkpointed_page(app_module, rendered_windows, tmp_path):
+
+    output_text_file_path = str(tmp_path / 'document.txt')
+    with pytest.raises(Exception):
+        StubRecognizer(failing_page=6).run_pipeline(app_module, output_text_file_path)
+
+    # Pages are written in order, so the failure surfaces once every page before it has been checkpointed
+    with open(app_module.get_ocr_progress_path(output_text_file_path)) as progress_file:
+        assert json.load(progress_file)['last_completed_page'] == 5
+
+    # Output written after the checkpoint is truncated & redone
+    with open(output_text_file_path, 'a', encoding='utf-8') as output_text_file:
+        output_text_file.write("[PAGE:6]\npartial")
+
+    recognizer = StubRecognizer()
+    recognizer.run_pipeline(app_module, output_text_file_path)
+
+    assert sorted(recognizer.submitted_pages) == list(range(6, PAGE_COUNT + 1))
+    with open(output_text_file_path, encoding='utf-8') as output_text_file:
+        assert output_text_file.read() == expected_output(1, PAGE_COUNT)
+    assert not (tmp_path / 'document.txt.progress').exists()
+
+
+def test_progress_of_other_content_is_not_resumed(app_module, rendered_windows, tmp_path):
+
+    output_text_file_path = str(tmp_path / 'document.txt')
+    with open(output_text_file_path, 'w', encoding='utf-8') as output_text_file:
+        output_text_file.write(expected_output(1, 4))
+    app_module.checkpoint_ocr_progress(output_text_file_path, 'other-content-hash', 'stub_ocr', 4, len(expected_output(1, 4)))
+
+    recognizer = StubRecognizer()
+    recognizer.run_pipeline(app_module, output_text_file_path)
+
+    assert sorted(recognizer.submitted_pages) == list(range(1, PAGE_COUNT + 1))
+    with open(output_text_file_path, encoding='utf-8') as output_text_file:
+        assert output_text_file.read() == expected_output(1, PAGE_COUNT)
+
+
+# Stands in for Azure's ComputerVisionClient, answering with the given exceptions before recognizing the page
+class StubComputerVisionClient:
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def recognize_printed_text_in_stream(self, image):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        words = [SimpleNamespace(text=word) for word in image.read().decode('utf-8').split()]
+        return SimpleNamespace(regions=[SimpleNamespace(lines=[SimpleNamespace(words=words)])])
+
+
+class StubThrottledError(Exception):
+    status_code = 429
+
+
+# Stands in for the endpoint's TokenBucket, recording the backoffs it's paused for
+class StubRateLimiter:
+
+    def __init__(self):
+        self.acquired = 0
+        self.pauses = []
+
+    def acquire(self, amount=1):
+        self.acquired += amount
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+@pytest.fixture
+def no_backoff(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.time, 'sleep', lambda seconds: None)
+
+
+def test_azure_ocr_retries_throttled_pages(app_module, no_backoff):
+
+    client = StubComputerVisionClient(errors=[StubThrottledError(), Exception("Operation returned an invalid status code 'Too Many Requests' (429)")])
+    limiter = StubRateLimiter()
+
+    assert app_module.recognize_page_via_azure_ocr(client, b"page 1", limiter, max_retries=2) == ["page 1"]
+    assert client.calls == 3
+    assert limiter.acquired == 3
+    assert len(limiter.pauses) == 2
+
+
+def test_azure_ocr_gives_up_after_max_retries_and_on_other_errors(app_module, no_backoff):
+
+    limiter = StubRateLimiter()
+
+    client = StubComputerVisionClient(errors=[StubThrottledError()] * 3)
+    with pytest.raises(StubThrottledError):
+        app_module.recognize_page_via_azure_ocr(client, b"page 1", limiter, max_retries=2)
+    assert client.calls == 3
+
+    client = StubComputerVisionClient(errors=[ValueError("bad image")])
+    with pytest.raises(ValueError):
+        app_module.recognize_page_via_azure_ocr(client, b"page 1", limiter, max_retries=2)
+    assert client.calls == 1